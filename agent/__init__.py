@@ -1,12 +1,24 @@
 import json
+import logging
 import os
 import re
-import requests
-from bs4 import BeautifulSoup
-from typing import List, Dict, Optional
-from urllib.parse import quote
+import time
+from typing import TYPE_CHECKING, Iterator, List, Dict, Optional, Tuple
+from agent.cache import cache_path
+from agent.content_search import iter_matches
+from agent.document_text import DocumentTextCache, is_document, iter_document_matches
+from agent.file_walker import FileEntry, FileWalker
+from agent.trigram_index import TrigramIndex
+from metrics import REGISTRY
+
+if TYPE_CHECKING:
+    from agent.embedding_index import EmbeddingIndex, Snippet
+    from agent.web_search import WebSearch
 
 class Agent:
+    MAX_CONTENT_RESULTS = 200  # Matching lines reported back by a content_search operation
+    RETRIEVAL_REFRESH_SECONDS = 30.0  # Minimum time between embedding index refreshes
+
     def __init__(self, base_directory: str = os.getcwd(), agent_config: str = None):
         """
         Initialize the Agent with a base directory and optional config file.
@@ -16,7 +28,13 @@ class Agent:
             agent_config (str): Name of config file (without .json) to load prompt from
         """
         self.base_directory = os.path.abspath(base_directory)
+        self.agent_name = agent_config or "agent"
         self.search_results = {}  # Cache for file search results
+        self.content_index: Optional[TrigramIndex] = None  # Loaded on first content search
+        self.document_text: Optional[DocumentTextCache] = None  # Created on first search that reaches a PDF
+        self.web_search: Optional["WebSearch"] = None  # Created on first web search
+        self.embedding_index: Optional["EmbeddingIndex"] = None  # Built on first retrieval
+        self.embedding_refreshed_at: Optional[float] = None
         self.other_agents = {}
         self.agent_prompt = self.load_agent_config_file(agent_config) if agent_config else {
             "prompt": "I am a general-purpose agent. How can I assist you?",
@@ -25,7 +43,7 @@ class Agent:
 
     @staticmethod
     def load_agent_config_file(agent_file: str) -> Dict[str, str]:
-        """Load system prompt and capabilities from agents/[filename].json."""
+        """Load system prompt, capabilities and optional stop strings from agents/[filename].json."""
         try:
             file_path = os.path.normpath(f'agent/{agent_file}.json')
             with open(file_path, "r", encoding="utf-8") as file:
@@ -36,10 +54,32 @@ class Agent:
         except Exception as e:
             raise ValueError(f'Error loading agent file {agent_file}: {str(e)}')
 
+    @property
+    def stop_sequences(self) -> List[str]:
+        """Strings that end this agent's generated replies (the config's optional "stop" list)."""
+        return list(self.agent_prompt.get("stop", []))
+
     def register_agent(self, other_agent_name: str, other_agent: "Agent") -> None:
         """Register another agent for potential collaboration."""
         self.other_agents[other_agent_name] = other_agent
 
+    def handle_agent_request(self, request: str) -> str:
+        """
+        Run the AGENT:<name>:<command> line that starts request on the registered agent it names.
+
+        Returns:
+            The agent's response, or a note that the request could not be delegated
+        """
+        parts = request.split("\n", 1)[0].split(":", 2)
+        if len(parts) < 3 or not parts[2].strip():
+            return f"Malformed agent request: {request.strip()}"
+        target_name, command = parts[1].strip(), parts[2].strip()
+        target = self.other_agents.get(target_name)
+        if target is None:
+            return f"Unknown agent: {target_name}"
+        logging.debug(f"{self.agent_name} delegated to {target_name}: {command}")
+        return target.handle_prompt(command)
+
     @staticmethod
     def analyze_prompt(user_prompt: str) -> Optional[str]:
         """Analyze user prompt to determine intended operation."""
@@ -58,12 +98,19 @@ class Agent:
 
     def process_operation(self, operation: str, context: str) -> str:
         """Execute the specified operation based on initial analysis."""
+        with REGISTRY.timer("tool_seconds", "Time spent executing agent tool operations", operation=operation):
+            return self._run_operation(operation, context)
+
+    def _run_operation(self, operation: str, context: str) -> str:
         if operation == "file_search":
             files = self.search_directory()
-            return f"Found files: {', '.join(files.keys())}"
+            return f"Found files: {', '.join(os.path.relpath(path, self.base_directory) for path in files)}"
         elif operation == "content_search":
             search_string = context.split("find")[1].split("in")[0].strip()
-            results = self.find_string_in_files(search_string)
+            results: Dict[str, List[str]] = {}
+            for path, line_no, line in self.iter_string_in_files(search_string, max_results=self.MAX_CONTENT_RESULTS):
+                location = f"page {line_no}" if is_document(path) else str(line_no)
+                results.setdefault(os.path.relpath(path, self.base_directory), []).append(f"{location}: {line}")
             return "\n".join([f"In {k}: {', '.join(v)}" for k, v in results.items()])
         elif operation == "web_search":
             results = self.search_web(context)
@@ -89,58 +136,191 @@ class Agent:
             # No specific operation detected, return generic response
             return f"{self.agent_prompt['prompt']}\nI can help with file search, content search, or web search. What would you like to do?"
 
-    # Existing methods (unchanged but included for completeness)
-    def search_directory(self, directory: str = None, file_extensions: List[str] = None) -> Dict[str, str]:
+    def iter_directory(
+            self,
+            directory: str = None,
+            file_extensions: List[str] = None,
+            max_depth: Optional[int] = None,
+            excludes: Optional[List[str]] = None
+    ) -> Iterator[FileEntry]:
+        """
+        Lazily walk a directory, skipping excluded paths and unchanged directory listings.
+
+        Args:
+            directory (str): Directory to walk (default: base directory)
+            file_extensions (List[str]): Only yield files with one of these suffixes
+            max_depth (Optional[int]): Deepest directory level to descend into (0 = top level only)
+            excludes (Optional[List[str]]): Gitignore-style rules replacing the defaults
+
+        Yields:
+            FileEntry: Absolute path, size and mtime of each file
+        """
         search_dir = os.path.abspath(directory) if directory else self.base_directory
-        if not os.path.exists(search_dir):
+        if not os.path.isdir(search_dir):
             raise ValueError(f"Directory {search_dir} does not exist")
-        found_files = {}
-        for root, _, files in os.walk(search_dir):
-            for file in files:
-                if file_extensions:
-                    if any(file.endswith(ext) for ext in file_extensions):
-                        full_path = os.path.join(root, file)
-                        found_files[file] = full_path
-                else:
-                    full_path = os.path.join(root, file)
-                    found_files[file] = full_path
+        walker = FileWalker(
+            search_dir,
+            excludes=excludes,
+            max_depth=max_depth,
+            manifest_path=cache_path(search_dir, "walk_manifest.json")
+        )
+        yield from walker.walk(file_extensions)
+
+    def search_directory(
+            self,
+            directory: str = None,
+            file_extensions: List[str] = None,
+            max_depth: Optional[int] = None,
+            excludes: Optional[List[str]] = None
+    ) -> Dict[str, str]:
+        """
+        Collect the files under a directory, keyed by full path (values are bare file names).
+
+        See iter_directory for the arguments.
+        """
+        found_files = {
+            entry.path: os.path.basename(entry.path)
+            for entry in self.iter_directory(directory, file_extensions, max_depth, excludes)
+        }
         self.search_results = found_files
         return found_files
 
-    def find_string_in_files(self, search_string: str, case_sensitive: bool = False) -> Dict[str, List[str]]:
+    def find_string_in_files(
+            self,
+            search_string: str,
+            case_sensitive: bool = False,
+            use_index: bool = True
+    ) -> Dict[str, List[str]]:
         if not self.search_results:
             raise ValueError("No files have been searched yet. Run search_directory first.")
+        candidates = self._index_candidates(search_string, case_sensitive) if use_index else None
         results = {}
         flags = 0 if case_sensitive else re.IGNORECASE
-        for filename, filepath in self.search_results.items():
+        documents = [path for path in self.search_results if is_document(path)]
+        for filepath, _, line in iter_document_matches(self._document_text(), documents, search_string, case_sensitive):
+            results.setdefault(filepath, []).append(line)
+        for filepath in self.search_results:
+            if is_document(filepath) or candidates is not None and filepath not in candidates:
+                continue
             try:
                 with open(filepath, 'r', encoding='utf-8') as file:
                     lines = file.readlines()
                     matching_lines = [line.strip() for line in lines if re.search(search_string, line, flags)]
                     if matching_lines:
-                        results[filename] = matching_lines
+                        results[filepath] = matching_lines
             except (UnicodeDecodeError, IOError):
                 continue
         return results
 
-    @staticmethod
+    def iter_string_in_files(
+            self,
+            search_string: str,
+            case_sensitive: bool = False,
+            max_results: Optional[int] = None,
+            workers: Optional[int] = None,
+            use_index: bool = True
+    ) -> Iterator[Tuple[str, int, str]]:
+        """
+        Stream matching lines from the searched files using parallel memory-mapped scans.
+
+        PDFs are searched in their extracted page text, cached across searches,
+        after the other files; their matches carry the page number instead of
+        a line number.
+
+        Args:
+            search_string (str): Regular expression to look for
+            case_sensitive (bool): Whether matching is case sensitive
+            max_results (Optional[int]): Stop after this many matching lines
+            workers (Optional[int]): Scanner processes (default: CPU count)
+            use_index (bool): Narrow the files with the trigram index first
+
+        Yields:
+            Tuple[str, int, str]: (file path, line or page number, line)
+        """
+        if not self.search_results:
+            raise ValueError("No files have been searched yet. Run search_directory first.")
+        candidates = self._index_candidates(search_string, case_sensitive) if use_index else None
+        documents = [path for path in self.search_results if is_document(path)]
+        paths = [
+            path for path in self.search_results
+            if not is_document(path) and (candidates is None or path in candidates)
+        ]
+        produced = 0
+        for match in iter_matches(paths, search_string, case_sensitive, max_results=max_results, workers=workers):
+            yield match
+            produced += 1
+        if documents and (max_results is None or produced < max_results):
+            yield from iter_document_matches(
+                self._document_text(workers), documents, search_string, case_sensitive,
+                max_results=max_results and max_results - produced
+            )
+
+    def _document_text(self, workers: Optional[int] = None) -> DocumentTextCache:
+        if self.document_text is None:
+            self.document_text = DocumentTextCache(cache_path(self.base_directory, "document_text"), workers=workers)
+        return self.document_text
+
+    def _index_candidates(self, search_string: str, case_sensitive: bool) -> Optional[set]:
+        """
+        Refresh the trigram index for the searched files and return the ones worth opening.
+
+        Returns None (scan everything) when the pattern cannot use the index or
+        the index cannot be read or written.
+        """
+        try:
+            if self.content_index is None:
+                self.content_index = TrigramIndex(cache_path(self.base_directory, "trigram.idx"))
+            stats = self.content_index.update(self.search_results)
+            logging.debug(f"Trigram index update: {stats}")
+            self.content_index.save()
+            return self.content_index.candidates(search_string, case_sensitive)
+        except Exception as e:
+            logging.warning(f"Trigram index unavailable, scanning all files: {str(e)}")
+            return None
+
     def search_web(self, query: str, num_results: int = 5) -> List[Dict[str, str]]:
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-        google_url = f"https://www.google.com/search?q={quote(query)}&num={num_results}"
-        bing_url = f"https://www.bing.com/search?q={quote(query)}&count={num_results}"
-        results = []
+        """
+        Search the web with every configured provider at once.
 
-        for url, source in [(google_url, "Google"), (bing_url, "Bing")]:
-            try:
-                response = requests.get(url, headers=headers)
-                soup = BeautifulSoup(response.text, 'html.parser')
-                items = soup.select('div.g' if source == "Google" else 'li.b_algo')[:num_results]
-                for item in items:
-                    link = item.find('a', href=True)
-                    title = item.find('h3' if source == "Google" else 'h2')
-                    if link and title:
-                        results.append({'title': title.text, 'url': link['href'], 'source': source})
-            except Exception as e:
-                print(f"{source} search failed: {e}")
-        return results[:num_results * 2]
+        Args:
+            query (str): Search terms
+            num_results (int): Results wanted from each provider
 
+        Returns:
+            List[Dict[str, str]]: title/url/source dicts
+        """
+        if self.web_search is None:
+            from agent.web_search import WebSearch  # Imported on use: only web searches need the HTTP and HTML stack
+            self.web_search = WebSearch()
+        return self.web_search.search(query, num_results)
+
+    def retrieve(self, query: str, k: int = 5) -> List["Snippet"]:
+        """
+        Find the chunks of the base directory's files most similar to the query.
+
+        The embedding index is brought up to date (re-embedding changed files
+        only) at most every RETRIEVAL_REFRESH_SECONDS.
+
+        Args:
+            query (str): Text to find related file content for
+            k (int): Chunks to return
+
+        Returns:
+            List[Snippet]: Best matches first
+        """
+        if self.embedding_index is None:
+            # Imported on use: only retrieval needs numpy and the embedder
+            from agent.embedding_index import EmbeddingIndex, default_embedder, index_directory_name
+            embedder = default_embedder()
+            self.embedding_index = EmbeddingIndex(cache_path(self.base_directory, index_directory_name(embedder)),
+                                                  embedder)
+        now = time.monotonic()
+        if self.embedding_refreshed_at is None or now - self.embedding_refreshed_at >= self.RETRIEVAL_REFRESH_SECONDS:
+            paths = [entry.path for entry in self.iter_directory() if not is_document(entry.path)]
+            with REGISTRY.timer("embedding_update_seconds", "Time spent bringing the embedding index up to date"):
+                stats = self.embedding_index.update(paths)
+            logging.debug(f"Embedding index update: {stats}")
+            self.embedding_index.save()
+            self.embedding_refreshed_at = now
+        with REGISTRY.timer("embedding_search_seconds", "Embedding index search time"):
+            return self.embedding_index.search(query, k)
@@ -0,0 +1,27 @@
+import hashlib
+import os
+
+DEFAULT_CACHE_ROOT = os.path.join(os.path.expanduser("~"), ".cache", "prizm")
+
+
+def cache_path(base_directory: str, filename: str) -> str:
+    """
+    Return the on-disk location of a cache file belonging to a base directory.
+
+    Caches live outside the searched tree (under $AGENT_CACHE_DIR, default
+    ~/.cache/prizm) in a folder derived from the absolute base directory, so
+    indexing a repository never writes into it.
+
+    Args:
+        base_directory (str): Directory the cache describes
+        filename (str): Name of the cache file
+
+    Returns:
+        str: Absolute path of the cache file (its parent directory exists)
+    """
+    root = os.environ.get("AGENT_CACHE_DIR", DEFAULT_CACHE_ROOT)
+    base = os.path.abspath(base_directory)
+    digest = hashlib.sha1(base.encode("utf-8")).hexdigest()[:16]
+    directory = os.path.join(root, f"{os.path.basename(base) or 'root'}-{digest}")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, filename)
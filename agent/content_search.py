@@ -0,0 +1,240 @@
+import mmap
+import multiprocessing
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import chain, islice
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from agent.trigram_index import TrigramIndex
+
+Match = Tuple[str, int, str]  # (file path, 1-based line number, stripped line)
+
+BINARY_SNIFF_BYTES = 8192
+INLINE_FILES = 256  # Candidate sets up to this size are scanned without a process pool
+SCAN_BLOCK_BYTES = 4 * 1024 * 1024  # Most bytes of a mapped file decoded at once
+
+
+@lru_cache(maxsize=64)
+def compile_pattern(pattern: str, flags: int = 0) -> "re.Pattern[str]":
+    """Compile a text pattern once per process; it runs on decoded text so \\w, . and IGNORECASE stay Unicode-aware."""
+    return re.compile(pattern, flags | re.MULTILINE)
+
+
+@lru_cache(maxsize=64)
+def compile_prefilter(pattern: str, flags: int = 0) -> Optional["re.Pattern[bytes]"]:
+    """
+    Compile a bytes regex for the longest literal every match must contain.
+
+    It runs on the raw mapped file, so blocks that cannot match are skipped
+    without being decoded. It always folds ASCII case, since (?i:...) groups
+    can make only part of a pattern case-insensitive, and required_literals
+    leaves out anything whose case-insensitive match could involve non-ASCII
+    text; so it finds every block the str pattern could match.
+
+    Args:
+        pattern (str): Regular expression
+        flags (int): re flags, e.g. re.IGNORECASE
+
+    Returns:
+        Optional[re.Pattern[bytes]]: The prefilter, or None when the pattern has no usable literal
+    """
+    literals = TrigramIndex.required_literals(pattern, flags)
+    if not literals:
+        return None
+    literal = max(literals, key=len)
+    return re.compile(re.escape(literal.encode("utf-8")), re.IGNORECASE)
+
+
+def _pool_context():
+    # Forking a process that may hold model threads and locks is unsafe; use a clean interpreter
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def scan_file(path: str, pattern: str, flags: int = 0, limit: Optional[int] = None) -> List[Match]:
+    """
+    Find the lines of one file that match the pattern.
+
+    The file is memory-mapped and walked in newline-aligned blocks of about
+    SCAN_BLOCK_BYTES. A block is skipped unless the bytes prefilter finds the
+    pattern's required literal in it; otherwise it is decoded as UTF-8 (with
+    CRLF line ends normalised) and searched with the str pattern, so \\w, .
+    and IGNORECASE stay Unicode-aware while memory stays bounded by the block
+    size. Each hit is confirmed against its own line so results are the same
+    as a per-line re.search. Empty, unreadable and binary (NUL-containing)
+    files yield nothing.
+
+    Args:
+        path (str): File to scan
+        pattern (str): Regular expression
+        flags (int): re flags, e.g. re.IGNORECASE
+        limit (Optional[int]): Stop after this many matching lines
+
+    Returns:
+        List[Match]: Matching (path, line number, line) tuples in file order
+    """
+    regex = compile_pattern(pattern, flags)
+    prefilter = compile_prefilter(pattern, flags)
+    matches: List[Match] = []
+    try:
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return matches
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                if buf.find(b"\0", 0, BINARY_SNIFF_BYTES) != -1:
+                    return matches
+                size = len(buf)
+                block_start = 0
+                line_no = 1
+                counted_to = 0
+                while block_start < size:
+                    block_end = _block_end(buf, block_start, size)
+                    if prefilter is None or prefilter.search(buf, block_start, block_end) is not None:
+                        line_no += _count_newlines(buf, counted_to, block_start)
+                        counted_to = block_start
+                        text = buf[block_start:block_end].decode("utf-8", errors="replace")
+                        for line_offset, line in _scan_text(text, regex):
+                            matches.append((path, line_no + line_offset, line))
+                            if limit is not None and len(matches) >= limit:
+                                return matches
+                    block_start = block_end
+    except (OSError, ValueError):
+        return matches
+    return matches
+
+
+def _block_end(buf: mmap.mmap, start: int, size: int) -> int:
+    # End the block just after a newline so no line is split; a single longer line becomes its own block
+    end = start + SCAN_BLOCK_BYTES
+    if end >= size:
+        return size
+    newline = buf.rfind(b"\n", start, end)
+    if newline == -1:
+        newline = buf.find(b"\n", end)
+    return size if newline == -1 else newline + 1
+
+
+def _count_newlines(buf: mmap.mmap, start: int, end: int) -> int:
+    # Counted a block at a time so skipped regions are never copied whole
+    count = 0
+    for pos in range(start, end, SCAN_BLOCK_BYTES):
+        count += buf[pos:min(pos + SCAN_BLOCK_BYTES, end)].count(b"\n")
+    return count
+
+
+def _scan_text(text: str, regex: "re.Pattern[str]") -> Iterator[Tuple[int, str]]:
+    # Yields (newlines before the line, stripped line) for each matching line of a decoded block
+    if "\r" in text:
+        text = text.replace("\r\n", "\n")  # So $ matches at the end of CRLF lines
+    size = len(text)
+    pos = 0
+    line_offset = 0
+    counted_to = 0
+    while pos < size:
+        hit = regex.search(text, pos)
+        if hit is None:
+            break
+        start = text.rfind("\n", 0, hit.start()) + 1
+        end = text.find("\n", hit.start())
+        if end == -1:
+            end = size
+        if regex.search(text, start, end) is not None:
+            line_offset += text.count("\n", counted_to, start)
+            counted_to = start
+            yield line_offset, text[start:end].strip()
+        pos = end + 1
+
+
+def scan_files(paths: List[str], pattern: str, flags: int = 0, limit: Optional[int] = None) -> List[Match]:
+    """Scan a chunk of files in one worker call, honouring the overall limit."""
+    matches: List[Match] = []
+    for path in paths:
+        remaining = None if limit is None else limit - len(matches)
+        if remaining is not None and remaining <= 0:
+            break
+        matches.extend(scan_file(path, pattern, flags, remaining))
+    return matches
+
+
+def iter_matches(
+        paths: Iterable[str],
+        pattern: str,
+        case_sensitive: bool = False,
+        max_results: Optional[int] = None,
+        workers: Optional[int] = None,
+        chunk_size: int = 64,
+        inline_files: int = INLINE_FILES
+) -> Iterator[Match]:
+    """
+    Stream matching lines from many files, scanning them across a process pool.
+
+    Files are handed to the workers in chunks with a bounded number in flight,
+    and results are yielded in input order as soon as each chunk completes.
+    Reaching max_results (or closing the generator) cancels outstanding work.
+    Workers start from a fresh interpreter (forkserver or spawn), which costs
+    more than a small scan, so short file lists are scanned inline.
+
+    Args:
+        paths (Iterable[str]): Files to scan
+        pattern (str): Regular expression
+        case_sensitive (bool): Whether matching is case sensitive
+        max_results (Optional[int]): Stop after this many matching lines
+        workers (Optional[int]): Process count (default: CPU count); 1 scans inline
+        chunk_size (int): Files per worker task
+        inline_files (int): Scan inline when there are no more files than this
+
+    Yields:
+        Match: (path, line number, line) tuples
+    """
+    flags = 0 if case_sensitive else re.IGNORECASE
+    compile_pattern(pattern, flags)  # Surface pattern errors before any work starts
+    workers = workers or os.cpu_count() or 1
+    produced = 0
+
+    paths = iter(paths)
+    head = list(islice(paths, inline_files + 1))
+    if len(head) <= inline_files:
+        workers = 1
+    paths = chain(head, paths)
+
+    def chunks() -> Iterator[List[str]]:
+        chunk: List[str] = []
+        for path in paths:
+            chunk.append(path)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    if workers == 1:
+        for chunk in chunks():
+            for match in scan_files(chunk, pattern, flags, max_results and max_results - produced):
+                yield match
+                produced += 1
+                if max_results is not None and produced >= max_results:
+                    return
+        return
+
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context())
+    try:
+        pending = deque()
+        work = chunks()
+        for chunk in work:
+            pending.append(pool.submit(scan_files, chunk, pattern, flags, max_results))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            for match in pending.popleft().result():
+                yield match
+                produced += 1
+                if max_results is not None and produced >= max_results:
+                    return
+            chunk = next(work, None)
+            if chunk is not None:
+                pending.append(pool.submit(scan_files, chunk, pattern, flags, max_results))
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from agent.content_search import Match
+from metrics import REGISTRY
+
+DOCUMENT_EXTENSIONS = (".pdf",)
+
+PDFSEARCH_BUILD = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "apps", "pdfsearch", "target", "release", "pdfsearch"
+)
+
+# Paths -> the text of each page, per path; an empty list marks an unparseable document,
+# and a path left out was not extracted at all (it is retried on the next lookup)
+Extractor = Callable[[List[str]], Dict[str, List[str]]]
+
+_warned_no_extractor = False  # Every agent has its own cache, so the missing-extractor warning is per process
+
+
+def is_document(path: str) -> bool:
+    return path.lower().endswith(DOCUMENT_EXTENSIONS)
+
+
+def extract_pdf_pages(path: str) -> List[str]:
+    """Text of every page of a PDF, via pypdf (an empty list if the file cannot be parsed)."""
+    from pypdf import PdfReader
+
+    try:
+        return [page.extract_text() or "" for page in PdfReader(path).pages]
+    except Exception as e:
+        logging.warning(f"Could not extract text from {path}: {str(e)}")
+        return []
+
+
+def pypdf_extractor(workers: Optional[int] = None) -> Extractor:
+    """Extractor parsing PDFs with pypdf across a process pool."""
+    def extract(paths: List[str]) -> Dict[str, List[str]]:
+        if len(paths) == 1 or workers == 1:
+            return {path: extract_pdf_pages(path) for path in paths}
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(paths))) as pool:
+            return dict(zip(paths, pool.map(extract_pdf_pages, paths)))
+    return extract
+
+
+def find_pdfsearch() -> Optional[str]:
+    """The pdfsearch binary: $PDFSEARCH_BIN, the cargo release build under apps/, or one on PATH."""
+    for candidate in (os.environ.get("PDFSEARCH_BIN"), PDFSEARCH_BUILD, shutil.which("pdfsearch")):
+        if candidate and os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
+
+
+def pdfsearch_extractor(binary: str, timeout: float = 300.0) -> Extractor:
+    """
+    Extractor running the pdfsearch binary once per batch in its --pages mode.
+
+    The binary prints one JSON object per page, {"file": ..., "page": n, "text": ...},
+    and parses the files on its own threads; a file it cannot parse is reported
+    on stderr and gets no pages. If the binary fails or times out, its output
+    may be incomplete, so nothing is returned and every path is retried later.
+    """
+    def extract(paths: List[str]) -> Dict[str, List[str]]:
+        pages: Dict[str, Dict[int, str]] = {path: {} for path in paths}
+        try:
+            completed = subprocess.run(
+                [binary, "--pages", *paths], capture_output=True, text=True, timeout=timeout, check=False
+            )
+        except subprocess.TimeoutExpired:
+            logging.warning(f"pdfsearch timed out after {timeout:g}s on {len(paths)} documents")
+            return {}
+        if completed.returncode != 0:
+            logging.warning(f"pdfsearch exited with {completed.returncode}: {completed.stderr.strip()[:500]}")
+            return {}
+        for line in completed.stdout.splitlines():
+            try:
+                record = json.loads(line)
+                pages[record["file"]][record["page"]] = record["text"]
+            except (ValueError, KeyError) as e:
+                logging.warning(f"Unexpected pdfsearch output {line[:200]!r}: {str(e)}")
+        return {path: [text for _, text in sorted(by_page.items())] for path, by_page in pages.items()}
+    return extract
+
+
+def default_extractor(workers: Optional[int] = None) -> Optional[Extractor]:
+    """pypdf if installed, else the pdfsearch binary if built, else None."""
+    try:
+        import pypdf  # noqa: F401
+        return pypdf_extractor(workers)
+    except ImportError:
+        pass
+    binary = find_pdfsearch()
+    return pdfsearch_extractor(binary) if binary else None
+
+
+def _warn_no_extractor() -> None:
+    global _warned_no_extractor
+    if not _warned_no_extractor:
+        _warned_no_extractor = True
+        logging.warning("Skipping PDFs: install pypdf (pip install -r requirements.txt) or build apps/pdfsearch "
+                        "(cargo build --release)")
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DocumentTextCache:
+    """
+    Extracted page text of documents, cached on disk.
+
+    Each document gets a JSON file holding its size, mtime, content hash and
+    page texts. An unchanged size and mtime is a hit without reading the
+    document; a changed mtime with the same content hash (a touch, a copy
+    that kept its bytes) is a hit after hashing it. Everything else is
+    extracted again, all stale documents of a lookup in one batch. Documents
+    the extractor reports as unparseable are cached with no pages, so they are
+    not retried until they change; ones it did not extract (the extractor
+    failed) are not cached and are tried again on the next lookup.
+    """
+
+    def __init__(self, directory: str, extractor: Optional[Extractor] = None, workers: Optional[int] = None):
+        """
+        Args:
+            directory: Folder for the cache files (created if missing)
+            extractor: Batch page-text extractor (default: pypdf, else the pdfsearch binary)
+            workers: Extraction processes for the pypdf extractor (default: CPU count)
+        """
+        self.directory = directory
+        self.extractor = extractor if extractor is not None else default_extractor(workers)
+        os.makedirs(directory, exist_ok=True)
+
+    def _entry_path(self, path: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(path.encode("utf-8")).hexdigest() + ".json")
+
+    def _load(self, path: str) -> Optional[Dict]:
+        try:
+            with open(self._entry_path(path), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, path: str, entry: Dict) -> None:
+        target = self._entry_path(path)
+        temporary = target + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(entry, file, ensure_ascii=False)
+        os.replace(temporary, target)
+
+    def pages(self, paths: Iterable[str]) -> Iterator[Tuple[str, List[str]]]:
+        """
+        Yield (path, page texts) for every readable document, in input order.
+
+        Cached documents are yielded straight away; the stale ones are extracted
+        together and yielded afterwards.
+        """
+        stale: Dict[str, Dict] = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entry = self._load(path)
+            if entry is not None and (entry["size"], entry["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+                REGISTRY.inc("document_text_cache_total", 1, "Document text lookups", result="hit")
+                yield path, entry["pages"]
+                continue
+            digest = file_digest(path)
+            if entry is not None and entry["sha256"] == digest:
+                REGISTRY.inc("document_text_cache_total", 1, "Document text lookups", result="hit")
+                entry["mtime_ns"] = stat.st_mtime_ns
+                self._store(path, entry)
+                yield path, entry["pages"]
+                continue
+            stale[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+
+        if not stale:
+            return
+        if self.extractor is None:
+            _warn_no_extractor()
+            return
+        REGISTRY.inc("document_text_cache_total", len(stale), "Document text lookups", result="miss")
+        try:
+            with REGISTRY.timer("document_extract_seconds", "Time spent extracting document text"):
+                extracted = self.extractor(list(stale))
+        except Exception as e:
+            logging.warning(f"Document text extraction failed: {str(e)}")
+            extracted = {}
+        for path, entry in stale.items():
+            if path not in extracted:
+                continue
+            entry["pages"] = extracted[path]
+            self._store(path, entry)
+            yield path, entry["pages"]
+
+
+def search_pages(path: str, pages: List[str], pattern: "re.Pattern[str]", limit: Optional[int] = None) -> List[Match]:
+    """Matching lines of a document as (path, page number, line) tuples."""
+    matches: List[Match] = []
+    for page_no, text in enumerate(pages, start=1):
+        for line in text.splitlines():
+            if pattern.search(line):
+                matches.append((path, page_no, line.strip()))
+                if limit is not None and len(matches) >= limit:
+                    return matches
+    return matches
+
+
+def iter_document_matches(
+        cache: DocumentTextCache,
+        paths: Iterable[str],
+        pattern: str,
+        case_sensitive: bool = False,
+        max_results: Optional[int] = None
+) -> Iterator[Match]:
+    """
+    Stream matching lines from documents' cached page text.
+
+    Yields:
+        Match: (path, 1-based page number, line) tuples
+    """
+    regex = re.compile(pattern, 0 if case_sensitive else re.IGNORECASE)
+    produced = 0
+    for path, pages in cache.pages(paths):
+        for match in search_pages(path, pages, regex, max_results and max_results - produced):
+            yield match
+            produced += 1
+            if max_results is not None and produced >= max_results:
+                return
@@ -0,0 +1,418 @@
+import hashlib
+import logging
+import os
+import pickle
+import re
+import zlib
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+TOKEN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+CAMEL = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+BINARY_SNIFF_BYTES = 8192
+
+
+@dataclass
+class Snippet:
+    path: str
+    start_line: int  # 1-based, inclusive
+    end_line: int
+    text: str
+    score: float = 0.0
+
+
+def chunk_text(text: str, max_chars: int = 1200, overlap_lines: int = 2) -> List[Tuple[int, int, str]]:
+    """
+    Split text into chunks of whole lines of at most about max_chars.
+
+    Consecutive chunks share overlap_lines lines so a passage cut at a chunk
+    boundary still appears whole in one of them. Blank chunks are dropped.
+
+    Returns:
+        (first line, last line, text) tuples with 1-based line numbers
+    """
+    lines = text.splitlines()
+    chunks = []
+    start = 0
+    while start < len(lines):
+        end, size = start, 0
+        while end < len(lines) and (end == start or size + len(lines[end]) + 1 <= max_chars):
+            size += len(lines[end]) + 1
+            end += 1
+        chunk = "\n".join(lines[start:end])
+        if chunk.strip():
+            chunks.append((start + 1, end, chunk[:max_chars]))
+        if end >= len(lines):
+            break
+        start = max(end - overlap_lines, start + 1)
+    return chunks
+
+
+class HashingEmbedder:
+    """
+    Embeds text by hashing its words and word pairs into a fixed number of signed buckets.
+
+    Identifiers are also split at underscores and camel case, so "load_config"
+    and "loadConfig" land close together. It needs no model and no training,
+    and catches lexical rather than semantic similarity; it is the fallback
+    when no local embedding model is available.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    @staticmethod
+    def features(text: str) -> List[str]:
+        words = []
+        for token in TOKEN.findall(text):
+            parts = [part.lower() for piece in token.split("_") for part in CAMEL.findall(piece)]
+            words.append(token.lower())
+            if len(parts) > 1:
+                words.extend(parts)
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self.features(text):
+                digest = zlib.crc32(feature.encode("utf-8"))
+                vectors[row, digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        return normalize(vectors)
+
+
+class TransformerEmbedder:
+    """Mean-pooled hidden states of a local transformers encoder (e.g. a MiniLM sentence model)."""
+
+    def __init__(self, model_path: str, batch_size: int = 32, max_length: int = 256):
+        from transformers import AutoModel, AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self.model = AutoModel.from_pretrained(model_path).eval()
+        self.dim = self.model.config.hidden_size
+        self.name = f"transformer-{os.path.basename(os.path.normpath(model_path))}-{self.dim}"
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        import torch
+
+        batches = []
+        for start in range(0, len(texts), self.batch_size):
+            inputs = self.tokenizer(texts[start:start + self.batch_size], padding=True, truncation=True,
+                                    max_length=self.max_length, return_tensors="pt")
+            with torch.inference_mode():
+                hidden = self.model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            batches.append(((hidden * mask).sum(1) / mask.sum(1).clamp(min=1)).float().numpy())
+        if not batches:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return normalize(np.concatenate(batches))
+
+
+def default_embedder(model_path: Optional[str] = None):
+    """
+    A TransformerEmbedder for model_path or $AGENT_EMBEDDING_MODEL when that folder exists
+    and transformers can load it, else a HashingEmbedder.
+    """
+    model_path = model_path or os.environ.get("AGENT_EMBEDDING_MODEL")
+    if model_path and os.path.isdir(model_path):
+        try:
+            return TransformerEmbedder(model_path)
+        except Exception as e:
+            logging.warning(f"Falling back to hashed embeddings, could not load {model_path}: {str(e)}")
+    return HashingEmbedder()
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+def kmeans(vectors: np.ndarray, clusters: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means: unit centroids maximising cosine similarity to their members."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = ~sums.any(axis=1)
+        sums[empty] = centroids[empty]  # Keep a centroid that lost all its members
+        centroids = normalize(sums)
+    return centroids
+
+
+class EmbeddingIndex:
+    """
+    Persistent vector index over the chunks of a set of files.
+
+    Chunk vectors are rows of a float32 matrix in vectors.f32, read through a
+    memory map and appended to in place. A changed file is re-chunked and its
+    new rows appended; its old rows become tombstones, so an update embeds
+    only changed files. The matrix is rewritten without tombstones once they
+    outnumber the live rows.
+
+    Below ivf_threshold live rows a search scores every row in one
+    matrix-vector product. Above it the rows are partitioned around k-means
+    centroids (an inverted file) and a search only scores the rows of the
+    nprobe centroids closest to the query. New rows join their nearest
+    partition; the partitions are retrained when the index has doubled.
+    """
+
+    VERSION = 1
+
+    def __init__(
+            self,
+            directory: str,
+            embedder=None,
+            max_file_size: int = 1024 * 1024,
+            max_chars: int = 1200,
+            ivf_threshold: int = 4096,
+            nprobe: int = 8
+    ):
+        """
+        Args:
+            directory: Folder for the vector matrix and the metadata (created if missing)
+            embedder: Object with dim, name and embed(texts) -> unit vectors (default: default_embedder())
+            max_file_size: Larger files are not indexed
+            max_chars: Chunk size in characters
+            ivf_threshold: Live rows from which searches use the partitions
+            nprobe: Partitions scored per search
+        """
+        self.directory = directory
+        self.embedder = embedder or default_embedder()
+        self.dim = self.embedder.dim
+        self.max_file_size = max_file_size
+        self.max_chars = max_chars
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.meta_path = os.path.join(directory, "index.pkl")
+        self.files: Dict[str, Tuple[float, int, List[int]]] = {}  # path -> (mtime, size, rows)
+        self.chunks: List[Optional[Tuple[str, int, int, str]]] = []  # row -> (path, first, last line, text); None = tombstone
+        self.centroids: Optional[np.ndarray] = None
+        self.assignment = np.zeros(0, dtype=np.int32)  # row -> partition
+        self.trained_rows = 0
+        self._matrix: Optional[np.memmap] = None
+        self._live: Optional[np.ndarray] = None
+        self._dirty = False
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    @property
+    def rows(self) -> int:
+        return len(self.chunks)
+
+    @property
+    def live_rows(self) -> int:
+        return sum(len(rows) for _, _, rows in self.files.values())
+
+    def load(self) -> None:
+        """Load the index from disk, starting empty if it is missing, unreadable or from another embedder."""
+        if not os.path.exists(self.meta_path):
+            self._reset()
+            return
+        try:
+            with open(self.meta_path, "rb") as file:
+                state = pickle.load(file)
+            if state.get("version") != self.VERSION or state.get("embedder") != self.embedder.name:
+                raise ValueError(f"built with {state.get('embedder')} (version {state.get('version')})")
+            if os.path.getsize(self.vectors_path) < len(state["chunks"]) * self.dim * 4:
+                raise ValueError("vector file is shorter than the metadata")
+            self.files = state["files"]
+            self.chunks = state["chunks"]
+            self.centroids = state["centroids"]
+            self.assignment = state["assignment"]
+            self.trained_rows = state["trained_rows"]
+            self._live = None
+        except Exception as e:
+            logging.warning(f"Rebuilding embedding index {self.directory}: {str(e)}")
+            self._reset()
+
+    def _reset(self) -> None:
+        self.files, self.chunks = {}, []
+        self.centroids, self.assignment, self.trained_rows = None, np.zeros(0, dtype=np.int32), 0
+        open(self.vectors_path, "wb").close()
+        self._matrix = None
+        self._live = None
+        self._dirty = True
+
+    def save(self) -> None:
+        """Atomically write the metadata if the index changed (vectors are written as they are added)."""
+        if not self._dirty:
+            return
+        if self.rows - self.live_rows > max(1024, self.live_rows):
+            self.compact()
+        state = {
+            "version": self.VERSION,
+            "embedder": self.embedder.name,
+            "files": self.files,
+            "chunks": self.chunks,
+            "centroids": self.centroids,
+            "assignment": self.assignment,
+            "trained_rows": self.trained_rows,
+        }
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, "wb") as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.meta_path)
+        self._dirty = False
+
+    def matrix(self) -> np.ndarray:
+        """All rows (tombstones included) as a read-only memory map."""
+        if self.rows == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        if self._matrix is None or self._matrix.shape[0] != self.rows:
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.rows, self.dim))
+        return self._matrix
+
+    def _append(self, chunks: List[Tuple[str, int, int, str]], vectors: np.ndarray) -> List[int]:
+        with open(self.vectors_path, "r+b") as file:
+            file.seek(self.rows * self.dim * 4)
+            file.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        first = self.rows
+        self.chunks.extend(chunks)
+        partitions = np.zeros(len(chunks), dtype=np.int32)
+        if self.centroids is not None and len(vectors):
+            partitions = np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+        self.assignment = np.concatenate([self.assignment, partitions])
+        return list(range(first, self.rows))
+
+    def _forget(self, path: str) -> None:
+        for row in self.files.pop(path)[2]:
+            self.chunks[row] = None
+        self._live = None
+        self._dirty = True
+
+    def _read(self, path: str) -> Optional[str]:
+        try:
+            with open(path, "rb") as file:
+                data = file.read(self.max_file_size + 1)
+            if len(data) > self.max_file_size or b"\0" in data[:BINARY_SNIFF_BYTES]:
+                return None
+            return data.decode("utf-8")
+        except (OSError, UnicodeDecodeError):
+            return None
+
+    def update(self, paths: Iterable[str], batch_size: int = 256) -> Dict[str, int]:
+        """
+        Bring the index in line with the given files.
+
+        Files whose mtime and size match the indexed values are skipped, and
+        indexed files missing from paths are forgotten. Changed chunks are
+        embedded in batches of batch_size.
+
+        Returns:
+            Dict[str, int]: Counts of 'indexed', 'unchanged' and 'removed' files and embedded 'chunks'
+        """
+        stats = {"indexed": 0, "unchanged": 0, "removed": 0, "chunks": 0}
+        seen = set()
+        pending: List[Tuple[str, float, int, List[Tuple[str, int, int, str]]]] = []
+        pending_chunks = 0
+        for path in paths:
+            seen.add(path)
+            entry = self.files.get(path)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if entry is not None and entry[0] == st.st_mtime and entry[1] == st.st_size:
+                stats["unchanged"] += 1
+                continue
+            if entry is not None:
+                self._forget(path)
+            text = self._read(path)
+            chunks = [(path, first, last, chunk) for first, last, chunk in chunk_text(text or "", self.max_chars)]
+            pending.append((path, st.st_mtime, st.st_size, chunks))
+            pending_chunks += len(chunks)
+            stats["indexed"] += 1
+            if pending_chunks >= batch_size:
+                stats["chunks"] += self._embed_files(pending)
+                pending, pending_chunks = [], 0
+        stats["chunks"] += self._embed_files(pending)
+        for path in set(self.files) - seen:
+            self._forget(path)
+            stats["removed"] += 1
+        if self.live_rows >= self.ivf_threshold and (self.centroids is None or self.rows >= 2 * self.trained_rows):
+            self.train()
+        return stats
+
+    def _embed_files(self, pending: List[Tuple[str, float, int, List[Tuple[str, int, int, str]]]]) -> int:
+        chunks = [chunk for _, _, _, file_chunks in pending for chunk in file_chunks]
+        vectors = self.embedder.embed([chunk[3] for chunk in chunks]) if chunks else np.zeros((0, self.dim))
+        rows = iter(self._append(chunks, vectors))
+        for path, mtime, size, file_chunks in pending:
+            self.files[path] = (mtime, size, [next(rows) for _ in file_chunks])
+        self._live = None
+        self._dirty = True
+        return len(chunks)
+
+    def live_row_ids(self) -> np.ndarray:
+        if self._live is None:
+            self._live = np.array(sorted(row for _, _, rows in self.files.values() for row in rows), dtype=np.int64)
+        return self._live
+
+    def train(self, clusters: Optional[int] = None) -> None:
+        """Partition the live rows around about sqrt(rows) k-means centroids."""
+        live = self.live_row_ids()
+        clusters = min(clusters or max(1, int(np.sqrt(len(live)))), len(live))
+        if clusters == 0:
+            return
+        matrix = self.matrix()
+        self.centroids = kmeans(np.asarray(matrix[live]), clusters)
+        self.assignment = np.argmax(matrix @ self.centroids.T, axis=1).astype(np.int32)
+        self.trained_rows = self.rows
+        self._dirty = True
+
+    def compact(self) -> None:
+        """Rewrite the vector file with only the live rows."""
+        live = self.live_row_ids()
+        renumber = {int(old): new for new, old in enumerate(live)}
+        vectors = np.asarray(self.matrix()[live]) if len(live) else np.zeros((0, self.dim), dtype=np.float32)
+        self._matrix = None
+        tmp_path = f"{self.vectors_path}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(vectors.tobytes())
+        os.replace(tmp_path, self.vectors_path)
+        self.chunks = [self.chunks[row] for row in live]
+        self.assignment = self.assignment[live] if len(live) else np.zeros(0, dtype=np.int32)
+        self.files = {path: (mtime, size, [renumber[row] for row in rows])
+                      for path, (mtime, size, rows) in self.files.items()}
+        self._live = None
+        self.trained_rows = min(self.trained_rows, self.rows)
+        self._dirty = True
+
+    def search(self, query: str, k: int = 5, nprobe: Optional[int] = None) -> List[Snippet]:
+        """
+        The k chunks most similar to the query, best first.
+
+        Args:
+            query: Text to look for
+            k: Chunks to return
+            nprobe: Partitions to score when the index is partitioned (default: self.nprobe)
+        """
+        live = self.live_row_ids()
+        if k <= 0 or len(live) == 0:
+            return []
+        vector = self.embedder.embed([query])[0]
+        matrix = self.matrix()
+        candidates = live
+        if self.centroids is not None and len(live) >= self.ivf_threshold:
+            probes = np.argsort(-(self.centroids @ vector))[:nprobe or self.nprobe]
+            candidates = live[np.isin(self.assignment[live], probes)]
+        scores = np.asarray(matrix[candidates]) @ vector
+        top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k] if len(scores) > k else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        snippets = []
+        for index in top:
+            path, first, last, text = self.chunks[int(candidates[index])]
+            snippets.append(Snippet(path, first, last, text, float(scores[index])))
+        return snippets
+
+
+def index_directory_name(embedder) -> str:
+    """Cache folder name for an index built with the embedder."""
+    return "embeddings-" + hashlib.sha1(embedder.name.encode("utf-8")).hexdigest()[:8]
@@ -0,0 +1,259 @@
+import json
+import logging
+import os
+import re
+import time
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+DEFAULT_EXCLUDES = [
+    ".git/",
+    ".hg/",
+    ".svn/",
+    "target/",
+    "models/",
+    "node_modules/",
+    "__pycache__/",
+    ".venv/",
+    "venv/",
+    ".mypy_cache/",
+    ".pytest_cache/",
+    ".tox/",
+    "*.pyc",
+]
+
+RACY_WINDOW_NS = 2_000_000_000  # Listings of directories modified this recently are not trusted
+
+
+class FileEntry(NamedTuple):
+    path: str
+    size: int
+    mtime: float
+
+
+class ExcludeRules:
+    """
+    Gitignore-style path rules.
+
+    Supports comments, '!' negation, trailing '/' for directory-only rules,
+    leading or embedded '/' to anchor a rule to the root, and the '*', '?',
+    '[...]' and '**' wildcards. As in git, the last matching rule wins.
+    """
+
+    def __init__(self, patterns: Iterable[str] = ()):
+        self.rules: List[Tuple["re.Pattern[str]", bool, bool]] = []  # (regex, negated, dir_only)
+        for pattern in patterns:
+            self.add(pattern)
+
+    def add(self, pattern: str) -> None:
+        pattern = pattern.rstrip("\n").rstrip()
+        if not pattern or pattern.startswith("#"):
+            return
+        negated = pattern.startswith("!")
+        if negated:
+            pattern = pattern[1:]
+        dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        anchored = "/" in pattern
+        pattern = pattern.lstrip("/")
+        body = self._translate(pattern)
+        regex = f"^{body}$" if anchored else f"^(?:.*/)?{body}$"
+        self.rules.append((re.compile(regex), negated, dir_only))
+
+    @staticmethod
+    def _translate(pattern: str) -> str:
+        out, i = [], 0
+        while i < len(pattern):
+            char = pattern[i]
+            if pattern.startswith("**/", i):
+                out.append("(?:.*/)?")
+                i += 3
+            elif pattern.startswith("**", i):
+                out.append(".*")
+                i += 2
+            elif char == "*":
+                out.append("[^/]*")
+                i += 1
+            elif char == "?":
+                out.append("[^/]")
+                i += 1
+            elif char == "[":
+                end = pattern.find("]", i + 1)
+                if end == -1:
+                    out.append(re.escape(char))
+                    i += 1
+                else:
+                    body = pattern[i + 1:end]
+                    if body.startswith("!"):
+                        body = "^" + body[1:]
+                    out.append(f"[{body}]")
+                    i = end + 1
+            else:
+                out.append(re.escape(char))
+                i += 1
+        return "".join(out)
+
+    def excluded(self, rel_path: str, is_dir: bool) -> bool:
+        """Return whether a root-relative, '/'-separated path is excluded."""
+        result = False
+        for regex, negated, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                result = not negated
+        return result
+
+
+class FileWalker:
+    """
+    Lazy os.scandir-based directory walker with a persisted listing manifest.
+
+    The manifest stores the raw listing of every visited directory together
+    with the directory's mtime. On a re-walk, a directory whose mtime is
+    unchanged is not listed again, so only directories where entries were
+    added, removed or renamed cost a scandir. File sizes and mtimes reported
+    for skipped directories are those recorded at their last listing.
+    """
+
+    MANIFEST_VERSION = 1
+
+    def __init__(
+            self,
+            root: str,
+            excludes: Optional[Iterable[str]] = None,
+            max_depth: Optional[int] = None,
+            manifest_path: Optional[str] = None,
+            use_gitignore: bool = True
+    ):
+        """
+        Args:
+            root (str): Directory to walk
+            excludes (Optional[Iterable[str]]): Gitignore-style rules (default: DEFAULT_EXCLUDES)
+            max_depth (Optional[int]): Deepest directory level to descend into (0 = root only)
+            manifest_path (Optional[str]): Where to persist directory listings; None disables it
+            use_gitignore (bool): Also apply the rules in the root's .gitignore
+        """
+        self.root = os.path.abspath(root)
+        self.rules = ExcludeRules(DEFAULT_EXCLUDES if excludes is None else excludes)
+        if use_gitignore:
+            try:
+                with open(os.path.join(self.root, ".gitignore"), "r", encoding="utf-8") as file:
+                    for line in file:
+                        self.rules.add(line)
+            except (OSError, UnicodeDecodeError):
+                pass
+        self.max_depth = max_depth
+        self.manifest_path = manifest_path
+        self.manifest: Dict[str, dict] = self._load_manifest()
+        self.stats = {"listed": 0, "reused": 0}
+
+    def walk(self, file_extensions: Optional[List[str]] = None) -> Iterator[FileEntry]:
+        """
+        Yield the files under the root, depth first, in sorted order.
+
+        Args:
+            file_extensions (Optional[List[str]]): Only yield files with one of these suffixes
+
+        Yields:
+            FileEntry: Absolute path, size and mtime of each file
+        """
+        self.stats = {"listed": 0, "reused": 0}
+        visited = set()
+        dirty = False
+        completed = False
+        stack = [("", 0)]
+        try:
+            while stack:
+                rel_dir, depth = stack.pop()
+                abs_dir = os.path.join(self.root, rel_dir) if rel_dir else self.root
+                listing, listed = self._listing(rel_dir, abs_dir)
+                if listing is None:
+                    continue
+                visited.add(rel_dir)
+                dirty = dirty or listed
+                if "pyvenv.cfg" in (name for name, _, _ in listing["files"]) and rel_dir:
+                    continue  # A virtualenv root
+
+                for name, size, mtime in listing["files"]:
+                    rel_path = f"{rel_dir}/{name}" if rel_dir else name
+                    if self.rules.excluded(rel_path, False):
+                        continue
+                    if file_extensions and not any(name.endswith(ext) for ext in file_extensions):
+                        continue
+                    yield FileEntry(os.path.join(abs_dir, name), size, mtime)
+
+                if self.max_depth is not None and depth >= self.max_depth:
+                    continue
+                for name in reversed(listing["dirs"]):
+                    rel_path = f"{rel_dir}/{name}" if rel_dir else name
+                    if not self.rules.excluded(rel_path, True):
+                        stack.append((rel_path, depth + 1))
+            completed = True
+        finally:
+            if completed and self.max_depth is None:
+                stale = [rel_dir for rel_dir in self.manifest if rel_dir not in visited]
+                for rel_dir in stale:
+                    del self.manifest[rel_dir]
+                dirty = dirty or bool(stale)
+            if dirty:
+                self._save_manifest()
+
+    def _listing(self, rel_dir: str, abs_dir: str) -> Tuple[Optional[dict], bool]:
+        """Return (listing, freshly_listed) for a directory, reusing the manifest when valid."""
+        try:
+            mtime_ns = os.stat(abs_dir).st_mtime_ns
+        except OSError:
+            return None, False
+        cached = self.manifest.get(rel_dir)
+        if cached is not None and cached["mtime_ns"] == mtime_ns:
+            self.stats["reused"] += 1
+            return cached, False
+
+        files, dirs = [], []
+        try:
+            with os.scandir(abs_dir) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            dirs.append(entry.name)
+                        elif entry.is_file():
+                            st = entry.stat()
+                            files.append((entry.name, st.st_size, st.st_mtime))
+                    except OSError:
+                        continue
+        except OSError as e:
+            logging.debug(f"Cannot list {abs_dir}: {str(e)}")
+            return None, False
+        files.sort()
+        dirs.sort()
+        self.stats["listed"] += 1
+        # A directory modified within the racy window may change again within the
+        # same mtime tick, so its listing is kept for this walk but never reused.
+        trusted = time.time_ns() - mtime_ns > RACY_WINDOW_NS
+        listing = {"mtime_ns": mtime_ns if trusted else -1, "files": files, "dirs": dirs}
+        self.manifest[rel_dir] = listing
+        return listing, True
+
+    def _load_manifest(self) -> Dict[str, dict]:
+        if not self.manifest_path or not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as file:
+                state = json.load(file)
+            if state.get("version") != self.MANIFEST_VERSION or state.get("root") != self.root:
+                return {}
+            return state["directories"]
+        except Exception as e:
+            logging.warning(f"Discarding unreadable walk manifest {self.manifest_path}: {str(e)}")
+            return {}
+
+    def _save_manifest(self) -> None:
+        if not self.manifest_path:
+            return
+        state = {"version": self.MANIFEST_VERSION, "root": self.root, "directories": self.manifest}
+        tmp_path = f"{self.manifest_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(state, file)
+            os.replace(tmp_path, self.manifest_path)
+        except OSError as e:
+            logging.warning(f"Could not write walk manifest {self.manifest_path}: {str(e)}")
@@ -0,0 +1,256 @@
+import logging
+import os
+import pickle
+import re
+from array import array
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+try:
+    import re._parser as sre_parse  # Python 3.11+
+except ImportError:  # pragma: no cover - Python 3.10
+    import sre_parse
+
+
+class TrigramIndex:
+    """
+    Persistent trigram index used to narrow content searches to candidate files.
+
+    Every indexed file gets an integer id, and each trigram (three bytes of the
+    ASCII-lowercased file content) maps to an append-only array of ids. A file
+    that changes on disk (different mtime or size) is re-indexed under a new id
+    and its old id becomes a tombstone, so updates never rewrite posting lists;
+    tombstones are purged once they outnumber live files.
+    """
+
+    VERSION = 1
+    MIN_LITERAL = 3
+    # ASCII letters that re.IGNORECASE also matches to non-ASCII ones (ı İ, the Kelvin sign, ſ)
+    UNICODE_FOLDED = frozenset("iksIKS")
+
+    def __init__(self, index_path: str, max_file_size: int = 4 * 1024 * 1024):
+        """
+        Args:
+            index_path (str): File the index is persisted to
+            max_file_size (int): Larger files are not indexed and always treated as candidates
+        """
+        self.index_path = index_path
+        self.max_file_size = max_file_size
+        self.files: Dict[str, Tuple[int, float, int]] = {}  # path -> (id, mtime, size)
+        self.postings: Dict[bytes, array] = {}
+        self.dead: Set[int] = set()
+        self.next_id = 0
+        self._paths_by_id: Optional[Dict[int, str]] = None
+        self._dirty = False
+        self.load()
+
+    def load(self) -> None:
+        """Load the index from disk, starting empty if it is missing or unreadable."""
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, "rb") as file:
+                state = pickle.load(file)
+            if state.get("version") != self.VERSION:
+                raise ValueError(f"unsupported index version {state.get('version')}")
+            self.files = state["files"]
+            self.postings = state["postings"]
+            self.dead = state["dead"]
+            self.next_id = state["next_id"]
+            self._paths_by_id = None
+        except Exception as e:
+            logging.warning(f"Discarding unreadable trigram index {self.index_path}: {str(e)}")
+            self.files, self.postings, self.dead, self.next_id = {}, {}, set(), 0
+
+    def save(self) -> None:
+        """Atomically write the index to disk if it changed since the last save."""
+        if not self._dirty:
+            return
+        if len(self.dead) > max(1024, len(self.files)):
+            self.compact()
+        state = {
+            "version": self.VERSION,
+            "files": self.files,
+            "postings": self.postings,
+            "dead": self.dead,
+            "next_id": self.next_id,
+        }
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "wb") as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.index_path)
+        self._dirty = False
+
+    def compact(self) -> None:
+        """Drop tombstoned ids from every posting list."""
+        dead = self.dead
+        compacted = {}
+        for trigram, ids in self.postings.items():
+            live = array("I", (file_id for file_id in ids if file_id not in dead))
+            if live:
+                compacted[trigram] = live
+        self.postings = compacted
+        self.dead = set()
+        self._dirty = True
+
+    def update(self, paths: Iterable[str]) -> Dict[str, int]:
+        """
+        Bring the index up to date for the given files.
+
+        Only files whose mtime or size differ from the indexed values are read.
+
+        Args:
+            paths (Iterable[str]): Files that are about to be searched
+
+        Returns:
+            Dict[str, int]: Counts of 'indexed', 'unchanged' and 'removed' files
+        """
+        stats = {"indexed": 0, "unchanged": 0, "removed": 0}
+        for path in paths:
+            entry = self.files.get(path)
+            try:
+                st = os.stat(path)
+            except OSError:
+                if entry is not None:
+                    self._forget(path)
+                    stats["removed"] += 1
+                continue
+            if entry is not None and entry[1] == st.st_mtime and entry[2] == st.st_size:
+                stats["unchanged"] += 1
+                continue
+            if entry is not None:
+                self._forget(path)
+            self._index_file(path, st.st_mtime, st.st_size)
+            stats["indexed"] += 1
+        return stats
+
+    def candidates(self, pattern: str, case_sensitive: bool = False) -> Optional[Set[str]]:
+        """
+        Return the indexed files that may contain a match for the pattern.
+
+        Args:
+            pattern (str): Regular expression as passed to re.search
+            case_sensitive (bool): Whether the search is case sensitive
+
+        Returns:
+            Optional[Set[str]]: Candidate paths, or None when the pattern has no
+            literal of at least three characters and every file must be scanned
+        """
+        trigrams = self.pattern_trigrams(pattern, 0 if case_sensitive else re.IGNORECASE)
+        if not trigrams:
+            return None
+
+        postings = []
+        for trigram in trigrams:
+            ids = self.postings.get(trigram)
+            if not ids:
+                postings = []
+                break
+            postings.append(ids)
+        postings.sort(key=len)
+
+        matched: Set[int] = set()
+        if postings:
+            matched = set(postings[0])
+            for ids in postings[1:]:
+                matched.intersection_update(ids)
+                if not matched:
+                    break
+        matched -= self.dead
+
+        paths_by_id = self._id_map()
+        result = {paths_by_id[file_id] for file_id in matched if file_id in paths_by_id}
+        # Oversized files are never tokenized, so they can never be ruled out
+        result.update(path for path, (file_id, _, _) in self.files.items() if file_id < 0)
+        return result
+
+    @classmethod
+    def pattern_trigrams(cls, pattern: str, flags: int = 0) -> Set[bytes]:
+        """Collect the trigrams of every literal run a match must contain."""
+        trigrams = set()
+        for literal in cls.required_literals(pattern, flags):
+            data = literal.encode("utf-8").lower()
+            trigrams.update(data[i:i + 3] for i in range(len(data) - 2))
+        return trigrams
+
+    @classmethod
+    def required_literals(cls, pattern: str, flags: int = 0) -> List[str]:
+        """
+        Extract literal substrings that any match of the pattern must contain.
+
+        The analysis is deliberately conservative: alternations, classes and
+        optional pieces end a literal run, and case-insensitive non-ASCII
+        literals are dropped because the index only folds ASCII case. For the
+        same reason a case-insensitive run is split at i, k and s, which also
+        match non-ASCII characters ("ſ" for s, the Kelvin sign for k).
+        """
+        try:
+            parsed = sre_parse.parse(pattern, flags)
+        except (re.error, RecursionError):
+            return []
+        literals: List[str] = []
+        cls._collect_literals(parsed, bool(parsed.state.flags & re.IGNORECASE), literals)
+        return [literal for literal in literals if len(literal) >= cls.MIN_LITERAL]
+
+    @classmethod
+    def _collect_literals(cls, items, ignore_case: bool, literals: List[str]) -> None:
+        run: List[str] = []
+
+        def flush():
+            literal = "".join(run)
+            run.clear()
+            if not literal:
+                return
+            if not ignore_case:
+                literals.append(literal)
+            elif literal.isascii():
+                literals.extend(re.split(f"[{''.join(sorted(cls.UNICODE_FOLDED))}]", literal))
+
+        for op, av in items:
+            if op is sre_parse.LITERAL:
+                run.append(chr(av))
+            elif op is sre_parse.SUBPATTERN:
+                flush()
+                _, add_flags, _, sub_items = av
+                cls._collect_literals(sub_items, ignore_case or bool(add_flags & re.IGNORECASE), literals)
+            elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+                flush()
+                cls._collect_literals(av[2], ignore_case, literals)
+            elif op is sre_parse.AT:
+                continue  # anchors consume nothing
+            else:
+                flush()
+        flush()
+
+    def _index_file(self, path: str, mtime: float, size: int) -> None:
+        self._dirty = True
+        self._paths_by_id = None
+        if size > self.max_file_size:
+            self.files[path] = (-1, mtime, size)
+            return
+        try:
+            with open(path, "rb") as file:
+                data = file.read().lower()
+        except OSError:
+            return
+        file_id = self.next_id
+        self.next_id += 1
+        self.files[path] = (file_id, mtime, size)
+        postings = self.postings
+        for trigram in {data[i:i + 3] for i in range(len(data) - 2)}:
+            ids = postings.get(trigram)
+            if ids is None:
+                postings[trigram] = array("I", (file_id,))
+            else:
+                ids.append(file_id)
+
+    def _forget(self, path: str) -> None:
+        file_id = self.files.pop(path)[0]
+        if file_id >= 0:
+            self.dead.add(file_id)
+        self._dirty = True
+        self._paths_by_id = None
+
+    def _id_map(self) -> Dict[int, str]:
+        if self._paths_by_id is None:
+            self._paths_by_id = {file_id: path for path, (file_id, _, _) in self.files.items() if file_id >= 0}
+        return self._paths_by_id
@@ -0,0 +1,154 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import quote
+
+import requests
+from bs4 import BeautifulSoup, FeatureNotFound
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+
+class Provider(NamedTuple):
+    name: str
+    url: str  # Format string with {query} and {num}
+    item_selector: str
+    title_selector: str
+
+
+DEFAULT_PROVIDERS = [
+    Provider("Google", "https://www.google.com/search?q={query}&num={num}", "div.g", "h3"),
+    Provider("Bing", "https://www.bing.com/search?q={query}&count={num}", "li.b_algo", "h2"),
+]
+
+
+class WebSearch:
+    """
+    Query several search providers at once over a pooled HTTP session.
+
+    Providers are fetched concurrently, each request has a connect/read
+    timeout and is retried with backoff on connection errors and 429/5xx
+    answers, and result pages are parsed with lxml when it is installed.
+    Results are cached per (query, num_results) with a TTL, and the cache
+    evicts least recently used queries beyond max_entries.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(
+            self,
+            providers: Optional[List[Provider]] = None,
+            timeout: Tuple[float, float] = (3.05, 10.0),
+            retries: int = 2,
+            backoff: float = 0.3,
+            max_entries: int = 256,
+            ttl: float = 900.0
+    ):
+        """
+        Args:
+            providers (Optional[List[Provider]]): Search providers (default: DEFAULT_PROVIDERS)
+            timeout (Tuple[float, float]): Connect and read timeouts in seconds
+            retries (int): Retries per request
+            backoff (float): Backoff factor between retries
+            max_entries (int): Cached queries kept
+            ttl (float): Seconds a cached result stays valid
+        """
+        self.providers = providers or DEFAULT_PROVIDERS
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=self.RETRY_STATUSES,
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=len(self.providers), pool_maxsize=8, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=len(self.providers), thread_name_prefix="web-search")
+        self.cache: "OrderedDict[Tuple[str, int], Tuple[float, List[Dict[str, str]]]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def search(self, query: str, num_results: int = 5) -> List[Dict[str, str]]:
+        """
+        Search every provider for the query.
+
+        Args:
+            query (str): Search terms
+            num_results (int): Results wanted from each provider
+
+        Returns:
+            List[Dict[str, str]]: title/url/source dicts, grouped by provider in provider order
+        """
+        key = (" ".join(query.lower().split()), num_results)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None and entry[0] > now:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return list(entry[1])
+            self.misses += 1
+
+        futures = [self.executor.submit(self._fetch, provider, query, num_results) for provider in self.providers]
+        results: List[Dict[str, str]] = []
+        failed = False
+        for future in futures:
+            provider_results = future.result()
+            failed = failed or provider_results is None
+            results.extend(provider_results or [])
+
+        if not failed:  # Do not pin a partial answer for the whole TTL
+            with self.lock:
+                self.cache[key] = (time.monotonic() + self.ttl, results)
+                self.cache.move_to_end(key)
+                while len(self.cache) > self.max_entries:
+                    self.cache.popitem(last=False)
+        return list(results)
+
+    def _fetch(self, provider: Provider, query: str, num_results: int) -> Optional[List[Dict[str, str]]]:
+        """Fetch and parse one provider's results; None when the request failed."""
+        url = provider.url.format(query=quote(query), num=num_results)
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            logging.warning(f"{provider.name} search failed: {str(e)}")
+            return None
+        results = self.parse(response.text, provider, num_results)
+        logging.debug(f"{provider.name} search took {time.perf_counter() - start:.2f}s")
+        return results
+
+    @staticmethod
+    def parse(html: str, provider: Provider, num_results: int) -> List[Dict[str, str]]:
+        try:
+            soup = BeautifulSoup(html, "lxml")
+        except FeatureNotFound:
+            soup = BeautifulSoup(html, "html.parser")
+        results = []
+        for item in soup.select(provider.item_selector)[:num_results]:
+            link = item.find('a', href=True)
+            title = item.find(provider.title_selector)
+            if link and title:
+                results.append({'title': title.get_text(strip=True), 'url': link['href'], 'source': provider.name})
+        return results
+
+    def clear(self) -> None:
+        with self.lock:
+            self.cache.clear()
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
@@ -1,14 +1,23 @@
 use lopdf::Document;
 use std::env;
 use std::fs;
+use std::io::{self, Write};
 use std::path::Path;
+use std::sync::{Arc, Mutex};
+use std::thread;
 
 fn main() {
     // Collect command-line arguments
     let args: Vec<String> = env::args().collect();
 
+    if args.len() >= 2 && args[1] == "--pages" {
+        dump_pages(&args[2..]);
+        return;
+    }
+
     if args.len() < 3 {
         eprintln!("Usage: {} <file_or_directory> <word1> [<word2> ...]", args[0]);
+        eprintln!("       {} --pages <file.pdf> [<file.pdf> ...]", args[0]);
         std::process::exit(1);
     }
 
@@ -58,3 +67,64 @@ fn process_file(file_path: &str, search_words: &[String]) -> Result<(), Box<dyn
     Ok(())
 }
 
+
+// Batch mode for the Python agent: print every page's text as one JSON line,
+// {"file": ..., "page": n, "text": ...}, parsing the files on a few threads.
+fn dump_pages(files: &[String]) {
+    let queue = Arc::new(Mutex::new(files.to_vec()));
+    let stdout = Arc::new(Mutex::new(io::stdout()));
+    let workers = thread::available_parallelism().map_or(1, |n| n.get()).min(files.len().max(1));
+    let handles: Vec<_> = (0..workers)
+        .map(|_| {
+            let queue = Arc::clone(&queue);
+            let stdout = Arc::clone(&stdout);
+            thread::spawn(move || loop {
+                let file_path = match queue.lock().unwrap().pop() {
+                    Some(file_path) => file_path,
+                    None => break,
+                };
+                let pdf = match Document::load(&file_path) {
+                    Ok(pdf) => pdf,
+                    Err(err) => {
+                        eprintln!("Failed to load PDF file '{}': {}", file_path, err);
+                        continue;
+                    }
+                };
+                let mut lines = String::new();
+                for page_number in pdf.get_pages().into_keys() {
+                    // extract_text takes page numbers, not object ids
+                    let text = pdf.extract_text(&[page_number]).unwrap_or_default();
+                    lines.push_str(&format!(
+                        "{{\"file\":{},\"page\":{},\"text\":{}}}\n",
+                        json_string(&file_path),
+                        page_number,
+                        json_string(&text)
+                    ));
+                }
+                // One write per file keeps the lines of concurrent files from interleaving
+                let _ = stdout.lock().unwrap().write_all(lines.as_bytes());
+            })
+        })
+        .collect();
+    for handle in handles {
+        let _ = handle.join();
+    }
+}
+
+fn json_string(value: &str) -> String {
+    let mut quoted = String::with_capacity(value.len() + 2);
+    quoted.push('"');
+    for c in value.chars() {
+        match c {
+            '"' => quoted.push_str("\\\""),
+            '\\' => quoted.push_str("\\\\"),
+            '\n' => quoted.push_str("\\n"),
+            '\r' => quoted.push_str("\\r"),
+            '\t' => quoted.push_str("\\t"),
+            c if (c as u32) < 0x20 => quoted.push_str(&format!("\\u{:04x}", c as u32)),
+            c => quoted.push(c),
+        }
+    }
+    quoted.push('"');
+    quoted
+}
@@ -0,0 +1,247 @@
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Set, Tuple
+from metrics import REGISTRY
+
+Messages = List[Dict[str, str]]
+
+
+@dataclass
+class BatchItem:
+    id: str
+    prompt: str
+    offset: int  # Byte offset just past the item's line in the input file
+    length: int = 0  # Prompt length used for bucketing
+
+
+@dataclass
+class BatchStats:
+    completed: int = 0
+    skipped: int = 0  # Already in the output from an earlier run
+    errors: int = 0
+    output_tokens: int = 0
+    elapsed: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+
+    def percentile(self, q: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self) -> Dict[str, float]:
+        elapsed = max(self.elapsed, 1e-9)
+        return {
+            "completed": self.completed,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "prompts_per_second": round(self.completed / elapsed, 3),
+            "output_tokens_per_second": round(self.output_tokens / elapsed, 3),
+            "latency_p50_seconds": round(self.percentile(0.5), 3),
+            "latency_p95_seconds": round(self.percentile(0.95), 3),
+            "latency_max_seconds": round(max(self.latencies, default=0.0), 3),
+        }
+
+
+def read_items(path: str, start: int = 0) -> Iterator[BatchItem]:
+    """
+    Stream the prompts of a JSONL file from a byte offset.
+
+    Each line is an object with a "prompt" string and an optional "id"
+    (default: the line's byte offset, which stays stable across runs).
+    Blank and malformed lines are skipped with a warning.
+    """
+    with open(path, "rb") as file:
+        file.seek(start)
+        offset = start
+        for line in file:
+            line_start, offset = offset, offset + len(line)
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                prompt = record["prompt"]
+                if not isinstance(prompt, str):
+                    raise ValueError("prompt is not a string")
+            except (ValueError, KeyError, TypeError) as e:
+                logging.warning(f"Skipping malformed batch line at byte {line_start}: {str(e)}")
+                continue
+            yield BatchItem(str(record.get("id", line_start)), prompt, offset)
+
+
+class BatchRunner:
+    """
+    Runs a JSONL file of prompts through a generate function, resumably.
+
+    Prompts are read as a stream, a window at a time. Each window is sorted
+    by prompt length and submitted in that order, so the prompts generating
+    together have similar lengths; with a batch scheduler behind generate
+    they share prefill and decode batches with little padding. Results are
+    appended to the output as each prompt finishes.
+
+    A checkpoint file next to the output records the input offset before
+    which every prompt is done, and is rewritten every checkpoint_every
+    results after flushing the output. A rerun reads the finished ids from
+    the output (cutting off a torn last line), continues from the
+    checkpointed offset and skips anything already written.
+    """
+
+    def __init__(
+            self,
+            generate: Callable[[Messages], str],
+            prepare: Callable[[str], Messages],
+            concurrency: int = 8,
+            window: int = 256,
+            checkpoint_every: int = 64,
+            count_tokens: Optional[Callable[[str], int]] = None
+    ):
+        """
+        Args:
+            generate: Turns messages into a response (e.g. PipelineProcessor.complete)
+            prepare: Turns a prompt into messages (e.g. the supervisor's prompt plus the user's)
+            concurrency: Prompts generating at once; match the scheduler's batch size
+            window: Prompts read ahead and sorted by length together
+            checkpoint_every: Results between checkpoints
+            count_tokens: Token counter for bucketing and throughput (default: ~4 characters a token)
+        """
+        self.generate = generate
+        self.prepare = prepare
+        self.concurrency = concurrency
+        self.window = window
+        self.checkpoint_every = checkpoint_every
+        self.count_tokens = count_tokens or (lambda text: (len(text) + 3) // 4)
+
+    @staticmethod
+    def checkpoint_path(out_path: str) -> str:
+        return out_path + ".checkpoint"
+
+    def _resume(self, input_path: str, out_path: str) -> Tuple[int, Set[str]]:
+        """The input offset to continue from and the ids already in the output."""
+        done: Set[str] = set()
+        if os.path.exists(out_path):
+            with open(out_path, "rb+") as file:
+                valid = 0
+                for line in file:
+                    if not line.endswith(b"\n"):
+                        break  # Cut off by a kill even if it parses: it is truncated below, so not done
+                    try:
+                        done.add(json.loads(line)["id"])
+                    except (ValueError, KeyError):
+                        break
+                    valid += len(line)
+                file.truncate(valid)  # Drop a result torn by a kill
+        start = 0
+        try:
+            with open(self.checkpoint_path(out_path), "r", encoding="utf-8") as file:
+                checkpoint = json.load(file)
+            if checkpoint["input"] == os.path.abspath(input_path) and checkpoint["input_size"] <= os.path.getsize(input_path):
+                start = checkpoint["offset"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return start, done
+
+    def _write_checkpoint(self, input_path: str, out_path: str, offset: int, output) -> None:
+        output.flush()
+        os.fsync(output.fileno())
+        checkpoint = {
+            "input": os.path.abspath(input_path),
+            "input_size": os.path.getsize(input_path),
+            "offset": offset,
+        }
+        tmp_path = self.checkpoint_path(out_path) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(checkpoint, file)
+        os.replace(tmp_path, self.checkpoint_path(out_path))
+
+    def _run_item(self, item: BatchItem) -> Dict:
+        started = time.perf_counter()
+        result = {"id": item.id}
+        try:
+            result["response"] = self.generate(self.prepare(item.prompt))
+        except Exception as e:
+            logging.error(f"Batch prompt {item.id} failed: {str(e)}")
+            result["error"] = str(e)
+        result["latency_seconds"] = round(time.perf_counter() - started, 4)
+        return result
+
+    def _windows(self, items: Iterator[BatchItem]) -> Iterator[List[BatchItem]]:
+        window: List[BatchItem] = []
+        for item in items:
+            item.length = self.count_tokens(item.prompt)
+            window.append(item)
+            if len(window) >= self.window:
+                yield sorted(window, key=lambda i: i.length)
+                window = []
+        if window:
+            yield sorted(window, key=lambda i: i.length)
+
+    def run(self, input_path: str, out_path: str) -> BatchStats:
+        """
+        Process every prompt of input_path not yet in out_path.
+
+        Returns:
+            BatchStats: Counts, throughput and per-prompt latencies of this run
+        """
+        start, done = self._resume(input_path, out_path)
+        if start or done:
+            logging.info(f"Resuming batch at byte {start} of {input_path}; {len(done)} results already written")
+        stats = BatchStats()
+        began = time.perf_counter()
+        outstanding: Deque[int] = deque()  # Input offsets of prompts not yet written, in input order
+        finished: Set[int] = set()
+        checkpoint_offset = start
+        since_checkpoint = 0
+
+        def advance(offset: int) -> None:
+            # The checkpoint may only move past prompts that are all written
+            nonlocal checkpoint_offset
+            finished.add(offset)
+            while outstanding and outstanding[0] in finished:
+                checkpoint_offset = outstanding.popleft()
+                finished.discard(checkpoint_offset)
+
+        with open(out_path, "a", encoding="utf-8") as output, \
+                ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch") as pool:
+            for window in self._windows(read_items(input_path, start)):
+                outstanding.extend(sorted(item.offset for item in window))
+                pending: Dict[Future, BatchItem] = {}
+                queue = iter(window)
+                while True:
+                    while len(pending) < self.concurrency:
+                        item = next(queue, None)
+                        if item is None:
+                            break
+                        if item.id in done:
+                            stats.skipped += 1
+                            advance(item.offset)
+                            continue
+                        pending[pool.submit(self._run_item, item)] = item
+                    if not pending:
+                        break
+                    completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in completed:
+                        item = pending.pop(future)
+                        result = future.result()
+                        output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                        done.add(item.id)
+                        stats.completed += 1
+                        stats.latencies.append(result["latency_seconds"])
+                        REGISTRY.observe("batch_prompt_seconds", result["latency_seconds"], "Batch prompt latency")
+                        if "error" in result:
+                            stats.errors += 1
+                        else:
+                            stats.output_tokens += self.count_tokens(result["response"])
+                        advance(item.offset)
+                        since_checkpoint += 1
+                        if since_checkpoint >= self.checkpoint_every:
+                            self._write_checkpoint(input_path, out_path, checkpoint_offset, output)
+                            since_checkpoint = 0
+            self._write_checkpoint(input_path, out_path, checkpoint_offset, output)
+        stats.elapsed = time.perf_counter() - began
+        return stats
@@ -0,0 +1,84 @@
+"""
+Compare content search with and without the trigram index.
+
+Builds a synthetic tree (100k files by default) and times a cold scan, a
+parallel scan, the first indexed query (which builds the index), a warm indexed query and a
+query after a handful of files were edited.
+
+    python -m benchmarks.bench_content_index --files 100000
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+from agent import Agent
+
+WORDS = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel",
+         "india", "juliet", "kilo", "lima", "mike", "november", "oscar", "papa"]
+
+
+def build_tree(root: str, num_files: int, files_per_dir: int = 500, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    for i in range(num_files):
+        directory = os.path.join(root, f"d{i // files_per_dir:04d}")
+        if i % files_per_dir == 0:
+            os.makedirs(directory, exist_ok=True)
+        lines = [" ".join(rng.choice(WORDS) for _ in range(8)) for _ in range(12)]
+        if i % 997 == 0:
+            lines.append(f"needle_token_{i} = True")
+        with open(os.path.join(directory, f"f{i:06d}.txt"), "w", encoding="utf-8") as file:
+            file.write("\n".join(lines))
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=100000)
+    parser.add_argument("--edits", type=int, default=10)
+    parser.add_argument("--query", default=r"needle_token_\d+")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_index_")
+    os.environ["AGENT_CACHE_DIR"] = os.path.join(workdir, "cache")
+    tree = os.path.join(workdir, "tree")
+    try:
+        build_time, _ = timed(lambda: build_tree(tree, args.files))
+        print(f"Generated {args.files} files in {build_time:.2f}s")
+
+        agent = Agent(base_directory=tree)
+        agent.search_directory()
+
+        cold, baseline = timed(lambda: agent.find_string_in_files(args.query, use_index=False))
+        build, indexed = timed(lambda: agent.find_string_in_files(args.query))
+        warm, _ = timed(lambda: agent.find_string_in_files(args.query))
+        assert indexed == baseline, "indexed search returned different results"
+        parallel, _ = timed(lambda: list(agent.iter_string_in_files(args.query, use_index=False)))
+
+        paths = sorted(agent.search_results)
+        for path in random.Random(1).sample(paths, min(args.edits, len(paths))):
+            with open(path, "a", encoding="utf-8") as file:
+                file.write("\nneedle_token_edit = 1")
+        incremental, _ = timed(lambda: agent.find_string_in_files(args.query))
+
+        print(f"{'cold scan (no index)':<28}{cold:>10.3f}s")
+        print(f"{'parallel scan':<28}{parallel:>10.3f}s")
+        print(f"{'first query (build index)':<28}{build:>10.3f}s")
+        print(f"{'warm index':<28}{warm:>10.3f}s")
+        print(f"{f'incremental ({args.edits} edits)':<28}{incremental:>10.3f}s")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Compare CPU precisions of Pipeline.initialize_pipeline.
+
+Each precision is loaded in a fresh interpreter so resident memory is not
+shared between runs; the report gives load time, RSS and greedy decode speed.
+
+    python -m benchmarks.bench_cpu_backend --model ./models/phi4 --threads 16
+    python -m benchmarks.bench_cpu_backend --tiny
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+
+from os.path import dirname, join, abspath
+REPO_ROOT = abspath(join(dirname(__file__), '..'))
+sys.path.insert(0, REPO_ROOT)
+
+RUN_ONE = """
+import json, sys
+sys.path.insert(0, {root!r})
+from pipeline import Pipeline
+pipeline = Pipeline.initialize_pipeline({model!r}, device="cpu", precision={precision!r},
+                                        num_threads={threads!r}, compile_model={compile!r})
+Pipeline.measure_throughput(pipeline, max_new_tokens={tokens!r})
+print(json.dumps(vars(pipeline.load_report)))
+"""
+
+
+def run_one(model: str, precision: str, threads, compile_model: bool, tokens: int) -> dict:
+    code = RUN_ONE.format(root=REPO_ROOT, model=model, precision=precision, threads=threads,
+                          compile=compile_model, tokens=tokens)
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{precision} run failed: {proc.stderr.strip().splitlines()[-1:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=None, help="Model directory")
+    parser.add_argument("--tiny", action="store_true", help="Use a small random model (as in the tests)")
+    parser.add_argument("--precisions", nargs="+", default=["fp32", "bf16", "int8"])
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--compile", action="store_true")
+    parser.add_argument("--tokens", type=int, default=32, help="Tokens generated for the timing")
+    args = parser.parse_args()
+
+    model = args.model
+    if args.tiny or model is None:
+        from tests.conftest import make_tiny_model
+        model = make_tiny_model(tempfile.mkdtemp(prefix="tiny_model_"), num_hidden_layers=4)
+
+    print(f"{'precision':<10} {'load s':>8} {'rss GiB':>8} {'tokens/s':>9}")
+    for precision in args.precisions:
+        report = run_one(model, precision, args.threads, args.compile, args.tokens)
+        print(f"{precision:<10} {report['load_seconds']:8.2f} {report['rss_bytes'] / 2**30:8.2f} "
+              f"{report['tokens_per_second']:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Measure what each forked model-host worker really costs in memory.
+
+The model is mapped once with load_shared_pipeline, N workers are forked and
+each runs a generation; once all are done the parent reads every worker's
+/proc/<pid>/smaps. The weights' Pss shrinks as more workers share them while
+their private bytes stay near zero.
+
+    python -m benchmarks.bench_model_host --tiny --workers 4
+    python -m benchmarks.bench_model_host --model ./models/phi4 --workers 2 --json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+
+def measure(model_path: str, workers: int, max_new_tokens: int = 8) -> dict:
+    from interface.pipeline_processor import PipelineProcessor
+    from model_host import ModelHost, load_shared_pipeline, memory_usage, safetensors_files
+
+    pipeline = load_shared_pipeline(model_path)
+    processor = PipelineProcessor(pipeline, max_new_tokens=max_new_tokens, do_sample=False)
+    host = ModelHost(processor, socket_path="", workers=workers)
+    ready_read, ready_write = os.pipe()
+    go_read, go_write = os.pipe()
+
+    def worker() -> None:
+        os.close(ready_read)
+        os.close(go_write)
+        processor.complete([{"role": "user", "content": "Share the weights, please."}])
+        os.write(ready_write, b"r")
+        os.read(go_read, 1)  # Stay alive until the parent has measured everyone
+
+    pids = host.fork_workers(worker)
+    os.close(ready_write)
+    os.close(go_read)
+    for _ in pids:
+        os.read(ready_read, 1)
+
+    weights_dir = os.path.realpath(model_path)
+    report = {
+        "checkpoint_bytes": sum(os.path.getsize(path) for path in safetensors_files(model_path)),
+        "parent": memory_usage(os.getpid()),
+        "workers": [
+            {"pid": pid, "total": memory_usage(pid), "weights": memory_usage(pid, weights_dir)}
+            for pid in pids
+        ]
+    }
+    os.close(go_write)
+    for pid in pids:
+        os.waitpid(pid, 0)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=None, help="Model directory")
+    parser.add_argument("--tiny", action="store_true", help="Use a small random model (as in the tests)")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--json", action="store_true", help="Print the raw report as JSON")
+    args = parser.parse_args()
+
+    model = args.model
+    if args.tiny or model is None:
+        from tests.conftest import make_tiny_model
+        model = make_tiny_model(tempfile.mkdtemp(prefix="tiny_model_"))
+
+    report = measure(model, args.workers)
+    if args.json:
+        print(json.dumps(report))
+        return
+    mib = 2 ** 20
+    print(f"checkpoint {report['checkpoint_bytes'] / mib:.1f} MiB, parent rss {report['parent']['rss'] / mib:.1f} MiB")
+    print(f"{'pid':>8} {'rss':>9} {'pss':>9} {'weights rss':>12} {'weights pss':>12} {'weights private':>16}")
+    for worker in report["workers"]:
+        total, weights = worker["total"], worker["weights"]
+        print(f"{worker['pid']:>8} {total['rss'] / mib:8.1f}M {total['pss'] / mib:8.1f}M "
+              f"{weights['rss'] / mib:11.1f}M {weights['pss'] / mib:11.1f}M {weights['private'] / mib:15.1f}M")
+
+
+if __name__ == "__main__":
+    main()
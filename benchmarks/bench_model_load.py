@@ -0,0 +1,66 @@
+"""
+Compare cold model loading: from_pretrained against ShardLoader.
+
+Each configuration loads in a fresh interpreter. Drop the page cache between
+runs (as root: sync; echo 3 > /proc/sys/vm/drop_caches) to time real disk reads.
+
+    python -m benchmarks.bench_model_load --model ./models/phi4 --precision bf16
+    python -m benchmarks.bench_model_load --tiny --precision int8 --checkpoint-cache
+"""
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+
+from os.path import dirname, join, abspath
+REPO_ROOT = abspath(join(dirname(__file__), '..'))
+sys.path.insert(0, REPO_ROOT)
+
+RUN_ONE = """
+import json, sys
+sys.path.insert(0, {root!r})
+from pipeline import Pipeline
+pipeline = Pipeline.initialize_pipeline({model!r}, device="cpu", precision={precision!r},
+                                        load_workers={workers!r}, checkpoint_cache={cache!r})
+report = pipeline.load_report
+print(json.dumps({{"seconds": report.load_seconds,
+                  "phases": report.timings.phases if report.timings else None,
+                  "from_cache": bool(report.timings and report.timings.from_cache)}}))
+"""
+
+
+def run_one(model: str, precision: str, workers: int, cache: bool) -> dict:
+    code = RUN_ONE.format(root=REPO_ROOT, model=model, precision=precision, workers=workers, cache=cache)
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"load failed: {proc.stderr.strip().splitlines()[-1:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=None, help="Model directory")
+    parser.add_argument("--tiny", action="store_true", help="Use a small random sharded model")
+    parser.add_argument("--precision", default="bf16", choices=["fp32", "bf16", "int8"])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4], help="ShardLoader worker counts")
+    parser.add_argument("--checkpoint-cache", action="store_true", help="Also time a write and a reuse of the cache")
+    args = parser.parse_args()
+
+    model = args.model
+    if args.tiny or model is None:
+        from tests.conftest import make_tiny_model
+        model = make_tiny_model(tempfile.mkdtemp(prefix="tiny_model_"), num_hidden_layers=8, max_shard_size="4MB")
+
+    runs = [("from_pretrained", 0, False)] + [(f"shard_loader x{w}", w, False) for w in args.workers]
+    if args.checkpoint_cache:
+        runs += [("cache write", args.workers[-1], True), ("cache reuse", args.workers[-1], True)]
+    for label, workers, cache in runs:
+        result = run_one(model, args.precision, workers, cache)
+        phases = result["phases"]
+        detail = " ".join(f"{k}={v:.2f}" for k, v in phases.items() if v) if phases else ""
+        print(f"{label:<18} {result['seconds']:7.2f}s  {detail}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Measure markdown render service throughput.
+
+Replays a chat UI re-rendering a conversation of long assistant messages as it
+scrolls, comparing the previous per-request path (JSON5 parse and a freshly
+built markdown converter) with the cached renderer, one message per request
+against /batch, and full re-renders of a streamed message against the
+incremental StreamRenderer.
+
+    python -m benchmarks.bench_render --messages 50 --passes 10
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+import json5
+import markdown
+from interface import render
+from interface.render import MarkdownRenderer, StreamRenderer
+
+WORDS = ["model", "tensor", "cache", "shard", "agent", "token", "stream", "render",
+         "batch", "thread", "kernel", "memory", "latency", "queue", "socket", "prompt"]
+
+
+def make_message(rng: random.Random, sections: int = 6) -> str:
+    parts = []
+    for i in range(sections):
+        parts.append(f"## Step {i + 1}")
+        parts.append(" ".join(rng.choice(WORDS) for _ in range(60)))
+        parts.append("```python\n" + "\n".join(f"x_{j} = {rng.choice(WORDS)!r}" for j in range(8)) + "\n```")
+        parts.append("\n".join(f"- **{rng.choice(WORDS)}**: {' '.join(rng.choice(WORDS) for _ in range(8))}"
+                               for _ in range(4)))
+        parts.append("| name | value |\n|---|---|\n" + "\n".join(f"| {rng.choice(WORDS)} | {j} |" for j in range(4)))
+    return "\n\n".join(parts)
+
+
+def rate(count: int, seconds: float) -> str:
+    return f"{count / seconds:>10.1f}/s"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--passes", type=int, default=10, help="Times the UI re-renders the conversation")
+    parser.add_argument("--chunk", type=int, default=8, help="Characters per streamed chunk")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    messages = [make_message(rng) for _ in range(args.messages)]
+    payloads = [{"text": json.dumps({"role": "agent", "content": message})} for message in messages]
+    total = args.messages * args.passes
+    client = render.app.test_client()
+
+    start = time.perf_counter()
+    for _ in range(args.passes):
+        for payload in payloads:
+            markdown.markdown(json5.loads(payload["text"])["content"], extensions=render.MARKDOWN_EXTENSIONS)
+    baseline = time.perf_counter() - start
+
+    render.renderer.clear()
+    start = time.perf_counter()
+    for _ in range(args.passes):
+        for payload in payloads:
+            client.post("/", json=payload)
+    single = time.perf_counter() - start
+
+    render.renderer.clear()
+    start = time.perf_counter()
+    for _ in range(args.passes):
+        client.post("/batch", json={"messages": messages})
+    batch = time.perf_counter() - start
+
+    message = messages[0]
+    chunks = [message[i:i + args.chunk] for i in range(0, len(message), args.chunk)]
+    converter = MarkdownRenderer()
+    start = time.perf_counter()
+    text = ""
+    for chunk in chunks:
+        text += chunk
+        converter.convert(text)
+    full = time.perf_counter() - start
+
+    stream = StreamRenderer(MarkdownRenderer())
+    start = time.perf_counter()
+    for chunk in chunks:
+        stream.feed(chunk)
+    incremental = time.perf_counter() - start
+    assert stream.html == converter.convert(message), "incremental render differs from a full render"
+
+    print(f"{args.messages} messages of ~{sum(map(len, messages)) // args.messages} chars, {args.passes} passes")
+    print(f"{'uncached, json5 (before)':<30}{rate(total, baseline)}")
+    print(f"{'POST / with render cache':<30}{rate(total, single)}")
+    print(f"{'POST /batch':<30}{rate(total, batch)}")
+    print(f"{len(chunks)} streamed chunks of {args.chunk} chars")
+    print(f"{'full re-render per chunk':<30}{full:>10.3f}s")
+    print(f"{'incremental tail render':<30}{incremental:>10.3f}s")
+
+
+if __name__ == "__main__":
+    main()
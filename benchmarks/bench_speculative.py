@@ -0,0 +1,79 @@
+"""
+Compare decode speed with and without speculative decoding.
+
+Generates greedily from a few prompts with PipelineProcessor, once plainly and
+once with the draft model proposing --draft-tokens tokens per main model pass,
+checks that both produce the same text and reports tokens/s and the draft
+acceptance rate.
+
+    python -m benchmarks.bench_speculative --model ./models/phi4 --draft ./models/<draft> --precision bf16
+    python -m benchmarks.bench_speculative --tiny
+
+With --tiny the draft is a copy of the tiny main model: every draft is
+accepted, so the run checks correctness and shows the loop's overhead rather
+than a speed-up (the main model is too small to be bandwidth bound).
+"""
+import argparse
+import sys
+import tempfile
+import time
+
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+PROMPTS = [
+    "Write a Python function that returns the n-th Fibonacci number.",
+    "Explain what a memory-mapped file is in two sentences.",
+    "List three ways to speed up a slow SQL query.",
+]
+
+
+def run(processor, prompts, max_new_tokens: int):
+    texts, generated = [], 0
+    tokenizer = processor.pipeline.tokenizer
+    start = time.perf_counter()
+    for prompt in prompts:
+        text = processor.complete([{"role": "user", "content": prompt}])
+        texts.append(text)
+        generated += len(tokenizer(text, add_special_tokens=False).input_ids)
+    return texts, generated / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=None, help="Main model directory")
+    parser.add_argument("--draft", default=None, help="Draft model directory sharing the tokenizer")
+    parser.add_argument("--tiny", action="store_true", help="Use a small random model as both main and draft")
+    parser.add_argument("--precision", default="fp32", help="Main model precision")
+    parser.add_argument("--draft-tokens", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--tokens", type=int, default=64, help="New tokens per prompt")
+    args = parser.parse_args()
+
+    from interface import PipelineProcessor
+    from pipeline import Pipeline
+
+    model, draft = args.model, args.draft
+    if args.tiny or model is None:
+        from tests.conftest import make_tiny_model
+        model = draft = make_tiny_model(tempfile.mkdtemp(prefix="tiny_model_"), num_hidden_layers=4)
+    pipeline = Pipeline.initialize_pipeline(model, precision=args.precision)
+    draft_model = Pipeline.load_draft_model(draft, pipeline)
+
+    def processor(**kwargs):
+        return PipelineProcessor(pipeline, max_new_tokens=args.tokens, do_sample=False, **kwargs)
+
+    run(processor(), PROMPTS[:1], 4)  # Warm-up
+    baseline_texts, baseline = run(processor(), PROMPTS, args.tokens)
+    print(f"{'mode':<22} {'tokens/s':>9} {'speed-up':>9} {'accepted':>9} {'tok/pass':>9}")
+    print(f"{'plain':<22} {baseline:9.1f} {1.0:9.2f} {'-':>9} {'-':>9}")
+    for draft_tokens in args.draft_tokens:
+        speculative = processor(draft_model=draft_model, num_draft_tokens=draft_tokens)
+        texts, rate = run(speculative, PROMPTS, args.tokens)
+        assert texts == baseline_texts, "speculative decoding changed the greedy output"
+        stats = speculative.speculative_stats
+        print(f"{f'draft {draft_tokens} tokens':<22} {rate:9.1f} {rate / baseline:9.2f} "
+              f"{stats.acceptance_rate:9.0%} {stats.tokens_per_round:9.2f}")
+
+
+if __name__ == "__main__":
+    main()
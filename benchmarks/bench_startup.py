@@ -0,0 +1,103 @@
+"""
+Measure import-time startup cost with `python -X importtime`.
+
+Each target statement runs in a fresh interpreter; the report shows the
+total import time and the most expensive top-level modules, and lists any
+heavy dependency (torch, transformers, ...) the statement pulled in.
+
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --target "import agent" --budget-ms 500
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, NamedTuple
+
+from os.path import dirname, join, abspath
+REPO_ROOT = abspath(join(dirname(__file__), '..'))
+
+DEFAULT_TARGETS = ["import agent", "import interface", "import main"]
+
+# Modules that must only be imported at the point of use
+HEAVY_MODULES = ["torch", "transformers", "requests", "bs4", "debugpy", "flask", "aiohttp"]
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$")
+
+
+class ImportProfile(NamedTuple):
+    total_us: int  # Sum of the cumulative times of top-level imports
+    cumulative_us: Dict[str, int]  # Every imported module -> cumulative microseconds
+
+
+def profile_imports(statement: str, cwd: str = None) -> ImportProfile:
+    """
+    Run a statement in a fresh interpreter with -X importtime and parse the report.
+
+    Imports done by interpreter startup itself (site and its dependencies) are
+    excluded. The statement runs with the repository root on sys.path and, by
+    default, in a scratch directory so module-level side effects stay out of the tree.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")])))
+    with tempfile.TemporaryDirectory() as scratch:
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", statement],
+            cwd=cwd or scratch,
+            env=env,
+            capture_output=True,
+            text=True
+        )
+    if proc.returncode != 0:
+        raise RuntimeError(f"{statement!r} failed: {proc.stderr.strip().splitlines()[-1:]}")
+
+    cumulative: Dict[str, int] = {}
+    total = 0
+    in_startup = True
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match is None:
+            continue
+        _, cumulative_us, indent, module = match.groups()
+        if in_startup:
+            # Interpreter startup ends with the top-level import of site
+            if module == "site" and not indent:
+                in_startup = False
+            continue
+        cumulative[module] = int(cumulative_us)
+        if not indent:
+            total += int(cumulative_us)
+    return ImportProfile(total, cumulative)
+
+
+def heavy_imports(profile: ImportProfile) -> List[str]:
+    return [module for module in HEAVY_MODULES if module in profile.cumulative_us]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--target", action="append", help="Statement to profile (repeatable)")
+    parser.add_argument("--top", type=int, default=8, help="Most expensive modules to list")
+    parser.add_argument("--budget-ms", type=float, default=None, help="Fail if a target exceeds this")
+    args = parser.parse_args()
+
+    over_budget = False
+    for target in args.target or DEFAULT_TARGETS:
+        profile = profile_imports(target)
+        total_ms = profile.total_us / 1000
+        print(f"{target:<24} {total_ms:8.1f} ms  heavy: {', '.join(heavy_imports(profile)) or 'none'}")
+        slowest = sorted(
+            ((us, module) for module, us in profile.cumulative_us.items() if "." not in module),
+            reverse=True
+        )[:args.top]
+        for us, module in slowest:
+            print(f"    {module:<30} {us / 1000:8.1f} ms")
+        if args.budget_ms is not None and total_ms > args.budget_ms:
+            over_budget = True
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
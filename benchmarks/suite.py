@@ -0,0 +1,464 @@
+"""
+Micro-benchmarks for the agent tools, prompt formatting, the processor and the render service.
+
+Every case is timed over several rounds, each long enough to be measured
+reliably, and the per-call statistics are written as JSON. A saved run is a
+baseline that later runs are compared against; a case whose median time grew
+by more than --threshold is reported as a regression and the command exits
+with status 1.
+
+    python -m benchmarks.suite run --save before
+    python -m benchmarks.suite run --compare before
+    python -m benchmarks.suite compare benchmarks/baselines/before.json after.json
+    python -m benchmarks.suite list
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Tuple
+
+from os.path import dirname, join, abspath
+REPO_ROOT = abspath(join(dirname(__file__), '..'))
+sys.path.insert(0, REPO_ROOT)
+
+BASELINE_DIR = join(REPO_ROOT, "benchmarks", "baselines")
+WORDS = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel",
+         "india", "juliet", "kilo", "lima", "mike", "november", "oscar", "papa"]
+PROMPTS = [
+    "Can you search directory contents?",
+    "Please find the config loader in files",
+    "Search web for python mmap examples",
+    "Hello, how are you?",
+    "look for TODO within content",
+    "Explain the scheduler to me in detail, with examples of how requests are admitted",
+]
+
+
+class SkipCase(Exception):
+    """Raised by a case's setup when it cannot run here (e.g. torch is missing)."""
+
+
+class Context:
+    """Shared fixtures for the cases, built on first use and removed after the run."""
+
+    def __init__(self, files: int):
+        self.files = files
+        self.workdir = tempfile.mkdtemp(prefix="bench_suite_")
+        os.environ["AGENT_CACHE_DIR"] = join(self.workdir, "cache")
+        self._tree: Optional[str] = None
+        self._tiny_model: Optional[str] = None
+
+    @property
+    def tree(self) -> str:
+        if self._tree is None:
+            self._tree = join(self.workdir, "tree")
+            rng = random.Random(0)
+            for i in range(self.files):
+                directory = join(self._tree, f"d{i // 200:03d}")
+                os.makedirs(directory, exist_ok=True)
+                lines = [" ".join(rng.choice(WORDS) for _ in range(8)) for _ in range(20)]
+                if i % 97 == 0:
+                    lines.append(f"needle_token_{i} = True")
+                with open(join(directory, f"f{i:05d}.py"), "w", encoding="utf-8") as file:
+                    file.write("\n".join(lines))
+        return self._tree
+
+    @property
+    def tiny_model(self) -> str:
+        if self._tiny_model is None:
+            try:
+                from tests.conftest import make_tiny_model
+                self._tiny_model = make_tiny_model(join(self.workdir, "tiny_model"))
+            except ImportError as e:
+                raise SkipCase(str(e))
+        return self._tiny_model
+
+    def close(self) -> None:
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+CASES: Dict[str, Callable[[Context], Callable[[], object]]] = {}
+
+
+def case(name: str):
+    """Register a case: the decorated setup function returns the callable that is timed."""
+    def register(setup: Callable[[Context], Callable[[], object]]):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+class FakeTokenizer:
+    """One token per UTF-8 byte; id 0 is end of sequence."""
+    eos_token_id = 0
+
+    def __call__(self, text, add_special_tokens=False, return_tensors=None, truncation=False):
+        ids = list(text.encode("utf-8"))
+        if return_tensors != "pt":
+            return {"input_ids": ids}
+        import torch
+        from transformers import BatchEncoding
+        return BatchEncoding({"input_ids": torch.tensor([ids]), "attention_mask": torch.ones(1, len(ids), dtype=torch.long)})
+
+    def decode(self, ids, skip_special_tokens=False):
+        return bytes(int(i) for i in ids if int(i)).decode("utf-8", errors="replace")
+
+
+class FakeModel:
+    """Answers every prompt instantly with a fixed reply, so only the processor itself is timed."""
+
+    def __init__(self, reply: str):
+        import torch
+        self.reply = torch.tensor([list(reply.encode("utf-8"))])
+        self.device = torch.device("cpu")
+        self.config = SimpleNamespace(max_position_embeddings=16384, _name_or_path="fake")
+        self.generation_config = SimpleNamespace(eos_token_id=0)
+
+    def generate(self, input_ids, attention_mask=None, streamer=None, **kwargs):
+        import torch
+        sequences = torch.cat([input_ids, self.reply], dim=1)
+        if streamer is not None:
+            streamer.put(input_ids)
+            streamer.put(self.reply[0])
+            streamer.end()
+        return SimpleNamespace(sequences=sequences, past_key_values=None)
+
+
+def fake_processor():
+    try:
+        from interface.pipeline_processor import PipelineProcessor
+    except ImportError as e:
+        raise SkipCase(str(e))
+    pipeline = SimpleNamespace(model=FakeModel("Here is the answer you asked for."), tokenizer=FakeTokenizer())
+    return PipelineProcessor(pipeline, max_new_tokens=256, do_sample=False)
+
+
+def conversation(turns: int) -> List[Dict[str, str]]:
+    rng = random.Random(1)
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "user", "content": " ".join(rng.choice(WORDS) for _ in range(30))})
+        messages.append({"role": "agent", "content": " ".join(rng.choice(WORDS) for _ in range(80))})
+    return messages
+
+
+@case("agent.search_directory")
+def search_directory(ctx: Context):
+    from agent import Agent
+    tree = ctx.tree
+    return lambda: Agent(tree).search_directory()
+
+
+@case("agent.search_directory.warm")
+def search_directory_warm(ctx: Context):
+    from agent import Agent
+    agent = Agent(ctx.tree)
+    agent.search_directory()
+    return agent.search_directory
+
+
+@case("agent.find_string_in_files")
+def find_string(ctx: Context):
+    from agent import Agent
+    agent = Agent(ctx.tree)
+    agent.search_directory()
+    return lambda: agent.find_string_in_files(r"needle_token_\d+", use_index=False)
+
+
+@case("agent.find_string_in_files.indexed")
+def find_string_indexed(ctx: Context):
+    from agent import Agent
+    agent = Agent(ctx.tree)
+    agent.search_directory()
+    agent.find_string_in_files(r"needle_token_\d+")  # Builds the index
+    return lambda: agent.find_string_in_files(r"needle_token_\d+")
+
+
+@case("agent.analyze_prompt")
+def analyze_prompt(ctx: Context):
+    from agent import Agent
+    return lambda: [Agent.analyze_prompt(prompt) for prompt in PROMPTS]
+
+
+@case("processor.format_prompt")
+def format_prompt(ctx: Context):
+    processor = fake_processor()
+    for message in conversation(100):
+        processor.update_conversation(message["role"], message["content"])
+    messages = [{"role": "system", "content": "You are a helpful agent."}, {"role": "user", "content": PROMPTS[-1]}]
+    return lambda: processor._format_prompt(messages)
+
+
+@case("processor.process.fake")
+def process_fake(ctx: Context):
+    from agent import Agent
+    processor = fake_processor()
+    supervisor = Agent(ctx.workdir)
+    messages = [{"role": "system", "content": "You are a helpful agent."}, {"role": "user", "content": PROMPTS[-1]}]
+
+    def turn():
+        processor.process(messages, supervisor)
+        if len(processor.memory) > 40:
+            processor.reset_conversation()
+    return turn
+
+
+@case("processor.process.tiny")
+def process_tiny(ctx: Context):
+    try:
+        import transformers
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        from agent import Agent
+        from interface.pipeline_processor import PipelineProcessor
+    except ImportError as e:
+        raise SkipCase(str(e))
+    model = AutoModelForCausalLM.from_pretrained(ctx.tiny_model)
+    tokenizer = AutoTokenizer.from_pretrained(ctx.tiny_model)
+    pipeline = transformers.pipeline("text-generation", model=model, tokenizer=tokenizer, device="cpu")
+    processor = PipelineProcessor(pipeline, max_new_tokens=16, do_sample=False)
+    supervisor = Agent(ctx.workdir)
+    messages = [{"role": "system", "content": "You are a helpful agent."}, {"role": "user", "content": PROMPTS[-1]}]
+
+    def turn():
+        processor.reset_conversation()
+        processor.process(messages, supervisor)
+    return turn
+
+
+def render_messages(count: int = 20) -> List[str]:
+    from benchmarks.bench_render import make_message
+    rng = random.Random(0)
+    return [make_message(rng, sections=3) for _ in range(count)]
+
+
+@case("render.convert")
+def render_convert(ctx: Context):
+    from interface.render import MarkdownRenderer
+    renderer, message = MarkdownRenderer(), render_messages(1)[0]
+    return lambda: renderer.convert(message)
+
+
+@case("render.post.cached")
+def render_post_cached(ctx: Context):
+    from interface import render
+    client = render.app.test_client()
+    payloads = [{"text": json.dumps({"role": "agent", "content": message})} for message in render_messages()]
+    return lambda: [client.post("/", json=payload) for payload in payloads]
+
+
+@case("render.batch")
+def render_batch(ctx: Context):
+    from interface import render
+    client = render.app.test_client()
+    messages = render_messages()
+    return lambda: client.post("/batch", json={"messages": messages})
+
+
+@case("render.stream")
+def render_stream(ctx: Context):
+    from interface.render import MarkdownRenderer, StreamRenderer
+    message = render_messages(1)[0]
+    chunks = [message[i:i + 16] for i in range(0, len(message), 16)]
+
+    def stream():
+        renderer = StreamRenderer(MarkdownRenderer())
+        for chunk in chunks:
+            renderer.feed(chunk)
+    return stream
+
+
+def measure(fn: Callable[[], object], min_time: float, rounds: int) -> Dict[str, float]:
+    """
+    Time fn over `rounds` rounds, each repeating it enough times to last about min_time / rounds.
+
+    Returns:
+        Dict[str, float]: Per-call min/median/mean/stdev in seconds, rounds and calls per round
+    """
+    fn()  # Warm-up
+    target = min_time / rounds
+    iterations = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= target or iterations >= 1 << 20:
+            break
+        iterations = max(iterations * 2, int(iterations * target / max(elapsed, 1e-9)))
+    samples = [elapsed / iterations]
+    for _ in range(rounds - 1):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        samples.append((time.perf_counter() - start) / iterations)
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.mean(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "rounds": rounds,
+        "iterations": iterations,
+    }
+
+
+def machine_info() -> Dict[str, object]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def run_suite(pattern: str = "", files: int = 2000, min_time: float = 1.0, rounds: int = 5) -> Dict[str, object]:
+    """
+    Run every case whose name matches the regular expression.
+
+    Returns:
+        Dict[str, object]: {"machine": ..., "results": {name: stats}, "skipped": {name: reason}}
+    """
+    ctx = Context(files)
+    results, skipped = {}, {}
+    try:
+        for name, setup in CASES.items():
+            if not re.search(pattern, name):
+                continue
+            try:
+                results[name] = measure(setup(ctx), min_time, rounds)
+            except SkipCase as e:
+                skipped[name] = str(e)
+    finally:
+        ctx.close()
+    return {"machine": machine_info(), "results": results, "skipped": skipped}
+
+
+def compare(baseline: Dict[str, object], current: Dict[str, object], threshold: float = 0.15) -> List[Tuple[str, Optional[float], Optional[float], str]]:
+    """
+    Compare the median time of each case against a baseline.
+
+    Returns:
+        List[Tuple[str, Optional[float], Optional[float], str]]: (case, baseline median, current median,
+            status) with status "regression", "improvement", "ok", "new" or "missing"
+    """
+    rows = []
+    base_results, current_results = baseline["results"], current["results"]
+    for name in sorted(set(base_results) | set(current_results)):
+        before = base_results.get(name, {}).get("median")
+        after = current_results.get(name, {}).get("median")
+        if before is None:
+            status = "new"
+        elif after is None:
+            status = "missing"
+        elif after > before * (1 + threshold):
+            status = "regression"
+        elif after < before / (1 + threshold):
+            status = "improvement"
+        else:
+            status = "ok"
+        rows.append((name, before, after, status))
+    return rows
+
+
+def baseline_path(name: str) -> str:
+    """A bare name refers to benchmarks/baselines/<name>.json; anything else is a path."""
+    if os.sep in name or name.endswith(".json"):
+        return name
+    return join(BASELINE_DIR, f"{name}.json")
+
+
+def load(name: str) -> Dict[str, object]:
+    with open(baseline_path(name), "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save(report: Dict[str, object], name: str) -> str:
+    path = baseline_path(name)
+    os.makedirs(dirname(abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+    return path
+
+
+def format_time(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "-"
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f}{unit}"
+    return f"{seconds / 1e-9:.0f}ns"
+
+
+def print_results(report: Dict[str, object]) -> None:
+    print(f"{'case':<36}{'median':>12}{'min':>12}{'stdev':>12}{'calls':>8}")
+    for name, stats in report["results"].items():
+        print(f"{name:<36}{format_time(stats['median']):>12}{format_time(stats['min']):>12}"
+              f"{format_time(stats['stdev']):>12}{stats['iterations'] * stats['rounds']:>8}")
+    for name, reason in report["skipped"].items():
+        print(f"{name:<36}skipped: {reason}")
+
+
+def print_comparison(rows, threshold: float) -> bool:
+    """Print the comparison table; returns whether any case regressed."""
+    print(f"{'case':<36}{'baseline':>12}{'current':>12}{'change':>9}  status (threshold {threshold:.0%})")
+    for name, before, after, status in rows:
+        change = f"{after / before - 1:+.1%}" if before and after else "-"
+        print(f"{name:<36}{format_time(before):>12}{format_time(after):>12}{change:>9}  {status}")
+    return any(status == "regression" for *_, status in rows)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run the benchmarks")
+    run.add_argument("--filter", default="", help="Only run cases matching this regular expression")
+    run.add_argument("--files", type=int, default=2000, help="Files in the generated tree")
+    run.add_argument("--min-time", type=float, default=1.0, help="Seconds spent timing each case")
+    run.add_argument("--rounds", type=int, default=5)
+    run.add_argument("--save", metavar="NAME", help="Write the results as a baseline (name or path)")
+    run.add_argument("--compare", metavar="BASELINE", help="Compare against a saved baseline")
+    run.add_argument("--threshold", type=float, default=0.15, help="Allowed slowdown (default: 0.15)")
+
+    diff = commands.add_parser("compare", help="Compare two saved runs")
+    diff.add_argument("baseline")
+    diff.add_argument("current")
+    diff.add_argument("--threshold", type=float, default=0.15)
+
+    commands.add_parser("list", help="List the cases")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        print("\n".join(CASES))
+        return 0
+    if args.command == "compare":
+        return int(print_comparison(compare(load(args.baseline), load(args.current), args.threshold), args.threshold))
+
+    report = run_suite(args.filter, args.files, args.min_time, args.rounds)
+    print_results(report)
+    if args.save:
+        print(f"Saved {save(report, args.save)}")
+    if args.compare:
+        print()
+        return int(print_comparison(compare(load(args.compare), report, args.threshold), args.threshold))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
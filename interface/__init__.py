@@ -1,20 +1,104 @@
+import importlib
 import logging
+import os
 import sys
-from typing import List, Dict, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import TYPE_CHECKING, Callable, Iterable, List, Dict, Optional, Tuple, Union
 from os.path import dirname, join, abspath
 sys.path.insert(0, abspath(join(dirname(__file__), '..')))
 from agent import Agent
-from interface.pipeline_processor import PipelineProcessor
+from metrics import REGISTRY
+
+if TYPE_CHECKING:
+    from interface.pipeline_processor import PipelineProcessor
+
+# Processor components are re-exported lazily: they import torch and transformers,
+# which the interactive prompt and the agent tools do not need up front.
+_LAZY_EXPORTS = {
+    "PipelineProcessor": "interface.pipeline_processor",
+    "ConversationMemory": "interface.pipeline_processor.conversation_memory",
+    "PrefixCache": "interface.pipeline_processor.prefix_cache",
+    "ResponseCache": "interface.pipeline_processor.response_cache",
+    "MemoryPolicy": "interface.pipeline_processor.memory_manager",
+    "SessionStore": "interface.pipeline_processor.session_store",
+}
+
+
+def __getattr__(name: str):
+    module = _LAZY_EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
 
 class Interface:
+    DELEGATION_TIMEOUT = 60.0  # Seconds an AGENT: delegation may take
+    MAX_DELEGATION_WORKERS = 8  # Delegations running at once
+    RETRIEVAL_CANDIDATES = 8  # Snippets retrieved before fitting them into the token budget
+
     @staticmethod
-    def prepare_model_input(input_text: str, agents: Dict[str, Agent]) -> Dict[str, str]:
+    def retrieval_context(
+            query: str,
+            agent: Agent,
+            budget: int,
+            count_tokens: Optional[Callable[[str], int]] = None
+    ) -> str:
+        """
+        Excerpts of the agent's files most relevant to the query, within a token budget.
+
+        The best-scoring excerpts are taken first; one that does not fit is
+        skipped in favour of smaller ones further down.
+
+        Args:
+            query (str): The user's input
+            agent (Agent): Agent whose base directory is searched
+            budget (int): Tokens the excerpts may take
+            count_tokens (Optional[Callable[[str], int]]): Token counter (default: ~4 characters a token)
+
+        Returns:
+            str: The excerpts under a heading, or "" when nothing relevant fits
+        """
+        if budget <= 0 or not query.strip():
+            return ""
+        count_tokens = count_tokens or (lambda text: (len(text) + 3) // 4)
+        try:
+            snippets = agent.retrieve(query, k=Interface.RETRIEVAL_CANDIDATES)
+        except Exception as e:
+            logging.error(f"Error retrieving file context: {str(e)}")
+            return ""
+        parts = ["Relevant excerpts from the files:"]
+        used = count_tokens(parts[0])
+        for snippet in snippets:
+            if snippet.score <= 0:
+                break
+            path = os.path.relpath(snippet.path, agent.base_directory)
+            block = f"--- {path}:{snippet.start_line}-{snippet.end_line} ---\n{snippet.text}"
+            cost = count_tokens(block)
+            if used + cost <= budget:
+                parts.append(block)
+                used += cost
+        REGISTRY.inc("retrieval_snippets_total", len(parts) - 1, "File excerpts added to prompts")
+        return "\n".join(parts) if len(parts) > 1 else ""
+
+    @staticmethod
+    def prepare_model_input(
+            input_text: str,
+            agents: Dict[str, Agent],
+            context_tokens: int = 0,
+            count_tokens: Optional[Callable[[str], int]] = None
+    ) -> Dict[str, str]:
         """
         Prepare input for the model by combining agent prompt with user input.
 
         Args:
             input_text (str): The user's input
             agents (Dict[str, Agent]): Dictionary of initialized agents
+            context_tokens (int): Budget for excerpts of the supervisor's files related to the input (0 = none)
+            count_tokens (Optional[Callable[[str], int]]): Token counter for that budget
 
         Returns:
             Dict[str, str]: A message dictionary with role and content
@@ -23,12 +107,52 @@ class Interface:
             # Assuming the supervisor is the first agent in the dict for simplicity
             supervisor = list(agents.values())[0]  # Could be passed explicitly if needed
             agent_prompt = supervisor.agent_prompt["prompt"]
+            context = Interface.retrieval_context(input_text, supervisor, context_tokens, count_tokens)
+            if context:
+                agent_prompt = f"{agent_prompt}\n{context}"
             full_input = f"{agent_prompt}\nUser: {input_text.strip()}"
             return {"role": "user", "content": full_input}
         except Exception as e:
             logging.error(f"Error preparing model input: {str(e)}")
             return {"role": "user", "content": input_text.strip()}  # Fallback
 
+    @staticmethod
+    def prepare_model_messages(
+            input_text: str,
+            agents: Dict[str, Agent],
+            context_tokens: int = 0,
+            count_tokens: Optional[Callable[[str], int]] = None
+    ) -> List[Dict[str, str]]:
+        """
+        Prepare input for the model as a system message holding the supervisor's
+        prompt followed by the user's message.
+
+        Keeping the agent prompt in its own leading message lets the processor
+        insert conversation history between it and the new turn. Retrieved
+        file excerpts go in a second system message, so the first one stays
+        the same every turn.
+
+        Args:
+            input_text (str): The user's input
+            agents (Dict[str, Agent]): Dictionary of initialized agents
+            context_tokens (int): Budget for excerpts of the supervisor's files related to the input (0 = none)
+            count_tokens (Optional[Callable[[str], int]]): Token counter for that budget
+
+        Returns:
+            List[Dict[str, str]]: System and user message dictionaries
+        """
+        messages = []
+        try:
+            supervisor = list(agents.values())[0]
+            messages.append({"role": "system", "content": supervisor.agent_prompt["prompt"]})
+            context = Interface.retrieval_context(input_text, supervisor, context_tokens, count_tokens)
+            if context:
+                messages.append({"role": "system", "content": context})
+        except Exception as e:
+            logging.error(f"Error preparing model input: {str(e)}")
+        messages.append({"role": "user", "content": input_text.strip()})
+        return messages
+
     @staticmethod
     def get_user_input() -> str:
         """
@@ -47,40 +171,123 @@ class Interface:
             return ""
 
     @staticmethod
-    def display_response(response: str) -> None:
+    def display_response(response: Union[str, Iterable[str]]) -> str:
         """
         Display the response to the user.
 
+        A string is printed at once; an iterable of text chunks (as produced by
+        PipelineProcessor.process_stream) is printed chunk by chunk as it arrives.
+
         Args:
-            response (str): The response to display
+            response (Union[str, Iterable[str]]): The response or its chunks
+
+        Returns:
+            str: The full text that was displayed
         """
+        if isinstance(response, str):
+            try:
+                print(response.strip())
+                sys.stdout.flush()
+            except Exception as e:
+                logging.error(f"Error displaying response: {str(e)}")
+                print(f"Error: {str(e)}")
+            return response
+
+        chunks = []
         try:
-            print(response.strip())
-            sys.stdout.flush()
+            for chunk in response:
+                chunks.append(chunk)
+                print(chunk, end="", flush=True)
+            print()
         except Exception as e:
             logging.error(f"Error displaying response: {str(e)}")
-            print(f"Error: {str(e)}")
+            print(f"\nError: {str(e)}")
+        return "".join(chunks)
+
+    @staticmethod
+    def _delegation_lock(agent: Agent) -> threading.Lock:
+        """The lock serialising delegations to one agent, created on first use and kept on the agent."""
+        return agent.__dict__.setdefault("_delegation_lock", threading.Lock())
+
+    @staticmethod
+    def _run_delegation(agent: Agent, agent_name: str, command: str) -> Optional[str]:
+        # An agent's search cache, trigram index and walk manifest are not thread-safe
+        with Interface._delegation_lock(agent):
+            start = time.perf_counter()
+            try:
+                return agent.handle_prompt(command)
+            finally:
+                elapsed = time.perf_counter() - start
+                REGISTRY.observe("delegation_seconds", elapsed, "Time agents spend on AGENT: delegations", agent=agent_name)
+                logging.info(f"Delegation to {agent_name} took {elapsed:.2f}s: {command}")
+
+    @staticmethod
+    def dispatch_delegations(
+            processor: "PipelineProcessor",
+            supervisor: Optional[Agent],
+            response: str
+    ) -> Optional[str]:
+        """
+        Run the AGENT: lines of a reply whose other text has already been shown.
+
+        Replies stop after a completed AGENT: line; the streaming and stateless
+        paths (process_stream, complete, the HTTP server) pass their finished
+        reply here so the delegation actually reaches the supervisor's
+        collaborators.
+
+        Args:
+            processor (PipelineProcessor): The pipeline processor instance
+            supervisor (Optional[Agent]): Agent whose registered collaborators are delegated to
+            response (str): The complete reply
+
+        Returns:
+            Optional[str]: One "<agent>: <result>" line per delegation, or None if there were none
+        """
+        delegations = "\n".join(line for line in response.split("\n") if line.startswith("AGENT:"))
+        if supervisor is None or not delegations:
+            return None
+        return Interface.process_agent_collaboration(processor, supervisor, supervisor.other_agents, delegations)
 
     @staticmethod
     def process_agent_collaboration(
-            processor: PipelineProcessor,
+            processor: "PipelineProcessor",
             supervisor: Agent,
             agents: Dict[str, Agent],
-            initial_response: str
+            initial_response: str,
+            timeout: Optional[float] = None,
+            agent_timeouts: Optional[Dict[str, float]] = None
     ) -> Optional[str]:
         """
         Process any collaboration commands in the supervisor's response.
 
+        dispatch_delegations calls this for every reply that ends in a
+        delegation, from the CLI, the HTTP server, batch mode and /generate.
+
+        Every AGENT:<name>:<command> line is dispatched to its agent on a
+        bounded thread pool, so delegations to different agents run
+        concurrently; those to the same agent take turns, also across
+        concurrent calls, and identical delegations run once. Results replace their lines in the original
+        order. A delegation that misses its timeout is reported as timed out
+        and abandoned (queued ones are cancelled; running ones finish in the
+        background and are ignored).
+
         Args:
             processor (PipelineProcessor): The pipeline processor instance
             supervisor (Agent): The supervisor agent
             agents (Dict[str, Agent]): All initialized agents
             initial_response (str): The initial response from handle_prompt
+            timeout (Optional[float]): Seconds each delegation may take (default: DELEGATION_TIMEOUT)
+            agent_timeouts (Optional[Dict[str, float]]): Per-agent overrides of timeout
 
         Returns:
             Optional[str]: Final response after collaboration, or None if no collaboration
         """
-        responses = []
+        timeout = Interface.DELEGATION_TIMEOUT if timeout is None else timeout
+        agent_timeouts = agent_timeouts or {}
+
+        # One entry per line: plain text, or the (agent, command) key of a delegation
+        lines: List[Union[str, Tuple[str, str]]] = []
+        delegations: Dict[Tuple[str, str], Agent] = {}
         for line in initial_response.split('\n'):
             if line.startswith("AGENT:"):
                 parts = line.split(":", 2)
@@ -92,17 +299,52 @@ class Interface:
                 logging.debug(f"Supervisor delegated to {target_agent_name}: {agent_command}")
                 target_agent = agents.get(target_agent_name)
                 if target_agent:
-                    # Simulate agent processing (could use processor if needed)
-                    agent_response = target_agent.handle_prompt(agent_command)
-                    if agent_response:
-                        responses.append(f"{target_agent_name}: {agent_response.strip()}")
+                    key = (target_agent_name, agent_command)
+                    if key not in delegations:
+                        delegations[key] = target_agent
+                        lines.append(key)
+            else:
+                lines.append(line)
+
+        results: Dict[Tuple[str, str], Optional[str]] = {}
+        if delegations:
+            executor = ThreadPoolExecutor(
+                max_workers=min(len(delegations), Interface.MAX_DELEGATION_WORKERS),
+                thread_name_prefix="delegation"
+            )
+            try:
+                started = time.monotonic()
+                futures = {
+                    key: executor.submit(Interface._run_delegation, agent, key[0], key[1])
+                    for key, agent in delegations.items()
+                }
+                for key, future in futures.items():
+                    limit = agent_timeouts.get(key[0], timeout)
+                    status = "ok"
+                    try:
+                        results[key] = future.result(timeout=max(started + limit - time.monotonic(), 0))
+                    except FutureTimeoutError:
+                        future.cancel()
+                        logging.warning(f"Delegation to {key[0]} timed out after {limit:.1f}s: {key[1]}")
+                        results[key] = f"[timed out after {limit:g}s]"
+                        status = "timeout"
+                    except Exception as e:
+                        logging.error(f"Delegation to {key[0]} failed: {str(e)}")
+                        results[key] = f"[failed: {str(e)}]"
+                        status = "failed"
+                    REGISTRY.inc("delegations_total", 1, "AGENT: delegations by outcome", agent=key[0], status=status)
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+        responses = []
+        for line in lines:
+            if isinstance(line, tuple):
+                agent_response = results.get(line)
+                if agent_response:
+                    responses.append(f"{line[0]}: {agent_response.strip()}")
             else:
                 responses.append(line)
 
-        if responses and len(responses) > 1:  # Only if collaboration occurred
-            combined_response = "\n".join(responses)
-            final_input = Interface.prepare_model_input(combined_response, agents)
-            # Here we could use processor.process() if it’s meant to refine output,
-            # but for simplicity, we’ll just return the combined response
-            return combined_response
+        if responses and (delegations or len(responses) > 1):  # Only if collaboration occurred
+            return "\n".join(responses)
         return None
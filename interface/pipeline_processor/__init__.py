@@ -1,12 +1,83 @@
 import logging
-from typing import Dict, List, Union
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar, Union
 import sys
 import torch
 from os.path import dirname, join, abspath
 sys.path.insert(0, abspath(join(dirname(__file__), '..')))
 from transformers import Pipeline as TransformersPipeline
+from transformers import DynamicCache, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
 from agent import Agent
-from interface.pipeline_processor.memory_manager import MemoryManager
+from interface import Interface
+from metrics import RATE_BUCKETS, REGISTRY
+from interface.pipeline_processor.conversation_memory import ConversationMemory, tokenizer_lock
+from interface.pipeline_processor.memory_manager import MemoryPolicy
+from interface.pipeline_processor.prefix_cache import PrefixCache
+from interface.pipeline_processor.response_cache import ResponseCache
+from interface.pipeline_processor.scheduler import ContinuousBatchScheduler, SamplingParams
+from interface.pipeline_processor.session_store import SessionStore
+from interface.pipeline_processor.speculative import SpeculativeDecoder, SpeculativeStats
+from interface.pipeline_processor.stop_sequences import ROLES, StopSequenceCriteria, StopSequences
+
+T = TypeVar("T")
+
+class CancelCriteria(StoppingCriteria):
+    """Stop generation as soon as the given event is set (e.g. the client went away)."""
+
+    def __init__(self, cancel_event: Event):
+        self.cancel_event = cancel_event
+
+    def __call__(self, input_ids: torch.Tensor, scores: torch.Tensor, **kwargs) -> torch.Tensor:
+        return torch.full((input_ids.shape[0],), self.cancel_event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+class GenerationTimer:
+    """
+    Streamer that times a generation: prefill up to the first token, then the decode rate.
+
+    generate() hands a streamer the prompt first and then every new token, so
+    the second put marks the first generated token. Calls are forwarded to an
+    optional inner streamer.
+    """
+
+    def __init__(self, streamer: Optional[TextIteratorStreamer] = None, mode: str = "generate"):
+        self.streamer = streamer
+        self.mode = mode
+        self.start = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.prompt_seen = False
+        self.tokens = 0
+
+    def put(self, value: torch.Tensor) -> None:
+        if not self.prompt_seen:
+            self.prompt_seen = True
+        else:
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            self.tokens += value.numel()
+        if self.streamer is not None:
+            self.streamer.put(value)
+
+    def end(self) -> None:
+        if self.streamer is not None:
+            self.streamer.end()
+
+    def record(self, prompt_tokens: int) -> None:
+        """Publish the timings of the finished generation."""
+        now = time.perf_counter()
+        REGISTRY.observe("generation_seconds", now - self.start, "Model generation time per request", mode=self.mode)
+        REGISTRY.inc("prompt_tokens_total", prompt_tokens, "Prompt tokens processed", mode=self.mode)
+        REGISTRY.inc("generated_tokens_total", self.tokens, "Tokens generated", mode=self.mode)
+        if self.first_token_at is None:
+            return
+        REGISTRY.observe("time_to_first_token_seconds", self.first_token_at - self.start,
+                         "Prefill time until the first generated token", mode=self.mode)
+        if self.tokens > 1 and now > self.first_token_at:
+            REGISTRY.observe("decode_tokens_per_second", (self.tokens - 1) / (now - self.first_token_at),
+                             "Decode rate after the first token", buckets=RATE_BUCKETS, mode=self.mode)
+
 
 class PipelineProcessor:
     def __init__(
@@ -14,7 +85,20 @@ class PipelineProcessor:
             pipeline: TransformersPipeline,
             temperature: float = 0.7,
             top_p: float = 0.9,
-            top_k: int = 50
+            top_k: int = 50,
+            max_new_tokens: int = 4096,
+            do_sample: bool = True,
+            prefix_cache: Optional[PrefixCache] = None,
+            scheduler: Optional[ContinuousBatchScheduler] = None,
+            response_cache: Optional[ResponseCache] = None,
+            memory: Optional[ConversationMemory] = None,
+            context_window: Optional[int] = None,
+            draft_model=None,
+            num_draft_tokens: int = 5,
+            memory_policy: Optional[MemoryPolicy] = None,
+            stop_sequences: Sequence[str] = (),
+            stop_on_turns: bool = True,
+            sessions: Optional[SessionStore] = None
     ):
         """
         Initialize the pipeline processor with a transformers pipeline and generation parameters.
@@ -24,61 +108,469 @@ class PipelineProcessor:
             temperature: Sampling temperature for generation
             top_p: Top-p sampling parameter
             top_k: Top-k sampling parameter
+            max_new_tokens: Upper bound on generated tokens per response
+            do_sample: Sample with the parameters above; False decodes greedily
+            prefix_cache: Optional store of past-key-values reused across calls
+            scheduler: Optional running batch scheduler that blocking generation is submitted to
+            response_cache: Optional cache of generated tokens for repeated prompts
+            memory: Conversation memory (default: drop-oldest memory on the pipeline's tokenizer)
+            context_window: Prompt plus generation token limit (default: the model's max positions)
+            draft_model: Optional small model sharing the tokenizer; enables speculative decoding
+            num_draft_tokens: Tokens the draft model proposes per verification pass
+            memory_policy: When to clear the allocator cache and how to retry after running out
+                of memory (default: a policy for the model's device)
+            stop_sequences: Strings that end every reply
+            stop_on_turns: End replies at a new "role:" line or after a completed AGENT: line
+            sessions: Optional persistent store of per-session histories; calls given a
+                session_id use that session's memory instead of memory
         """
         self.pipeline = pipeline
         self.temperature = temperature
         self.top_p = top_p
         self.top_k = top_k
-        self.conversation_history: List[Dict[str, str]] = []
-        self.memory_manager = MemoryManager()
+        self.max_new_tokens = max_new_tokens
+        self.do_sample = do_sample
+        self.prefix_cache = prefix_cache
+        self.scheduler = scheduler
+        self.response_cache = response_cache
+        self.memory = memory or ConversationMemory(getattr(pipeline, "tokenizer", None))
+        model_config = getattr(getattr(pipeline, "model", None), "config", None)
+        self.context_window = context_window or getattr(model_config, "max_position_embeddings", 4096)
+        self.memory_policy = memory_policy or MemoryPolicy(device=getattr(getattr(pipeline, "model", None), "device", None))
+        self.speculative = SpeculativeDecoder(pipeline.model, draft_model, num_draft_tokens) if draft_model else None
+        self.speculative_stats = SpeculativeStats()  # Totals over every speculative generation
+        self.stats_lock = Lock()
+        self.tokenizer_lock = tokenizer_lock(getattr(pipeline, "tokenizer", None))  # Shared by every encode call
+        self.stop_sequences = tuple(stop_sequences)
+        self.stop_on_turns = stop_on_turns
+        self.sessions = sessions
+
+    @property
+    def conversation_history(self) -> List[Dict[str, str]]:
+        """
+        Messages recorded so far (oldest first).
+        """
+        return self.memory.messages
+
+    def _session_store(self) -> SessionStore:
+        if self.sessions is None:
+            raise ValueError("A session_id needs a PipelineProcessor created with a session store")
+        return self.sessions
+
+    def _memory(self, session_id: Optional[str] = None) -> ConversationMemory:
+        """The session's memory, or the processor's own without a session_id."""
+        if session_id is None:
+            return self.memory
+        return self._session_store().memory(session_id)
 
-    def _format_prompt(self, _input: List[Dict[str,str]]) -> str:
+    def history(self, session_id: Optional[str] = None) -> List[Dict[str, str]]:
+        """
+        Messages recorded so far in a session, or in the processor's own conversation (oldest first).
+        """
+        return self._memory(session_id).messages
+
+    def _format_prompt(
+            self,
+            _input: List[Dict[str,str]],
+            include_history: bool = True,
+            context_window: Optional[int] = None,
+            max_new_tokens: Optional[int] = None,
+            session_id: Optional[str] = None
+    ) -> str:
         """
         Format the prompt with optional system prompt and conversation history.
+
+        Leading system messages come first, then as much recent history as fits
+        the context window after reserving max_new_tokens, then the rest of the
+        input. context_window and max_new_tokens override the configured limits;
+        session_id selects whose history is used.
         """
-        formatted_prompt = ""
+        with REGISTRY.timer("prompt_format_seconds", "Prompt formatting time, history packing included"):
+            messages = _input
+            if include_history:
+                budget = (context_window or self.context_window) - (max_new_tokens or self.max_new_tokens)
+                messages = self._memory(session_id).surround(_input, budget)
 
-        for message in _input:
-            role = message["role"]
-            content = message["content"]
-            formatted_prompt += f"{role}: {content}\n"
+            formatted_prompt = ""
 
-        # Context expansion here
-        # for message in self.conversation_history[-3:]:  # Keep last 3 messages for context
-        #     role = message["role"]
-        #     content = message["content"]
-        #     formatted_prompt += f"{role}: {content}\n"
+            for message in messages:
+                role = message["role"]
+                content = message["content"]
+                formatted_prompt += f"{role}: {content}\n"
 
+            return formatted_prompt
 
-        return formatted_prompt
+    def _generation_config(self, max_new_tokens: Optional[int] = None) -> Dict[str, Union[int, float, bool]]:
+        """
+        Generation parameters shared by blocking and streaming generation.
+        """
+        config = {
+            "max_new_tokens": max_new_tokens or self.max_new_tokens,  # Limit output size
+            "pad_token_id": self.pipeline.tokenizer.eos_token_id,
+            "do_sample": self.do_sample
+        }
+        if self.do_sample:
+            config.update(temperature=self.temperature, top_p=self.top_p, top_k=self.top_k)
+        return config
 
-    def _generate_response(self, prompt: str) -> str:
+    def _stops(self, agent: Optional[Agent] = None) -> Optional[StopSequences]:
         """
-        Generate response using the pipeline.
+        Where replies end: the configured stop strings plus the agent's, and with stop_on_turns
+        any role marker (the agent and its collaborators included) or completed AGENT: line.
         """
-        try:
-            generation_config = {
-                "max_new_tokens": 4096,  # Limit output size
-                "truncation": True,
-                "temperature": self.temperature,
-                "top_p": self.top_p,
-                "top_k": self.top_k,
-                "pad_token_id": self.pipeline.tokenizer.eos_token_id,
-                "do_sample": True
-            }
+        stop = self.stop_sequences + tuple(agent.stop_sequences if agent is not None else ())
+        roles = ROLES
+        if agent is not None:
+            roles += (agent.agent_name, *agent.other_agents)
+        stops = StopSequences(stop, roles if self.stop_on_turns else (), stop_on_delegation=self.stop_on_turns)
+        return stops or None
+
+    def _cache_key(
+            self,
+            prompt: str,
+            max_new_tokens: Optional[int] = None,
+            stops: Optional[StopSequences] = None
+    ) -> Optional[str]:
+        """Response-cache key for the prompt under the current generation config, if cacheable."""
+        if self.response_cache is None:
+            return None
+        config = self._generation_config(max_new_tokens)
+        if not self.response_cache.cacheable(config):
+            return None
+        model_name = getattr(getattr(self.pipeline.model, "config", None), "_name_or_path", "")
+        return self.response_cache.make_key(prompt, {**config, "model": model_name, "stop": repr(stops)})
+
+    def _decode_reply(self, token_ids, stops: Optional[StopSequences] = None) -> str:
+        """Generated tokens as text, cut at the first stop."""
+        text = self.pipeline.tokenizer.decode(token_ids, skip_special_tokens=True)
+        return stops.truncate(text) if stops is not None else text
 
-            outputs = self.pipeline(
-                prompt,
-                **generation_config
+    def _generate(
+            self,
+            prompt: str,
+            streamer: Optional[TextIteratorStreamer] = None,
+            cancel_event: Optional[Event] = None,
+            context_window: Optional[int] = None,
+            max_new_tokens: Optional[int] = None,
+            stops: Optional[StopSequences] = None
+    ) -> Tuple[torch.Tensor, int]:
+        """
+        Run model.generate on the prompt, resuming from the prefix cache when one is configured,
+        or the speculative draft/verify loop when a draft model is.
+
+        Args:
+            prompt: Formatted prompt
+            streamer: Receives the prompt and then the generated tokens
+            cancel_event: Set it to stop generation early
+            context_window: Keep only the last context_window - max_new_tokens prompt tokens
+            max_new_tokens: Overrides the configured generation budget
+            stops: Ends generation as soon as the new text hits a stop; the returned tokens
+                may run a little past it, so cut the decoded text with stops.truncate
+
+        Returns:
+            The output token ids (prompt followed by the generated tokens) and the prompt length
+        """
+        tokenizer = self.pipeline.tokenizer
+        model = self.pipeline.model
+        with REGISTRY.timer("tokenize_seconds", "Prompt tokenization time"), self.tokenizer_lock:
+            inputs = tokenizer(prompt, return_tensors="pt", truncation=True).to(model.device)
+        if context_window is not None:
+            keep = max(1, context_window - (max_new_tokens or self.max_new_tokens))
+            if inputs["input_ids"].shape[1] > keep:
+                logging.info(f"Truncating the prompt from {inputs['input_ids'].shape[1]} to its last {keep} tokens")
+                inputs = {name: tensor[:, -keep:] for name, tensor in inputs.items()}
+        prompt_length = inputs["input_ids"].shape[1]
+
+        cache_key = self._cache_key(prompt, max_new_tokens, stops)
+        cached = self.response_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            generated = torch.tensor(cached, dtype=inputs["input_ids"].dtype, device=model.device)
+            if streamer is not None:
+                streamer.put(inputs["input_ids"])
+                streamer.put(generated)
+                streamer.end()
+            REGISTRY.inc("response_cache_hits_total", 1, "Generations answered from the response cache")
+            return torch.cat([inputs["input_ids"][0], generated]), prompt_length
+
+        stopping_criteria = StoppingCriteriaList()
+        if cancel_event is not None:
+            stopping_criteria.append(CancelCriteria(cancel_event))
+        if stops is not None:
+            stopping_criteria.append(StopSequenceCriteria(stops, tokenizer, prompt_length))
+
+        if self.speculative is not None:
+            # The draft/verify loop keeps its own KV caches, so the prefix cache is not used
+            eos_token_id = getattr(model.generation_config, "eos_token_id", None) or tokenizer.eos_token_id
+            timer = GenerationTimer(streamer, mode="speculative")
+            sequence, stats = self.speculative.generate(
+                inputs["input_ids"], self._sampling_params(max_new_tokens), eos_token_id, timer, cancel_event,
+                stopping_criteria=stopping_criteria
             )
+            timer.record(prompt_length)
+            with self.stats_lock:
+                self.speculative_stats.add(stats)
+            REGISTRY.inc("draft_tokens_total", stats.drafted, "Tokens proposed by the draft model")
+            REGISTRY.inc("draft_tokens_accepted_total", stats.accepted, "Draft tokens accepted by the main model")
+            logging.info(f"Speculative decoding: {stats}")
+            if cache_key and not (cancel_event is not None and cancel_event.is_set()):
+                self.response_cache.put(cache_key, sequence[prompt_length:].tolist())
+            return sequence, prompt_length
+
+        cache_kwargs = {}
+        if self.prefix_cache is not None:
+            reused, past_key_values = self.prefix_cache.lookup(inputs["input_ids"][0])
+            if past_key_values is not None:
+                logging.debug(f"Resuming from {reused} cached prompt tokens")
+            # On a miss too: without a Cache object generate returns legacy tuples that cannot be stored
+            cache_kwargs["past_key_values"] = past_key_values if past_key_values is not None else DynamicCache()
+        if stopping_criteria:
+            cache_kwargs["stopping_criteria"] = stopping_criteria
 
-            logging.debug(f"++++++\n\nRaw outputs: \n\n {outputs} \n\n")
+        timer = GenerationTimer(streamer)
+        outputs = model.generate(
+            **inputs,
+            **cache_kwargs,
+            **self._generation_config(max_new_tokens),
+            streamer=timer,
+            return_dict_in_generate=True
+        )
+        timer.record(prompt_length)
+        if self.prefix_cache is not None and outputs.past_key_values is not None:
+            self.prefix_cache.store(outputs.sequences[0], outputs.past_key_values)
+        if cache_key and not (cancel_event is not None and cancel_event.is_set()):
+            self.response_cache.put(cache_key, outputs.sequences[0][prompt_length:].tolist())
+        return outputs.sequences[0], prompt_length
 
-            return outputs[0]["generated_text"].strip()
+    def _sampling_params(self, max_new_tokens: Optional[int] = None) -> SamplingParams:
+        return SamplingParams(
+            max_new_tokens=max_new_tokens or self.max_new_tokens,
+            temperature=self.temperature,
+            top_p=self.top_p,
+            top_k=self.top_k,
+            do_sample=self.do_sample
+        )
+
+    def _schedule(
+            self,
+            prompt: str,
+            cancel_event: Optional[Event] = None,
+            max_new_tokens: Optional[int] = None,
+            stops: Optional[StopSequences] = None
+    ) -> str:
+        """Generate through the batch scheduler, withdrawing the request if cancel_event is set."""
+        cache_key = self._cache_key(prompt, max_new_tokens, stops)
+        cached = self.response_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            return self._decode_reply(cached, stops)
+
+        params = self._sampling_params(max_new_tokens)
+        params.stop = stops
+        future = self.scheduler.submit(prompt, params)
+        while True:
+            try:
+                result = future.result(timeout=0.05)
+            except FutureTimeoutError:
+                if cancel_event is not None and cancel_event.is_set():
+                    future.cancel()
+                    return ""
+                continue
+            if cache_key:
+                self.response_cache.put(cache_key, result.token_ids)
+            REGISTRY.observe("scheduler_queue_wait_seconds", result.queue_wait, "Time scheduled requests wait for a batch slot")
+            REGISTRY.observe("time_to_first_token_seconds", result.time_to_first_token,
+                             "Prefill time until the first generated token", mode="scheduler")
+            REGISTRY.observe("generation_seconds", result.latency, "Model generation time per request", mode="scheduler")
+            REGISTRY.inc("prompt_tokens_total", result.prompt_tokens, "Prompt tokens processed", mode="scheduler")
+            REGISTRY.inc("generated_tokens_total", len(result.token_ids), "Tokens generated", mode="scheduler")
+            return result.text
+
+    def _generate_response(
+            self,
+            prompt: str,
+            context_window: Optional[int] = None,
+            max_new_tokens: Optional[int] = None,
+            stops: Optional[StopSequences] = None
+    ) -> str:
+        """
+        Generate a response using the pipeline's model and tokenizer.
+
+        Only the newly generated text is returned, cut at the first stop.
+        Out-of-memory errors are raised so the caller can retry with smaller
+        limits; any other error is returned as the response text.
+        """
+        try:
+            if self.scheduler is not None:
+                return self._schedule(prompt, max_new_tokens=max_new_tokens, stops=stops).strip()
+
+            sequence, prompt_length = self._generate(prompt, context_window=context_window,
+                                                     max_new_tokens=max_new_tokens, stops=stops)
+
+            logging.debug(f"++++++\n\nRaw outputs: \n\n {sequence} \n\n")
+
+            return self._decode_reply(sequence[prompt_length:], stops).strip()
 
         except Exception as e:
+            if MemoryPolicy.is_oom(e):
+                raise
             return f"Error in generation: {str(e)}"
 
+    def _reduced_limits(self, error: Exception, attempt: int) -> Optional[Tuple[int, int]]:
+        """(context_window, max_new_tokens) to retry with after error, or None if it is not retried."""
+        if not MemoryPolicy.is_oom(error):
+            return None
+        self.memory_policy.clear()
+        limits = self.memory_policy.degrade(attempt, self.context_window, self.max_new_tokens)
+        if limits is not None:
+            logging.warning(f"Out of memory ({str(error)}); retrying with a {limits[0]} token context "
+                            f"and at most {limits[1]} new tokens")
+        return limits
+
+    def _with_oom_retry(self, generate: Callable[[Optional[int], Optional[int]], T]) -> T:
+        """
+        Call generate(context_window, max_new_tokens), first with (None, None) for the
+        configured limits and again with the memory policy's smaller limits after
+        every out-of-memory error until it gives up.
+        """
+        limits: Tuple[Optional[int], Optional[int]] = (None, None)
+        attempt = 0
+        while True:
+            try:
+                return generate(*limits)
+            except Exception as e:
+                attempt += 1
+                reduced = self._reduced_limits(e, attempt)
+                if reduced is None:
+                    raise
+                limits = reduced
+
+    def _stream_with_oom_retry(
+            self,
+            make_prompt: Callable[[Optional[int], Optional[int]], str],
+            cancel_event: Optional[Event] = None,
+            stops: Optional[StopSequences] = None
+    ) -> Iterator[str]:
+        """
+        Stream the response to make_prompt(context_window, max_new_tokens), retrying with
+        smaller limits after an out-of-memory error as long as nothing was yielded yet.
+        """
+        limits: Tuple[Optional[int], Optional[int]] = (None, None)
+        attempt = 0
+        while True:
+            started = False
+            try:
+                for chunk in self._stream_response(make_prompt(*limits), cancel_event, *limits, stops):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                attempt += 1
+                reduced = None if started else self._reduced_limits(e, attempt)
+                if reduced is None:
+                    raise
+                limits = reduced
+
+    def _stream_response(
+            self,
+            prompt: str,
+            cancel_event: Optional[Event] = None,
+            context_window: Optional[int] = None,
+            max_new_tokens: Optional[int] = None,
+            stops: Optional[StopSequences] = None
+    ) -> Iterator[str]:
+        """
+        Generate a response and yield decoded text chunks as tokens are produced.
+
+        Generation runs in a background thread feeding a TextIteratorStreamer;
+        only newly generated text is yielded, cut at the first stop. An error
+        raised by generation is re-raised in the consuming thread once the
+        streamer is drained.
+        """
+        streamer = TextIteratorStreamer(self.pipeline.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        errors: List[Exception] = []
+
+        def generate() -> None:
+            try:
+                self._generate(prompt, streamer, cancel_event, context_window, max_new_tokens, stops)
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
+
+        worker = Thread(target=generate, daemon=True)
+        worker.start()
+        chunks = stops.trim_stream(streamer) if stops is not None else streamer
+        for chunk in chunks:
+            if chunk:
+                yield chunk
+        worker.join()
+        if errors:
+            raise errors[0]
+
+    def complete(self, _input: List[Dict[str, str]], cancel_event: Optional[Event] = None) -> str:
+        """
+        Generate a reply to the messages without touching the conversation history.
+
+        A completed AGENT: line ends the reply but is not dispatched; callers
+        holding a supervisor pass the reply to Interface.dispatch_delegations.
+        Safe to call from several threads at once: the prefix and response
+        caches take their own locks, and tokenizer encode calls share
+        tokenizer_lock with the conversation memories. Used by the HTTP server
+        where every request carries its own messages.
+
+        Args:
+            _input: Messages to answer
+            cancel_event: Set it to stop generation early
+
+        Returns:
+            The generated reply only (the prompt is not echoed), cut at the first stop
+        """
+        prompt = self._format_prompt(_input, include_history=False)
+        stops = self._stops()
+
+        def generate(context_window: Optional[int], max_new_tokens: Optional[int]) -> str:
+            if self.scheduler is not None:
+                return self._schedule(prompt, cancel_event, max_new_tokens, stops).strip()
+            sequence, prompt_length = self._generate(prompt, cancel_event=cancel_event, context_window=context_window,
+                                                     max_new_tokens=max_new_tokens, stops=stops)
+            return self._decode_reply(sequence[prompt_length:], stops).strip()
+
+        return self._with_oom_retry(generate)
+
+    def complete_stream(self, _input: List[Dict[str, str]], cancel_event: Optional[Event] = None) -> Iterator[str]:
+        """
+        Streaming counterpart of complete (delegations are likewise left to the caller).
+
+        Args:
+            _input: Messages to answer
+            cancel_event: Set it to stop generation early
+
+        Yields:
+            Chunks of generated text
+        """
+        prompt = self._format_prompt(_input, include_history=False)
+        yield from self._stream_with_oom_retry(lambda context_window, max_new_tokens: prompt, cancel_event, self._stops())
+
+    def warm_prefix(self, _input: List[Dict[str, str]]) -> int:
+        """
+        Prefill a constant prompt prefix (such as an agent's system prompt) into the prefix cache.
+
+        Args:
+            _input: Messages forming the prefix, formatted like any other prompt
+
+        Returns:
+            Number of cached prefix tokens (0 without a prefix cache)
+        """
+        if self.prefix_cache is None:
+            return 0
+        model = self.pipeline.model
+        prompt = self._format_prompt(_input, include_history=False)
+        with self.tokenizer_lock:
+            input_ids = self.pipeline.tokenizer(prompt, return_tensors="pt").input_ids.to(model.device)
+        cache = DynamicCache()
+        with torch.no_grad():
+            model(input_ids=input_ids, past_key_values=cache, use_cache=True)
+        self.prefix_cache.store(input_ids[0], cache)
+        return cache.get_seq_length()
+
     def process_agent_action(self, agent_response: str) -> Dict[str, Union[str, List[str]]]:
         """
         Process agent actions and prepare appropriate responses.
@@ -109,19 +601,28 @@ class PipelineProcessor:
                 "message": "Unknown agent action"
             }
 
-    def update_conversation(self, role: str, content: str) -> None:
+    def update_conversation(self, role: str, content: str, session_id: Optional[str] = None) -> None:
         """
-        Update the conversation history.
+        Update the conversation history (of the session, if given).
         """
-        self.conversation_history.append({
-            "role": role,
-            "content": content
-        })
+        if session_id is None:
+            self.memory.append(role, content)
+        else:
+            self._session_store().append(session_id, role, content)
+
+    def _record_input(self, _input: List[Dict[str, str]], session_id: Optional[str] = None) -> None:
+        """
+        Add the non-system input messages of the current turn to the history.
+        """
+        for message in _input:
+            if message["role"] != "system":
+                self.update_conversation(message["role"], message["content"], session_id)
 
     def process(
             self,
             _input: List[Dict[str,str]],
-            supervisor_agent: Agent
+            supervisor_agent: Agent,
+            session_id: Optional[str] = None
     ) -> str:
         """
         Process input through the pipeline and agent.
@@ -129,39 +630,101 @@ class PipelineProcessor:
         Args:
             _input: User input + system prompt dict
             supervisor_agent: Main agent (ie Karen or Linus)
+            session_id: Conversation to continue and record into (default: the processor's own)
         Returns:
             Generated response or agent action result
         """
+        stops = self._stops(supervisor_agent)
+
+        def generate(context_window: Optional[int], max_new_tokens: Optional[int]) -> str:
+            formatted_input = self._format_prompt(_input, context_window=context_window,
+                                                  max_new_tokens=max_new_tokens, session_id=session_id)
+            return self._generate_response(formatted_input, context_window, max_new_tokens, stops)
+
         try:
-            self.memory_manager.clear_memory()
+            self.memory_policy.maybe_clear()
 
-            formatted_input = self._format_prompt(_input)
-            response = self._generate_response(formatted_input)
-            self.update_conversation("agent", response)
+            response = self._with_oom_retry(generate)
+            self._record_input(_input, session_id)  # After generating: a retry formats the prompt again
+            self.update_conversation("agent", response, session_id)
 
             if response.startswith("AGENT:"):
                 agent_result = supervisor_agent.handle_agent_request(response)
                 logging.debug(f"Agent response: {response}")
-                self.update_conversation(supervisor_agent.agent_name, agent_result)
+                self.update_conversation(supervisor_agent.agent_name, agent_result, session_id)
                 return agent_result
 
             return response
 
-        except RuntimeError as e:
-            if "out of memory" in str(e):
-                self.memory_manager.clear_memory()
-                # Could retry with smaller context/generation limits
-                return "Memory error occurred. Try with shorter input."
         except Exception as e:
-            error_msg = f"Pipeline processing error: {str(e)}"
-            self.update_conversation("system", error_msg)
+            if MemoryPolicy.is_oom(e):
+                error_msg = "Memory error occurred. Try with shorter input."
+            else:
+                error_msg = f"Pipeline processing error: {str(e)}"
+            self.update_conversation("system", error_msg, session_id)
             return error_msg
 
-    def reset_conversation(self) -> None:
+    def process_stream(
+            self,
+            _input: List[Dict[str,str]],
+            supervisor_agent: Agent,
+            session_id: Optional[str] = None
+    ) -> Iterator[str]:
+        """
+        Streaming counterpart of process: yield response text as it is generated.
+
+        The full response is recorded in the conversation history once the
+        stream is exhausted. Running out of memory before the first chunk
+        retries with smaller limits, like process. AGENT: lines in the response
+        are then dispatched to the supervisor's collaborators, and their results
+        follow as a last chunk.
+
+        Args:
+            _input: User input + system prompt dict
+            supervisor_agent: Main agent (ie Karen or Linus)
+            session_id: Conversation to continue and record into (default: the processor's own)
+        Yields:
+            Chunks of generated text
         """
-        Reset the conversation history.
+        self.memory_policy.maybe_clear()
+        chunks = []
+        try:
+            stream = self._stream_with_oom_retry(
+                lambda context_window, max_new_tokens: self._format_prompt(
+                    _input, context_window=context_window, max_new_tokens=max_new_tokens, session_id=session_id
+                ),
+                stops=self._stops(supervisor_agent)
+            )
+            for chunk in stream:
+                if not chunks:
+                    self._record_input(_input, session_id)  # The prompt is final once generation has started
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            if not chunks:
+                self._record_input(_input, session_id)
+            error_msg = f"Error in generation: {str(e)}"
+            self.update_conversation("system", error_msg, session_id)
+            yield error_msg
+            return
+        if not chunks:
+            self._record_input(_input, session_id)
+        response = "".join(chunks)
+        self.update_conversation("agent", response, session_id)
+
+        agent_result = Interface.dispatch_delegations(self, supervisor_agent, response)
+        if agent_result:
+            self.update_conversation(supervisor_agent.agent_name, agent_result, session_id)
+            yield "\n" + agent_result
+
+    def reset_conversation(self, session_id: Optional[str] = None) -> None:
+        """
+        Reset the conversation history; with a session_id, delete that session's stored history.
         """
-        self.conversation_history = []
+        if session_id is None:
+            self.memory.clear()
+        else:
+            self._session_store().reset(session_id)
 
     @property
     def device(self) -> torch.device:
@@ -0,0 +1,215 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+Message = Dict[str, str]
+
+OVERFLOW_STRATEGIES = ("drop_oldest", "summarise_oldest")
+
+
+def tokenizer_lock(tokenizer) -> threading.Lock:
+    """
+    The lock every encode call on a shared tokenizer must hold.
+
+    A fast tokenizer switches its truncation and padding settings in place
+    when a call asks for different ones, and raises "Already borrowed" if
+    another thread is encoding at that moment. The lock is kept on the
+    tokenizer itself, so the processor, the conversation memories and the
+    scheduler using one tokenizer all share it.
+    """
+    if tokenizer is None:
+        return threading.Lock()
+    return tokenizer.__dict__.setdefault("_encode_lock", threading.Lock())
+
+
+def extractive_summary(messages: List[Message]) -> str:
+    """Cheap default summariser: the first sentence of every message, prefixed by its role."""
+    parts = []
+    for message in messages:
+        first = re.split(r"(?<=[.!?])\s", message["content"].strip(), maxsplit=1)[0]
+        parts.append(f"{message['role']}: {first[:200]}")
+    return " ".join(parts)
+
+
+class ConversationMemory:
+    """
+    Conversation history that knows how many tokens each message costs.
+
+    Each message is tokenized once, when it is appended, in the same
+    "role: content" line form the prompt formatter emits, so packing the
+    history into a token budget never re-tokenizes old turns. When the
+    history does not fit, the oldest messages are either dropped or folded
+    into a running summary that is itself cached and only extended as more
+    messages fall out of the window.
+    """
+
+    def __init__(
+            self,
+            tokenizer=None,
+            overflow: str = "drop_oldest",
+            summarizer: Optional[Callable[[List[Message]], str]] = None,
+            summary_share: float = 0.25
+    ):
+        """
+        Args:
+            tokenizer: Tokenizer used for counting; without one, ~4 characters count as a token
+            overflow: "drop_oldest" or "summarise_oldest"
+            summarizer: Turns a list of messages into summary text (default: extractive_summary)
+            summary_share: Fraction of the budget a summary may take
+        """
+        if overflow not in OVERFLOW_STRATEGIES:
+            raise ValueError(f"Unknown overflow strategy {overflow}; expected one of {OVERFLOW_STRATEGIES}")
+        self.tokenizer = tokenizer
+        self.overflow = overflow
+        self.summarizer = summarizer or extractive_summary
+        self.summary_share = summary_share
+        self.messages: List[Message] = []
+        self._token_ids: List[List[int]] = []
+        self._summary: Optional[Tuple[int, Message, int]] = None  # (messages covered, message, tokens)
+        self._counts: "OrderedDict[str, int]" = OrderedDict()  # Recent non-history texts, e.g. the system prompt
+
+    COUNT_CACHE_SIZE = 32
+
+    @staticmethod
+    def render(message: Message) -> str:
+        return f"{message['role']}: {message['content']}\n"
+
+    def tokenize(self, text: str) -> List[int]:
+        if self.tokenizer is None:
+            return list(range((len(text) + 3) // 4))
+        with tokenizer_lock(self.tokenizer):
+            return self.tokenizer(text, add_special_tokens=False)["input_ids"]
+
+    def count_tokens(self, text: str) -> int:
+        """Token count of text, remembered for recently counted texts such as a fixed system prompt."""
+        count = self._counts.get(text)
+        if count is None:
+            count = len(self.tokenize(text))
+            self._counts[text] = count
+            if len(self._counts) > self.COUNT_CACHE_SIZE:
+                self._counts.popitem(last=False)
+        else:
+            self._counts.move_to_end(text)
+        return count
+
+    def append(self, role: str, content: str) -> None:
+        message = {"role": role, "content": content}
+        self.messages.append(message)
+        self._token_ids.append(self.tokenize(self.render(message)))
+
+    def clear(self) -> None:
+        self.messages = []
+        self._token_ids = []
+        self._summary = None
+
+    def token_ids(self, index: int) -> List[int]:
+        """Cached token ids of one message as rendered in the prompt."""
+        return self._token_ids[index]
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(len(ids) for ids in self._token_ids)
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def __iter__(self) -> Iterator[Message]:
+        return iter(self.messages)
+
+    def __getitem__(self, index):
+        return self.messages[index]
+
+    def pack(self, budget: int) -> List[Message]:
+        """
+        Select the history to include in a prompt without exceeding the token budget.
+
+        Args:
+            budget: Tokens available for history
+
+        Returns:
+            The newest messages that fit, preceded by a summary message of the
+            older ones when the overflow strategy is "summarise_oldest"
+        """
+        if budget <= 0 or not self.messages:
+            return []
+        start, used = self._window(budget)
+        if start == 0:
+            return list(self.messages)
+        if self.overflow == "drop_oldest":
+            return self.messages[start:]
+
+        summary_budget = int(budget * self.summary_share)
+        while start < len(self.messages) and used + summary_budget > budget:
+            used -= len(self._token_ids[start])
+            start += 1
+        summary = self._summarise(start, summary_budget)
+        return ([summary] if summary else []) + self.messages[start:]
+
+    def surround(self, _input: List[Message], budget: int) -> List[Message]:
+        """
+        Place as much history as fits between the leading system messages of
+        _input and the rest of it.
+
+        Args:
+            _input: Messages of the current turn
+            budget: Tokens available for the whole prompt
+
+        Returns:
+            System messages, packed history, then the remaining input messages
+        """
+        split = 0
+        while split < len(_input) and _input[split]["role"] == "system":
+            split += 1
+        history = []
+        if self.messages:
+            input_tokens = sum(self.count_tokens(self.render(message)) for message in _input)
+            history = self.pack(budget - input_tokens)
+        return _input[:split] + history + _input[split:]
+
+    def _window(self, budget: int) -> Tuple[int, int]:
+        """Index of the oldest message in the newest run that fits the budget, and its token total."""
+        start, used = len(self.messages), 0
+        for index in range(len(self.messages) - 1, -1, -1):
+            cost = len(self._token_ids[index])
+            if used + cost > budget:
+                break
+            used += cost
+            start = index
+        return start, used
+
+    def _summarise(self, covered: int, budget: int) -> Optional[Message]:
+        if budget <= 0 or covered == 0:
+            return None
+        if self._summary is not None and self._summary[0] == covered and self._summary[2] <= budget:
+            return self._summary[1]
+
+        if self._summary is not None and self._summary[0] < covered:
+            # Extend the previous summary with the messages that have since fallen out of the window
+            previous = self._summary[1]
+            text = self.summarizer([previous] + self.messages[self._summary[0]:covered])
+        else:
+            text = self.summarizer(self.messages[:covered])
+
+        prefix = "Summary of earlier conversation: "
+        if text.startswith(prefix):
+            text = text[len(prefix):]
+        message = {"role": "system", "content": prefix + text}
+        ids = self.tokenize(self.render(message))
+        if len(ids) > budget:
+            # Cut the summary text at a token boundary; re-tokenizing the cut text can differ slightly, so re-check
+            overhead = self.count_tokens(self.render({"role": "system", "content": prefix}))
+            text_ids = self.tokenize(text)
+            keep = budget - overhead
+            while len(ids) > budget and keep > 0:
+                if self.tokenizer is None:
+                    text = text[:keep * 4]
+                else:
+                    text = self.tokenizer.decode(text_ids[:keep])
+                message["content"] = prefix + text
+                ids = self.tokenize(self.render(message))
+                keep -= max(len(ids) - budget, 1)
+        if len(ids) > budget:
+            return None
+        self._summary = (covered, message, len(ids))
+        return message
@@ -1,4 +1,12 @@
+import gc
+import logging
+import os
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple, Union
 import torch
+from metrics import REGISTRY, MetricsRegistry, peak_rss_bytes, resident_memory_bytes
+
+CGROUP_LIMITS = ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes")
 
 class MemoryManager:
     @staticmethod
@@ -8,9 +16,205 @@ class MemoryManager:
             torch.cuda.ipc_collect()
 
     @staticmethod
-    def get_memory_stats():
+    def get_memory_stats() -> Dict[str, int]:
+        """
+        GPU memory of the current device in bytes: allocated, reserved and peak allocated.
+
+        Returns an empty dict without a GPU.
+        """
         if torch.cuda.is_available():
-            allocated = torch.cuda.memory_allocated() / 1024**2
-            reserved = torch.cuda.memory_reserved() / 1024**2
-            return f"Allocated: {allocated:.2f}MB, Reserved: {reserved:.2f}MB"
-        return "GPU not available"
\ No newline at end of file
+            return {
+                "allocated": torch.cuda.memory_allocated(),
+                "reserved": torch.cuda.memory_reserved(),
+                "peak_allocated": torch.cuda.max_memory_allocated(),
+            }
+        return {}
+
+    @staticmethod
+    def collect_metrics(registry: MetricsRegistry) -> None:
+        for name, value in MemoryManager.get_memory_stats().items():
+            registry.set(f"gpu_memory_{name}_bytes", value, f"GPU memory {name.replace('_', ' ')}")
+
+
+REGISTRY.add_collector(MemoryManager.collect_metrics)
+
+
+def host_memory_limit() -> int:
+    """Physical memory, or the cgroup limit of this process when that is lower."""
+    limit = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    for path in CGROUP_LIMITS:
+        try:
+            with open(path, "r") as file:
+                value = file.read().strip()
+        except OSError:
+            continue
+        if value.isdigit():  # "max" (v2) means unlimited
+            limit = min(limit, int(value))
+    return limit
+
+
+@dataclass
+class MemoryReading:
+    device: str  # "cuda" or "cpu"
+    used: int  # Allocated tensors on a GPU, resident set size on the CPU
+    peak: int
+    limit: int  # Device memory, or host memory / cgroup limit
+    reserved: int = 0  # Held by the CUDA caching allocator, allocated or not
+
+    @property
+    def fraction(self) -> float:
+        """Share of the limit in use, counting memory the allocator holds on to."""
+        return max(self.used, self.reserved) / self.limit if self.limit else 0.0
+
+
+class MemoryPolicy:
+    """
+    Tracks memory use and reacts to pressure.
+
+    The allocator cache is only cleared once usage passes `threshold` of the
+    limit, since emptying it on every request throws away blocks the next
+    generation would reuse. Out-of-memory errors are recognised by is_oom,
+    and degrade() gives the smaller context window and generation budget to
+    retry with. headroom() is what the batch scheduler admits requests
+    against.
+
+    The limit defaults to the device's (or on the CPU, the host's or cgroup's)
+    memory; pass limit_bytes, or a reader returning MemoryReadings, to
+    simulate a smaller device.
+    """
+
+    def __init__(
+            self,
+            threshold: float = 0.9,
+            limit_bytes: Optional[int] = None,
+            retry_shrink: float = 0.5,
+            max_retries: int = 2,
+            min_new_tokens: int = 64,
+            min_context: int = 512,
+            device: Optional[Union[str, torch.device]] = None,
+            reader: Optional[Callable[[], MemoryReading]] = None
+    ):
+        """
+        Args:
+            threshold: Fraction of the limit treated as full: the cache is cleared above it
+                and headroom is measured up to it
+            limit_bytes: Memory limit overriding the device's
+            retry_shrink: Factor the context window and max_new_tokens shrink by per OOM retry
+            max_retries: Retries after an out-of-memory error before giving up
+            min_new_tokens: Floor for the reduced generation budget
+            min_context: Floor for the reduced context window
+            device: Device to track (default: the current GPU when available, else the CPU)
+            reader: Replaces reading the device, e.g. to simulate memory use in tests
+        """
+        if not 0 < threshold <= 1:
+            raise ValueError(f"threshold must be in (0, 1], got {threshold}")
+        if not 0 < retry_shrink < 1:
+            raise ValueError(f"retry_shrink must be in (0, 1), got {retry_shrink}")
+        self.threshold = threshold
+        self.retry_shrink = retry_shrink
+        self.max_retries = max_retries
+        self.min_new_tokens = min_new_tokens
+        self.min_context = min_context
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = torch.device(device)
+        self.reader = reader
+        if limit_bytes is None and reader is None:
+            limit_bytes = (torch.cuda.get_device_properties(self.device).total_memory
+                           if self.device.type == "cuda" else host_memory_limit())
+        self.limit_bytes = limit_bytes
+        REGISTRY.add_collector(self.collect_metrics)
+
+    def read(self) -> MemoryReading:
+        """Current, peak and limit memory of the tracked device."""
+        if self.reader is not None:
+            reading = self.reader()
+            if self.limit_bytes is not None:
+                reading.limit = self.limit_bytes
+            return reading
+        if self.device.type == "cuda":
+            return MemoryReading(
+                device="cuda",
+                used=torch.cuda.memory_allocated(self.device),
+                peak=torch.cuda.max_memory_allocated(self.device),
+                limit=self.limit_bytes,
+                reserved=torch.cuda.memory_reserved(self.device)
+            )
+        used = resident_memory_bytes()
+        # The kernel updates the peak lazily, so it can trail a fresh reading
+        return MemoryReading(device="cpu", used=used, peak=max(used, peak_rss_bytes()), limit=self.limit_bytes)
+
+    def headroom(self, reading: Optional[MemoryReading] = None) -> int:
+        """Bytes that can still be allocated before usage reaches the threshold."""
+        reading = reading or self.read()
+        return max(0, int(reading.limit * self.threshold) - max(reading.used, reading.reserved))
+
+    def can_admit(self, required_bytes: int) -> bool:
+        """Whether required_bytes more fit under the threshold."""
+        return required_bytes <= self.headroom()
+
+    def clear(self) -> None:
+        gc.collect()  # Frees tensors only reachable through reference cycles
+        MemoryManager.clear_memory()
+        REGISTRY.inc("memory_clears_total", 1, "Allocator cache clears under memory pressure")
+
+    def maybe_clear(self) -> bool:
+        """
+        Clear the cache if usage is above the threshold.
+
+        Returns:
+            Whether it was cleared
+        """
+        reading = self.read()
+        if reading.fraction < self.threshold:
+            return False
+        logging.info(f"Memory at {reading.fraction:.0%} of {reading.limit} bytes on {reading.device}, clearing cache")
+        self.clear()
+        return True
+
+    @staticmethod
+    def is_oom(error: BaseException) -> bool:
+        """Whether error is a GPU or host allocation failure."""
+        if isinstance(error, MemoryError):
+            return True
+        if not isinstance(error, RuntimeError):
+            return False
+        message = str(error)
+        return "out of memory" in message or "can't allocate memory" in message
+
+    def degrade(self, attempt: int, context_window: int, max_new_tokens: int) -> Optional[Tuple[int, int]]:
+        """
+        Limits for the attempt-th retry after an out-of-memory error.
+
+        Both limits shrink by retry_shrink per attempt down to their floors, and
+        generation never takes more than half of the reduced window.
+
+        Args:
+            attempt: Retry number, from 1
+            context_window: Configured prompt plus generation token limit
+            max_new_tokens: Configured generation budget
+
+        Returns:
+            (context_window, max_new_tokens), or None when retries are exhausted
+            or the limits cannot shrink any further
+        """
+        if attempt > self.max_retries:
+            return None
+        limits = self._shrink(attempt, context_window, max_new_tokens)
+        if attempt > 1 and limits == self._shrink(attempt - 1, context_window, max_new_tokens):
+            return None
+        REGISTRY.inc("oom_retries_total", 1, "Generations retried with smaller limits after running out of memory")
+        return limits
+
+    def _shrink(self, attempt: int, context_window: int, max_new_tokens: int) -> Tuple[int, int]:
+        factor = self.retry_shrink ** attempt
+        context = max(min(self.min_context, context_window), int(context_window * factor))
+        new_tokens = max(min(self.min_new_tokens, max_new_tokens), int(max_new_tokens * factor))
+        return context, max(1, min(new_tokens, context // 2))
+
+    def collect_metrics(self, registry: MetricsRegistry) -> None:
+        reading = self.read()
+        registry.set("memory_used_bytes", reading.used, "Memory in use on the tracked device", device=reading.device)
+        registry.set("memory_peak_bytes", reading.peak, "Peak memory use on the tracked device", device=reading.device)
+        registry.set("memory_headroom_bytes", self.headroom(reading),
+                     "Memory left below the memory policy threshold", device=reading.device)
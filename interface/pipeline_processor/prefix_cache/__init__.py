@@ -0,0 +1,119 @@
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+import torch
+from transformers import DynamicCache
+
+
+class PrefixCache:
+    """
+    LRU store of past-key-values keyed by the token ids they were computed from.
+
+    A lookup returns a private copy of the longest cached prefix shared with
+    the new input, so a constant agent prompt (and the earlier turns of a
+    conversation) is prefilled once and then resumed from. Total cached tensor
+    size is bounded by max_bytes; the least recently used entries go first.
+    Lookups and stores may come from several generating threads at once.
+    """
+
+    def __init__(self, max_bytes: int = 2 * 1024**3, min_prefix_tokens: int = 16):
+        """
+        Args:
+            max_bytes: Upper bound on the memory held by cached key/value tensors
+            min_prefix_tokens: Shorter shared prefixes are not worth a cache copy
+        """
+        self.max_bytes = max_bytes
+        self.min_prefix_tokens = min_prefix_tokens
+        self.entries: "OrderedDict[Tuple[int, ...], Tuple[torch.Tensor, DynamicCache, int]]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cache_bytes(cache: DynamicCache) -> int:
+        return sum(t.numel() * t.element_size() for t in (*cache.key_cache, *cache.value_cache))
+
+    @staticmethod
+    def slice_cache(cache: DynamicCache, length: int) -> DynamicCache:
+        """Copy the first `length` positions of a cache into a new DynamicCache."""
+        sliced = DynamicCache()
+        for layer_idx, (keys, values) in enumerate(zip(cache.key_cache, cache.value_cache)):
+            sliced.update(keys[..., :length, :].clone(), values[..., :length, :].clone(), layer_idx)
+        return sliced
+
+    def lookup(self, input_ids: torch.Tensor) -> Tuple[int, Optional[DynamicCache]]:
+        """
+        Find the cached entry sharing the longest token prefix with the input.
+
+        At least one input token is always left uncached so generation has
+        something to prefill.
+
+        Args:
+            input_ids: 1-D tensor of prompt token ids
+
+        Returns:
+            Tuple[int, Optional[DynamicCache]]: Number of reusable tokens and a
+            copy of the cache truncated to them, or (0, None) on a miss
+        """
+        limit = input_ids.shape[0] - 1
+        with self._lock:
+            best_key, best_length = None, 0
+            for key, (ids, _, _) in self.entries.items():
+                span = min(ids.shape[0], limit)
+                if span <= best_length:
+                    continue
+                mismatch = (ids[:span] != input_ids[:span].to(ids.device)).nonzero()
+                length = span if mismatch.numel() == 0 else int(mismatch[0])
+                if length > best_length:
+                    best_key, best_length = key, length
+
+            if best_key is None or best_length < self.min_prefix_tokens:
+                self.misses += 1
+                return 0, None
+            self.entries.move_to_end(best_key)
+            self.hits += 1
+            self.reused_tokens += best_length
+            cache = self.entries[best_key][1]
+        # Stored caches are never modified, so the copy can be made outside the lock
+        return best_length, self.slice_cache(cache, best_length)
+
+    def store(self, token_ids: torch.Tensor, cache: DynamicCache) -> None:
+        """
+        Remember a cache computed for the given tokens (only the covered positions are kept).
+
+        Args:
+            token_ids: 1-D tensor of the token ids the cache was built from
+            cache: The matching DynamicCache (or legacy tuple of key/value pairs); it must not be modified afterwards
+        """
+        if isinstance(cache, tuple):
+            cache = DynamicCache.from_legacy_cache(cache)
+        length = cache.get_seq_length()
+        if length < self.min_prefix_tokens:
+            return
+        ids = token_ids[:length].detach()
+        key = tuple(ids.tolist())
+        size = self.cache_bytes(cache)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return
+            # Drop entries that are strict prefixes of the new one; it covers them.
+            for other in [k for k in self.entries if len(k) < len(key) and key[:len(k)] == k]:
+                self._evict(other)
+            self.entries[key] = (ids, cache, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                self._evict(next(iter(self.entries)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def _evict(self, key: Tuple[int, ...]) -> None:
+        _, _, size = self.entries.pop(key)
+        self.total_bytes -= size
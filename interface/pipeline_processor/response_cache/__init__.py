@@ -0,0 +1,148 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+
+class ResponseCache:
+    """
+    Cache of generated token ids keyed on the formatted prompt plus generation config.
+
+    The in-memory tier is an LRU bounded by an estimate of the bytes it holds;
+    every entry expires after ttl seconds. An optional SQLite file acts as a
+    second tier that survives restarts. Greedy requests are always cacheable;
+    sampled requests only when cache_sampled is set, since reusing them
+    removes the variety sampling asks for.
+    """
+
+    ENTRY_OVERHEAD = 96  # Rough per-entry bookkeeping cost in bytes
+    PURGE_EVERY = 256  # Disk puts between sweeps of expired rows
+
+    def __init__(
+            self,
+            max_bytes: int = 64 * 1024**2,
+            ttl: Optional[float] = 24 * 3600.0,
+            disk_path: Optional[str] = None,
+            cache_sampled: bool = False
+    ):
+        """
+        Args:
+            max_bytes: Memory budget of the LRU tier
+            ttl: Seconds an entry stays valid (None: never expires)
+            disk_path: SQLite file for the persistent tier (None: memory only)
+            cache_sampled: Also cache requests generated with do_sample=True
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.cache_sampled = cache_sampled
+        self.entries: "OrderedDict[str, Tuple[List[int], float, int]]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, token_ids TEXT, expires_at REAL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def make_key(prompt: str, config: Dict) -> str:
+        payload = json.dumps({"prompt": prompt, "config": config}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def cacheable(self, config: Dict) -> bool:
+        return not config.get("do_sample") or self.cache_sampled
+
+    def get(self, key: str) -> Optional[List[int]]:
+        """Return the cached token ids for the key, or None on a miss or expiry."""
+        now = time.time()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[1] >= now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                self._evict(key)
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT token_ids, expires_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] >= now:
+                    token_ids = json.loads(row[0])
+                    self._remember(key, token_ids, row[1])
+                    self.disk_hits += 1
+                    return token_ids
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, token_ids: List[int]) -> None:
+        """Store the generated token ids for the key in every tier."""
+        expires_at = time.time() + self.ttl if self.ttl is not None else float("inf")
+        with self._lock:
+            if key in self.entries:
+                self._evict(key)
+            self._remember(key, list(token_ids), expires_at)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                        (key, json.dumps(list(token_ids)), expires_at)
+                    )
+                    self._puts += 1
+                    if self._puts % self.PURGE_EVERY == 0:
+                        self._db.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logging.warning(f"Response cache disk write failed: {str(e)}")
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "evictions": self.evictions,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries.clear()
+            self.total_bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _remember(self, key: str, token_ids: List[int], expires_at: float) -> None:
+        size = 8 * len(token_ids) + len(key) + self.ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (token_ids, expires_at, size)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            self._evict(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _evict(self, key: str) -> None:
+        _, _, size = self.entries.pop(key)
+        self.total_bytes -= size
@@ -0,0 +1,477 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Deque, Dict, List, Optional
+import torch
+from transformers import DynamicCache
+from metrics import REGISTRY, MetricsRegistry
+from interface.pipeline_processor.conversation_memory import tokenizer_lock
+from interface.pipeline_processor.stop_sequences import IncrementalDecoder, StopSequences
+
+if TYPE_CHECKING:
+    from interface.pipeline_processor.memory_manager import MemoryPolicy
+
+
+@dataclass
+class SamplingParams:
+    max_new_tokens: int = 256
+    temperature: float = 0.7
+    top_p: float = 0.9
+    top_k: int = 50
+    do_sample: bool = True
+    seed: Optional[int] = None
+    stop: Optional[StopSequences] = None  # Ends the sequence early; the result text is cut at the stop
+
+
+@dataclass
+class GenerationResult:
+    text: str
+    token_ids: List[int]
+    prompt_tokens: int
+    queue_wait: float  # Seconds between submit and prefill
+    time_to_first_token: float  # Seconds between submit and the first sampled token
+    latency: float  # Seconds between submit and completion
+
+
+@dataclass
+class _Sequence:
+    request_id: int
+    prompt_ids: List[int]
+    params: SamplingParams
+    future: Future
+    submitted_at: float
+    generator: Optional[torch.Generator] = None
+    generated: List[int] = field(default_factory=list)
+    keys: Optional[List[torch.Tensor]] = None  # Per-layer (1, heads, length, dim) when not in a group
+    values: Optional[List[torch.Tensor]] = None
+    length: int = 0  # Tokens held in the KV cache
+    started_at: float = 0.0
+    first_token_at: float = 0.0
+    group: Optional["_Group"] = None
+    row: int = 0
+    decoder: Optional[IncrementalDecoder] = None  # Generated text so far, when the params have stops
+
+
+@dataclass
+class _Group:
+    """Sequences decoded together, sharing one left-padded batched KV cache."""
+    sequences: List[_Sequence]
+    cache: DynamicCache
+    pads: List[int]
+    mask: torch.Tensor  # (batch, cache length) with zeros over padding
+
+
+def kv_cache_bytes_per_token(model) -> int:
+    """Key and value bytes one token takes in the model's KV cache, estimated from its config."""
+    config = getattr(model, "config", None)
+    layers = getattr(config, "num_hidden_layers", 0)
+    heads = getattr(config, "num_attention_heads", 0)
+    if not layers or not heads:
+        return 0
+    head_dim = getattr(config, "head_dim", None) or config.hidden_size // heads
+    kv_heads = getattr(config, "num_key_value_heads", None) or heads
+    dtype = getattr(model, "dtype", torch.float32)
+    element_size = torch.finfo(dtype).bits // 8 if dtype.is_floating_point else 1
+    return 2 * layers * kv_heads * head_dim * element_size
+
+
+def filter_scores(scores: torch.Tensor, params: SamplingParams) -> torch.Tensor:
+    """
+    Apply temperature, top-k and top-p to a (vocab,) row of float scores; filtered tokens get -inf.
+    """
+    scores = scores / max(params.temperature, 1e-5)
+    if 0 < params.top_k < scores.shape[-1]:
+        kth = torch.topk(scores, params.top_k).values[-1]
+        scores = scores.masked_fill(scores < kth, float("-inf"))
+    if params.top_p < 1.0:
+        sorted_scores, order = torch.sort(scores, descending=True)
+        cumulative = sorted_scores.softmax(-1).cumsum(-1)
+        drop = cumulative - sorted_scores.softmax(-1) > params.top_p
+        scores = scores.masked_fill(torch.zeros_like(drop).scatter(0, order, drop), float("-inf"))
+    return scores
+
+
+def sample_tokens(logits: torch.Tensor, params: List[SamplingParams], generators: List[Optional[torch.Generator]]) -> List[int]:
+    """
+    Pick the next token for each row of a (batch, vocab) logits tensor with that row's own parameters.
+    """
+    tokens = []
+    for row, (row_params, generator) in enumerate(zip(params, generators)):
+        scores = logits[row].float()
+        if not row_params.do_sample:
+            tokens.append(int(scores.argmax()))
+            continue
+        probs = filter_scores(scores, row_params).softmax(-1)
+        tokens.append(int(torch.multinomial(probs, 1, generator=generator)))
+    return tokens
+
+
+class ContinuousBatchScheduler:
+    """
+    Continuous-batching front end for a causal LM.
+
+    Requests are queued by submit() and admitted into the running batch as
+    soon as a slot is free; every scheduler step decodes one token for all
+    running sequences, and finished sequences leave immediately so waiting
+    requests can take their place. Prompts of equal length are prefilled
+    together without padding. For decoding, running sequences are bucketed by
+    cache length (at most bucket_width apart) so left padding stays small;
+    a bucket keeps its batched KV cache across steps until its membership
+    changes. With a memory policy, a request is only admitted while the KV
+    cache it and the running sequences can still grow to fits the policy's
+    headroom.
+    """
+
+    def __init__(
+            self,
+            model,
+            tokenizer,
+            max_batch_size: int = 8,
+            bucket_width: int = 64,
+            max_queue: int = 1024,
+            memory_policy: Optional["MemoryPolicy"] = None
+    ):
+        """
+        Args:
+            model: Causal LM (transformers PreTrainedModel)
+            tokenizer: Matching tokenizer
+            max_batch_size: Running sequences decoded per step
+            bucket_width: Largest cache-length spread within one decode batch
+            max_queue: Waiting requests accepted before submit() raises
+            memory_policy: Admits requests only while their KV cache fits its headroom
+        """
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.bucket_width = bucket_width
+        self.max_queue = max_queue
+        self.memory_policy = memory_policy
+        self.kv_bytes_per_token = kv_cache_bytes_per_token(model)
+        self.eos_token_id = tokenizer.eos_token_id
+        self.waiting: Deque[_Sequence] = deque()
+        self.running: List[_Sequence] = []
+        self.groups: List[_Group] = []
+        self._next_id = 0
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._stats = {
+            "completed": 0,
+            "generated_tokens": 0,
+            "busy_seconds": 0.0,
+            "queue_wait_total": 0.0,
+            "queue_wait_max": 0.0,
+            "padded_slots": 0,
+            "real_slots": 0,
+            "deferred_for_memory": 0,
+        }
+        REGISTRY.add_collector(self.collect_metrics)
+
+    def collect_metrics(self, registry: MetricsRegistry) -> None:
+        registry.set("scheduler_queue_depth", len(self.waiting), "Requests waiting for a batch slot")
+        registry.set("scheduler_running", len(self.running), "Sequences in the running batch")
+
+    @property
+    def device(self) -> torch.device:
+        return next(self.model.parameters()).device
+
+    def submit(self, prompt: str, params: Optional[SamplingParams] = None) -> Future:
+        """
+        Queue a prompt for generation.
+
+        Args:
+            prompt: Fully formatted prompt text
+            params: Per-request sampling parameters
+
+        Returns:
+            Future resolving to a GenerationResult
+        """
+        params = params or SamplingParams()
+        with tokenizer_lock(self.tokenizer):
+            prompt_ids = self.tokenizer(prompt)["input_ids"]
+        if not prompt_ids:
+            raise ValueError("Prompt produced no tokens")
+        future: Future = Future()
+        with self._condition:
+            if len(self.waiting) >= self.max_queue:
+                raise RuntimeError("Scheduler queue is full")
+            generator = None
+            if params.seed is not None:
+                generator = torch.Generator(device=self.device).manual_seed(params.seed)
+            sequence = _Sequence(self._next_id, prompt_ids, params, future, time.perf_counter(), generator)
+            if params.stop is not None:
+                sequence.decoder = IncrementalDecoder(self.tokenizer)
+            self._next_id += 1
+            self.waiting.append(sequence)
+            self._condition.notify()
+        return future
+
+    def generate(self, prompt: str, params: Optional[SamplingParams] = None) -> GenerationResult:
+        """Submit a prompt and block until it completes (requires start() or another thread stepping)."""
+        return self.submit(prompt, params).result()
+
+    def start(self) -> None:
+        """Run the scheduling loop in a background thread."""
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._loop, name="batch-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background loop; unfinished requests are failed."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        error = RuntimeError("Scheduler stopped")
+        for sequence in list(self.waiting) + self.running:
+            if not sequence.future.done():
+                sequence.future.set_exception(error)
+        self.waiting.clear()
+        self.running, self.groups = [], []
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self.waiting)
+
+    def has_work(self) -> bool:
+        return bool(self.waiting or self.running)
+
+    def run_until_idle(self) -> None:
+        """Step synchronously until every queued request has finished."""
+        while self.has_work():
+            self.step()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Throughput and queueing statistics since construction.
+
+        Returns:
+            Dict with completed requests, generated tokens, tokens/s over busy
+            time, mean and max queue wait, current queue depth and running
+            batch size, the fraction of decode slots spent on padding and how
+            often admission was put off for lack of memory headroom.
+        """
+        s = self._stats
+        slots = s["padded_slots"] + s["real_slots"]
+        return {
+            "completed": s["completed"],
+            "generated_tokens": s["generated_tokens"],
+            "tokens_per_second": s["generated_tokens"] / s["busy_seconds"] if s["busy_seconds"] else 0.0,
+            "mean_queue_wait": s["queue_wait_total"] / s["completed"] if s["completed"] else 0.0,
+            "max_queue_wait": s["queue_wait_max"],
+            "queue_depth": len(self.waiting),
+            "running": len(self.running),
+            "padding_ratio": s["padded_slots"] / slots if slots else 0.0,
+            "deferred_for_memory": s["deferred_for_memory"],
+        }
+
+    def _loop(self) -> None:
+        while True:
+            with self._condition:
+                while not self._stopping and not self.has_work():
+                    self._condition.wait()
+                if self._stopping:
+                    return
+            try:
+                self.step()
+            except Exception as e:
+                logging.error(f"Scheduler step failed: {str(e)}")
+                for sequence in list(self.running):
+                    if not sequence.future.done():
+                        sequence.future.set_exception(e)
+                self.running, self.groups = [], []
+
+    @torch.no_grad()
+    def step(self) -> None:
+        """Admit waiting requests, decode one token for every running sequence and retire finished ones."""
+        started = time.perf_counter()
+        self._admit()
+        for group in self._regroup():
+            self._decode(group)
+        self._retire()
+        self._stats["busy_seconds"] += time.perf_counter() - started
+
+    def _kv_bytes(self, sequence: _Sequence) -> int:
+        """KV cache the sequence still needs to grow by until it reaches max_new_tokens."""
+        final_length = len(sequence.prompt_ids) + sequence.params.max_new_tokens
+        return (final_length - sequence.length) * self.kv_bytes_per_token
+
+    def _admit(self) -> None:
+        admitted = []
+        with self._condition:
+            headroom = None
+            if self.memory_policy is not None and self.waiting:
+                headroom = self.memory_policy.headroom() - sum(self._kv_bytes(s) for s in self.running)
+            while self.waiting and len(self.running) + len(admitted) < self.max_batch_size:
+                sequence = self.waiting[0]
+                if sequence.future.cancelled():
+                    self.waiting.popleft()
+                    continue
+                if headroom is not None:
+                    required = self._kv_bytes(sequence)
+                    if required > headroom and (self.running or admitted):
+                        # An idle scheduler still admits one request so nothing waits forever
+                        self._stats["deferred_for_memory"] += 1
+                        break
+                    headroom -= required
+                admitted.append(self.waiting.popleft())
+        if not admitted:
+            return
+
+        now = time.perf_counter()
+        by_length: Dict[int, List[_Sequence]] = {}
+        for sequence in admitted:
+            sequence.started_at = now
+            by_length.setdefault(len(sequence.prompt_ids), []).append(sequence)
+
+        for sequences in by_length.values():
+            try:
+                input_ids = torch.tensor([s.prompt_ids for s in sequences], device=self.device)
+                cache = DynamicCache()
+                logits = self.model(input_ids=input_ids, past_key_values=cache, use_cache=True).logits[:, -1, :]
+                tokens = sample_tokens(logits, [s.params for s in sequences], [s.generator for s in sequences])
+            except Exception as e:
+                # Not running yet, so the step's failure handler would never resolve them
+                logging.error(f"Prefill of {len(sequences)} requests failed: {str(e)}")
+                for sequence in sequences:
+                    if not sequence.future.done():
+                        sequence.future.set_exception(e)
+                continue
+            first_token_at = time.perf_counter()
+            for row, (sequence, token) in enumerate(zip(sequences, tokens)):
+                sequence.keys = [k[row:row + 1] for k in cache.key_cache]
+                sequence.values = [v[row:row + 1] for v in cache.value_cache]
+                sequence.length = input_ids.shape[1]
+                sequence.first_token_at = first_token_at
+                sequence.generated.append(token)
+                self.running.append(sequence)
+        self._retire()
+
+    def _regroup(self) -> List[_Group]:
+        """Bucket running sequences by cache length, reusing groups whose membership is unchanged."""
+        ordered = sorted(self.running, key=lambda s: (s.length, s.request_id))
+        buckets: List[List[_Sequence]] = []
+        for sequence in ordered:
+            if buckets and len(buckets[-1]) < self.max_batch_size \
+                    and sequence.length - buckets[-1][0].length <= self.bucket_width:
+                buckets[-1].append(sequence)
+            else:
+                buckets.append([sequence])
+
+        existing = {tuple(s.request_id for s in g.sequences): g for g in self.groups}
+        groups = []
+        for bucket in buckets:
+            bucket.sort(key=lambda s: s.request_id)
+            group = existing.get(tuple(s.request_id for s in bucket))
+            groups.append(group if group is not None else self._build_group(bucket))
+        self.groups = groups
+        return groups
+
+    def _build_group(self, sequences: List[_Sequence]) -> _Group:
+        for sequence in sequences:
+            self._detach(sequence)
+        max_length = max(s.length for s in sequences)
+        pads = [max_length - s.length for s in sequences]
+        cache = DynamicCache()
+        for layer_idx in range(len(sequences[0].keys)):
+            keys, values = [], []
+            for sequence, pad in zip(sequences, pads):
+                k, v = sequence.keys[layer_idx], sequence.values[layer_idx]
+                if pad:
+                    k = torch.cat([k.new_zeros(*k.shape[:2], pad, k.shape[3]), k], dim=2)
+                    v = torch.cat([v.new_zeros(*v.shape[:2], pad, v.shape[3]), v], dim=2)
+                keys.append(k)
+                values.append(v)
+            cache.update(torch.cat(keys), torch.cat(values), layer_idx)
+        mask = torch.ones(len(sequences), max_length, dtype=torch.long, device=self.device)
+        for row, pad in enumerate(pads):
+            mask[row, :pad] = 0
+        group = _Group(sequences, cache, pads, mask)
+        for row, sequence in enumerate(sequences):
+            sequence.group, sequence.row = group, row
+            sequence.keys = sequence.values = None
+        return group
+
+    @staticmethod
+    def _detach(sequence: _Sequence) -> None:
+        """Copy a sequence's own KV rows out of its group's batched cache."""
+        group = sequence.group
+        if group is None:
+            return
+        pad = group.pads[sequence.row]
+        row = sequence.row
+        sequence.keys = [k[row:row + 1, :, pad:, :] for k in group.cache.key_cache]
+        sequence.values = [v[row:row + 1, :, pad:, :] for v in group.cache.value_cache]
+        sequence.group = None
+
+    def _decode(self, group: _Group) -> None:
+        sequences = group.sequences
+        input_ids = torch.tensor([[s.generated[-1]] for s in sequences], device=self.device)
+        position_ids = torch.tensor([[s.length] for s in sequences], device=self.device)
+        group.mask = torch.cat([group.mask, group.mask.new_ones(len(sequences), 1)], dim=1)
+        logits = self.model(
+            input_ids=input_ids,
+            attention_mask=group.mask,
+            position_ids=position_ids,
+            past_key_values=group.cache,
+            use_cache=True
+        ).logits[:, -1, :]
+        tokens = sample_tokens(logits, [s.params for s in sequences], [s.generator for s in sequences])
+        for sequence, token in zip(sequences, tokens):
+            sequence.length += 1
+            sequence.generated.append(token)
+        self._stats["padded_slots"] += sum(group.pads)
+        self._stats["real_slots"] += sum(s.length for s in sequences)
+
+    def _retire(self) -> None:
+        finished = [s for s in self.running if self._is_finished(s)]
+        if not finished:
+            return
+        now = time.perf_counter()
+        for sequence in finished:
+            self.running.remove(sequence)
+            sequence.keys = sequence.values = None
+            tokens = sequence.generated
+            if tokens and tokens[-1] == self.eos_token_id:
+                tokens = tokens[:-1]
+            queue_wait = sequence.started_at - sequence.submitted_at
+            text = self.tokenizer.decode(tokens, skip_special_tokens=True)
+            result = GenerationResult(
+                text=sequence.params.stop.truncate(text) if sequence.params.stop is not None else text,
+                token_ids=tokens,
+                prompt_tokens=len(sequence.prompt_ids),
+                queue_wait=queue_wait,
+                time_to_first_token=sequence.first_token_at - sequence.submitted_at,
+                latency=now - sequence.submitted_at
+            )
+            self._stats["completed"] += 1
+            self._stats["generated_tokens"] += len(sequence.generated)
+            self._stats["queue_wait_total"] += queue_wait
+            self._stats["queue_wait_max"] = max(self._stats["queue_wait_max"], queue_wait)
+            if not sequence.future.done():
+                sequence.future.set_result(result)
+        # Groups that lost members are rebuilt on the next regroup
+        self.groups = [g for g in self.groups if not any(s in finished for s in g.sequences)]
+        for sequence in self.running:
+            if sequence.group is not None and sequence.group not in self.groups:
+                self._detach(sequence)
+
+    def _is_finished(self, sequence: _Sequence) -> bool:
+        if sequence.future.cancelled():
+            return True
+        if (sequence.generated and sequence.generated[-1] == self.eos_token_id) \
+                or len(sequence.generated) >= sequence.params.max_new_tokens:
+            return True
+        if sequence.decoder is not None:
+            text = sequence.decoder.feed(sequence.generated[len(sequence.decoder.ids):])
+            if sequence.params.stop.find(text) is not None:
+                REGISTRY.inc("stop_sequence_hits_total", 1, "Generations ended early by a stop sequence")
+                return True
+        return False
@@ -0,0 +1,411 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import IO, Callable, Dict, List, Optional, Tuple
+from metrics import REGISTRY, MetricsRegistry
+from interface.pipeline_processor.conversation_memory import ConversationMemory, Message
+
+Position = Tuple[int, int]  # (segment number, byte offset of a record)
+
+SEGMENT_NAME = re.compile(r"^segment-(\d{6})\.log$")
+
+
+@dataclass
+class _SessionEntry:
+    head: Position  # Newest record; each record points to the one before it
+    count: int = 0
+    segments: Dict[int, int] = field(default_factory=dict)  # Segment -> bytes of this session's records in it
+
+
+class ConversationLog:
+    """
+    Append-only, segmented on-disk log of conversation messages.
+
+    Every message is one JSON line appended to the active segment file; the
+    active segment is sealed and a new one started once it reaches
+    segment_bytes. Each record holds the position of the same session's
+    previous record, so the index only needs a session's newest position:
+    reading a session follows its chain and touches none of the other
+    sessions' records.
+
+    The index is checkpointed to index.json (atomically) every
+    checkpoint_every appends and on close, together with the log position it
+    covers. Opening the log replays the records written after that position,
+    so appends made since the last checkpoint survive a crash; a torn last
+    line is cut off. compact() rewrites the sessions still living in sealed
+    segments that are mostly dead (deleted sessions, rewritten histories)
+    into the active segment and removes those segments.
+    """
+
+    VERSION = 1
+    INDEX_NAME = "index.json"
+
+    def __init__(
+            self,
+            directory: str,
+            segment_bytes: int = 16 * 1024**2,
+            checkpoint_every: int = 256,
+            fsync: bool = False
+    ):
+        """
+        Args:
+            directory: Folder holding the segment files and the index (created if missing)
+            segment_bytes: Size at which the active segment is sealed
+            checkpoint_every: Appends between index checkpoints
+            fsync: fsync every append, not only flush it to the OS
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.checkpoint_every = checkpoint_every
+        self.fsync = fsync
+        self.sessions: Dict[str, _SessionEntry] = {}
+        self.segment_sizes: Dict[int, int] = {}
+        self._lock = threading.RLock()
+        self._readers: Dict[int, IO[bytes]] = {}
+        self._writer: Optional[IO[bytes]] = None
+        self._unsaved = 0
+        os.makedirs(directory, exist_ok=True)
+        self._open()
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"segment-{segment:06d}.log")
+
+    @property
+    def active_segment(self) -> int:
+        return max(self.segment_sizes)
+
+    def _open(self) -> None:
+        for name in os.listdir(self.directory):
+            match = SEGMENT_NAME.match(name)
+            if match:
+                self.segment_sizes[int(match.group(1))] = os.path.getsize(os.path.join(self.directory, name))
+        start = self._load_index()
+        replayed = self._replay(start)
+        if not self.segment_sizes:
+            self.segment_sizes[1] = 0
+        self._writer = open(self._segment_path(self.active_segment), "ab")
+        if replayed:
+            logging.info(f"Conversation log {self.directory}: replayed {replayed} records after the last checkpoint")
+            self.checkpoint()
+
+    def _load_index(self) -> Position:
+        """Load the checkpointed index; returns the position to replay from."""
+        first = (min(self.segment_sizes), 0) if self.segment_sizes else (1, 0)
+        path = os.path.join(self.directory, self.INDEX_NAME)
+        if not os.path.exists(path):
+            return first
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                state = json.load(file)
+            if state.get("version") != self.VERSION:
+                raise ValueError(f"unsupported index version {state.get('version')}")
+            self.sessions = {
+                session_id: _SessionEntry(
+                    head=tuple(entry["head"]),
+                    count=entry["count"],
+                    segments={int(segment): size for segment, size in entry["segments"].items()}
+                )
+                for session_id, entry in state["sessions"].items()
+            }
+            return tuple(state["end"])
+        except Exception as e:
+            logging.warning(f"Rebuilding conversation index {path} from the segments: {str(e)}")
+            self.sessions = {}
+            return first
+
+    def _replay(self, start: Position) -> int:
+        replayed = 0
+        for segment in sorted(s for s in self.segment_sizes if s >= start[0]):
+            path = self._segment_path(segment)
+            offset = start[1] if segment == start[0] else 0
+            with open(path, "rb") as file:
+                file.seek(offset)
+                for line in file:
+                    record = self._parse(line)
+                    if record is None:
+                        # A torn write from a crash; nothing valid can follow it
+                        logging.warning(f"Truncating torn record at {path}:{offset}")
+                        file.close()
+                        os.truncate(path, offset)
+                        self.segment_sizes[segment] = offset
+                        break
+                    self._apply(record, (segment, offset), len(line))
+                    offset += len(line)
+                    replayed += 1
+        return replayed
+
+    @staticmethod
+    def _parse(line: bytes) -> Optional[Dict]:
+        if not line.endswith(b"\n"):
+            return None
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+
+    def _apply(self, record: Dict, position: Position, size: int) -> None:
+        session_id = record["s"]
+        if record.get("d"):
+            self.sessions.pop(session_id, None)
+            return
+        entry = self.sessions.get(session_id)
+        if entry is None or record.get("n"):
+            entry = self.sessions[session_id] = _SessionEntry(head=position)
+        entry.head = position
+        entry.count += 1
+        entry.segments[position[0]] = entry.segments.get(position[0], 0) + size
+
+    def _seal(self) -> None:
+        """Start a new active segment."""
+        self._writer.close()
+        segment = self.active_segment + 1
+        self.segment_sizes[segment] = 0
+        self._writer = open(self._segment_path(segment), "ab")
+
+    def _write(self, record: Dict) -> Position:
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        if self.segment_sizes[self.active_segment] and \
+                self.segment_sizes[self.active_segment] + len(line) > self.segment_bytes:
+            self._seal()
+        segment = self.active_segment
+        position = (segment, self.segment_sizes[segment])
+        self._writer.write(line)
+        self._writer.flush()
+        if self.fsync:
+            os.fsync(self._writer.fileno())
+        self.segment_sizes[segment] += len(line)
+        self._apply(record, position, len(line))
+        self._unsaved += 1
+        return position
+
+    def _maybe_checkpoint(self) -> None:
+        if self._unsaved >= self.checkpoint_every:
+            self.checkpoint()
+
+    def append(self, session_id: str, role: str, content: str) -> None:
+        with self._lock:
+            entry = self.sessions.get(session_id)
+            self._write({"s": session_id, "r": role, "c": content, "p": list(entry.head) if entry else None})
+            self._maybe_checkpoint()
+
+    def delete(self, session_id: str) -> None:
+        """Forget a session; its records become garbage for compaction."""
+        with self._lock:
+            if session_id in self.sessions:
+                self._write({"s": session_id, "d": 1})
+                self._maybe_checkpoint()
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self.sessions
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def _read_record(self, position: Position) -> Dict:
+        reader = self._readers.get(position[0])
+        if reader is None:
+            reader = self._readers[position[0]] = open(self._segment_path(position[0]), "rb")
+        reader.seek(position[1])
+        return json.loads(reader.readline())
+
+    def read(self, session_id: str) -> List[Message]:
+        """A session's messages, oldest first (empty for an unknown session)."""
+        with self._lock:
+            entry = self.sessions.get(session_id)
+            if entry is None:
+                return []
+            messages = []
+            position = entry.head
+            for _ in range(entry.count):
+                record = self._read_record(position)
+                messages.append({"role": record["r"], "content": record["c"]})
+                if record["p"] is None:
+                    break
+                position = tuple(record["p"])
+            messages.reverse()
+            return messages
+
+    def checkpoint(self) -> None:
+        """Write the index and the log position it covers."""
+        with self._lock:
+            state = {
+                "version": self.VERSION,
+                "end": [self.active_segment, self.segment_sizes[self.active_segment]],
+                "sessions": {
+                    session_id: {
+                        "head": list(entry.head),
+                        "count": entry.count,
+                        "segments": {str(segment): size for segment, size in entry.segments.items()}
+                    }
+                    for session_id, entry in self.sessions.items()
+                }
+            }
+            path = os.path.join(self.directory, self.INDEX_NAME)
+            temporary = path + ".tmp"
+            with open(temporary, "w", encoding="utf-8") as file:
+                json.dump(state, file, separators=(",", ":"))
+                if self.fsync:
+                    file.flush()
+                    os.fsync(file.fileno())
+            os.replace(temporary, path)
+            self._unsaved = 0
+
+    def live_bytes(self) -> Dict[int, int]:
+        """Bytes of every segment still referenced by a session."""
+        live = {segment: 0 for segment in self.segment_sizes}
+        for entry in self.sessions.values():
+            for segment, size in entry.segments.items():
+                live[segment] = live.get(segment, 0) + size
+        return live
+
+    def compact(self, min_live_ratio: float = 0.5) -> int:
+        """
+        Rewrite the sessions in segments whose live share is below min_live_ratio into
+        a new segment, then delete every sealed segment nothing refers to.
+
+        Returns:
+            Number of segment files removed
+        """
+        with self._lock:
+            live = self.live_bytes()
+            victims = {
+                segment for segment, size in self.segment_sizes.items()
+                if size and live.get(segment, 0) < min_live_ratio * size
+            }
+            moved = [s for s, entry in self.sessions.items() if victims & entry.segments.keys()]
+            if moved and self.active_segment in victims:
+                self._seal()  # The rewritten sessions must not land among the garbage
+            for session_id in moved:
+                messages = self.read(session_id)
+                del self.sessions[session_id]
+                for index, message in enumerate(messages):
+                    # "n" starts a new chain, so replaying the log replaces the old history instead of extending it
+                    record = {"s": session_id, "r": message["role"], "c": message["content"], "p": None}
+                    if index == 0:
+                        record["n"] = 1
+                    else:
+                        record["p"] = list(self.sessions[session_id].head)
+                    self._write(record)
+            self.checkpoint()  # The index must stop referring to the old records before they go
+
+            live = self.live_bytes()
+            removed = 0
+            for segment in sorted(self.segment_sizes):
+                if segment != self.active_segment and not live.get(segment):
+                    reader = self._readers.pop(segment, None)
+                    if reader is not None:
+                        reader.close()
+                    os.remove(self._segment_path(segment))
+                    del self.segment_sizes[segment]
+                    removed += 1
+            if removed:
+                logging.info(f"Compacted conversation log {self.directory}: {len(moved)} sessions rewritten, "
+                             f"{removed} segments removed")
+            return removed
+
+    def close(self) -> None:
+        with self._lock:
+            if self._writer is None:
+                return
+            self.checkpoint()
+            self._writer.close()
+            self._writer = None
+            for reader in self._readers.values():
+                reader.close()
+            self._readers.clear()
+
+
+class SessionStore:
+    """
+    Conversation memories by session ID, backed by a ConversationLog.
+
+    A session's memory is loaded from the log on first use, so resuming
+    reads only that session's records. Appends go to the log first and then
+    to the loaded memory. Sessions idle for idle_seconds, and the least
+    recently used ones beyond max_sessions, are dropped from memory (their
+    history stays in the log).
+    """
+
+    def __init__(
+            self,
+            log: ConversationLog,
+            memory_factory: Optional[Callable[[], ConversationMemory]] = None,
+            idle_seconds: float = 1800.0,
+            max_sessions: int = 1024,
+            clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Args:
+            log: Persistent message log
+            memory_factory: Creates an empty memory for a loaded session (default: ConversationMemory())
+            idle_seconds: Time without use after which a session leaves memory
+            max_sessions: Sessions kept in memory at most
+            clock: Time source (replaceable in tests)
+        """
+        self.log = log
+        self.memory_factory = memory_factory or ConversationMemory
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        self.clock = clock
+        self.loaded: "OrderedDict[str, Tuple[ConversationMemory, float]]" = OrderedDict()
+        self.evictions = 0
+        self._lock = threading.Lock()
+        REGISTRY.add_collector(self.collect_metrics)
+
+    def collect_metrics(self, registry: MetricsRegistry) -> None:
+        registry.set("sessions_loaded", len(self.loaded), "Conversation sessions held in memory")
+        registry.set("sessions_stored", len(self.log), "Conversation sessions in the on-disk log")
+
+    def memory(self, session_id: str) -> ConversationMemory:
+        """The session's memory, loaded from the log if it is not in memory."""
+        with self._lock:
+            now = self.clock()
+            cached = self.loaded.pop(session_id, None)
+            if cached is not None:
+                memory = cached[0]
+            else:
+                memory = self.memory_factory()
+                for message in self.log.read(session_id):
+                    memory.append(message["role"], message["content"])
+                REGISTRY.inc("session_loads_total", 1, "Conversation sessions loaded from the log")
+            self.loaded[session_id] = (memory, now)
+            self._evict(now)
+            return memory
+
+    def append(self, session_id: str, role: str, content: str) -> None:
+        self.log.append(session_id, role, content)
+        with self._lock:
+            cached = self.loaded.get(session_id)
+            if cached is not None:
+                cached[0].append(role, content)
+
+    def reset(self, session_id: str) -> None:
+        """Delete a session's history."""
+        self.log.delete(session_id)
+        with self._lock:
+            self.loaded.pop(session_id, None)
+
+    def evict_idle(self) -> int:
+        """Drop idle sessions from memory; returns how many were dropped."""
+        with self._lock:
+            return self._evict(self.clock())
+
+    def _evict(self, now: float) -> int:
+        evicted = 0
+        # Least recently used first, so the scan stops at the first session still in use
+        while self.loaded:
+            session_id, (_, last_used) = next(iter(self.loaded.items()))
+            if len(self.loaded) <= self.max_sessions and now - last_used < self.idle_seconds:
+                break
+            del self.loaded[session_id]
+            evicted += 1
+        self.evictions += evicted
+        return evicted
+
+    def close(self) -> None:
+        self.log.close()
@@ -0,0 +1,194 @@
+import inspect
+import logging
+from dataclasses import dataclass
+from threading import Event
+from typing import List, Optional, Set, Tuple, Union
+import torch
+from transformers import DynamicCache, StoppingCriteriaList, TextIteratorStreamer
+from interface.pipeline_processor.scheduler import SamplingParams, filter_scores
+
+
+@dataclass
+class SpeculativeStats:
+    rounds: int = 0  # Draft-then-verify steps (one main model forward pass each)
+    drafted: int = 0  # Tokens proposed by the draft model
+    accepted: int = 0  # Proposed tokens the main model kept
+    generated: int = 0  # Tokens emitted, accepted drafts plus one main-model token per round
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.accepted / self.drafted if self.drafted else 0.0
+
+    @property
+    def tokens_per_round(self) -> float:
+        return self.generated / self.rounds if self.rounds else 0.0
+
+    def add(self, other: "SpeculativeStats") -> None:
+        self.rounds += other.rounds
+        self.drafted += other.drafted
+        self.accepted += other.accepted
+        self.generated += other.generated
+
+    def __str__(self) -> str:
+        return (
+            f"accepted {self.accepted}/{self.drafted} drafted tokens ({self.acceptance_rate:.0%}), "
+            f"{self.tokens_per_round:.2f} tokens per main model pass"
+        )
+
+
+class SpeculativeDecoder:
+    """
+    Speculative decoding with a small draft model that shares the main model's tokenizer.
+
+    Each round the draft model proposes num_draft_tokens tokens one by one, and
+    the main model scores all of them in a single forward pass. Greedy decoding
+    keeps the longest prefix the main model agrees with, then adds the main
+    model's own next token, so the output is exactly what the main model
+    would have produced alone. When sampling, proposals are accepted with
+    probability min(1, p/q), and the first rejected one is resampled from the
+    residual max(0, p - q). This keeps the main model's output distribution.
+    Both models keep KV caches that are cropped back to the accepted tokens
+    after every round.
+    """
+
+    def __init__(self, model, draft_model, num_draft_tokens: int = 5):
+        """
+        Args:
+            model: Main causal LM
+            draft_model: Smaller causal LM using the same tokenizer
+            num_draft_tokens: Tokens proposed per round
+        """
+        if num_draft_tokens < 1:
+            raise ValueError(f"num_draft_tokens must be positive, got {num_draft_tokens}")
+        self.model = model
+        self.draft_model = draft_model
+        self.num_draft_tokens = num_draft_tokens
+        # Embedding tables are often padded past the tokenizer; only shared ids can be compared
+        self.vocab_size = min(model.config.vocab_size, draft_model.config.vocab_size)
+        self.trims_logits = {
+            id(m): "num_logits_to_keep" in inspect.signature(m.forward).parameters for m in (model, draft_model)
+        }
+
+    def _forward(self, model, input_ids: List[int], cache: DynamicCache, keep: int) -> torch.Tensor:
+        """Run input_ids through the model, extending cache; returns the last `keep` rows of logits."""
+        kwargs = {}
+        if self.trims_logits[id(model)]:
+            kwargs["num_logits_to_keep"] = keep  # Skips the LM head over the rest of a long prompt
+        ids = torch.tensor([input_ids], device=model.device)
+        logits = model(input_ids=ids, past_key_values=cache, use_cache=True, **kwargs).logits
+        return logits[0, -keep:].float()
+
+    def _probs(self, scores: torch.Tensor, params: SamplingParams) -> torch.Tensor:
+        return filter_scores(scores[:self.vocab_size], params).softmax(-1)
+
+    def generate(
+            self,
+            input_ids: torch.Tensor,
+            params: SamplingParams,
+            eos_token_id: Optional[Union[int, List[int]]] = None,
+            streamer: Optional[TextIteratorStreamer] = None,
+            cancel_event: Optional[Event] = None,
+            generator: Optional[torch.Generator] = None,
+            stopping_criteria: Optional[StoppingCriteriaList] = None
+    ) -> Tuple[torch.Tensor, SpeculativeStats]:
+        """
+        Generate up to params.max_new_tokens tokens after a (1, length) prompt.
+
+        Args:
+            input_ids: Prompt token ids
+            params: Sampling parameters (do_sample=False decodes greedily)
+            eos_token_id: Token id(s) that end generation
+            streamer: Receives the prompt and then each round's accepted tokens
+            cancel_event: Set it to stop after the current round
+            generator: Random generator for sampling
+            stopping_criteria: Checked on the whole sequence after every round
+
+        Returns:
+            The prompt followed by the generated tokens, and the round statistics
+        """
+        eos: Set[int] = set([eos_token_id] if isinstance(eos_token_id, int) else eos_token_id or [])
+        tokens = input_ids[0].tolist()
+        prompt_length = len(tokens)
+        stats = SpeculativeStats()
+        main_cache, draft_cache = DynamicCache(), DynamicCache()
+        if streamer is not None:
+            streamer.put(input_ids.cpu())
+
+        with torch.inference_mode():
+            # Both caches hold every token but the last, which each round feeds first
+            if prompt_length > 1:
+                self._forward(self.model, tokens[:-1], main_cache, 1)
+                self._forward(self.draft_model, tokens[:-1], draft_cache, 1)
+
+            finished = False
+            while not finished and len(tokens) - prompt_length < params.max_new_tokens:
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                remaining = params.max_new_tokens - (len(tokens) - prompt_length)
+                draft_count = min(self.num_draft_tokens, remaining - 1)
+
+                drafted, draft_probs = [], []
+                pending = tokens[draft_cache.get_seq_length():]
+                for _ in range(draft_count):
+                    scores = self._forward(self.draft_model, pending, draft_cache, 1)[0]
+                    if params.do_sample:
+                        probs = self._probs(scores, params)
+                        token = int(torch.multinomial(probs, 1, generator=generator))
+                        draft_probs.append(probs)
+                    else:
+                        token = int(scores[:self.vocab_size].argmax())
+                    drafted.append(token)
+                    pending = [token]
+                    if token in eos:
+                        break
+
+                scores = self._forward(self.model, tokens[main_cache.get_seq_length():] + drafted, main_cache,
+                                       len(drafted) + 1)
+                accepted = 0
+                next_token = None
+                for i, token in enumerate(drafted):
+                    if params.do_sample:
+                        p = self._probs(scores[i], params)
+                        q = draft_probs[i]
+                        if torch.rand((), generator=generator, device=p.device) < p[token] / q[token]:
+                            accepted += 1
+                            continue
+                        residual = (p - q).clamp(min=0)
+                        residual = residual if residual.sum() > 0 else p
+                        next_token = int(torch.multinomial(residual / residual.sum(), 1, generator=generator))
+                    else:
+                        target = int(scores[i, :self.vocab_size].argmax())
+                        if target == token:
+                            accepted += 1
+                            continue
+                        next_token = target
+                    break
+                if next_token is None:
+                    # Every draft token was accepted: the verify pass already scored one more position
+                    bonus = scores[len(drafted)]
+                    next_token = (int(torch.multinomial(self._probs(bonus, params), 1, generator=generator))
+                                  if params.do_sample else int(bonus[:self.vocab_size].argmax()))
+
+                new_tokens = drafted[:accepted] + [next_token]
+                for end, token in enumerate(new_tokens):
+                    if token in eos:
+                        new_tokens = new_tokens[:end + 1]
+                        finished = True
+                        break
+                tokens.extend(new_tokens)
+                main_cache.crop(len(tokens) - 1)
+                draft_cache.crop(min(draft_cache.get_seq_length(), len(tokens) - 1))
+
+                stats.rounds += 1
+                stats.drafted += len(drafted)
+                stats.accepted += accepted
+                stats.generated += len(new_tokens)
+                if streamer is not None:
+                    streamer.put(torch.tensor(new_tokens))
+                if stopping_criteria and bool(stopping_criteria(torch.tensor([tokens]), None).any()):
+                    break
+
+        if streamer is not None:
+            streamer.end()
+        logging.debug(f"Speculative decoding: {stats}")
+        return torch.tensor(tokens, dtype=input_ids.dtype, device=input_ids.device), stats
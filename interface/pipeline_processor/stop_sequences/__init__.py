@@ -0,0 +1,135 @@
+import re
+from typing import Iterable, Iterator, List, Optional, Sequence
+import torch
+from transformers import StoppingCriteria
+from metrics import REGISTRY
+
+ROLES = ("system", "user", "agent", "assistant")  # Roles _format_prompt writes as "role: content" lines
+
+# A delegation line is complete once its newline arrives
+DELEGATION = re.compile(r"^AGENT:[^:\n]+:[^\n]*\S[^\n]*\n", re.MULTILINE)
+
+
+class StopSequences:
+    """
+    Where a generated reply ends.
+
+    The prompt is a list of "role: content" lines, so a reply that starts a
+    new line with a role marker ("\\nuser:") is the model writing the next
+    turn itself; the reply is cut before the marker. A completed
+    AGENT:<name>:<command> line ends the reply right after the line, so the
+    delegation can start without waiting for the rest. Any of the stop
+    strings also ends it, before the string. A role marker before the first
+    non-blank character is the reply's own label and does not count.
+    """
+
+    def __init__(self, stop: Sequence[str] = (), roles: Iterable[str] = ROLES, stop_on_delegation: bool = True):
+        """
+        Args:
+            stop: Strings the reply is cut before
+            roles: Role names whose markers end the reply (their capitalised forms too)
+            stop_on_delegation: End the reply after a completed AGENT: line
+        """
+        self.stop = tuple(sorted({s for s in stop if s}))
+        self.roles = tuple(sorted({variant for role in roles for variant in (role, role.capitalize())}))
+        self.stop_on_delegation = stop_on_delegation
+        self.role_marker = None
+        if self.roles:
+            # Case-sensitive, so "AGENT:" stays a delegation rather than an agent turn
+            self.role_marker = re.compile(r"\n(?:%s):" % "|".join(map(re.escape, self.roles)))
+        # Trailing characters of streamed text that may still turn out to begin a stop
+        self.holdback = max([len(s) - 1 for s in self.stop] + [max(map(len, self.roles)) + 1 if self.roles else 0])
+
+    def __bool__(self) -> bool:
+        return bool(self.stop or self.roles or self.stop_on_delegation)
+
+    def __repr__(self) -> str:
+        return f"StopSequences(stop={self.stop!r}, roles={self.roles!r}, stop_on_delegation={self.stop_on_delegation})"
+
+    def find(self, text: str) -> Optional[int]:
+        """Index text should be cut at, or None if it has not hit a stop."""
+        cuts = []
+        if self.role_marker is not None:
+            match = self.role_marker.search(text, len(text) - len(text.lstrip()))
+            if match:
+                cuts.append(match.start())
+        for stop in self.stop:
+            index = text.find(stop)
+            if index >= 0:
+                cuts.append(index)
+        if self.stop_on_delegation:
+            match = DELEGATION.search(text)
+            if match:
+                cuts.append(match.end() - 1)
+        return min(cuts) if cuts else None
+
+    def truncate(self, text: str) -> str:
+        cut = self.find(text)
+        return text if cut is None else text[:cut]
+
+    def trim_stream(self, chunks: Iterable[str]) -> Iterator[str]:
+        """
+        Yield the chunks cut at the first stop.
+
+        Up to holdback trailing characters are held back until it is clear they
+        do not begin a stop. After a stop the rest of the chunks are drained
+        unseen, as generation ends within a step on its own.
+        """
+        text, emitted, cut = "", 0, None
+        for chunk in chunks:
+            if cut is not None:
+                continue
+            text += chunk
+            cut = self.find(text)
+            end = cut if cut is not None else len(text) - self.holdback
+            if end > emitted:
+                yield text[emitted:end]
+                emitted = end
+        if cut is None and len(text) > emitted:
+            yield text[emitted:]
+
+
+class IncrementalDecoder:
+    """
+    Text of a growing token sequence, decoding only the tokens added since the last feed.
+
+    Each feed decodes a short window starting a few tokens back, so tokenizers
+    that merge text across token boundaries (leading spaces, multi-byte
+    characters) produce the same text as decoding the whole sequence.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.ids: List[int] = []
+        self.text = ""
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    def feed(self, token_ids: List[int]) -> str:
+        self.ids.extend(token_ids)
+        if len(self.ids) > self.read_offset:
+            prefix = self.tokenizer.decode(self.ids[self.prefix_offset:self.read_offset], skip_special_tokens=True)
+            full = self.tokenizer.decode(self.ids[self.prefix_offset:], skip_special_tokens=True)
+            if len(full) > len(prefix) and not full.endswith("\ufffd"):  # Wait for the rest of a character
+                self.text += full[len(prefix):]
+                self.prefix_offset, self.read_offset = self.read_offset, len(self.ids)
+        return self.text
+
+
+class StopSequenceCriteria(StoppingCriteria):
+    """Stop generation once the text generated after the prompt hits a stop (batch size 1)."""
+
+    def __init__(self, stops: StopSequences, tokenizer, prompt_length: int):
+        self.stops = stops
+        self.decoder = IncrementalDecoder(tokenizer)
+        self.prompt_length = prompt_length
+        self.stopped = False
+
+    def __call__(self, input_ids: torch.Tensor, scores: Optional[torch.Tensor] = None, **kwargs) -> torch.Tensor:
+        if not self.stopped:
+            start = self.prompt_length + len(self.decoder.ids)
+            text = self.decoder.feed(input_ids[0, start:].tolist())
+            if self.stops.find(text) is not None:
+                self.stopped = True
+                REGISTRY.inc("stop_sequence_hits_total", 1, "Generations ended early by a stop sequence")
+        return torch.full((input_ids.shape[0],), self.stopped, dtype=torch.bool, device=input_ids.device)
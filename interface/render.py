@@ -1,19 +1,291 @@
+import argparse
+import hashlib
 import json
-from flask import Flask, request, render_template_string
-import markdown
 import re
-import ast
-import json5 as json
+import threading
+from collections import OrderedDict
+from json import dumps as json_dumps
+from typing import Callable, Iterator, List, Optional, Tuple
+from flask import Flask, Response, request, stream_with_context
+import markdown
+import json5
 
 app = Flask(__name__)
 
+STREAM_SOURCE_KEY = "STREAM_SOURCE"
+MARKDOWN_EXTENSIONS = ["fenced_code", "tables"]
+
+FENCE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+# A blank line only ends a block when the next line cannot continue it (lists, quotes, indented code)
+CONTINUATION = re.compile(r"^(\s|>|[-*+](\s|$)|\d+[.)](\s|$))")
+# Raw HTML and reference definitions can reach across blocks, so such text is rendered whole
+WHOLE_DOCUMENT = re.compile(r"^ {0,3}(<|\[[^\]]+\]:)", re.MULTILINE)
+
+
+def split_blocks(text: str, final: bool = True) -> List[str]:
+    """
+    Split markdown into top-level blocks that render independently.
+
+    Splits happen at blank lines outside fenced code, and only before a line that
+    starts a new block, so the rendered blocks joined with newlines match rendering
+    the whole text. The pieces concatenate back to the original text.
+
+    Args:
+        text (str): Markdown source
+        final (bool): Whether the text is complete; a streamed tail line may still
+            grow into a list item, so it cannot confirm a split
+
+    Returns:
+        List[str]: Consecutive pieces of the text
+    """
+    if WHOLE_DOCUMENT.search(text):
+        return [text] if text else []
+    lines = text.splitlines(keepends=True)
+    blocks = []
+    start = 0
+    offset = 0
+    fence: Optional[str] = None
+    blank = False
+    for line in lines:
+        complete = final or line.endswith("\n")
+        if fence is None and blank and line.strip() and complete and not CONTINUATION.match(line):
+            if offset > start:
+                blocks.append(text[start:offset])
+            start = offset
+        match = FENCE.match(line)
+        if match and fence is None:
+            fence = match.group(1)
+        elif match and set(line.strip()) == {fence[0]} and len(line.strip()) >= len(fence):
+            fence = None
+        blank = fence is None and not line.strip()
+        offset += len(line)
+    if offset > start:
+        blocks.append(text[start:])
+    return blocks
+
+
+class MarkdownRenderer:
+    """
+    Markdown to HTML with a content-addressed LRU cache.
+
+    Each thread reuses one preconfigured markdown.Markdown converter (they are
+    not thread-safe, and building one loads every extension). Rendered HTML is
+    cached by a hash of the source, so a chat UI re-rendering the same messages
+    as it scrolls only converts each message once.
+    """
+
+    def __init__(self, extensions: Optional[List[str]] = None, max_entries: int = 1024):
+        """
+        Args:
+            extensions (Optional[List[str]]): Markdown extensions (default: MARKDOWN_EXTENSIONS)
+            max_entries (int): Rendered sources kept
+        """
+        self.extensions = extensions or MARKDOWN_EXTENSIONS
+        self.max_entries = max_entries
+        self.cache: "OrderedDict[bytes, str]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+    def convert(self, text: str) -> str:
+        """Convert without the cache."""
+        converter = getattr(self.local, "converter", None)
+        if converter is None:
+            converter = self.local.converter = markdown.Markdown(extensions=self.extensions)
+        return converter.reset().convert(text)
+
+    def render(self, text: str) -> str:
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        with self.lock:
+            html = self.cache.get(key)
+            if html is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+        html = self.convert(text)
+        with self.lock:
+            self.cache[key] = html
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+        return html
+
+    def render_many(self, texts: List[str]) -> List[str]:
+        return [self.render(text) for text in texts]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.cache.clear()
+
+
+class StreamRenderer:
+    """
+    Render a message while it streams in, re-rendering only its unfinished tail.
+
+    Blocks that a later blank line has closed are rendered once (through the
+    renderer's cache) and kept; each feed re-renders just the open last block.
+    """
+
+    def __init__(self, renderer: MarkdownRenderer):
+        self.renderer = renderer
+        self.text = ""
+        self.offset = 0  # Start of the open tail in self.text
+        self.blocks: List[str] = []  # HTML of the closed blocks
+
+    def feed(self, chunk: str) -> Tuple[int, List[str]]:
+        """
+        Append a chunk of the message.
+
+        Args:
+            chunk (str): Newly generated text
+
+        Returns:
+            Tuple[int, List[str]]: Index of the first block that changed and the HTML of
+                that block and every block after it; earlier blocks are final
+        """
+        self.text += chunk
+        first = len(self.blocks)
+        pieces = split_blocks(self.text[self.offset:], final=False)
+        if len(pieces) > 1:
+            for piece in pieces[:-1]:
+                self.blocks.append(self.renderer.render(piece))
+                self.offset += len(piece)
+        tail = self.text[self.offset:]
+        return first, self.blocks[first:] + ([self.renderer.convert(tail)] if tail.strip() else [])
+
+    @property
+    def html(self) -> str:
+        tail = self.text[self.offset:]
+        return "\n".join(self.blocks + ([self.renderer.convert(tail)] if tail.strip() else []))
+
+
+renderer = MarkdownRenderer()
+
+
+def parse_message(text: str) -> dict:
+    """Parse a posted message, trying the C JSON parser before the much slower JSON5 one."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return json5.loads(text)
+
+
+def set_stream_source(source: Callable[[str], Iterator[str]]) -> None:
+    """
+    Attach the text generator served by /generate.
+
+    Args:
+        source: Callable taking the user's text and yielding response chunks,
+            e.g. a wrapper around PipelineProcessor.process_stream
+    """
+    app.config[STREAM_SOURCE_KEY] = source
+
+
+def model_host_source(socket_path: str, agent_name: Optional[str] = None) -> Callable[[str], Iterator[str]]:
+    """
+    A /generate source answering as the agent through a model host (main.py --model-host).
+
+    Every request is a stateless completion with the agent's prompt, so the
+    render workers share the host's single copy of the model and load no
+    weights themselves. The host is connected on the first request;
+    delegations in the reply are dispatched and their results streamed last.
+
+    Args:
+        socket_path: Unix socket of the model host
+        agent_name: Agent config to answer as (default: the general-purpose agent)
+    """
+    from agent import Agent
+    from interface import Interface
+    from model_host import ModelClient
+
+    supervisor = Agent(agent_config=agent_name)
+    agents = {supervisor.agent_name: supervisor}
+    clients: List[ModelClient] = []
+    lock = threading.Lock()
+
+    def client() -> ModelClient:
+        with lock:
+            if not clients:
+                clients.append(ModelClient(socket_path))
+            return clients[0]
+
+    def source(text: str) -> Iterator[str]:
+        host = client()
+        chunks = []
+        for chunk in host.complete_stream(Interface.prepare_model_messages(text, agents)):
+            chunks.append(chunk)
+            yield chunk
+        agent_result = Interface.dispatch_delegations(host, supervisor, "".join(chunks))
+        if agent_result:
+            yield "\n" + agent_result
+
+    return source
+
+
+@app.route("/generate", methods=["POST"])
+def generate_stream():
+    """
+    Stream a generated response as Server-Sent Events, or as chunked plain text with ?format=text.
+
+    With ?format=html each event also carries rendered markdown: "html" replaces the
+    blocks of the message from index "from" onwards, earlier blocks are final.
+    """
+    source = app.config.get(STREAM_SOURCE_KEY)
+    if source is None:
+        return {"error": "No generation backend attached"}, 503
+    data = request.json or {}
+    text = data.get("text", "")
+    if not text:
+        return {"error": "'text' field is required in the request JSON"}, 400
+
+    chunks = source(text)
+    if request.args.get("format") == "text":
+        return Response(stream_with_context(chunks), mimetype="text/plain")
+
+    stream = StreamRenderer(renderer) if request.args.get("format") == "html" else None
+
+    def events():
+        for chunk in chunks:
+            event = {'content': chunk}
+            if stream is not None:
+                event["from"], event["html"] = stream.feed(chunk)
+            yield f"data: {json_dumps(event)}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.route("/batch", methods=["POST"])
+def render_batch():
+    """
+    Render many messages in one request.
+
+    Expects {"messages": [...]} where each message is a markdown string or an object
+    with a "content" field, and answers {"html": [...]} in the same order.
+    """
+    data = request.get_json(silent=True) or {}
+    messages = data.get("messages")
+    if not isinstance(messages, list):
+        return {"error": "'messages' list is required in the request JSON"}, 400
+    try:
+        texts = [message if isinstance(message, str) else message["content"] for message in messages]
+    except (KeyError, TypeError):
+        return {"error": "Each message must be a string or an object with a 'content' field"}, 400
+    return {"html": renderer.render_many(texts)}
+
+
 @app.route("/", methods=["POST", "GET"])
 def render_markdown():
     if request.method == "POST":
         try:
             # Get the JSON input with markdown content
             data = request.json
-            astr = json.loads(data["text"])
+            astr = parse_message(data["text"])
             
             # Extract only the .content field from the input
             assistant_content = astr.get("content", "")
@@ -21,11 +293,8 @@ def render_markdown():
             if not assistant_content:
                 return {"error": "'content' field is required in the request JSON"}, 400
 
-            # Convert the .content field into Markdown
-            html_content = markdown.markdown(assistant_content, extensions=["fenced_code", "tables"])
-            
             # Return the rendered markdown as plain HTML
-            return html_content
+            return renderer.render(assistant_content)
         except Exception as e:
             return {"error": str(e)}, 400
     
@@ -73,4 +342,14 @@ def render_markdown():
     '''
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    # Development server only; deploy interface.wsgi:application behind a WSGI server
+    parser = argparse.ArgumentParser(description="Markdown render service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--debug", action="store_true", help="Enable the Flask debugger and reloader")
+    parser.add_argument("--connect", metavar="SOCKET", default=None, help="Serve /generate from this model host")
+    parser.add_argument("--agent", default=None, help="Agent config /generate answers as")
+    args = parser.parse_args()
+    if args.connect:
+        set_stream_source(model_host_source(args.connect, args.agent))
+    app.run(host=args.host, port=args.port, debug=args.debug, threaded=True)
@@ -0,0 +1,321 @@
+import asyncio
+import json
+import logging
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional
+from aiohttp import web
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+from agent import Agent
+from interface import Interface
+from metrics import REGISTRY, MetricsRegistry
+
+if TYPE_CHECKING:
+    from interface.pipeline_processor import PipelineProcessor
+
+
+class QueueFull(Exception):
+    pass
+
+
+class InferenceServer:
+    """
+    Asyncio HTTP front end exposing the supervisor agent through an OpenAI-style
+    POST /v1/chat/completions endpoint.
+
+    Every request carries its own message history, so any number of client
+    sessions can be served concurrently. At most max_concurrency requests
+    generate at once and up to max_queue more wait for a slot; beyond that the
+    server answers 429. Each request has a deadline (queueing included), and
+    generation is cancelled when the deadline passes or the client disconnects.
+    """
+
+    def __init__(
+            self,
+            processor: "PipelineProcessor",
+            supervisor: Agent,
+            model_name: str = "phi4",
+            max_concurrency: int = 4,
+            max_queue: int = 32,
+            request_timeout: float = 300.0
+    ):
+        """
+        Args:
+            processor: Pipeline processor used for generation
+            supervisor: Agent whose prompt is prepended and whose tools answer tool requests
+            model_name: Name reported in responses
+            max_concurrency: Requests generating at the same time
+            max_queue: Requests allowed to wait for a free slot
+            request_timeout: Seconds a request may take, including time spent queued
+        """
+        self.processor = processor
+        self.supervisor = supervisor
+        self.model_name = model_name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.request_timeout = request_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="inference")
+        self.pending = 0  # Requests queued or generating
+        self.generating = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+        REGISTRY.add_collector(self.collect_metrics)
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_get("/health", self.health)
+        app.router.add_get("/metrics", self.metrics)
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+    async def _on_startup(self, app: web.Application) -> None:
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+
+    async def _on_cleanup(self, app: web.Application) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "status": "ok",
+            "pending": self.pending,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue
+        })
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        """Metrics as Prometheus text, or as a JSON snapshot with ?format=json."""
+        if request.query.get("format") == "json":
+            return web.json_response(REGISTRY.snapshot())
+        return web.Response(text=REGISTRY.prometheus(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Prometheus-Format": "0.0.4"})
+
+    def collect_metrics(self, registry: MetricsRegistry) -> None:
+        registry.set("server_queued_requests", self.pending - self.generating, "Requests waiting for a generation slot")
+        registry.set("server_active_requests", self.generating, "Requests generating")
+
+    @asynccontextmanager
+    async def _admission(self, deadline: float):
+        """
+        Reserve a queue place and hold a generation slot for the block.
+
+        Raises QueueFull when the queue is full and asyncio.TimeoutError when no
+        slot frees up before the deadline.
+        """
+        if self.pending >= self.max_concurrency + self.max_queue:
+            raise QueueFull()
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            queued_at = loop.time()
+            await asyncio.wait_for(self._slots.acquire(), max(deadline - loop.time(), 0))
+            REGISTRY.observe("server_queue_wait_seconds", loop.time() - queued_at, "Time requests wait for a generation slot")
+            self.generating += 1
+            try:
+                yield
+            finally:
+                self.generating -= 1
+                self._slots.release()
+        finally:
+            self.pending -= 1
+
+    def _prepare_messages(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        if not any(message["role"] == "system" for message in messages):
+            messages = [{"role": "system", "content": self.supervisor.agent_prompt["prompt"]}] + messages
+        return messages
+
+    def _tool_response(self, messages: List[Dict[str, str]]) -> Optional[str]:
+        """Answer with the supervisor's tools when the last user message asks for a tool operation."""
+        user_messages = [message["content"] for message in messages if message["role"] == "user"]
+        if not user_messages:
+            return None
+        operation, _ = self.supervisor.analyze_prompt(user_messages[-1])
+        return self.supervisor.handle_prompt(user_messages[-1]) if operation else None
+
+    def _respond(self, messages: List[Dict[str, str]], cancel_event: threading.Event) -> str:
+        tool_response = self._tool_response(messages)
+        if tool_response is not None:
+            return tool_response
+        response = self.processor.complete(self._prepare_messages(messages), cancel_event)
+        agent_result = Interface.dispatch_delegations(self.processor, self.supervisor, response)
+        return f"{response}\n{agent_result}" if agent_result else response
+
+    def _respond_stream(self, messages: List[Dict[str, str]], cancel_event: threading.Event) -> Iterator[str]:
+        tool_response = self._tool_response(messages)
+        if tool_response is not None:
+            yield tool_response
+            return
+        chunks = []
+        for chunk in self.processor.complete_stream(self._prepare_messages(messages), cancel_event):
+            chunks.append(chunk)
+            yield chunk
+        if cancel_event.is_set():
+            return
+        agent_result = Interface.dispatch_delegations(self.processor, self.supervisor, "".join(chunks))
+        if agent_result:
+            yield "\n" + agent_result
+
+    @staticmethod
+    def _error(status: int, message: str, error_type: str, headers: Optional[Dict[str, str]] = None) -> web.Response:
+        return web.json_response({"error": {"message": message, "type": error_type}}, status=status, headers=headers)
+
+    def _completion_body(self, completion_id: str, created: int, text: str) -> Dict:
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": self.model_name,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop"
+            }]
+        }
+
+    def _chunk_body(self, completion_id: str, created: int, delta: Dict[str, str], finish_reason: Optional[str]) -> str:
+        body = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": self.model_name,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+        return f"data: {json.dumps(body)}\n\n"
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        try:
+            payload = await request.json()
+            messages = [{"role": str(m["role"]), "content": str(m["content"])} for m in payload["messages"]]
+        except (ValueError, KeyError, TypeError) as e:
+            return self._error(400, f"Invalid request body: {str(e)}", "invalid_request_error")
+        if not messages:
+            return self._error(400, "'messages' must not be empty", "invalid_request_error")
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        deadline = asyncio.get_running_loop().time() + self.request_timeout
+        cancel_event = threading.Event()
+        start = time.perf_counter()
+        stream = bool(payload.get("stream"))
+        status = "error"
+        try:
+            async with self._admission(deadline):
+                if stream:
+                    response = await self._stream(request, messages, completion_id, created, deadline, cancel_event)
+                else:
+                    response = await self._complete(messages, completion_id, created, deadline, cancel_event)
+                status = str(response.status)
+                return response
+        except QueueFull:
+            status = "429"
+            return self._error(429, "Server is at capacity, retry later", "rate_limit_error", {"Retry-After": "1"})
+        except asyncio.TimeoutError:
+            status = "504"
+            cancel_event.set()
+            return self._error(504, "Request timed out", "timeout_error")
+        except asyncio.CancelledError:
+            status = "cancelled"
+            cancel_event.set()
+            logging.info(f"Client disconnected, cancelled {completion_id}")
+            raise
+        finally:
+            REGISTRY.observe("server_request_seconds", time.perf_counter() - start, "Chat completion request latency",
+                             stream=str(stream).lower())
+            REGISTRY.inc("server_requests_total", 1, "Chat completion requests by outcome", status=status)
+
+    async def _complete(
+            self,
+            messages: List[Dict[str, str]],
+            completion_id: str,
+            created: int,
+            deadline: float,
+            cancel_event: threading.Event
+    ) -> web.Response:
+        loop = asyncio.get_running_loop()
+        work = loop.run_in_executor(self.executor, self._respond, messages, cancel_event)
+        try:
+            text = await asyncio.wait_for(work, max(deadline - loop.time(), 0))
+        finally:
+            if not work.done():
+                cancel_event.set()
+        return web.json_response(self._completion_body(completion_id, created, text))
+
+    async def _stream(
+            self,
+            request: web.Request,
+            messages: List[Dict[str, str]],
+            completion_id: str,
+            created: int,
+            deadline: float,
+            cancel_event: threading.Event
+    ) -> web.StreamResponse:
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def produce() -> None:
+            try:
+                for chunk in self._respond_stream(messages, cancel_event):
+                    if cancel_event.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, ("chunk", chunk))
+                loop.call_soon_threadsafe(queue.put_nowait, ("done", None))
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, ("error", str(e)))
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        loop.run_in_executor(self.executor, produce)
+        finish_reason = "stop"
+        try:
+            await response.write(self._chunk_body(completion_id, created, {"role": "assistant"}, None).encode())
+            while True:
+                try:
+                    kind, data = await asyncio.wait_for(queue.get(), max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    finish_reason = "length"
+                    break
+                if kind == "chunk":
+                    await response.write(self._chunk_body(completion_id, created, {"content": data}, None).encode())
+                elif kind == "error":
+                    error = {"error": {"message": data, "type": "server_error"}}
+                    await response.write(f"data: {json.dumps(error)}\n\n".encode())
+                    finish_reason = "error"
+                    break
+                else:
+                    break
+            await response.write(self._chunk_body(completion_id, created, {}, finish_reason).encode())
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+        except (ConnectionResetError, asyncio.CancelledError):
+            logging.info(f"Client disconnected, cancelled {completion_id}")
+            raise
+        finally:
+            cancel_event.set()
+        return response
+
+
+def run_server(
+        processor: "PipelineProcessor",
+        supervisor: Agent,
+        host: str = "0.0.0.0",
+        port: int = 8000,
+        **server_kwargs
+) -> None:
+    """
+    Serve the supervisor over HTTP until interrupted.
+
+    Args:
+        processor: Pipeline processor used for generation
+        supervisor: Supervisor agent
+        host: Interface to bind
+        port: Port to bind
+        **server_kwargs: Passed to InferenceServer
+    """
+    server = InferenceServer(processor, supervisor, **server_kwargs)
+    logging.info(f"Serving chat completions on {host}:{port}")
+    web.run_app(server.create_app(), host=host, port=port, handler_cancellation=True, print=None)
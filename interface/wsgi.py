@@ -0,0 +1,24 @@
+"""
+Production entry points for the markdown render service.
+
+    gunicorn --workers 4 --threads 8 interface.wsgi:application
+    uvicorn interface.wsgi:asgi_application  # needs asgiref
+
+/generate streams from the model host at $MODEL_HOST_SOCKET (python main.py
+--model-host SOCKET), answering as the agent named by $RENDER_AGENT.
+"""
+import os
+import sys
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+from interface.render import app as application, model_host_source, set_stream_source
+
+if os.environ.get("MODEL_HOST_SOCKET"):
+    set_stream_source(model_host_source(os.environ["MODEL_HOST_SOCKET"], os.environ.get("RENDER_AGENT")))
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    asgi_application = None
+else:
+    asgi_application = WsgiToAsgi(application)
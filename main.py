@@ -1,26 +1,151 @@
 import argparse
+import atexit
+import json
 import os
 import sys
 import logging
-from pipeline import Pipeline  # Assuming this handles model loading
-from interface import PipelineProcessor  # Assuming this processes model outputs
+import threading
+from concurrent.futures import Future
+from typing import Dict, List
 from agent import Agent
 from interface import Interface  # Assuming this handles user I/O
 from dotenv import load_dotenv
-import debugpy
-
-# Configure logging
-logging.basicConfig(
-    filename="main.log",
-    format='%(asctime)s %(message)s',
-    filemode='w',
-    level=logging.INFO
-)
 
 load_dotenv()
 
-# Set up debugger
-debugpy.listen(("0.0.0.0", 5678))
+
+class ModelLoadError(Exception):
+    pass
+
+
+def build_processor(model_path: str, args: argparse.Namespace, agents_dict: Dict[str, Agent], interface: Interface):
+    """
+    Load the model and wrap it in a PipelineProcessor with the supervisor's prompt prefilled.
+
+    torch and transformers are first imported here, so nothing pays for them
+    until a model is actually needed.
+    """
+    from pipeline import Pipeline
+    from interface import ConversationMemory, MemoryPolicy, PipelineProcessor, PrefixCache, ResponseCache, SessionStore
+
+    if args.workers:
+        # Forked workers share the memory-mapped checkpoint instead of private copies
+        from model_host import load_shared_pipeline
+        base_pipeline = load_shared_pipeline(model_path, num_threads=args.threads)
+    else:
+        base_pipeline = Pipeline.initialize_pipeline(
+            model_path=model_path,
+            device=args.device,
+            precision=args.precision,
+            num_threads=args.threads,
+            compile_model=args.compile,
+            load_workers=args.load_workers,
+            checkpoint_cache=args.checkpoint_cache
+        )
+    logging.info(f"Model loaded: {base_pipeline.load_report}")
+    draft_model = Pipeline.load_draft_model(args.draft_model, base_pipeline) if args.draft_model else None
+    sessions = None
+    if args.session_dir:
+        from interface.pipeline_processor.session_store import ConversationLog
+        log = ConversationLog(args.session_dir)
+        log.compact()
+        atexit.register(log.close)  # Checkpoint the index so the next start replays nothing
+        sessions = SessionStore(
+            log,
+            memory_factory=lambda: ConversationMemory(base_pipeline.tokenizer, overflow=args.history_overflow)
+        )
+    processor = PipelineProcessor(
+        pipeline=base_pipeline,
+        temperature=0.7,
+        top_p=0.9,
+        top_k=50,
+        prefix_cache=None if draft_model else PrefixCache(),  # Drafting keeps its own KV caches
+        response_cache=ResponseCache(disk_path=args.response_cache, cache_sampled=args.cache_sampled),
+        memory=ConversationMemory(base_pipeline.tokenizer, overflow=args.history_overflow),
+        context_window=args.context_window,
+        draft_model=draft_model,
+        num_draft_tokens=args.draft_tokens,
+        memory_policy=MemoryPolicy(
+            threshold=args.memory_threshold,
+            limit_bytes=int(args.memory_limit * 2 ** 30) if args.memory_limit else None,
+            device=base_pipeline.model.device
+        ),
+        sessions=sessions
+    )
+
+    # Prefill the supervisor's constant prompt once; every turn resumes from it. Not
+    # before forking workers: running the model would start thread pools first.
+    if agents_dict and not args.workers:
+        cached_tokens = processor.warm_prefix(interface.prepare_model_messages("", agents_dict)[:1])
+        logging.info(f"Cached {cached_tokens} prompt prefix tokens for {args.agents[0]}")
+    return processor
+
+
+def load_in_background(*build_args) -> Future:
+    """
+    Run build_processor on a daemon thread so the prompt is usable while the model loads.
+
+    Returns:
+        Future: Resolves to the processor, or raises ModelLoadError
+    """
+    future: Future = Future()
+
+    def load() -> None:
+        try:
+            future.set_result(build_processor(*build_args))
+        except Exception as e:
+            logging.error(f"Model loading failed: {str(e)}")
+            future.set_exception(ModelLoadError(str(e)))
+
+    threading.Thread(target=load, name="model-loader", daemon=True).start()
+    return future
+
+
+def run_batch(processor, args: argparse.Namespace, agents_dict: Dict[str, Agent], interface: Interface) -> Dict:
+    """
+    Answer every prompt of args.batch with the supervisor's prompt and write the replies to args.out.
+
+    A local model generates through a continuous batch scheduler, so the
+    prompts the runner keeps in flight share decode steps.
+
+    Returns:
+        Dict: The run's throughput and latency summary
+    """
+    from batch import BatchRunner
+
+    scheduler = None
+    if getattr(processor, "pipeline", None) is not None and processor.scheduler is None:
+        from interface.pipeline_processor.scheduler import ContinuousBatchScheduler
+        scheduler = ContinuousBatchScheduler(
+            processor.pipeline.model,
+            processor.pipeline.tokenizer,
+            max_batch_size=args.batch_size,
+            memory_policy=processor.memory_policy
+        )
+        scheduler.start()
+        processor.scheduler = scheduler
+    memory = getattr(processor, "memory", None)
+    supervisor = next(iter(agents_dict.values()))
+
+    def generate(messages: List[Dict[str, str]]) -> str:
+        response = processor.complete(messages)
+        agent_result = interface.dispatch_delegations(processor, supervisor, response)
+        return f"{response}\n{agent_result}" if agent_result else response
+
+    runner = BatchRunner(
+        generate,
+        lambda prompt: interface.prepare_model_messages(prompt, agents_dict),
+        concurrency=args.batch_size,
+        count_tokens=(lambda text: len(memory.tokenize(text))) if memory is not None else None
+    )
+    try:
+        stats = runner.run(args.batch, args.out)
+    finally:
+        if scheduler is not None:
+            scheduler.stop()
+            processor.scheduler = None
+    return stats.summary()
+
 
 def parse_arguments() -> argparse.Namespace:
     """Parse command line arguments with support for positional agent names."""
@@ -33,12 +158,173 @@ def parse_arguments() -> argparse.Namespace:
         default="phi4",
         help="Source model path (default: phi4)"
     )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Serve the supervisor over an OpenAI-style HTTP API instead of the interactive prompt"
+    )
+    parser.add_argument("--host", type=str, default="0.0.0.0", help="Bind address for --serve")
+    parser.add_argument("--port", type=int, default=8000, help="Port for --serve (default: 8000)")
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=4,
+        help="Requests generating at once in --serve mode (default: 4)"
+    )
+    parser.add_argument(
+        "--max-queue",
+        type=int,
+        default=32,
+        help="Requests waiting for a slot before --serve answers 429 (default: 32)"
+    )
+    parser.add_argument(
+        "--request-timeout",
+        type=float,
+        default=300.0,
+        help="Per-request timeout in seconds for --serve, queueing included (default: 300)"
+    )
+    parser.add_argument(
+        "--response-cache",
+        type=str,
+        default=None,
+        help="SQLite file backing a persistent response cache (default: in-memory only)"
+    )
+    parser.add_argument(
+        "--cache-sampled",
+        action="store_true",
+        help="Also cache sampled (non-greedy) responses"
+    )
+    parser.add_argument(
+        "--context-window",
+        type=int,
+        default=None,
+        help="Token budget for prompt plus reply (default: the model's maximum positions)"
+    )
+    parser.add_argument(
+        "--memory-threshold",
+        type=float,
+        default=0.9,
+        help="Fraction of device memory above which the allocator cache is cleared (default: 0.9)"
+    )
+    parser.add_argument(
+        "--memory-limit",
+        type=float,
+        metavar="GIB",
+        default=None,
+        help="Treat the device as having this much memory (default: its actual memory)"
+    )
+    parser.add_argument(
+        "--history-overflow",
+        choices=["drop_oldest", "summarise_oldest"],
+        default="drop_oldest",
+        help="What happens to conversation history that no longer fits (default: drop_oldest)"
+    )
+    parser.add_argument(
+        "--retrieval-tokens",
+        type=int,
+        default=0,
+        help="Add excerpts of the supervisor's files related to each prompt, up to this many tokens (default: 0, off)"
+    )
+    parser.add_argument(
+        "--session-dir",
+        metavar="DIR",
+        default=None,
+        help="Keep conversations in an append-only log in this folder, resumable across runs"
+    )
+    parser.add_argument(
+        "--session",
+        default="default",
+        help="Conversation to continue when --session-dir is set (default: default)"
+    )
+    parser.add_argument(
+        "--device",
+        choices=["auto", "cuda", "cpu"],
+        default="auto",
+        help="Where to run the model (default: a GPU when available, else the CPU)"
+    )
+    parser.add_argument(
+        "--precision",
+        choices=["fp32", "fp16", "bf16", "int8"],
+        default=None,
+        help="Weight precision; int8 is bitsandbytes on GPU and dynamic quantization on CPU (default: int8)"
+    )
+    parser.add_argument("--threads", type=int, default=None, help="CPU threads for inference")
+    parser.add_argument("--compile", action="store_true", help="Compile the model with torch.compile")
+    parser.add_argument(
+        "--load-workers",
+        type=int,
+        default=None,
+        help="Checkpoint shards loaded concurrently (default: up to 4; 0 loads through from_pretrained)"
+    )
+    parser.add_argument(
+        "--checkpoint-cache",
+        action="store_true",
+        help="On the CPU, keep converted/quantized weights in a cache so later starts skip conversion"
+    )
+    parser.add_argument(
+        "--draft-model",
+        metavar="PATH",
+        default=None,
+        help="Small model sharing the tokenizer (e.g. under models/) for speculative decoding"
+    )
+    parser.add_argument(
+        "--draft-tokens",
+        type=int,
+        default=5,
+        help="Tokens the draft model proposes per verification pass (default: 5)"
+    )
+    parser.add_argument(
+        "--model-host",
+        metavar="SOCKET",
+        default=None,
+        help="Load the model once and serve it to agent clients on this Unix socket"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Forked --model-host workers sharing the memory-mapped weights (CPU only; default: 0)"
+    )
+    parser.add_argument(
+        "--connect",
+        metavar="SOCKET",
+        default=None,
+        help="Generate on the --model-host listening on this socket instead of loading the model"
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="INPUT",
+        default=None,
+        help='Answer the prompts of a JSONL file ({"id": ..., "prompt": ...} per line) and exit'
+    )
+    parser.add_argument(
+        "--out",
+        metavar="OUTPUT",
+        default=None,
+        help="JSONL file --batch appends results to; rerunning resumes where it stopped"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=8,
+        help="Prompts --batch generates at once (default: 8)"
+    )
+    parser.add_argument(
+        "--debugpy",
+        action="store_true",
+        help="Listen for a debugger on 0.0.0.0:5678"
+    )
     parser.add_argument(
         "agents",
-        nargs="+",  # Require at least one agent
+        nargs="*",  # At least one agent unless running as --model-host
         help="Names of agents to initialize (first agent is supervisor)"
     )
     args = parser.parse_args()
+    if args.batch and not args.out:
+        parser.error("--batch needs --out")
+    if args.session_dir and (args.connect or args.model_host):
+        # The log has a single writer; a host's clients keep per-connection histories
+        parser.error("--session-dir cannot be combined with --connect or --model-host")
     return args
 
 def main():
@@ -46,27 +332,43 @@ def main():
     Main function to initialize agents and process user input.
     The first agent is the supervisor, others are available for collaboration.
     """
+    # Configure logging here rather than at import, so importing main (the tests do) leaves main.log alone
+    logging.basicConfig(
+        filename="main.log",
+        format='%(asctime)s %(message)s',
+        filemode='w',
+        level=logging.INFO
+    )
     os.environ['PYTORCH_HIP_ALLOC_CONF'] = 'max_split_size_mb:512'  # Prevent fragmentation
 
     # Parse arguments
     args = parse_arguments()
+
+    if args.debugpy:
+        import debugpy
+        debugpy.listen(("0.0.0.0", 5678))
     model_path = f"./models/{args.model}"
 
-    if not os.path.exists(model_path):
+    if not args.connect and not os.path.exists(model_path):
         logging.error(f"Source model directory {model_path} does not exist.")
         print(f"Error: Source model directory {model_path} does not exist.")
         sys.exit(1)
 
+    interface = Interface()
+
+    if args.model_host:
+        from model_host import ModelHost
+        processor = build_processor(model_path, args, {}, interface)
+        print(f"Model host listening on {args.model_host}")
+        ModelHost(processor, args.model_host, workers=args.workers).serve_forever()
+        return
+
     agents_list = args.agents
     if not agents_list:
         logging.error("No agents specified.")
         print("Error: No agents specified.")
         sys.exit(1)
 
-    # Initialize components
-    pipeline = Pipeline()
-    interface = Interface()
-
     # Initialize all agents
     agents_dict = {}
     for agent_name in agents_list:
@@ -84,20 +386,37 @@ def main():
                 agent.register_agent(other_name, other_agent)
 
     try:
-        # Initialize the transformer pipeline
-        base_pipeline = Pipeline.initialize_pipeline(model_path=model_path)
-
-        # Create pipeline processor
-        processor = PipelineProcessor(
-            pipeline=base_pipeline,
-            temperature=0.7,
-            top_p=0.9,
-            top_k=50
-        )
-
         supervisor_name = agents_list[0]
         supervisor = agents_dict[supervisor_name]
 
+        if args.connect:
+            from model_host import ModelClient
+            model_future = Future()
+            model_future.set_result(ModelClient(args.connect))
+        else:
+            # The model loads in the background; tool prompts are answered meanwhile
+            model_future = load_in_background(model_path, args, agents_dict, interface)
+
+        if args.batch:
+            summary = run_batch(model_future.result(), args, agents_dict, interface)
+            logging.info(f"Batch finished: {summary}")
+            print(json.dumps(summary, indent=2))
+            return
+
+        if args.serve:
+            from interface.server import run_server
+            run_server(
+                model_future.result(),
+                supervisor,
+                host=args.host,
+                port=args.port,
+                model_name=args.model,
+                max_concurrency=args.max_concurrency,
+                max_queue=args.max_queue,
+                request_timeout=args.request_timeout
+            )
+            return
+
         logging.info(f"Agents {' '.join(agents_list)} initialized. Supervisor: {supervisor_name}")
         print(f"Agents {' '.join(agents_list)} initialized. Supervisor: {supervisor_name}")
         print("Awaiting input...")
@@ -109,13 +428,26 @@ def main():
                 if user_input.lower() in ["exit", "quit"]:
                     break
 
-                # Supervisor processes the prompt
-                response = supervisor.handle_prompt(user_input)
-
-                # Output response to user
-                interface.display_response(response)  # Assuming Interface has this method
+                operation, _ = supervisor.analyze_prompt(user_input)
+                if operation:
+                    # Supervisor runs the tool operation itself
+                    response = interface.display_response(supervisor.handle_prompt(user_input))
+                else:
+                    if not model_future.done():
+                        print("Waiting for the model to finish loading...", flush=True)
+                    processor = model_future.result()
+                    # Stream the model's reply to the user as it is generated
+                    memory = getattr(processor, "memory", None)  # Counts with the model's tokenizer when local
+                    model_input = interface.prepare_model_messages(
+                        user_input, agents_dict, context_tokens=args.retrieval_tokens,
+                        count_tokens=(lambda text: len(memory.tokenize(text))) if memory is not None else None
+                    )
+                    session = {"session_id": args.session} if args.session_dir else {}
+                    response = interface.display_response(processor.process_stream(model_input, supervisor, **session))
                 logging.info(f"User: {user_input}\nResponse: {response}")
 
+            except ModelLoadError:
+                raise
             except Exception as e:
                 error_msg = f"Error processing input: {str(e)}"
                 logging.error(error_msg)
@@ -0,0 +1,275 @@
+"""
+In-process metrics: counters, gauges and fixed-bucket histograms.
+
+Recording is a lock, a bisect and a few additions, so instrumentation can stay
+on in production. Snapshots are rendered as Prometheus text or as JSON with
+quantiles estimated from the buckets. Only the standard library is used, so
+importing this module does not slow down start-up.
+"""
+import bisect
+import os
+import resource
+import sys
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+QUANTILES = (0.5, 0.9, 0.99)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last one counts values above every bound
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """(upper bound, observations at or below it) pairs, ending with +Inf."""
+        with self.lock:
+            counts = list(self.counts)
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile by linear interpolation inside its bucket."""
+        cumulative = self.cumulative()
+        total = cumulative[-1][1]
+        if total == 0:
+            return None
+        rank = q * total
+        lower, below = 0.0, 0
+        for bound, count in cumulative:
+            if count >= rank:
+                if bound == float("inf"):
+                    return lower  # Beyond the last bound only the bound itself is known
+                inside = count - below
+                return lower + (bound - lower) * ((rank - below) / inside if inside else 1.0)
+            lower, below = bound, count
+        return lower
+
+
+class MetricsRegistry:
+    """
+    Named metrics, each split into series by label values.
+
+    Collectors registered with add_collector run before every snapshot, so
+    values that are cheap to read but pointless to track continuously (peak
+    memory, queue depths) are sampled only when metrics are scraped.
+    """
+
+    def __init__(self, namespace: str = "prizm"):
+        """
+        Args:
+            namespace: Prefix of every exported metric name
+        """
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        self.help: Dict[str, str] = {}
+        self.types: Dict[str, str] = {}
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.gauges: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.collectors: List[Callable[[], Optional[Callable[["MetricsRegistry"], None]]]] = []
+
+    def _declare(self, name: str, kind: str, help_text: str) -> None:
+        known = self.types.get(name)
+        if known is None:
+            self.types[name] = kind
+            self.help[name] = help_text
+        elif known != kind:
+            raise ValueError(f"Metric {name} is a {known}, not a {kind}")
+
+    def inc(self, name: str, amount: float = 1, help_text: str = "", **labels) -> None:
+        key = _labels(labels)
+        with self.lock:
+            self._declare(name, "counter", help_text)
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def set(self, name: str, value: float, help_text: str = "", **labels) -> None:
+        key = _labels(labels)
+        with self.lock:
+            self._declare(name, "gauge", help_text)
+            self.gauges.setdefault(name, {})[key] = value
+
+    def set_max(self, name: str, value: float, help_text: str = "", **labels) -> None:
+        """Raise a gauge to value if it is higher (peak tracking)."""
+        key = _labels(labels)
+        with self.lock:
+            self._declare(name, "gauge", help_text)
+            series = self.gauges.setdefault(name, {})
+            series[key] = max(series.get(key, value), value)
+
+    def observe(self, name: str, value: float, help_text: str = "", buckets: Sequence[float] = LATENCY_BUCKETS,
+                **labels) -> None:
+        key = _labels(labels)
+        histogram = self.histograms.get(name, {}).get(key)
+        if histogram is None:
+            with self.lock:
+                self._declare(name, "histogram", help_text)
+                histogram = self.histograms.setdefault(name, {}).setdefault(key, Histogram(buckets))
+        histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, help_text: str = "", **labels) -> Iterator[None]:
+        """Observe the seconds spent in the block (also when it raises)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, help_text, **labels)
+
+    def add_collector(self, collector: Callable[["MetricsRegistry"], None]) -> None:
+        """
+        Run collector(registry) before each snapshot. Bound methods are held weakly,
+        so registering one does not keep its object alive.
+        """
+        if hasattr(collector, "__self__"):
+            method = weakref.WeakMethod(collector)
+            self.collectors.append(method)
+        else:
+            self.collectors.append(lambda: collector)
+
+    def collect(self) -> None:
+        alive = []
+        for reference in list(self.collectors):
+            collector = reference()
+            if collector is None:
+                continue
+            alive.append(reference)
+            try:
+                collector(self)
+            except Exception:
+                pass  # A failing collector must not break scraping
+        self.collectors = alive
+
+    def reset(self) -> None:
+        with self.lock:
+            self.help.clear()
+            self.types.clear()
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def snapshot(self) -> Dict[str, Dict[str, List[Dict[str, object]]]]:
+        """
+        JSON-serialisable view of every metric.
+
+        Returns:
+            {"counters": {name: [{"labels", "value"}]}, "gauges": {...},
+             "histograms": {name: [{"labels", "count", "sum", "buckets", "p50", "p90", "p99"}]}}
+        """
+        self.collect()
+        with self.lock:
+            counters = {name: dict(series) for name, series in self.counters.items()}
+            gauges = {name: dict(series) for name, series in self.gauges.items()}
+            histograms = {name: dict(series) for name, series in self.histograms.items()}
+        result = {
+            "counters": {name: [{"labels": dict(labels), "value": value} for labels, value in series.items()]
+                         for name, series in counters.items()},
+            "gauges": {name: [{"labels": dict(labels), "value": value} for labels, value in series.items()]
+                       for name, series in gauges.items()},
+            "histograms": {},
+        }
+        for name, series in histograms.items():
+            entries = []
+            for labels, histogram in series.items():
+                entry = {
+                    "labels": dict(labels),
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "buckets": {_format_number(bound): count for bound, count in histogram.cumulative()},
+                }
+                for q in QUANTILES:
+                    entry[f"p{int(q * 100)}"] = histogram.quantile(q)
+                entries.append(entry)
+            result["histograms"][name] = entries
+        return result
+
+    def prometheus(self) -> str:
+        """Every metric in the Prometheus text exposition format."""
+        self.collect()
+        lines = []
+        with self.lock:
+            names = sorted(self.types)
+            types = dict(self.types)
+            counters = {name: dict(series) for name, series in self.counters.items()}
+            gauges = {name: dict(series) for name, series in self.gauges.items()}
+            histograms = {name: dict(series) for name, series in self.histograms.items()}
+        for name in names:
+            full = f"{self.namespace}_{name}" if self.namespace else name
+            if self.help.get(name):
+                lines.append(f"# HELP {full} {self.help[name]}")
+            lines.append(f"# TYPE {full} {types[name]}")
+            if types[name] == "histogram":
+                for labels, histogram in sorted(histograms.get(name, {}).items()):
+                    for bound, count in histogram.cumulative():
+                        lines.append(f"{full}_bucket{_format_labels(labels, ('le', _format_number(bound)))} {count}")
+                    lines.append(f"{full}_sum{_format_labels(labels)} {_format_number(histogram.sum)}")
+                    lines.append(f"{full}_count{_format_labels(labels)} {histogram.count}")
+            else:
+                series = counters.get(name, {}) if types[name] == "counter" else gauges.get(name, {})
+                suffix = "_total" if types[name] == "counter" and not full.endswith("_total") else ""
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{full}{suffix}{_format_labels(labels)} {_format_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def resident_memory_bytes() -> int:
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/statm", "r") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()  # No /proc: the peak is the best available estimate
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux reports KiB
+
+
+def collect_process(registry: MetricsRegistry) -> None:
+    registry.set("process_peak_rss_bytes", peak_rss_bytes(), "Peak resident set size of the process")
+
+
+REGISTRY = MetricsRegistry()
+REGISTRY.add_collector(collect_process)
@@ -0,0 +1,424 @@
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import struct
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional
+
+if TYPE_CHECKING:
+    import torch
+    import transformers
+
+# torch and transformers are imported inside the loading functions so that
+# ModelClient, which agents use instead of a local model, does not pay for them.
+
+SAFETENSORS_DTYPES = {
+    "F64": "float64",
+    "F32": "float32",
+    "F16": "float16",
+    "BF16": "bfloat16",
+    "I64": "int64",
+    "I32": "int32",
+    "I16": "int16",
+    "I8": "int8",
+    "U8": "uint8",
+    "BOOL": "bool",
+}
+
+
+def safetensors_files(model_path: str) -> List[str]:
+    """The checkpoint files of a model directory, sharded (index.json) or single-file."""
+    index_path = os.path.join(model_path, "model.safetensors.index.json")
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as file:
+            weight_map = json.load(file)["weight_map"]
+        return [os.path.join(model_path, name) for name in sorted(set(weight_map.values()))]
+    single = os.path.join(model_path, "model.safetensors")
+    if os.path.exists(single):
+        return [single]
+    raise FileNotFoundError(f"No safetensors checkpoint in {model_path}")
+
+
+def load_mmap_state_dict(files: List[str]) -> Dict[str, "torch.Tensor"]:
+    """
+    Map safetensors files into memory and return tensors that are views of the mapping.
+
+    The files are mapped privately (copy-on-write), so nothing is read until a
+    tensor is touched, the pages live in the page cache, and every process that
+    maps the same file, forked or not, shares one physical copy of the weights.
+    """
+    import torch
+
+    state_dict: Dict[str, torch.Tensor] = {}
+    for path in files:
+        size = os.path.getsize(path)
+        with open(path, "rb") as file:
+            header_size = struct.unpack("<Q", file.read(8))[0]
+            header = json.loads(file.read(header_size))
+        storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=size)
+        data_start = 8 + header_size
+        for name, info in header.items():
+            if name == "__metadata__":
+                continue
+            dtype = getattr(torch, SAFETENSORS_DTYPES[info["dtype"]])
+            begin, end = info["data_offsets"]
+            itemsize = torch.empty((), dtype=dtype).element_size()
+            offset = data_start + begin
+            if offset % itemsize:
+                raise ValueError(f"{name} in {path} is not aligned for {info['dtype']}")
+            tensor = torch.empty(0, dtype=dtype)
+            tensor.set_(storage, offset // itemsize, info["shape"])
+            state_dict[name] = tensor
+    return state_dict
+
+
+def load_shared_pipeline(model_path: str, num_threads: Optional[int] = None) -> "transformers.Pipeline":
+    """
+    Build a CPU text-generation pipeline whose weights are the mapped checkpoint itself.
+
+    Weights keep the checkpoint's dtype: any conversion or quantization would
+    write private copies and defeat the sharing.
+
+    Args:
+        model_path: Directory holding the model and tokenizer
+        num_threads: Intra-op CPU threads (default: torch's choice)
+    """
+    import torch
+    import transformers
+    from accelerate import init_empty_weights
+    from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+    from pipeline import LoadReport
+    from metrics import resident_memory_bytes
+
+    start = time.perf_counter()
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    config = AutoConfig.from_pretrained(model_path)
+    state_dict = load_mmap_state_dict(safetensors_files(model_path))
+    dtype = next(iter(state_dict.values())).dtype
+
+    # Parameters start on the meta device, so only the mapped tensors ever hold weights
+    with init_empty_weights():
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=dtype)
+    model.load_state_dict(state_dict, strict=False, assign=True)
+    model.tie_weights()
+    missing = [name for name, param in model.named_parameters() if param.is_meta]
+    if missing:
+        raise ValueError(f"Checkpoint in {model_path} has no weights for {missing[:5]}")
+    model.eval()
+
+    pipeline = transformers.pipeline("text-generation", model=model, tokenizer=tokenizer, device="cpu")
+    pipeline.load_report = LoadReport(
+        device="cpu",
+        precision=str(dtype).replace("torch.", ""),
+        threads=torch.get_num_threads(),
+        compiled=False,
+        load_seconds=time.perf_counter() - start,
+        rss_bytes=resident_memory_bytes()
+    )
+    return pipeline
+
+
+def memory_usage(pid: int, path_prefix: Optional[str] = None) -> Dict[str, int]:
+    """
+    Rss, Pss and private bytes of a process from /proc/<pid>/smaps.
+
+    Args:
+        pid: Process to inspect
+        path_prefix: Only count mappings of files under this path
+    """
+    usage = {"rss": 0, "pss": 0, "private": 0}
+    counting = path_prefix is None
+    with open(f"/proc/{pid}/smaps", "r") as file:
+        for line in file:
+            fields = line.split()
+            if not fields[0].endswith(":"):
+                # Mapping header: address perms offset dev inode [pathname]
+                counting = path_prefix is None or (len(fields) > 5 and fields[5].startswith(path_prefix))
+            elif counting:
+                key = fields[0][:-1]
+                if key == "Rss":
+                    usage["rss"] += int(fields[1]) * 1024
+                elif key == "Pss":
+                    usage["pss"] += int(fields[1]) * 1024
+                elif key in ("Private_Clean", "Private_Dirty"):
+                    usage["private"] += int(fields[1]) * 1024
+    return usage
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """
+    One client connection: newline-delimited JSON requests, each answered by JSON lines.
+
+    Requests without an "op" are stateless completions. "turn" requests run
+    against a conversation kept for the lifetime of the connection, so an agent
+    client's history is tokenized once, on the host, with the model's tokenizer.
+    """
+
+    def handle(self) -> None:
+        from interface.pipeline_processor.conversation_memory import ConversationMemory
+
+        host: "ModelHost" = self.server.host
+        processor = host.processor
+        memory = ConversationMemory(
+            getattr(processor.pipeline, "tokenizer", None),
+            overflow=processor.memory.overflow,
+            summarizer=processor.memory.summarizer
+        )
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                self._send({"error": f"Invalid request: {str(e)}"})
+                continue
+            op = request.get("op")
+            if op == "info":
+                self._send(host.info())
+                continue
+            if op == "metrics":
+                from metrics import REGISTRY
+                self._send({"metrics": REGISTRY.snapshot(), "pid": os.getpid()})
+                continue
+            if op == "reset":
+                memory.clear()
+                self._send({"done": True})
+                continue
+
+            messages = request["messages"]
+            if op == "turn":
+                messages = memory.surround(messages, processor.context_window - processor.max_new_tokens)
+                for message in request["messages"]:
+                    if message["role"] != "system":
+                        memory.append(message["role"], message["content"])
+            cancel_event = threading.Event()
+            chunks = []
+            try:
+                for chunk in processor.complete_stream(messages, cancel_event):
+                    chunks.append(chunk)
+                    self._send({"chunk": chunk})
+                if op == "turn":
+                    # Before "done": the client may send its next turn as soon as it reads it
+                    memory.append("agent", "".join(chunks))
+                self._send({"done": True})
+            except (BrokenPipeError, ConnectionResetError):
+                cancel_event.set()
+                return
+            except Exception as e:
+                logging.error(f"Model host request failed: {str(e)}")
+                if op == "turn":
+                    memory.append("system", f"Error in generation: {str(e)}")
+                self._send({"error": str(e)})
+
+    def _send(self, message: Dict) -> None:
+        self.wfile.write(json.dumps(message).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ModelHost:
+    """
+    Serve one loaded model to thin agent clients over a Unix socket.
+
+    With workers > 0 the host pre-forks: the model is mapped once in the
+    parent and every worker process accepts connections on the shared
+    listening socket, so the weights are shared copy-on-write and each extra
+    worker only costs its own activations and KV cache. Forking is only safe
+    before any CUDA or intra-op thread pool is started, so it is meant for CPU
+    hosts; a GPU host should use workers=0 and serve from threads.
+    """
+
+    def __init__(self, processor, socket_path: str, workers: int = 0):
+        """
+        Args:
+            processor: PipelineProcessor answering the requests
+            socket_path: Filesystem path of the Unix socket
+            workers: Forked worker processes (0 serves from this process)
+        """
+        self.processor = processor
+        self.socket_path = socket_path
+        self.workers = workers
+        self.worker_pids: List[int] = []
+        self.server: Optional[_UnixServer] = None
+
+    def info(self) -> Dict:
+        return {
+            "context_window": self.processor.context_window,
+            "max_new_tokens": self.processor.max_new_tokens,
+            "pid": os.getpid()
+        }
+
+    def bind(self) -> None:
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.server = _UnixServer(self.socket_path, _RequestHandler)
+        self.server.host = self
+
+    def fork_workers(self, target: Callable[[], None]) -> List[int]:
+        """Fork self.workers processes that each run target and exit."""
+        for _ in range(self.workers):
+            pid = os.fork()
+            if pid == 0:
+                code = 0
+                try:
+                    target()
+                except BaseException:
+                    logging.exception("Model host worker failed")
+                    code = 1
+                finally:
+                    os._exit(code)
+            self.worker_pids.append(pid)
+        return self.worker_pids
+
+    def serve_forever(self) -> None:
+        """Accept connections until interrupted, in this process or in forked workers."""
+        if self.server is None:
+            self.bind()
+        if not self.workers:
+            logging.info(f"Model host serving on {self.socket_path}")
+            self.server.serve_forever()
+            return
+
+        self.fork_workers(self.server.serve_forever)
+        logging.info(f"Model host serving on {self.socket_path} with workers {self.worker_pids}")
+        try:
+            for pid in self.worker_pids:
+                os.waitpid(pid, 0)
+        finally:
+            self.shutdown()
+
+    def shutdown(self) -> None:
+        for pid in self.worker_pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        if self.server is not None:
+            if not self.workers:
+                self.server.shutdown()
+            self.server.server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class ModelClient:
+    """
+    Thin agent-side stand-in for PipelineProcessor that generates on a ModelHost.
+
+    It offers the complete/complete_stream/process_stream calls main.py and the
+    HTTP server use without importing torch or loading any weights. The
+    conversation of process_stream lives on the host, tied to this client's
+    session connection.
+    """
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        """
+        Args:
+            socket_path: Unix socket of the model host
+            timeout: Socket timeout in seconds (default: none)
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._session: Optional[socket.socket] = None
+        self._session_lock = threading.Lock()
+        info = next(self._exchange(self._connect(), {"op": "info"}, close=True))
+        self.context_window = info["context_window"]
+        self.max_new_tokens = info["max_new_tokens"]
+
+    def _connect(self) -> socket.socket:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(self.timeout)
+        connection.connect(self.socket_path)
+        return connection
+
+    @staticmethod
+    def _exchange(connection: socket.socket, message: Dict, close: bool) -> Iterator[Dict]:
+        """Send one request and yield its replies up to and including the final one."""
+        try:
+            connection.sendall(json.dumps(message).encode("utf-8") + b"\n")
+            with connection.makefile("rb") as reader:
+                while True:
+                    line = reader.readline()
+                    if not line:
+                        raise ConnectionError("Model host closed the connection")
+                    reply = json.loads(line)
+                    yield reply
+                    if "chunk" not in reply:
+                        return
+        finally:
+            if close:
+                connection.close()
+
+    @staticmethod
+    def _chunks(replies: Iterator[Dict], cancel_event: Optional[threading.Event]) -> Iterator[str]:
+        for reply in replies:
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            if "error" in reply:
+                raise RuntimeError(f"Model host error: {reply['error']}")
+            if "chunk" in reply:
+                yield reply["chunk"]
+
+    def complete_stream(
+            self,
+            _input: List[Dict[str, str]],
+            cancel_event: Optional[threading.Event] = None
+    ) -> Iterator[str]:
+        """Yield reply chunks; setting cancel_event closes the connection, which cancels the host's generation."""
+        yield from self._chunks(self._exchange(self._connect(), {"messages": _input}, close=True), cancel_event)
+
+    def complete(self, _input: List[Dict[str, str]], cancel_event: Optional[threading.Event] = None) -> str:
+        return "".join(self.complete_stream(_input, cancel_event)).strip()
+
+    def _session_exchange(self, message: Dict) -> Iterator[Dict]:
+        with self._session_lock:
+            if self._session is None:
+                self._session = self._connect()
+            try:
+                yield from self._exchange(self._session, message, close=False)
+            except (OSError, ValueError, GeneratorExit):
+                # Unread replies would be taken for the next turn's, so drop the session
+                self._session.close()
+                self._session = None  # The host-side conversation is gone with the connection
+                raise
+
+    def process_stream(self, _input: List[Dict[str, str]], supervisor_agent=None) -> Iterator[str]:
+        """
+        Like PipelineProcessor.process_stream, with the history kept by the host.
+
+        The host has no agents, so AGENT: lines are dispatched here, on the agent side.
+        """
+        from interface import Interface
+
+        chunks = []
+        try:
+            for chunk in self._chunks(self._session_exchange({"op": "turn", "messages": _input}), None):
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            yield f"Error in generation: {str(e)}"
+            return
+        agent_result = Interface.dispatch_delegations(self, supervisor_agent, "".join(chunks))
+        if agent_result:
+            yield "\n" + agent_result
+
+    def reset_conversation(self) -> None:
+        for _ in self._session_exchange({"op": "reset"}):
+            pass
+
+    def metrics(self) -> Dict:
+        """JSON metrics snapshot of the host process (with workers, of the worker that answers)."""
+        return next(self._exchange(self._connect(), {"op": "metrics"}, close=True))["metrics"]
+
+    def close(self) -> None:
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
@@ -1,52 +1,255 @@
+import logging
+import os
+import time
 import transformers
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, Optional, Union
 from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
 import torch
 import sys
+from metrics import resident_memory_bytes
+
+if TYPE_CHECKING:
+    from shard_loader import LoadTimings
+
+PRECISIONS = ("fp32", "fp16", "bf16", "int8")
+
+TORCH_DTYPES = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
+
+GPU_MEMORY_SHARE = 0.9  # Fraction of each GPU's memory offered to the weights
+CPU_MEMORY_SHARE = 0.8  # Fraction of host memory offered to offloaded weights
+
+
+@dataclass
+class LoadReport:
+    device: str
+    precision: str
+    threads: int
+    compiled: bool
+    load_seconds: float
+    rss_bytes: int
+    tokens_per_second: Optional[float] = None
+    timings: Optional["LoadTimings"] = None  # Per-phase breakdown when ShardLoader was used
+
+    def __str__(self) -> str:
+        text = (f"device={self.device} precision={self.precision} threads={self.threads} "
+                f"compiled={self.compiled} load={self.load_seconds:.1f}s rss={self.rss_bytes / 2**30:.2f}GiB")
+        if self.tokens_per_second is not None:
+            text += f" {self.tokens_per_second:.1f} tokens/s"
+        return text
+
 
 class Pipeline:
+    @staticmethod
+    def detect_device(device: str = "auto") -> str:
+        """
+        Resolve "auto" to "cuda" when a GPU is usable (ROCm builds also report
+        through torch.cuda) and to "cpu" otherwise.
+        """
+        if device != "auto":
+            return device
+        return "cuda" if torch.cuda.is_available() else "cpu"
+
+    @staticmethod
+    def default_max_memory() -> Dict[Union[int, str], str]:
+        """Memory map for device_map="auto", sized from the memory actually present."""
+        max_memory: Dict[Union[int, str], str] = {}
+        for index in range(torch.cuda.device_count()):
+            total = torch.cuda.get_device_properties(index).total_memory
+            max_memory[index] = f"{int(total * GPU_MEMORY_SHARE) // 2**20}MiB"
+        total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+        max_memory["cpu"] = f"{int(total * CPU_MEMORY_SHARE) // 2**20}MiB"
+        return max_memory
+
     @staticmethod
     def initialize_pipeline(
         model_path: str = "./",
         load_in_8bit: bool = True,
         device_map: str = "auto",
+        device: str = "auto",
+        precision: Optional[str] = None,
+        num_threads: Optional[int] = None,
+        compile_model: bool = False,
+        max_memory: Optional[Dict[Union[int, str], str]] = None,
+        load_workers: Optional[int] = None,
+        checkpoint_cache: bool = False,
     ) -> transformers.Pipeline:
         """
         Initialize the text generation pipeline with a locally sharded model.
+
+        On a GPU, int8 loads through bitsandbytes and the weights are spread
+        with device_map; other precisions go through the parallel ShardLoader
+        unless load_workers is 0. On the CPU, int8 applies torch dynamic quantization to
+        the linear layers of a float32 model, and bf16 keeps bfloat16 weights.
+        The returned pipeline carries a LoadReport as its load_report attribute.
+
+        Args:
+            model_path: Directory holding the model and tokenizer
+            load_in_8bit: Default to int8 when precision is not given
+            device_map: Weight placement on GPUs
+            device: "auto", "cuda" or "cpu"
+            precision: One of PRECISIONS (default: int8 if load_in_8bit, else fp16 on GPU and bf16 on CPU)
+            num_threads: Intra-op CPU threads (default: torch's choice)
+            compile_model: Wrap the model's forward in torch.compile
+            max_memory: Per-device memory limits (default: derived from the hardware)
+            load_workers: Shards loaded concurrently by ShardLoader (default: up to 4; 0 uses from_pretrained)
+            checkpoint_cache: On the CPU, reuse converted and quantized weights from the checkpoint cache
         """
         try:
-            print(f'Device name [0]: {torch.cuda.get_device_name(0)}', file=sys.stderr)
+            start = time.perf_counter()
+            device = Pipeline.detect_device(device)
+            if precision is None:
+                precision = "int8" if load_in_8bit else ("fp16" if device == "cuda" else "bf16")
+            if precision not in PRECISIONS:
+                raise ValueError(f"Unknown precision {precision}; expected one of {PRECISIONS}")
+            if num_threads:
+                torch.set_num_threads(num_threads)
 
-            tokenizer = AutoTokenizer.from_pretrained(
-                model_path
-            )
+            if device == "cuda":
+                print(f'Device name [0]: {torch.cuda.get_device_name(0)}', file=sys.stderr)
+            else:
+                print(f'Running on CPU with {torch.get_num_threads()} threads', file=sys.stderr)
+
+            torch_dtype = TORCH_DTYPES.get(precision, torch.float16 if device == "cuda" else torch.float32)
+            if device == "cuda" and precision == "int8":
+                try:
+                    import bitsandbytes  # noqa: F401
+                except ImportError:
+                    logging.warning("bitsandbytes is not installed; loading the model in fp16")
+                    precision = "fp16"
+            if device == "cuda" and max_memory is None:
+                max_memory = Pipeline.default_max_memory()
 
-            memory_config = {
-                0: "22GB",  # GPU 0
-                "cpu": "64GB"  # CPU memory
-            }
+            timings = None
+            sharded = os.path.exists(os.path.join(model_path, "model.safetensors.index.json")) or \
+                os.path.exists(os.path.join(model_path, "model.safetensors"))
+            if sharded and load_workers != 0 and not (device == "cuda" and precision == "int8"):
+                from shard_loader import ShardLoader
+                # Dynamic int8 quantization starts from float32 weights
+                loader = ShardLoader(
+                    model_path,
+                    dtype=torch_dtype,
+                    device=device,
+                    device_map=device_map if device == "cuda" else None,
+                    max_memory=max_memory,
+                    quantize=device == "cpu" and precision == "int8",
+                    workers=load_workers,
+                    checkpoint_cache=checkpoint_cache
+                )
+                model, tokenizer = loader.load()
+                timings = loader.timings
+                print(f"Load phases: {timings}", file=sys.stderr)
+            else:
+                tokenizer = AutoTokenizer.from_pretrained(
+                    model_path
+                )
 
-            model_kwargs = {
-                "torch_dtype": torch.float16,
-                "device_map": device_map,
-                "local_files_only": True,
-                "max_memory": memory_config
-            }
+                model_kwargs = {"local_files_only": True, "torch_dtype": torch_dtype}
+                if device == "cuda":
+                    model_kwargs["device_map"] = device_map
+                    model_kwargs["max_memory"] = max_memory
+                    if precision == "int8":
+                        model_kwargs["quantization_config"] = BitsAndBytesConfig(load_in_8bit=True)
+                else:
+                    model_kwargs["low_cpu_mem_usage"] = True
 
-            config: BitsAndBytesConfig = BitsAndBytesConfig(load_in_8bit=load_in_8bit)
-            model = AutoModelForCausalLM.from_pretrained(model_path, **model_kwargs)
+                model = AutoModelForCausalLM.from_pretrained(model_path, **model_kwargs)
+                model.eval()
 
+                if device == "cpu" and precision == "int8":
+                    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
 
+            compiled = False
+            if compile_model:
+                try:
+                    model.forward = torch.compile(model.forward, dynamic=True)
+                    compiled = True
+                except Exception as e:
+                    logging.warning(f"torch.compile unavailable, running eagerly: {str(e)}")
+
+            pipeline_kwargs = {} if device == "cuda" else {"device": "cpu"}
             pipeline = transformers.pipeline(
                 "text-generation",
                 model=model,
                 tokenizer=tokenizer,
-                config=config,
-                model_kwargs=model_kwargs
+                **pipeline_kwargs
             )
 
-            print(f"Successfully loaded model from {model_path}", file=sys.stderr)
+            pipeline.load_report = LoadReport(
+                device=device,
+                precision=precision,
+                threads=torch.get_num_threads(),
+                compiled=compiled,
+                load_seconds=time.perf_counter() - start,
+                rss_bytes=resident_memory_bytes(),
+                timings=timings
+            )
+            print(f"Successfully loaded model from {model_path}: {pipeline.load_report}", file=sys.stderr)
             return pipeline
 
         except Exception as e:
             print(f"Error loading model from {model_path}: {str(e)}", file=sys.stderr)
             raise
+
+    @staticmethod
+    def load_draft_model(draft_path: str, pipeline: transformers.Pipeline):
+        """
+        Load a small draft model for speculative decoding next to the pipeline's model.
+
+        The draft must use the main model's tokenizer; it is loaded in the main
+        model's dtype on the main model's device.
+
+        Args:
+            draft_path (str): Directory of the draft checkpoint (e.g. under models/)
+            pipeline (transformers.Pipeline): Pipeline with the main model
+
+        Returns:
+            The draft model, in eval mode
+        """
+        model = pipeline.model
+        draft = AutoModelForCausalLM.from_pretrained(draft_path, torch_dtype=model.dtype).to(model.device)
+        if draft.config.vocab_size < len(pipeline.tokenizer):
+            raise ValueError(
+                f"Draft model {draft_path} has {draft.config.vocab_size} token ids, "
+                f"the tokenizer needs {len(pipeline.tokenizer)}; it must share the main model's tokenizer"
+            )
+        return draft.eval()
+
+    @staticmethod
+    def measure_throughput(
+        pipeline: transformers.Pipeline,
+        prompt: str = "The quick brown fox",
+        max_new_tokens: int = 32
+    ) -> float:
+        """
+        Time a greedy generation and record the decode rate in the pipeline's load report.
+
+        A short warm-up generation runs first and is not timed.
+
+        Returns:
+            float: Generated tokens per second
+        """
+        model, tokenizer = pipeline.model, pipeline.tokenizer
+        inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+        input_ids = inputs.input_ids
+
+        def generate(new_tokens: int) -> torch.Tensor:
+            with torch.inference_mode():
+                return model.generate(
+                    **inputs,
+                    max_new_tokens=new_tokens,
+                    min_new_tokens=new_tokens,
+                    do_sample=False,
+                    pad_token_id=tokenizer.eos_token_id
+                )
+
+        generate(2)  # Warm-up, so one-off costs such as compilation are not counted
+        start = time.perf_counter()
+        output = generate(max_new_tokens)
+        elapsed = time.perf_counter() - start
+        tokens_per_second = (output.shape[1] - input_ids.shape[1]) / elapsed
+        report = getattr(pipeline, "load_report", None)
+        if report is not None:
+            report.tokens_per_second = tokens_per_second
+            report.rss_bytes = resident_memory_bytes()
+        return tokens_per_second
@@ -0,0 +1,338 @@
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Union
+
+import torch
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+
+from agent.cache import cache_path
+from model_host import SAFETENSORS_DTYPES, safetensors_files
+
+PHASES = ("tokenizer", "model_init", "shard_io", "conversion", "placement", "quantization", "cache_write")
+
+CACHE_VERSION = 1
+
+
+@dataclass
+class LoadTimings:
+    """
+    Where model loading spent its time.
+
+    Phase times are busy seconds summed over the loader threads, so with
+    overlapping shards they can add up to more than the wall time.
+    """
+    phases: Dict[str, float] = field(default_factory=lambda: {phase: 0.0 for phase in PHASES})
+    wall: float = 0.0
+    shards: int = 0
+    bytes_read: int = 0
+    from_cache: bool = False
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    def add(self, phase: str, seconds: float) -> None:
+        with self._lock:
+            self.phases[phase] += seconds
+
+    def count_bytes(self, size: int) -> None:
+        with self._lock:
+            self.bytes_read += size
+
+    def __str__(self) -> str:
+        phases = " ".join(f"{phase}={seconds:.2f}s" for phase, seconds in self.phases.items())
+        source = "cache" if self.from_cache else "checkpoint"
+        return (f"{self.shards} shards ({self.bytes_read / 2**30:.2f}GiB from {source}) "
+                f"in {self.wall:.2f}s: {phases}")
+
+
+class _Timer:
+    def __init__(self, timings: LoadTimings, phase: str):
+        self.timings = timings
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.timings.add(self.phase, time.perf_counter() - self.start)
+
+
+def read_safetensors(path: str) -> Tuple[Dict[str, torch.Tensor], int]:
+    """
+    Read a whole safetensors file with one sequential read and return tensors viewing the buffer.
+
+    The read releases the GIL, so several files can be read concurrently.
+
+    Returns:
+        (tensors by name, bytes read)
+    """
+    size = os.path.getsize(path)
+    buffer = bytearray(size)
+    with open(path, "rb", buffering=0) as file:
+        view = memoryview(buffer)
+        read = 0
+        while read < size:
+            count = file.readinto(view[read:])
+            if not count:
+                raise IOError(f"Unexpected end of {path}")
+            read += count
+    header_size = struct.unpack_from("<Q", buffer, 0)[0]
+    header = json.loads(bytes(buffer[8:8 + header_size]))
+    data_start = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = getattr(torch, SAFETENSORS_DTYPES[info["dtype"]])
+        begin, end = info["data_offsets"]
+        if begin == end:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        itemsize = torch.empty((), dtype=dtype).element_size()
+        tensor = torch.frombuffer(buffer, dtype=dtype, count=(end - begin) // itemsize, offset=data_start + begin)
+        tensors[name] = tensor.view(info["shape"])
+    return tensors, size
+
+
+class ShardLoader:
+    """
+    Load a sharded safetensors checkpoint with concurrent shard reads.
+
+    Every shard listed in model.safetensors.index.json is read, converted
+    and placed by a pool of threads. While one shard's tensors are being
+    converted or copied to the device, the next shards are already being
+    read, so disk I/O overlaps with tensor placement. The tokenizer loads
+    alongside the shards. On the CPU, the converted and optionally
+    int8-quantized weights can be written to a checkpoint cache and loaded
+    from it on later starts.
+    """
+
+    def __init__(
+            self,
+            model_path: str,
+            dtype: Optional[torch.dtype] = None,
+            device: str = "cpu",
+            device_map: Optional[Union[str, Dict[str, Union[int, str]]]] = None,
+            max_memory: Optional[Dict[Union[int, str], str]] = None,
+            quantize: bool = False,
+            workers: Optional[int] = None,
+            checkpoint_cache: bool = False
+    ):
+        """
+        Args:
+            model_path: Directory holding the checkpoint and tokenizer
+            dtype: Parameter dtype (default: as stored)
+            device: "cpu" or a torch device such as "cuda"
+            device_map: "auto" or an explicit module -> device map for spreading the model over devices
+            max_memory: Per-device limits used with device_map="auto"
+            quantize: Apply dynamic int8 quantization to the linear layers (CPU only)
+            workers: Shards processed at once (default: min(shards, 4))
+            checkpoint_cache: Reuse or write converted weights under the cache directory (CPU only)
+        """
+        if quantize and device != "cpu":
+            raise ValueError("Dynamic int8 quantization is only available on the CPU")
+        self.model_path = model_path
+        self.dtype = dtype
+        self.device = device
+        self.device_map = device_map
+        self.max_memory = max_memory
+        self.quantize = quantize
+        self.workers = workers
+        self.checkpoint_cache = checkpoint_cache and device == "cpu"
+        self.timings = LoadTimings()
+
+    def cache_dir(self) -> str:
+        """Checkpoint cache directory for this checkpoint, dtype and quantization."""
+        shards = [(os.path.basename(path), os.path.getsize(path), os.path.getmtime(path))
+                  for path in safetensors_files(self.model_path)]
+        key = json.dumps([CACHE_VERSION, torch.__version__, str(self.dtype), self.quantize, shards])
+        return cache_path(self.model_path, f"checkpoint-{hashlib.sha1(key.encode()).hexdigest()[:16]}")
+
+    def load(self):
+        """
+        Returns:
+            (model, tokenizer); the phase timings are in self.timings
+        """
+        start = time.perf_counter()
+        self.timings = LoadTimings()
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="tokenizer") as tokenizer_pool:
+            tokenizer_future = tokenizer_pool.submit(self._load_tokenizer)
+
+            cache_dir = self.cache_dir() if self.checkpoint_cache else None
+            from_cache = cache_dir is not None and os.path.exists(os.path.join(cache_dir, "cache.json"))
+            files = [os.path.join(cache_dir, "model.safetensors")] if from_cache else safetensors_files(self.model_path)
+            quantized_names = self._cached_quantized_names(cache_dir) if from_cache else []
+
+            with _Timer(self.timings, "model_init"):
+                model = self._empty_model(quantized_names)
+            placement = self._placement(model)
+            state_dict = self._read_shards(files, placement)
+            self._assign(model, state_dict, quantized_names)
+
+            if self.quantize and not from_cache:
+                with _Timer(self.timings, "quantization"):
+                    torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+            if cache_dir is not None and not from_cache:
+                with _Timer(self.timings, "cache_write"):
+                    self._write_cache(model, cache_dir)
+
+            devices = set(placement.values()) if isinstance(placement, dict) else {placement}
+            if len(devices) > 1:
+                from accelerate import dispatch_model
+                with _Timer(self.timings, "placement"):
+                    model = dispatch_model(model, device_map=placement)
+            else:
+                # Also for a map putting everything on one device, e.g. {"": 0}
+                with _Timer(self.timings, "placement"):
+                    model.to(devices.pop())  # Non-persistent buffers such as rotary frequencies
+            tokenizer = tokenizer_future.result()
+
+        model.eval()
+        self.timings.from_cache = from_cache
+        self.timings.shards = len(files)
+        self.timings.wall = time.perf_counter() - start
+        logging.info(f"Loaded {self.model_path}: {self.timings}")
+        return model, tokenizer
+
+    def _load_tokenizer(self):
+        with _Timer(self.timings, "tokenizer"):
+            return AutoTokenizer.from_pretrained(self.model_path)
+
+    def _empty_model(self, quantized_names: List[str]):
+        from accelerate import init_empty_weights
+
+        config = AutoConfig.from_pretrained(self.model_path)
+        with init_empty_weights():
+            model = AutoModelForCausalLM.from_config(config, torch_dtype=self.dtype or config.torch_dtype)
+        for name in quantized_names:
+            parent_name, _, attr = name.rpartition(".")
+            parent = model.get_submodule(parent_name)
+            linear = getattr(parent, attr)
+            setattr(parent, attr, torch.ao.nn.quantized.dynamic.Linear(
+                linear.in_features, linear.out_features, bias_=linear.bias is not None, dtype=torch.qint8
+            ))
+        return model
+
+    def _placement(self, model) -> Union[str, Dict[str, Union[int, str]]]:
+        """The target device, or a module -> device map when the model is spread over devices."""
+        if self.device_map is None or self.device == "cpu":
+            return self.device
+        if isinstance(self.device_map, dict):
+            return self.device_map
+        from accelerate import infer_auto_device_map
+        device_map = infer_auto_device_map(
+            model,
+            max_memory=self.max_memory,
+            no_split_module_classes=getattr(model, "_no_split_modules", None) or [],
+            dtype=self.dtype
+        )
+        if "disk" in device_map.values():
+            raise ValueError("The model does not fit in the available GPU and CPU memory")
+        return device_map
+
+    @staticmethod
+    def _device_for(name: str, placement) -> Union[int, str]:
+        if not isinstance(placement, dict):
+            return placement
+        module = name
+        while module:
+            if module in placement:
+                return placement[module]
+            module = module.rpartition(".")[0]
+        return placement.get("", "cpu")
+
+    def _read_shards(self, files: List[str], placement) -> Dict[str, torch.Tensor]:
+        workers = self.workers or min(len(files), 4)
+        state_dict: Dict[str, torch.Tensor] = {}
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shard") as pool:
+            for tensors in pool.map(lambda path: self._load_shard(path, placement), files):
+                state_dict.update(tensors)
+        return state_dict
+
+    def _load_shard(self, path: str, placement) -> Dict[str, torch.Tensor]:
+        with _Timer(self.timings, "shard_io"):
+            tensors, size = read_safetensors(path)
+        self.timings.count_bytes(size)
+
+        for name, tensor in tensors.items():
+            device = self._device_for(name, placement)
+            convert = self.dtype is not None and tensor.is_floating_point() and tensor.dtype != self.dtype
+            if device != "cpu":
+                # Copy first and convert on the device, where conversion is cheap
+                with _Timer(self.timings, "placement"):
+                    tensor = tensor.to(device, non_blocking=False)
+            if convert:
+                with _Timer(self.timings, "conversion"):
+                    tensor = tensor.to(self.dtype)
+            tensors[name] = tensor
+        return tensors
+
+    def _assign(self, model, state_dict: Dict[str, torch.Tensor], quantized_names: List[str]) -> None:
+        for name in quantized_names:
+            qweight = torch._make_per_tensor_quantized_tensor(
+                state_dict.pop(f"{name}.weight.int8"),
+                state_dict.pop(f"{name}.weight.scale").item(),
+                state_dict.pop(f"{name}.weight.zero_point").item()
+            )
+            model.get_submodule(name).set_weight_bias(qweight, state_dict.pop(f"{name}.bias", None))
+        # Assign tensors directly: load_state_dict would expect the quantized layers' own serialized form
+        for name, tensor in state_dict.items():
+            module_name, _, attr = name.rpartition(".")
+            module = model.get_submodule(module_name)
+            if attr in module._parameters:
+                module._parameters[attr] = torch.nn.Parameter(tensor, requires_grad=False)
+            elif attr in module._buffers:
+                module._buffers[attr] = tensor
+            else:
+                logging.debug(f"Ignoring unexpected checkpoint tensor {name}")
+        model.tie_weights()
+        missing = [name for name, param in model.named_parameters() if param.is_meta]
+        if missing:
+            raise ValueError(f"Checkpoint in {self.model_path} has no weights for {missing[:5]}")
+
+    @staticmethod
+    def _cached_quantized_names(cache_dir: str) -> List[str]:
+        with open(os.path.join(cache_dir, "cache.json"), "r", encoding="utf-8") as file:
+            return json.load(file)["quantized"]
+
+    @staticmethod
+    def _write_cache(model, cache_dir: str) -> None:
+        """Save the loaded (converted, quantized) weights so the next start skips those steps."""
+        from safetensors.torch import save_file
+
+        tensors: Dict[str, torch.Tensor] = {}
+        quantized = []
+        for name, module in model.named_modules():
+            if isinstance(module, torch.ao.nn.quantized.dynamic.Linear):
+                weight, bias = module._weight_bias()
+                tensors[f"{name}.weight.int8"] = weight.int_repr().contiguous()
+                tensors[f"{name}.weight.scale"] = torch.tensor(weight.q_scale(), dtype=torch.float64)
+                tensors[f"{name}.weight.zero_point"] = torch.tensor(weight.q_zero_point(), dtype=torch.int64)
+                if bias is not None:
+                    tensors[f"{name}.bias"] = bias.contiguous()
+                quantized.append(name)
+        seen = set()
+        for name, tensor in model.state_dict().items():
+            if not isinstance(tensor, torch.Tensor) or tensor.is_quantized or "_packed_params" in name:
+                continue
+            if any(name.startswith(f"{q}.") for q in quantized) or tensor.data_ptr() in seen:
+                continue  # Quantized layers are stored above; tied weights once
+            seen.add(tensor.data_ptr())
+            tensors[name] = tensor.contiguous()
+
+        tmp_dir = f"{cache_dir}.tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        save_file(tensors, os.path.join(tmp_dir, "model.safetensors"))
+        with open(os.path.join(tmp_dir, "cache.json"), "w", encoding="utf-8") as file:
+            json.dump({"version": CACHE_VERSION, "quantized": quantized}, file)
+        if os.path.isdir(cache_dir):
+            import shutil
+            shutil.rmtree(cache_dir)
+        os.replace(tmp_dir, cache_dir)
@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pytest
+
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+TOKENIZER_DIR = join(abspath(join(dirname(__file__), '..')), "models", "phi4")
+
+
+def make_tiny_model(path: str, seed: int = 0, num_hidden_layers: int = 2, max_shard_size: str = "5GB") -> str:
+    """Save a randomly initialised Phi-3 architecture model using Phi-4's tokenizer."""
+    from transformers import AutoTokenizer, Phi3Config, Phi3ForCausalLM
+    import torch
+
+    tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_DIR)
+    config = Phi3Config(
+        vocab_size=len(tokenizer),
+        hidden_size=16,
+        intermediate_size=32,
+        num_hidden_layers=num_hidden_layers,
+        num_attention_heads=2,
+        num_key_value_heads=1,
+        max_position_embeddings=1024,
+        pad_token_id=tokenizer.eos_token_id,
+        bos_token_id=tokenizer.eos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+    )
+    torch.manual_seed(seed)
+    model = Phi3ForCausalLM(config)
+    model.save_pretrained(path, max_shard_size=max_shard_size)
+    tokenizer.save_pretrained(path)
+    return path
+
+
+@pytest.fixture(scope="session")
+def tiny_model_dir(tmp_path_factory):
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    return make_tiny_model(str(tmp_path_factory.mktemp("tiny_model")))
+
+
+@pytest.fixture(scope="session")
+def tiny_pipeline(tiny_model_dir):
+    import transformers
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    model = AutoModelForCausalLM.from_pretrained(tiny_model_dir)
+    tokenizer = AutoTokenizer.from_pretrained(tiny_model_dir)
+    return transformers.pipeline("text-generation", model=model, tokenizer=tokenizer, device="cpu")
@@ -1,22 +1,60 @@
-import os, sys
+import os
+import sys
 
 from os.path import dirname, join, abspath
 sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+import pytest
+
 from agent import Agent
 
-# Example usage
-if __name__ == "__main__":
-    # Assuming agents/expert.json exists with {"prompt": "I'm an expert agent...", "capabilities": [...]}
-    agent = Agent(agent_config="linus")
-
-    # Test cases
-    prompts = [
-        "Can you search the directory?",
-        "Find python in files",
-        "Search web for python courses",
-        "Hello, how are you?"
-    ]
-
-    for prompt in prompts:
-        print(f"\nUser prompt: {prompt}")
-        print(agent.handle_prompt(prompt))
\ No newline at end of file
+REPO_ROOT = abspath(join(dirname(__file__), '..'))
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    monkeypatch.setenv("AGENT_CACHE_DIR", str(tmp_path / "cache"))
+    root = tmp_path / "tree"
+    (root / "pkg").mkdir(parents=True)
+    (root / "README.md").write_text("Project notes\n")
+    (root / "pkg" / "module.py").write_text("import os\nneedle = 1\n")
+    return root
+
+
+@pytest.mark.parametrize("prompt, expected", [
+    ("Can you search directory contents?", ("file_search", "search directory")),
+    ("Please find needle in files", ("content_search", "find needle in files")),
+    ("Search web for python courses", ("web_search", "python courses")),
+    ("Hello, how are you?", (None, None)),
+])
+def test_analyze_prompt(prompt, expected):
+    assert Agent.analyze_prompt(prompt) == expected
+
+
+def test_file_search_prompt(tree):
+    agent = Agent(str(tree))
+    response = agent.handle_prompt("Search files please")
+    assert response.startswith(agent.agent_prompt["prompt"])
+    found = response.split("Found files: ")[1].split(", ")
+    assert sorted(found) == ["README.md", os.path.join("pkg", "module.py")]
+
+
+def test_content_search_prompt(tree):
+    agent = Agent(str(tree))
+    agent.search_directory()  # Content search scans the files found by the last directory search
+    response = agent.handle_prompt("find needle in files")
+    assert f"In {os.path.join('pkg', 'module.py')}: 2: needle = 1" in response
+
+
+def test_prompt_without_operation(tree):
+    response = Agent(str(tree)).handle_prompt("Hello, how are you?")
+    assert response.endswith("What would you like to do?")
+
+
+def test_agent_config_files(monkeypatch):
+    monkeypatch.chdir(REPO_ROOT)
+    linus = Agent(agent_config="linus")
+    assert linus.agent_prompt["prompt"].startswith("You are Linus")
+    assert isinstance(linus.agent_prompt["capabilities"], list)
+    with pytest.raises(ValueError, match="missing_agent"):
+        Agent(agent_config="missing_agent")
@@ -0,0 +1,125 @@
+import argparse
+import json
+import os
+import sys
+import threading
+
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+import pytest
+
+from batch import BatchRunner, read_items
+
+PROMPTS = ["a much longer prompt than the others", "hi", "medium prompt", "tiny", "another long-ish prompt"]
+
+
+def write_input(path, prompts=PROMPTS):
+    with open(path, "w", encoding="utf-8") as file:
+        for index, prompt in enumerate(prompts):
+            file.write(json.dumps({"id": f"p{index}", "prompt": prompt}) + "\n")
+        file.write("not json\n\n")
+
+
+def read_results(path):
+    with open(path, "r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+class Recorder:
+    """generate() that upper-cases the user message, recording calls and failing on request."""
+
+    def __init__(self, fail_on=()):
+        self.calls = []
+        self.fail_on = set(fail_on)
+        self.lock = threading.Lock()
+
+    def __call__(self, messages):
+        prompt = messages[-1]["content"]
+        with self.lock:
+            self.calls.append(prompt)
+        if prompt in self.fail_on:
+            raise RuntimeError(f"cannot answer {prompt}")
+        return prompt.upper()
+
+
+def runner(generate, **kwargs):
+    return BatchRunner(generate, lambda prompt: [{"role": "user", "content": prompt}], **kwargs)
+
+
+def test_prompts_run_in_length_order_within_a_window(tmp_path):
+    source, out = str(tmp_path / "in.jsonl"), str(tmp_path / "out.jsonl")
+    write_input(source)
+    generate = Recorder(fail_on=["tiny"])
+    stats = runner(generate, concurrency=1, window=3).run(source, out)
+    assert generate.calls == ["hi", "medium prompt", "a much longer prompt than the others",
+                              "tiny", "another long-ish prompt"]
+    results = {result["id"]: result for result in read_results(out)}
+    assert results["p2"]["response"] == "MEDIUM PROMPT"
+    assert results["p3"]["error"] == "cannot answer tiny"
+    summary = stats.summary()
+    assert (summary["completed"], summary["errors"], summary["skipped"]) == (5, 1, 0)
+    assert summary["prompts_per_second"] > 0 and summary["latency_max_seconds"] >= summary["latency_p50_seconds"]
+
+
+def test_a_killed_run_resumes_without_repeating_prompts(tmp_path):
+    source, out = str(tmp_path / "in.jsonl"), str(tmp_path / "out.jsonl")
+    prompts = [f"prompt {i}" for i in range(40)]
+    write_input(source, prompts)
+
+    class Killed(BaseException):
+        pass
+
+    def dies_after_15(messages, count=[0]):
+        count[0] += 1
+        if count[0] > 15:
+            raise Killed()
+        return "ok"
+
+    with pytest.raises(Killed):
+        runner(dies_after_15, concurrency=1, window=8, checkpoint_every=4).run(source, out)
+    with open(out, "a", encoding="utf-8") as file:
+        file.write('{"id": "p15", "resp')  # Torn by the kill
+    checkpoint = json.load(open(BatchRunner.checkpoint_path(out)))
+    assert 0 < checkpoint["offset"] < os.path.getsize(source)
+    assert list(read_items(source, checkpoint["offset"]))[0].id != "p0"
+
+    generate = Recorder()
+    stats = runner(generate, concurrency=4, window=8, checkpoint_every=4).run(source, out)
+    ids = [result["id"] for result in read_results(out)]
+    assert sorted(ids) == sorted(f"p{i}" for i in range(40))  # Every prompt exactly once
+    assert len(generate.calls) == 40 - 15 and stats.completed == 25
+    assert runner(Recorder(), concurrency=2).run(source, out).completed == 0  # Nothing left
+
+
+def test_main_batch_mode_on_a_tiny_model(tiny_pipeline, tmp_path):
+    from agent import Agent
+    from interface import Interface
+    from interface.pipeline_processor import PipelineProcessor
+    from main import run_batch
+
+    source, out = str(tmp_path / "in.jsonl"), str(tmp_path / "out.jsonl")
+    write_input(source)
+    agents = {"karen": Agent()}
+    interface = Interface()
+    processor = PipelineProcessor(tiny_pipeline, max_new_tokens=8, do_sample=False)
+    expected = {f"p{i}": processor.complete(interface.prepare_model_messages(p, agents)) for i, p in enumerate(PROMPTS)}
+
+    args = argparse.Namespace(batch=source, out=out, batch_size=3)
+    summary = run_batch(processor, args, agents, interface)
+    assert summary["completed"] == len(PROMPTS) and summary["errors"] == 0
+    assert {result["id"]: result["response"] for result in read_results(out)} == expected
+    assert processor.scheduler is None  # Detached again after the run
+
+
+def test_a_complete_record_without_its_newline_is_regenerated(tmp_path):
+    source, out = str(tmp_path / "in.jsonl"), str(tmp_path / "out.jsonl")
+    write_input(source, ["first", "second", "third"])
+    with open(out, "w", encoding="utf-8") as file:
+        file.write('{"id": "p0", "response": "FIRST"}\n{"id": "p1", "response": "SECOND"}')  # Killed before the newline
+
+    generate = Recorder()
+    stats = runner(generate, concurrency=1).run(source, out)
+    assert sorted(generate.calls) == ["second", "third"]
+    assert stats.skipped == 1 and stats.completed == 2
+    assert sorted(result["id"] for result in read_results(out)) == ["p0", "p1", "p2"]
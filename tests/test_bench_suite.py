@@ -0,0 +1,48 @@
+import json
+import sys
+
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+from benchmarks import suite
+
+
+def report(**medians):
+    return {"machine": {}, "skipped": {}, "results": {name: {"median": value} for name, value in medians.items()}}
+
+
+def test_every_area_has_cases():
+    for prefix in ["agent.search_directory", "agent.find_string_in_files", "agent.analyze_prompt",
+                   "processor.format_prompt", "processor.process.fake", "processor.process.tiny", "render."]:
+        assert any(name.startswith(prefix) for name in suite.CASES), prefix
+
+
+def test_quick_run_and_save(tmp_path):
+    path = str(tmp_path / "quick.json")
+    code = suite.main(["run", "--filter", r"^(agent\.|processor\.format|render\.convert)", "--files", "20",
+                       "--min-time", "0.02", "--rounds", "2", "--save", path])
+    assert code == 0
+    with open(path, encoding="utf-8") as file:
+        saved = json.load(file)
+    assert set(saved["results"]) == {name for name in suite.CASES
+                                     if name.startswith(("agent.", "processor.format", "render.convert"))}
+    for stats in saved["results"].values():
+        assert 0 < stats["min"] <= stats["median"] and stats["rounds"] == 2 and stats["iterations"] >= 1
+    assert saved["machine"]["python"]
+
+
+def test_compare_flags_regressions(tmp_path):
+    baseline = report(fast=1.0, slow=1.0, faster=1.0, gone=1.0)
+    current = report(fast=1.1, slow=1.3, faster=0.5, added=2.0)
+    assert suite.compare(baseline, current, threshold=0.15) == [
+        ("added", None, 2.0, "new"),
+        ("fast", 1.0, 1.1, "ok"),
+        ("faster", 1.0, 0.5, "improvement"),
+        ("gone", 1.0, None, "missing"),
+        ("slow", 1.0, 1.3, "regression"),
+    ]
+
+    suite.save(baseline, str(tmp_path / "base.json"))
+    suite.save(current, str(tmp_path / "current.json"))
+    assert suite.main(["compare", str(tmp_path / "base.json"), str(tmp_path / "current.json")]) == 1
+    assert suite.main(["compare", str(tmp_path / "base.json"), str(tmp_path / "base.json")]) == 0
@@ -0,0 +1,120 @@
+import sys
+import threading
+import time
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+from interface import Interface
+
+
+class SlowAgent:
+    def __init__(self, delay: float, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def handle_prompt(self, command: str) -> str:
+        with self.lock:
+            self.calls.append(command)
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("search backend down")
+        return f"done {command}\n"
+
+
+def collaborate(agents, response, **kwargs):
+    return Interface.process_agent_collaboration(None, None, agents, response, **kwargs)
+
+
+def test_delegations_run_concurrently_in_line_order():
+    agents = {"linus": SlowAgent(0.3), "karen": SlowAgent(0.3), "bob": SlowAgent(0.1)}
+    response = "Plan:\nAGENT:linus:find a\nAGENT:karen:find b\nbetween\nAGENT:bob:find c\nEnd"
+    start = time.perf_counter()
+    result = collaborate(agents, response)
+    elapsed = time.perf_counter() - start
+    assert elapsed < 0.6  # Sequential dispatch would take 0.7s
+    assert result == "Plan:\nlinus: done find a\nkaren: done find b\nbetween\nbob: done find c\nEnd"
+
+
+def test_identical_delegations_run_once():
+    linus = SlowAgent(0.01)
+    result = collaborate({"linus": linus}, "AGENT:linus:find a\nAGENT:linus: find a\nAGENT:linus:find b")
+    assert sorted(linus.calls) == ["find a", "find b"]
+    assert result == "linus: done find a\nlinus: done find b"
+
+
+def test_delegations_to_one_agent_take_turns():
+    class CountingAgent(SlowAgent):
+        def __init__(self, delay):
+            super().__init__(delay)
+            self.running = self.most_running = 0
+
+        def handle_prompt(self, command):
+            with self.lock:
+                self.running += 1
+                self.most_running = max(self.most_running, self.running)
+            try:
+                return super().handle_prompt(command)
+            finally:
+                with self.lock:
+                    self.running -= 1
+
+    linus, karen = CountingAgent(0.2), CountingAgent(0.2)
+    agents = {"linus": linus, "karen": karen}
+    response = "AGENT:linus:first\nAGENT:linus:second\nAGENT:karen:third"
+    start = time.monotonic()
+    threads = [threading.Thread(target=collaborate, args=(agents, response)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    assert sorted(linus.calls) == ["first", "first", "second", "second"]
+    assert linus.most_running == 1 and karen.most_running == 1
+    assert 0.8 <= elapsed < 1.2  # linus's four calls in turn, karen's two alongside them
+
+
+def test_timeouts_and_failures_are_reported():
+    agents = {"slow": SlowAgent(2.0), "fast": SlowAgent(0.01), "broken": SlowAgent(0.01, fail=True)}
+    response = "Start\nAGENT:slow:find a\nAGENT:fast:find b\nAGENT:broken:find c"
+    start = time.perf_counter()
+    result = collaborate(agents, response, timeout=5.0, agent_timeouts={"slow": 0.2})
+    assert time.perf_counter() - start < 1.0
+    assert result.splitlines() == [
+        "Start",
+        "slow: [timed out after 0.2s]",
+        "fast: done find b",
+        "broken: [failed: search backend down]",
+    ]
+
+
+def test_no_collaboration():
+    assert collaborate({}, "Just an answer") is None
+    assert collaborate({}, "Two\nlines") == "Two\nlines"
+
+
+def test_delegation_metrics():
+    from metrics import REGISTRY
+
+    def outcomes():
+        return {tuple(sorted(entry["labels"].items())): entry["value"]
+                for entry in REGISTRY.snapshot()["counters"].get("delegations_total", [])}
+
+    before = outcomes()
+    collaborate({"metered": SlowAgent(0.01), "broken_meter": SlowAgent(0.01, fail=True)},
+                "AGENT:metered:find a\nAGENT:broken_meter:find b")
+    after = outcomes()
+    ok, failed = (("agent", "metered"), ("status", "ok")), (("agent", "broken_meter"), ("status", "failed"))
+    assert after[ok] == before.get(ok, 0) + 1 and after[failed] == before.get(failed, 0) + 1
+
+
+def test_dispatch_delegations_of_a_shown_reply():
+    from agent import Agent
+
+    supervisor = Agent()
+    supervisor.register_agent("linus", SlowAgent(0.01))
+    assert Interface.dispatch_delegations(None, supervisor, "Let me ask.\nAGENT:linus:find a") == "linus: done find a"
+    assert Interface.dispatch_delegations(None, supervisor, "No delegation here") is None
+    assert Interface.dispatch_delegations(None, None, "AGENT:linus:find a") is None
@@ -0,0 +1,85 @@
+import os
+import re
+import sys
+
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+from agent import Agent
+from agent.content_search import iter_matches, scan_file
+
+
+def make_tree(root, count=20):
+    paths = []
+    for i in range(count):
+        path = os.path.join(root, f"file{i:02d}.txt")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(f"header {i}\n  Needle {i}\nplain\nneedle again\n")
+        paths.append(path)
+    return paths
+
+
+def test_scan_file_matches_per_line_semantics(tmp_path):
+    path = str(tmp_path / "a.txt")
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("one two\nthree\nfour two\nend")
+    assert scan_file(path, "two") == [(path, 1, "one two"), (path, 3, "four two")]
+    assert scan_file(path, r"two\sthree") == []
+    assert scan_file(path, "^end$") == [(path, 4, "end")]
+    assert scan_file(path, "two", limit=1) == [(path, 1, "one two")]
+
+    binary = str(tmp_path / "b.bin")
+    with open(binary, "wb") as file:
+        file.write(b"two\0two")
+    assert scan_file(binary, "two") == []
+
+
+def test_scan_file_keeps_unicode_and_crlf_semantics(tmp_path):
+    path = str(tmp_path / "crlf.txt")
+    with open(path, "wb") as file:
+        file.write("café x\r\nnext line\r\n".encode("utf-8"))
+    assert scan_file(path, "x$") == [(path, 1, "café x")]
+    assert scan_file(path, r"caf\w") == [(path, 1, "café x")]
+    assert scan_file(path, "CAFÉ", re.IGNORECASE) == [(path, 1, "café x")]
+    assert scan_file(path, "^next line$") == [(path, 2, "next line")]
+
+
+def test_scan_file_blocks_skip_and_count_lines(tmp_path, monkeypatch):
+    import agent.content_search as content_search
+    monkeypatch.setattr(content_search, "SCAN_BLOCK_BYTES", 64)
+    lines = [f"filler line {i}" for i in range(40)]
+    lines[3] = "café needle"
+    lines[25] = "NEEDLE straddles " + "x" * 100  # Longer than a block
+    lines[39] = "last needle"
+    path = str(tmp_path / "big.txt")
+    with open(path, "wb") as file:
+        file.write("\r\n".join(lines).encode("utf-8"))
+    expected = [(path, 4, "café needle"), (path, 26, lines[25]), (path, 40, "last needle")]
+    assert scan_file(path, "needle", re.IGNORECASE) == expected
+    assert scan_file(path, "(?i:needle)") == expected
+    assert scan_file(path, r"needle$") == [(path, 4, "café needle"), (path, 40, "last needle")]
+    assert scan_file(path, r"caf\w needle") == [(path, 4, "café needle")]
+    assert scan_file(path, r"line 3\d$") == [(path, i + 1, lines[i]) for i in range(30, 39)]
+
+
+def test_iter_matches_parallel_is_ordered_and_limited(tmp_path):
+    paths = make_tree(str(tmp_path))
+    serial = list(iter_matches(paths, "needle", workers=1))
+    parallel = list(iter_matches(paths, "needle", workers=2, chunk_size=3, inline_files=0))
+    assert serial == parallel
+    assert len(serial) == 40
+    assert serial[0] == (paths[0], 2, "Needle 0")
+
+    assert len(list(iter_matches(paths, "needle", workers=2, chunk_size=3, max_results=5, inline_files=0))) == 5
+    assert list(iter_matches(paths, "Needle", case_sensitive=True, workers=1, max_results=2)) == [
+        (paths[0], 2, "Needle 0"), (paths[1], 2, "Needle 1")]
+
+
+def test_agent_iter_string_in_files(tmp_path, monkeypatch):
+    monkeypatch.setenv("AGENT_CACHE_DIR", str(tmp_path / "cache"))
+    tree = tmp_path / "tree"
+    tree.mkdir()
+    make_tree(str(tree), count=3)
+    agent = Agent(base_directory=str(tree))
+    agent.search_directory()
+    matches = list(agent.iter_string_in_files("needle again", workers=1))
+    assert sorted(line_no for _, line_no, _ in matches) == [4, 4, 4]
@@ -0,0 +1,94 @@
+import sys
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+import pytest
+
+from interface.pipeline_processor.conversation_memory import ConversationMemory
+
+
+class CountingTokenizer:
+    """Whitespace tokenizer that records how often it is called."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text, add_special_tokens=False):
+        self.calls += 1
+        return {"input_ids": [hash(word) for word in text.split()]}
+
+    def decode(self, ids):
+        return " ".join("w" for _ in ids)
+
+
+def fill(memory, turns):
+    for i in range(turns):
+        memory.append("user", f"question {i} about something")
+        memory.append("agent", f"answer {i}. More detail follows here")
+
+
+def test_pack_keeps_newest_messages_within_budget():
+    memory = ConversationMemory(CountingTokenizer())
+    fill(memory, 10)
+    packed = memory.pack(20)
+    assert packed == memory.messages[-len(packed):]
+    assert packed[-1]["content"].startswith("answer 9")
+    assert sum(memory.count_tokens(ConversationMemory.render(m)) for m in packed) <= 20
+    assert memory.pack(10_000) == memory.messages
+    assert memory.pack(0) == []
+
+
+def test_messages_are_tokenized_once():
+    tokenizer = CountingTokenizer()
+    memory = ConversationMemory(tokenizer)
+    fill(memory, 5)
+    assert tokenizer.calls == 10
+    for budget in (5, 15, 50):
+        memory.pack(budget)
+    assert tokenizer.calls == 10
+
+    memory.count_tokens("system: fixed prompt\n")
+    memory.count_tokens("system: fixed prompt\n")
+    assert tokenizer.calls == 11
+
+
+def test_summarise_oldest_adds_summary_within_budget():
+    tokenizer = CountingTokenizer()
+    memory = ConversationMemory(tokenizer, overflow="summarise_oldest", summary_share=0.5)
+    fill(memory, 10)
+    packed = memory.pack(40)
+    summary, recent = packed[0], packed[1:]
+    assert summary["role"] == "system"
+    assert summary["content"].startswith("Summary of earlier conversation: ")
+    assert recent == memory.messages[-len(recent):]
+    assert sum(memory.count_tokens(ConversationMemory.render(m)) for m in packed) <= 40
+
+    calls = tokenizer.calls
+    assert memory.pack(40) == packed  # The cached summary is reused
+    assert tokenizer.calls == calls
+
+
+def test_unknown_overflow_strategy():
+    with pytest.raises(ValueError):
+        ConversationMemory(overflow="forget_everything")
+
+
+def test_processor_prompt_stays_within_context_window(tiny_pipeline):
+    from interface.pipeline_processor import PipelineProcessor
+
+    processor = PipelineProcessor(tiny_pipeline, max_new_tokens=32, do_sample=False, context_window=160)
+    system = {"role": "system", "content": "You are a terse assistant."}
+    for i in range(40):
+        processor.update_conversation("user", f"Tell me fact number {i} about the moon, please.")
+        processor.update_conversation("agent", f"Fact {i}: the moon is far away.")
+
+    prompt = processor._format_prompt([system, {"role": "user", "content": "One more?"}])
+    tokens = len(tiny_pipeline.tokenizer(prompt).input_ids)
+    assert tokens + processor.max_new_tokens <= processor.context_window
+    assert prompt.startswith("system: You are a terse assistant.\n")
+    assert prompt.endswith("user: One more?\n")
+    assert "Fact 39:" in prompt and "Fact 0:" not in prompt
+
+    assert "Fact" not in processor._format_prompt([system], include_history=False)
+    processor.reset_conversation()
+    assert processor.conversation_history == []
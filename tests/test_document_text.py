@@ -0,0 +1,171 @@
+import os
+import sys
+import time
+
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+import pytest
+
+from agent import Agent
+from agent.document_text import DocumentTextCache, iter_document_matches, pdfsearch_extractor
+
+
+class FakeExtractor:
+    """Page texts from a dict, recording which paths were extracted."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def __call__(self, paths):
+        self.calls.append(sorted(paths))
+        return {path: self.pages.get(os.path.basename(path), []) for path in paths}
+
+
+def write_pdf(path, pages):
+    """Minimal PDF with one line of Helvetica text per page."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+                       b"/Resources << /Font << /F1 3 0 R >> >> >>" % len(objects))
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % k for k in kids), len(kids))
+    body, offsets = b"%PDF-1.4\n", []
+    for number, content in enumerate(objects, start=1):
+        offsets.append(len(body))
+        body += b"%d 0 obj\n%s\nendobj\n" % (number, content)
+    xref = len(body)
+    body += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    body += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    body += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as file:
+        file.write(body)
+
+
+def make_documents(root):
+    paths = []
+    for name in ("a.pdf", "b.pdf"):
+        path = os.path.join(root, name)
+        with open(path, "wb") as file:
+            file.write(b"%PDF-1.4 " + name.encode())
+        paths.append(path)
+    return paths
+
+
+def test_unchanged_documents_are_never_extracted_twice(tmp_path):
+    a, b = make_documents(str(tmp_path))
+    extractor = FakeExtractor({"a.pdf": ["intro", "the needle\nmore"], "b.pdf": ["no match"]})
+    cache = DocumentTextCache(str(tmp_path / "cache"), extractor=extractor)
+
+    assert list(iter_document_matches(cache, [a, b], "NEEDLE")) == [(a, 2, "the needle")]
+    assert extractor.calls == [[a, b]]  # Both stale documents in one batch
+
+    reopened = DocumentTextCache(str(tmp_path / "cache"), extractor=extractor)
+    assert list(iter_document_matches(reopened, [a, b], "needle")) == [(a, 2, "the needle")]
+    assert len(extractor.calls) == 1
+
+    later = time.time() + 10
+    os.utime(a, (later, later))  # Touched, same bytes: hashed, not extracted
+    assert dict(reopened.pages([a])) == {a: ["intro", "the needle\nmore"]}
+    assert len(extractor.calls) == 1
+
+    with open(b, "ab") as file:
+        file.write(b" changed")
+    extractor.pages["b.pdf"] = ["a needle now"]
+    assert list(iter_document_matches(reopened, [a, b], "needle", case_sensitive=True)) == [
+        (a, 2, "the needle"), (b, 1, "a needle now")]
+    assert extractor.calls[1:] == [[b]]
+
+
+def test_unparseable_documents_are_cached_empty(tmp_path):
+    a, _ = make_documents(str(tmp_path))
+    extractor = FakeExtractor({})
+    cache = DocumentTextCache(str(tmp_path / "cache"), extractor=extractor)
+    assert dict(cache.pages([a, str(tmp_path / "missing.pdf")])) == {a: []}
+    assert dict(cache.pages([a])) == {a: []}
+    assert len(extractor.calls) == 1
+
+
+def test_missing_extractor_is_reported_once(tmp_path, monkeypatch, caplog):
+    import agent.document_text as document_text
+    monkeypatch.setattr(document_text, "default_extractor", lambda workers=None: None)
+    monkeypatch.setattr(document_text, "_warned_no_extractor", False)
+    a, b = make_documents(str(tmp_path))
+    with caplog.at_level("WARNING"):
+        for name in ("first", "second"):
+            cache = DocumentTextCache(str(tmp_path / name))
+            assert list(cache.pages([a, b])) == []
+            assert list(cache.pages([a])) == []
+    assert [record.getMessage() for record in caplog.records if "Skipping PDFs" in record.getMessage()] == [
+        "Skipping PDFs: install pypdf (pip install -r requirements.txt) or build apps/pdfsearch (cargo build --release)"]
+
+
+def test_pdfsearch_batch_output_is_parsed(tmp_path):
+    a, b = make_documents(str(tmp_path))
+    binary = tmp_path / "pdfsearch"
+    # Stands in for the Rust binary's --pages mode: pages out of order, one line per page
+    binary.write_text(
+        f"#!{sys.executable}\n"
+        "import json, sys\n"
+        "assert sys.argv[1] == '--pages'\n"
+        "for path in reversed(sys.argv[2:]):\n"
+        "    for page in (2, 1):\n"
+        "        print(json.dumps({'file': path, 'page': page, 'text': f'page {page} of {path[-5:]}'}))\n"
+    )
+    binary.chmod(0o755)
+    pages = pdfsearch_extractor(str(binary))([a, b])
+    assert pages == {a: ["page 1 of a.pdf", "page 2 of a.pdf"], b: ["page 1 of b.pdf", "page 2 of b.pdf"]}
+
+
+@pytest.mark.parametrize("failure, timeout", [("sys.exit(3)", 30.0), ("time.sleep(30)", 0.5)])
+def test_a_failed_pdfsearch_run_caches_nothing(tmp_path, failure, timeout):
+    a, b = make_documents(str(tmp_path))
+    binary = tmp_path / "pdfsearch"
+    # Prints a's page, then dies (or hangs) before finishing b
+    binary.write_text(
+        f"#!{sys.executable}\n"
+        "import json, sys, time\n"
+        "print(json.dumps({'file': sys.argv[2], 'page': 1, 'text': 'needle'}), flush=True)\n"
+        f"{failure}\n"
+    )
+    binary.chmod(0o755)
+    cache = DocumentTextCache(str(tmp_path / "cache"), extractor=pdfsearch_extractor(str(binary), timeout=timeout))
+    assert dict(cache.pages([a, b])) == {}
+
+    extractor = FakeExtractor({"a.pdf": ["needle"], "b.pdf": ["other"]})
+    cache.extractor = extractor
+    assert dict(cache.pages([a, b])) == {a: ["needle"], b: ["other"]}
+    assert extractor.calls == [[a, b]]  # Neither was cached by the failed run
+
+
+def test_pypdf_extraction(tmp_path):
+    pytest.importorskip("pypdf")
+    from agent.document_text import pypdf_extractor
+
+    paths = [str(tmp_path / "one.pdf"), str(tmp_path / "two.pdf")]
+    write_pdf(paths[0], ["First page", "Second page with a needle"])
+    write_pdf(paths[1], ["Nothing here"])
+    cache = DocumentTextCache(str(tmp_path / "cache"), extractor=pypdf_extractor(workers=2))
+    assert list(iter_document_matches(cache, paths, "needle")) == [(paths[0], 2, "Second page with a needle")]
+
+
+def test_content_search_reports_pages(tmp_path, monkeypatch):
+    monkeypatch.setenv("AGENT_CACHE_DIR", str(tmp_path / "cache"))
+    tree = tmp_path / "tree"
+    tree.mkdir()
+    make_documents(str(tree))
+    (tree / "notes.txt").write_text("a needle in text\n")
+    agent = Agent(base_directory=str(tree))
+    agent.document_text = DocumentTextCache(str(tmp_path / "text"),
+                                            extractor=FakeExtractor({"b.pdf": ["", "needle on page two"]}))
+    agent.search_directory()
+
+    result = agent.process_operation("content_search", "find needle in files")
+    assert "In notes.txt: 1: a needle in text" in result
+    assert "In b.pdf: page 2: needle on page two" in result
+    assert agent.find_string_in_files("needle")[str(tree / "b.pdf")] == ["needle on page two"]
+    assert len(list(agent.iter_string_in_files("needle", max_results=1, workers=1))) == 1
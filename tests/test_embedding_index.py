@@ -0,0 +1,141 @@
+import os
+import sys
+
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from agent import Agent
+from agent.embedding_index import EmbeddingIndex, HashingEmbedder, chunk_text
+from interface import Interface
+
+FILES = {
+    "config.py": "def load_config(path):\n    \"\"\"Read the YAML settings file.\"\"\"\n    return yaml.safe_load(open(path))\n",
+    "server.py": "def start_server(port):\n    \"\"\"Listen for HTTP requests on the port.\"\"\"\n    app.run(port=port)\n",
+    "notes.md": "# Shopping\nMilk, eggs and bread for the weekend.\n",
+}
+
+
+class CountingEmbedder(HashingEmbedder):
+    def __init__(self):
+        super().__init__(dim=256)
+        self.embedded = 0
+
+    def embed(self, texts):
+        self.embedded += len(texts)
+        return super().embed(texts)
+
+
+def write_tree(root, files=FILES):
+    for name, content in files.items():
+        with open(os.path.join(root, name), "w", encoding="utf-8") as file:
+            file.write(content)
+    return sorted(os.path.join(root, name) for name in files)
+
+
+def test_chunks_are_whole_overlapping_lines():
+    text = "\n".join(f"line {i:02d}" for i in range(1, 21))
+    chunks = chunk_text(text, max_chars=40, overlap_lines=1)
+    assert chunks[0] == (1, 5, "line 01\nline 02\nline 03\nline 04\nline 05")
+    assert chunks[1][0] == 5  # One line of overlap
+    assert chunks[-1][1] == 20
+    assert chunk_text("\n\n  \n") == []
+
+
+def test_hashing_embedder_splits_identifiers():
+    embedder = HashingEmbedder()
+    snake, camel, other = embedder.embed(["load_config", "loadConfig", "start server"])
+    assert float(snake @ camel) > 0.3 > abs(float(snake @ other))
+    assert np.allclose(np.linalg.norm(embedder.embed(["a b c"]), axis=1), 1.0)
+
+
+def test_search_and_incremental_updates(tmp_path):
+    tree = tmp_path / "tree"
+    tree.mkdir()
+    paths = write_tree(str(tree))
+    embedder = CountingEmbedder()
+    index = EmbeddingIndex(str(tmp_path / "index"), embedder)
+    assert index.update(paths) == {"indexed": 3, "unchanged": 0, "removed": 0, "chunks": 3}
+    index.save()
+    assert index.search("where are the yaml settings loaded", k=1)[0].path == str(tree / "config.py")
+    top = index.search("http port", k=2)
+    assert top[0].path == str(tree / "server.py") and top[0].score >= top[1].score
+    assert (top[0].start_line, top[0].end_line) == (1, 3)
+
+    embedded = embedder.embedded
+    reopened = EmbeddingIndex(str(tmp_path / "index"), embedder)
+    assert reopened.update(paths)["unchanged"] == 3 and embedder.embedded == embedded
+
+    with open(tree / "notes.md", "w", encoding="utf-8") as file:
+        file.write("# Deployment\nThe server listens on port 8080 behind nginx.\n")
+    os.remove(tree / "config.py")
+    stats = reopened.update([path for path in paths if not path.endswith("config.py")])
+    assert stats == {"indexed": 1, "unchanged": 1, "removed": 1, "chunks": 1}
+    assert embedder.embedded == embedded + 1  # Only the changed file was embedded again
+    assert {s.path for s in reopened.search("yaml settings", k=5)} == {str(tree / "server.py"), str(tree / "notes.md")}
+
+
+def test_tombstones_are_compacted_away(tmp_path):
+    tree = tmp_path / "tree"
+    tree.mkdir()
+    paths = write_tree(str(tree))
+    index = EmbeddingIndex(str(tmp_path / "index"), HashingEmbedder(dim=64))
+    index.update(paths)
+    for _ in range(1100):
+        index._forget(paths[0])
+        index.update(paths)
+    assert index.rows > 1000
+    index.save()
+    assert index.rows == index.live_rows == 3
+    assert os.path.getsize(index.vectors_path) == 3 * 64 * 4
+    reopened = EmbeddingIndex(str(tmp_path / "index"), HashingEmbedder(dim=64))
+    assert reopened.search("yaml settings", k=1)[0].path == paths[0]
+
+
+def test_partitioned_search_matches_brute_force(tmp_path):
+    tree = tmp_path / "tree"
+    tree.mkdir()
+    topics = ["python parser", "gpu kernel", "http server", "sql query", "tensor shape", "file cache"]
+    files = {f"doc{i:03d}.txt": f"{topics[i % len(topics)]} note {i} word{i}\n" for i in range(300)}
+    paths = write_tree(str(tree), files)
+    index = EmbeddingIndex(str(tmp_path / "index"), HashingEmbedder(dim=128), ivf_threshold=100, nprobe=4)
+    index.update(paths)
+    assert index.centroids is not None and len(index.centroids) == 17
+
+    query = files["doc042.txt"]
+    exhaustive = index.search(query, k=5, nprobe=len(index.centroids))
+    assert exhaustive[0].path == str(tree / "doc042.txt")
+    probed = index.search(query, k=5)
+    assert probed[0].path == exhaustive[0].path and probed[0].score == pytest.approx(exhaustive[0].score)
+
+    # Four of the 17 partitions hold a fraction of the rows
+    probes = np.argsort(-(index.centroids @ index.embedder.embed([query])[0]))[:4]
+    assert np.isin(index.assignment, probes).sum() < index.rows / 2
+
+
+def test_prompt_gets_relevant_excerpts_within_the_budget(tmp_path, monkeypatch):
+    monkeypatch.setenv("AGENT_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.delenv("AGENT_EMBEDDING_MODEL", raising=False)
+    tree = tmp_path / "tree"
+    tree.mkdir()
+    write_tree(str(tree))
+    agents = {"karen": Agent(base_directory=str(tree))}
+    prompt = agents["karen"].agent_prompt["prompt"]
+
+    messages = Interface.prepare_model_messages("how are yaml settings loaded?", agents, context_tokens=200)
+    assert messages[0] == {"role": "system", "content": prompt}
+    assert messages[1]["role"] == "system"
+    assert messages[1]["content"].startswith("Relevant excerpts from the files:\n--- config.py:1-3 ---\n")
+    assert (len(messages[1]["content"]) + 3) // 4 <= 200
+    assert messages[2] == {"role": "user", "content": "how are yaml settings loaded?"}
+
+    small = Interface.retrieval_context("how are yaml settings loaded?", agents["karen"], budget=10)
+    assert small == ""  # Nothing fits
+    single = Interface.prepare_model_input("yaml settings", agents, context_tokens=60)
+    assert single["content"].startswith(f"{prompt}\nRelevant excerpts from the files:\n--- config.py")
+    assert single["content"].endswith("User: yaml settings")
+    assert Interface.prepare_model_messages("hi", agents) == [
+        {"role": "system", "content": prompt}, {"role": "user", "content": "hi"}]
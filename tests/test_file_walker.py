@@ -0,0 +1,79 @@
+import os
+import sys
+
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+from agent import Agent
+from agent.file_walker import ExcludeRules, FileWalker
+
+
+def touch(root, rel_path, text="x"):
+    path = os.path.join(root, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(text)
+    return path
+
+
+def age(root, seconds=10):
+    """Push directory mtimes out of the racy window so their listings are reusable."""
+    for dirpath, _, _ in os.walk(root):
+        st = os.stat(dirpath)
+        os.utime(dirpath, ns=(st.st_atime_ns, st.st_mtime_ns - seconds * 10**9))
+
+
+def test_exclude_rules():
+    rules = ExcludeRules(["target/", "*.log", "/build", "docs/**/draft*", "!keep.log"])
+    assert rules.excluded("apps/pdfsearch/target", True)
+    assert not rules.excluded("apps/pdfsearch/target", False)
+    assert rules.excluded("a/b/run.log", False)
+    assert not rules.excluded("a/keep.log", False)
+    assert rules.excluded("build", True)
+    assert not rules.excluded("src/build", True)
+    assert rules.excluded("docs/x/y/draft1.md", False)
+
+
+def test_walk_excludes_depth_and_duplicate_names(tmp_path):
+    root = str(tmp_path)
+    a = touch(root, "pkg/__init__.py")
+    b = touch(root, "pkg/sub/__init__.py")
+    touch(root, ".git/HEAD")
+    touch(root, "apps/pdfsearch/target/out.txt")
+    touch(root, "env/pyvenv.cfg")
+    touch(root, "env/lib/site.py")
+    top = touch(root, "README.md")
+
+    paths = [entry.path for entry in FileWalker(root).walk()]
+    assert paths == [top, a, b]
+    assert [e.path for e in FileWalker(root, max_depth=1).walk()] == [top, a]
+    assert [e.path for e in FileWalker(root).walk([".md"])] == [top]
+
+
+def test_manifest_reuses_unchanged_directories(tmp_path):
+    root = str(tmp_path / "tree")
+    manifest = str(tmp_path / "manifest.json")
+    for i in range(3):
+        touch(root, f"d{i}/f.txt")
+    age(root)
+
+    first = FileWalker(root, manifest_path=manifest)
+    assert len(list(first.walk())) == 3
+    assert first.stats == {"listed": 4, "reused": 0}
+
+    second = FileWalker(root, manifest_path=manifest)
+    assert len(list(second.walk())) == 3
+    assert second.stats == {"listed": 0, "reused": 4}
+
+    new_file = touch(root, "d1/g.txt")
+    third = FileWalker(root, manifest_path=manifest)
+    assert new_file in [entry.path for entry in third.walk()]
+    assert third.stats == {"listed": 1, "reused": 3}
+
+
+def test_search_directory_keys_by_full_path(tmp_path, monkeypatch):
+    monkeypatch.setenv("AGENT_CACHE_DIR", str(tmp_path / "cache"))
+    root = str(tmp_path / "tree")
+    one = touch(root, "a/config.json")
+    two = touch(root, "b/config.json")
+    files = Agent(base_directory=root).search_directory()
+    assert files == {one: "config.json", two: "config.json"}
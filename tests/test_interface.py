@@ -1,25 +1,48 @@
-import logging
+import sys
 
 from os.path import dirname, join, abspath
 sys.path.insert(0, abspath(join(dirname(__file__), '..')))
-from interface import PipelineProcessor, Interface
+
 from agent import Agent
+from interface import Interface
+
+
+def test_prepare_model_input_and_messages():
+    agents = {"supervisor": Agent(), "helper": Agent()}
+    prompt = agents["supervisor"].agent_prompt["prompt"]
+    assert Interface.prepare_model_input("  hi  ", agents) == {"role": "user", "content": f"{prompt}\nUser: hi"}
+    assert Interface.prepare_model_messages("  hi  ", agents) == [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": "hi"},
+    ]
+    # Without agents only the user's message is sent
+    assert Interface.prepare_model_input("hi", {}) == {"role": "user", "content": "hi"}
+    assert Interface.prepare_model_messages("hi", {}) == [{"role": "user", "content": "hi"}]
+
+
+def test_get_user_input(monkeypatch):
+    monkeypatch.setattr("builtins.input", lambda prompt: "  list files \n")
+    assert Interface.get_user_input() == "list files"
+
+    def end_of_input(prompt):
+        raise EOFError
+
+    monkeypatch.setattr("builtins.input", end_of_input)
+    assert Interface.get_user_input() == "exit"
+
+
+def test_display_response_string(capsys):
+    assert Interface.display_response("  done \n") == "  done \n"
+    assert capsys.readouterr().out == "done\n"
+
 
-# Example usage (for testing)
-if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO)
-
-    # Mock agents and processor for testing
-    agents = {"supervisor": Agent(agent_config="supervisor")}
-    processor = PipelineProcessor(pipeline=None)  # Assuming this works with None for testing
-
-    # Test the interface
-    while True:
-        user_input = Interface.get_user_input()
-        if user_input.lower() in ["exit", "quit"]:
-            break
-        response = agents["supervisor"].handle_prompt(user_input)
-        final_response = Interface.process_agent_collaboration(
-            processor, agents["supervisor"], agents, response
-        )
-        Interface.display_response(final_response or response)
\ No newline at end of file
+def test_collaboration_with_real_agents(tmp_path, monkeypatch):
+    monkeypatch.setenv("AGENT_CACHE_DIR", str(tmp_path / "cache"))
+    (tmp_path / "notes.txt").write_text("todo\n")
+    agents = {"supervisor": Agent(str(tmp_path)), "finder": Agent(str(tmp_path))}
+    result = Interface.process_agent_collaboration(
+        None, agents["supervisor"], agents, "Checking.\nAGENT:finder:search directory files"
+    )
+    lines = result.splitlines()
+    assert lines[0] == "Checking."
+    assert lines[1].startswith("finder: ") and "Found files: notes.txt" in result
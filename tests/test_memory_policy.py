@@ -0,0 +1,170 @@
+import sys
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from interface.pipeline_processor.memory_manager import MemoryManager, MemoryPolicy, MemoryReading
+
+GIB = 2 ** 30
+MESSAGES = [{"role": "user", "content": "Hello there, how are you"}]
+
+
+class SimulatedDevice:
+    """Memory reader with settable usage, standing in for a GPU."""
+
+    def __init__(self, used: int = 0, limit: int = 8 * GIB):
+        self.used = used
+        self.limit = limit
+
+    def __call__(self) -> MemoryReading:
+        return MemoryReading(device="sim", used=self.used, peak=self.used, limit=self.limit)
+
+
+@pytest.fixture
+def clears(monkeypatch):
+    calls = []
+    monkeypatch.setattr(MemoryManager, "clear_memory", staticmethod(lambda: calls.append(1)))
+    return calls
+
+
+def oom_above(monkeypatch, model, max_tokens):
+    """Make model.generate fail like an exhausted GPU when prompt plus new tokens exceed max_tokens."""
+    generate = model.generate
+    attempts = []
+
+    def limited(*args, **kwargs):
+        tokens = kwargs["input_ids"].shape[1] + kwargs["max_new_tokens"]
+        attempts.append((kwargs["input_ids"].shape[1], kwargs["max_new_tokens"]))
+        if tokens > max_tokens:
+            raise torch.cuda.OutOfMemoryError("CUDA out of memory. Tried to allocate 2.00 GiB")
+        return generate(*args, **kwargs)
+
+    monkeypatch.setattr(model, "generate", limited)
+    return attempts
+
+
+def processor(pipeline, **kwargs):
+    from interface.pipeline_processor import PipelineProcessor
+    policy = MemoryPolicy(reader=SimulatedDevice(), min_new_tokens=8, min_context=32)
+    return PipelineProcessor(pipeline, do_sample=False, memory_policy=policy, **kwargs)
+
+
+def test_cache_is_cleared_only_above_the_threshold(clears):
+    device = SimulatedDevice(used=4 * GIB)
+    policy = MemoryPolicy(threshold=0.75, reader=device)
+    assert not policy.maybe_clear() and clears == []
+    assert policy.headroom() == 2 * GIB
+    assert policy.can_admit(GIB) and not policy.can_admit(3 * GIB)
+
+    device.used = 7 * GIB
+    assert policy.maybe_clear() and clears == [1]
+    assert policy.headroom() == 0
+
+
+def test_limit_override_simulates_a_smaller_device():
+    policy = MemoryPolicy(threshold=0.5, limit_bytes=2 * GIB, reader=SimulatedDevice(used=GIB // 2))
+    assert policy.read().limit == 2 * GIB
+    assert policy.headroom() == GIB // 2
+
+
+def test_cpu_reading_uses_the_process():
+    reading = MemoryPolicy(device="cpu").read()
+    assert reading.device == "cpu"
+    assert 0 < reading.used <= reading.peak and reading.used < reading.limit
+
+
+def test_degrade_shrinks_to_the_floors_then_gives_up():
+    policy = MemoryPolicy(reader=SimulatedDevice(), max_retries=3, min_new_tokens=64, min_context=512)
+    assert policy.degrade(1, 4096, 1024) == (2048, 512)
+    assert policy.degrade(2, 4096, 1024) == (1024, 256)
+    assert policy.degrade(4, 4096, 1024) is None  # Past max_retries
+    assert policy.degrade(1, 1024, 4096) == (512, 256)  # Generation gets at most half the window
+    small = MemoryPolicy(reader=SimulatedDevice(), max_retries=3, min_new_tokens=64, min_context=512)
+    assert small.degrade(1, 512, 64) == (512, 64)
+    assert small.degrade(2, 512, 64) is None  # Nothing left to shrink
+
+
+def test_is_oom():
+    assert MemoryPolicy.is_oom(torch.cuda.OutOfMemoryError("CUDA out of memory"))
+    assert MemoryPolicy.is_oom(RuntimeError("DefaultCPUAllocator: can't allocate memory: you tried to allocate 1"))
+    assert MemoryPolicy.is_oom(MemoryError())
+    assert not MemoryPolicy.is_oom(RuntimeError("shape mismatch"))
+    assert not MemoryPolicy.is_oom(ValueError("out of memory"))
+
+
+def test_complete_retries_with_smaller_limits(tiny_pipeline, monkeypatch, clears):
+    reference = processor(tiny_pipeline, max_new_tokens=16).complete(MESSAGES)
+    attempts = oom_above(monkeypatch, tiny_pipeline.model, 40)
+    text = processor(tiny_pipeline, max_new_tokens=64, context_window=128).complete(MESSAGES)
+    prompt_tokens = attempts[0][0]
+    assert attempts == [(prompt_tokens, 64), (prompt_tokens, 32), (prompt_tokens, 16)]
+    assert text == reference  # Greedy decoding: the shorter budget yields a prefix of the same reply
+    assert len(clears) == 2
+
+
+def test_retry_truncates_a_long_prompt(tiny_pipeline, monkeypatch, clears):
+    attempts = oom_above(monkeypatch, tiny_pipeline.model, 64)
+    messages = [{"role": "user", "content": "word " * 200}]
+    assert processor(tiny_pipeline, max_new_tokens=16, context_window=128).complete(messages)
+    assert attempts[-1] == (64 - 8, 8)  # Prompt cut to the 64 token window minus the 8 new tokens
+
+
+def test_process_records_the_turn_once_after_retrying(tiny_pipeline, monkeypatch, clears):
+    from agent import Agent
+
+    attempts = oom_above(monkeypatch, tiny_pipeline.model, 40)
+    pipeline_processor = processor(tiny_pipeline, max_new_tokens=64, context_window=128)
+    response = pipeline_processor.process(MESSAGES, Agent("Karen"))
+    assert len(attempts) == 3
+    assert not response.startswith(("Memory error", "Error", "Pipeline"))
+    roles = [message["role"] for message in pipeline_processor.conversation_history]
+    assert roles == ["user", "agent"]
+
+
+def test_process_reports_exhausted_retries(tiny_pipeline, monkeypatch, clears):
+    from agent import Agent
+
+    oom_above(monkeypatch, tiny_pipeline.model, 0)
+    pipeline_processor = processor(tiny_pipeline, max_new_tokens=64, context_window=128)
+    assert pipeline_processor.process(MESSAGES, Agent("Karen")) == "Memory error occurred. Try with shorter input."
+    assert len(clears) == 3  # Two retries and the final failure
+
+
+def test_stream_retries_before_the_first_chunk(tiny_pipeline, monkeypatch, clears):
+    reference = processor(tiny_pipeline, max_new_tokens=16).complete(MESSAGES)
+    attempts = oom_above(monkeypatch, tiny_pipeline.model, 40)
+    chunks = list(processor(tiny_pipeline, max_new_tokens=64, context_window=128).complete_stream(MESSAGES))
+    assert len(attempts) == 3
+    assert "".join(chunks).strip() == reference
+
+
+def test_scheduler_admits_within_headroom(tiny_pipeline):
+    from interface.pipeline_processor.scheduler import ContinuousBatchScheduler, SamplingParams
+
+    params = SamplingParams(max_new_tokens=8, do_sample=False)
+    prompts = ["Hello there", "What is a memory map?", "List three prime numbers", "Good night"]
+    unconstrained = ContinuousBatchScheduler(tiny_pipeline.model, tiny_pipeline.tokenizer)
+    futures = [unconstrained.submit(prompt, params) for prompt in prompts]
+    unconstrained.run_until_idle()
+    expected = [future.result().token_ids for future in futures]
+
+    device = SimulatedDevice(limit=scheduler_bytes(tiny_pipeline, 20))
+    scheduler = ContinuousBatchScheduler(tiny_pipeline.model, tiny_pipeline.tokenizer,
+                                         memory_policy=MemoryPolicy(threshold=1.0, reader=device))
+    futures = [scheduler.submit(prompt, params) for prompt in prompts]
+    running = []
+    while scheduler.has_work():
+        device.used = scheduler_bytes(tiny_pipeline, sum(s.length for s in scheduler.running))
+        scheduler.step()
+        running.append(len(scheduler.running))
+    assert [future.result().token_ids for future in futures] == expected
+    assert max(running) == 1  # Room for one request's KV cache at a time
+    assert scheduler.stats()["deferred_for_memory"] > 0
+
+
+def scheduler_bytes(pipeline, tokens):
+    from interface.pipeline_processor.scheduler import kv_cache_bytes_per_token
+    return kv_cache_bytes_per_token(pipeline.model) * tokens
@@ -0,0 +1,105 @@
+import gc
+import sys
+import time
+
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+from metrics import REGISTRY, MetricsRegistry
+
+
+def series(snapshot, kind, name, **labels):
+    for entry in snapshot[kind].get(name, []):
+        if entry["labels"] == {key: str(value) for key, value in labels.items()}:
+            return entry
+    return None
+
+
+def test_histogram_buckets_and_quantiles():
+    registry = MetricsRegistry(namespace="test")
+    for value in [0.002] * 50 + [0.02] * 40 + [3.0] * 10:
+        registry.observe("latency_seconds", value, "Request latency", route="/a")
+    entry = series(registry.snapshot(), "histograms", "latency_seconds", route="/a")
+    assert entry["count"] == 100 and abs(entry["sum"] - 30.9) < 1e-9
+    assert entry["buckets"]["0.0025"] == 50 and entry["buckets"]["0.025"] == 90 and entry["buckets"]["+Inf"] == 100
+    assert 0.001 < entry["p50"] <= 0.0025
+    assert 0.01 < entry["p90"] <= 0.025
+    assert 2.5 < entry["p99"] <= 5.0
+
+
+def test_prometheus_text():
+    registry = MetricsRegistry(namespace="test")
+    registry.inc("requests_total", 2, "Requests", status="200")
+    registry.set("queue_depth", 3, "Waiting requests")
+    registry.observe("latency_seconds", 0.3, "Latency", buckets=(0.1, 1.0), route='say "hi"')
+    assert registry.prometheus().splitlines() == [
+        "# HELP test_latency_seconds Latency",
+        "# TYPE test_latency_seconds histogram",
+        'test_latency_seconds_bucket{route="say \\"hi\\"",le="0.1"} 0',
+        'test_latency_seconds_bucket{route="say \\"hi\\"",le="1.0"} 1',
+        'test_latency_seconds_bucket{route="say \\"hi\\"",le="+Inf"} 1',
+        'test_latency_seconds_sum{route="say \\"hi\\""} 0.3',
+        'test_latency_seconds_count{route="say \\"hi\\""} 1',
+        "# HELP test_queue_depth Waiting requests",
+        "# TYPE test_queue_depth gauge",
+        "test_queue_depth 3",
+        "# HELP test_requests_total Requests",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{status="200"} 2',
+    ]
+
+
+def test_collectors_and_weak_references():
+    registry = MetricsRegistry()
+
+    class Queue:
+        def collect(self, registry):
+            registry.set("depth", 7)
+
+    queue = Queue()
+    registry.add_collector(queue.collect)
+    assert series(registry.snapshot(), "gauges", "depth")["value"] == 7
+    del queue
+    gc.collect()
+    registry.reset()
+    registry.snapshot()
+    assert registry.collectors == [] and "depth" not in registry.gauges
+
+
+def test_recording_overhead_is_small():
+    registry = MetricsRegistry()
+    start = time.perf_counter()
+    for i in range(20000):
+        with registry.timer("op_seconds", operation="read"):
+            pass
+        registry.inc("ops_total", operation="read")
+    per_call = (time.perf_counter() - start) / 20000
+    assert per_call < 50e-6
+    assert series(registry.snapshot(), "histograms", "op_seconds", operation="read")["count"] == 20000
+
+
+def test_processor_and_tool_timings(tiny_pipeline, tmp_path, monkeypatch):
+    from agent import Agent
+    from interface.pipeline_processor import PipelineProcessor
+
+    monkeypatch.setenv("AGENT_CACHE_DIR", str(tmp_path / "cache"))
+    before = REGISTRY.snapshot()
+    processor = PipelineProcessor(tiny_pipeline, max_new_tokens=8, do_sample=False)
+    processor.complete([{"role": "user", "content": "Hello there"}])
+    Agent(str(tmp_path)).process_operation("file_search", "")
+    after = REGISTRY.snapshot()
+
+    def count(kind, name, field="count", **labels):
+        entries = [series(snapshot, kind, name, **labels) for snapshot in (before, after)]
+        return [(entry or {}).get(field, 0) for entry in entries]
+
+    for name in ["prompt_format_seconds", "tokenize_seconds"]:
+        start, end = count("histograms", name)
+        assert end == start + 1, name
+    for name in ["generation_seconds", "time_to_first_token_seconds", "decode_tokens_per_second"]:
+        start, end = count("histograms", name, mode="generate")
+        assert end == start + 1, name
+    start, end = count("counters", "generated_tokens_total", "value", mode="generate")
+    assert end - start == 8
+    start, end = count("histograms", "tool_seconds", operation="file_search")
+    assert end == start + 1
@@ -0,0 +1,146 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+import pytest
+
+from benchmarks.bench_startup import heavy_imports, profile_imports
+
+REPO_ROOT = abspath(join(dirname(__file__), '..'))
+
+
+def test_mmap_state_dict_matches_checkpoint(tiny_model_dir):
+    import torch
+    from safetensors.torch import load_file
+    from model_host import load_mmap_state_dict, safetensors_files
+
+    files = safetensors_files(tiny_model_dir)
+    mapped = load_mmap_state_dict(files)
+    loaded = load_file(files[0])
+    assert mapped.keys() == loaded.keys()
+    for name, tensor in loaded.items():
+        assert torch.equal(mapped[name], tensor)
+
+
+@pytest.fixture(scope="module")
+def shared_processor(tiny_model_dir):
+    from interface.pipeline_processor import PipelineProcessor
+    from model_host import load_shared_pipeline
+
+    return PipelineProcessor(load_shared_pipeline(tiny_model_dir), max_new_tokens=8, do_sample=False)
+
+
+def test_shared_pipeline_generates_like_from_pretrained(tiny_pipeline, shared_processor):
+    from interface.pipeline_processor import PipelineProcessor
+
+    messages = [{"role": "user", "content": "Hello there"}]
+    reference = PipelineProcessor(tiny_pipeline, max_new_tokens=8, do_sample=False)
+    assert shared_processor.complete(messages) == reference.complete(messages)
+    assert shared_processor.pipeline.load_report.precision == "float32"
+
+
+def test_client_round_trip(tmp_path, shared_processor):
+    from model_host import ModelClient, ModelHost
+
+    host = ModelHost(shared_processor, str(tmp_path / "host.sock"))
+    host.bind()
+    thread = threading.Thread(target=host.serve_forever, daemon=True)
+    thread.start()
+    try:
+        client = ModelClient(host.socket_path, timeout=30)
+        assert client.context_window == shared_processor.context_window
+        messages = [{"role": "user", "content": "Hello there"}]
+        assert client.complete(messages) == shared_processor.complete(messages)
+
+        first = "".join(client.process_stream(messages))
+        assert first.strip() == shared_processor.complete(messages)
+        # The second turn sees the first one through the host-side history
+        with_history = messages + [{"role": "agent", "content": first}, {"role": "user", "content": "Again"}]
+        second = "".join(client.process_stream([{"role": "user", "content": "Again"}]))
+        assert second.strip() == shared_processor.complete(with_history)
+
+        client.reset_conversation()
+        assert "".join(client.process_stream(messages)) == first
+        assert client.metrics()["histograms"]["generation_seconds"]
+        client.close()
+    finally:
+        host.shutdown()
+
+
+def test_host_built_like_main(tmp_path, tiny_model_dir, monkeypatch):
+    # --model-host goes through build_processor, which adds an unwarmed prefix cache
+    from interface import Interface
+    from interface.pipeline_processor import PipelineProcessor
+    from main import build_processor, parse_arguments
+    from model_host import ModelClient, ModelHost
+
+    socket_path = str(tmp_path / "host.sock")
+    monkeypatch.setattr(sys, "argv", ["main.py", "--model-host", socket_path, "--precision", "fp32", "--device", "cpu"])
+    processor = build_processor(tiny_model_dir, parse_arguments(), {}, Interface())
+    assert processor.prefix_cache is not None and not processor.prefix_cache.entries
+    processor.do_sample, processor.max_new_tokens = False, 8  # Deterministic and short for the comparison
+    reference = PipelineProcessor(processor.pipeline, max_new_tokens=8, do_sample=False)
+
+    host = ModelHost(processor, socket_path)
+    host.bind()
+    thread = threading.Thread(target=host.serve_forever, daemon=True)
+    thread.start()
+    try:
+        client = ModelClient(host.socket_path, timeout=30)
+        system = [{"role": "system", "content": "You are a terse assistant. " * 4}]
+        for question in ("Hello there", "Name a prime"):  # The second one resumes from the cached system prefix
+            messages = system + [{"role": "user", "content": question}]
+            assert client.complete(messages) == reference.complete(messages)
+        assert processor.prefix_cache.entries and processor.prefix_cache.hits >= 1
+        assert "".join(client.process_stream(messages)).strip() == reference.complete(messages)
+        client.close()
+
+        # Concurrent sessions tokenize their histories while others generate on the same tokenizer
+        replies, errors = [], []
+
+        def session(n):
+            own = ModelClient(host.socket_path, timeout=60)
+            try:
+                for turn in range(3):
+                    replies.append("".join(own.process_stream([{"role": "user", "content": f"turn {turn} " * 3000}])))
+                    replies.append(own.complete(system + [{"role": "user", "content": f"client {n} " * 3000}]))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                own.close()
+
+        sessions = [threading.Thread(target=session, args=(n,)) for n in range(4)]
+        for worker in sessions:
+            worker.start()
+        for worker in sessions:
+            worker.join()
+        assert errors == [] and len(replies) == 24
+        assert not any(reply.startswith("Error") for reply in replies)
+    finally:
+        host.shutdown()
+
+
+def test_client_does_not_import_torch():
+    assert heavy_imports(profile_imports("import model_host")) == []
+
+
+def test_forked_workers_share_weights():
+    pytest.importorskip("torch")
+    if not os.path.exists("/proc/self/smaps"):
+        pytest.skip("needs /proc/<pid>/smaps")
+    proc = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_model_host", "--tiny", "--workers", "2", "--json"],
+        cwd=REPO_ROOT, capture_output=True, text=True, timeout=600
+    )
+    assert proc.returncode == 0, proc.stderr
+    report = json.loads(proc.stdout.strip().splitlines()[-1])
+    checkpoint = report["checkpoint_bytes"]
+    for worker in report["workers"]:
+        weights = worker["weights"]
+        assert weights["rss"] > 0.5 * checkpoint  # Every worker uses the weights...
+        assert weights["private"] < 0.05 * checkpoint  # ...without a private copy of them
+        assert weights["pss"] <= 0.6 * weights["rss"]  # ...and shares them with the other worker
@@ -0,0 +1,42 @@
+import sys
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def restore_torch_threads():
+    torch = pytest.importorskip("torch")
+    threads = torch.get_num_threads()
+    yield
+    torch.set_num_threads(threads)
+
+
+@pytest.mark.parametrize("precision", ["int8", "bf16"])
+def test_cpu_backend_loads_and_generates(tiny_model_dir, precision):
+    import torch
+    from pipeline import Pipeline
+
+    pipeline = Pipeline.initialize_pipeline(tiny_model_dir, device="cpu", precision=precision, num_threads=1)
+    report = pipeline.load_report
+    assert (report.device, report.precision, report.threads) == ("cpu", precision, 1)
+    assert report.load_seconds > 0 and report.rss_bytes > 0
+
+    down_proj = pipeline.model.model.layers[0].mlp.down_proj
+    if precision == "int8":
+        assert isinstance(down_proj, torch.ao.nn.quantized.dynamic.Linear)
+    else:
+        assert down_proj.weight.dtype == torch.bfloat16
+
+    assert Pipeline.measure_throughput(pipeline, max_new_tokens=4) > 0
+    assert report.tokens_per_second > 0
+
+
+def test_default_precision_follows_load_in_8bit(tiny_model_dir):
+    from pipeline import Pipeline
+
+    pipeline = Pipeline.initialize_pipeline(tiny_model_dir, load_in_8bit=False, device="cpu")
+    assert pipeline.load_report.precision == "bf16"
+    with pytest.raises(ValueError):
+        Pipeline.initialize_pipeline(tiny_model_dir, device="cpu", precision="int4")
@@ -0,0 +1,137 @@
+import sys
+
+import pytest
+
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+torch = pytest.importorskip("torch")
+from transformers import DynamicCache
+from interface import PipelineProcessor, PrefixCache
+
+
+def fake_cache(length, layers=2):
+    cache = DynamicCache()
+    for layer_idx in range(layers):
+        cache.update(torch.randn(1, 1, length, 4), torch.randn(1, 1, length, 4), layer_idx)
+    return cache
+
+
+def test_lookup_returns_longest_shared_prefix_copy():
+    cache = PrefixCache(min_prefix_tokens=2)
+    stored = fake_cache(6)
+    cache.store(torch.tensor([1, 2, 3, 4, 5, 6, 7]), stored)
+
+    reused, past = cache.lookup(torch.tensor([1, 2, 3, 9, 9]))
+    assert reused == 3
+    assert past.get_seq_length() == 3
+    assert torch.equal(past.key_cache[0], stored.key_cache[0][..., :3, :])
+    past.key_cache[0].zero_()
+    assert stored.key_cache[0].abs().sum() > 0  # the stored entry is untouched
+
+    reused, past = cache.lookup(torch.tensor([1, 2, 3, 4]))
+    assert reused == 3  # one token always left to prefill
+    assert cache.lookup(torch.tensor([8, 8, 8]))[1] is None
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_store_is_bounded_by_bytes():
+    one_entry = PrefixCache.cache_bytes(fake_cache(4))
+    cache = PrefixCache(max_bytes=2 * one_entry, min_prefix_tokens=1)
+    for start in (10, 20, 30):
+        cache.store(torch.arange(start, start + 5), fake_cache(4))
+    assert len(cache.entries) == 2
+    assert cache.total_bytes == 2 * one_entry
+    assert cache.lookup(torch.tensor([10, 11, 12]))[1] is None
+
+
+def test_cached_generation_matches_uncached(tiny_pipeline):
+    system = [{"role": "system", "content": "You are a terse assistant. " * 4}]
+    plain = PipelineProcessor(pipeline=tiny_pipeline, max_new_tokens=6, do_sample=False)
+    cached = PipelineProcessor(
+        pipeline=tiny_pipeline,
+        max_new_tokens=6,
+        do_sample=False,
+        prefix_cache=PrefixCache(min_prefix_tokens=4)
+    )
+    assert cached.warm_prefix(system) > 4
+
+    for question in ("what is a trigram?", "name a prime number"):
+        prompt = plain._format_prompt(system + [{"role": "user", "content": question}])
+        assert cached._generate_response(prompt) == plain._generate_response(prompt)
+    assert cached.prefix_cache.hits == 2
+
+
+def test_unwarmed_cache_fills_itself_from_generation(tiny_pipeline):
+    system = [{"role": "system", "content": "You are a terse assistant. " * 4}]
+    plain = PipelineProcessor(pipeline=tiny_pipeline, max_new_tokens=6, do_sample=False)
+    cached = PipelineProcessor(
+        pipeline=tiny_pipeline,
+        max_new_tokens=6,
+        do_sample=False,
+        prefix_cache=PrefixCache(min_prefix_tokens=4)
+    )
+
+    for question in ("what is a trigram?", "name a prime number"):
+        messages = system + [{"role": "user", "content": question}]
+        assert cached.complete(messages) == plain.complete(messages)
+        assert cached.prefix_cache.entries
+    assert cached.prefix_cache.hits == 1  # The second prompt resumes from the first one's system prefix
+
+
+def test_store_accepts_legacy_tuples():
+    cache = PrefixCache(min_prefix_tokens=2)
+    legacy = fake_cache(5).to_legacy_cache()
+    cache.store(torch.arange(6), legacy)
+    reused, past = cache.lookup(torch.arange(6))
+    assert reused == 5 and isinstance(past, DynamicCache)
+
+
+def test_concurrent_lookups_and_stores_keep_the_byte_count():
+    import threading
+
+    one_entry = PrefixCache.cache_bytes(fake_cache(4))
+    cache = PrefixCache(max_bytes=8 * one_entry, min_prefix_tokens=2)
+
+    def worker(offset):
+        for i in range(200):
+            start = (offset * 7 + i) % 40
+            cache.store(torch.arange(start, start + 5), fake_cache(4))
+            cache.lookup(torch.arange(start, start + 6))
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache.total_bytes == sum(size for _, _, size in cache.entries.values()) <= cache.max_bytes
+    assert cache.hits + cache.misses == 8 * 200
+
+
+def test_concurrent_complete_and_history_tokenization(tiny_pipeline):
+    import threading
+
+    processor = PipelineProcessor(
+        pipeline=tiny_pipeline, max_new_tokens=4, do_sample=False, prefix_cache=PrefixCache(min_prefix_tokens=4)
+    )
+    errors = []
+
+    def completions(n):
+        try:
+            for i in range(3):
+                processor.complete([{"role": "user", "content": f"question {n} {i} " * 1500}])
+        except Exception as e:
+            errors.append(e)
+
+    def history():
+        try:
+            for i in range(30):
+                processor.memory.tokenize(f"an old turn {i} " * 1500)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=completions, args=(n,)) for n in range(3)] + [threading.Thread(target=history)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
@@ -0,0 +1,141 @@
+import json
+import sys
+
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+import markdown
+from interface import render
+from interface.render import MarkdownRenderer, StreamRenderer, split_blocks
+
+DOCUMENT = """# Plan
+
+Some *text* here
+continued.
+
+```python
+def f():
+
+    return 1
+```
+
+| a | b |
+|---|---|
+| 1 | 2 |
+
+- one
+- two
+
+- three
+
+1. x
+2. y
+
+> quote
+
+> more
+
+    indented code
+
+    more code
+
+Final para.
+"""
+
+
+def test_blocks_render_like_the_whole_document():
+    blocks = split_blocks(DOCUMENT)
+    assert len(blocks) > 3 and "".join(blocks) == DOCUMENT
+    expected = markdown.markdown(DOCUMENT, extensions=render.MARKDOWN_EXTENSIONS)
+    assert "\n".join(MarkdownRenderer().convert(block) for block in blocks) == expected
+
+
+def test_reference_links_are_not_split():
+    text = "See [the docs][1].\n\nMore text.\n\n[1]: https://example.com\n"
+    assert split_blocks(text) == [text]
+
+
+def test_render_cache_hits_and_evicts():
+    renderer = MarkdownRenderer(max_entries=2)
+    first = renderer.render("**a**")
+    assert first == "<p><strong>a</strong></p>"
+    assert renderer.render("**a**") == first and renderer.hits == 1
+    renderer.render("b")
+    renderer.render("c")
+    assert len(renderer.cache) == 2
+    renderer.render("**a**")
+    assert renderer.misses == 4
+
+
+def test_stream_renders_only_the_tail():
+    renderer = MarkdownRenderer()
+    stream = StreamRenderer(renderer)
+    blocks = []
+    for start in range(0, len(DOCUMENT), 5):
+        first, html = stream.feed(DOCUMENT[start:start + 5])
+        assert first <= len(blocks)
+        blocks[first:] = html
+    expected = markdown.markdown(DOCUMENT, extensions=render.MARKDOWN_EXTENSIONS)
+    assert "\n".join(blocks) == stream.html == expected
+    assert renderer.misses == len(stream.blocks)  # Each closed block was rendered once
+
+
+def test_render_endpoint_accepts_json5_and_caches():
+    render.renderer.clear()
+    client = render.app.test_client()
+    response = client.post("/", json={"text": "{content: '# Hi',}"})
+    assert response.get_data(as_text=True) == "<h1>Hi</h1>"
+    hits = render.renderer.hits
+    response = client.post("/", json={"text": json.dumps({"content": "# Hi"})})
+    assert response.get_data(as_text=True) == "<h1>Hi</h1>"
+    assert render.renderer.hits == hits + 1
+    assert client.post("/", json={"text": "{}"}).status_code == 400
+
+
+def test_batch_endpoint():
+    client = render.app.test_client()
+    response = client.post("/batch", json={"messages": ["*a*", {"role": "agent", "content": "b"}, "*a*"]})
+    assert response.get_json() == {"html": ["<p><em>a</em></p>", "<p>b</p>", "<p><em>a</em></p>"]}
+    assert client.post("/batch", json={"messages": [{"role": "agent"}]}).status_code == 400
+    assert client.post("/batch", json={}).status_code == 400
+
+
+def test_generate_streams_rendered_html():
+    render.set_stream_source(lambda text: iter(["# Ti", "tle\n\nBo", "dy\n", "more"]))
+    client = render.app.test_client()
+    body = client.post("/generate?format=html", json={"text": "hi"}).get_data(as_text=True)
+    events = [json.loads(line[len("data: "):]) for line in body.splitlines() if line.startswith("data: {\"")]
+    assert [(event["from"], event["html"]) for event in events] == [
+        (0, ["<h1>Ti</h1>"]),
+        (0, ["<h1>Title</h1>\n<p>Bo</p>"]),  # "Bo" could still become a list item
+        (0, ["<h1>Title</h1>", "<p>Body</p>"]),
+        (1, ["<p>Body\nmore</p>"]),
+    ]
+
+
+def test_wsgi_entry_point():
+    from interface.wsgi import application
+    assert application is render.app
+
+
+def test_wsgi_serves_generate_from_a_model_host(tiny_pipeline, tmp_path, monkeypatch):
+    import importlib
+    import threading
+    from agent import Agent
+    from interface import Interface, wsgi
+    from interface.pipeline_processor import PipelineProcessor
+    from model_host import ModelHost
+
+    processor = PipelineProcessor(tiny_pipeline, max_new_tokens=8, do_sample=False)
+    host = ModelHost(processor, str(tmp_path / "host.sock"))
+    host.bind()
+    threading.Thread(target=host.serve_forever, daemon=True).start()
+    monkeypatch.setenv("MODEL_HOST_SOCKET", host.socket_path)
+    try:
+        importlib.reload(wsgi)
+        client = wsgi.application.test_client()
+        body = client.post("/generate?format=text", json={"text": "Hello there"}).get_data(as_text=True)
+        agent = Agent()
+        assert body.strip() == processor.complete(Interface.prepare_model_messages("Hello there", {"agent": agent}))
+    finally:
+        render.app.config.pop(render.STREAM_SOURCE_KEY, None)
+        host.shutdown()
@@ -0,0 +1,58 @@
+import sys
+import time
+
+import pytest
+
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+pytest.importorskip("torch")
+from interface import PipelineProcessor, ResponseCache
+
+
+def test_lru_ttl_and_counters():
+    cache = ResponseCache(max_bytes=2 * (8 * 3 + 64 + ResponseCache.ENTRY_OVERHEAD), ttl=0.2)
+    keys = [ResponseCache.make_key(f"prompt {i}", {"do_sample": False}) for i in range(3)]
+    for key in keys:
+        cache.put(key, [1, 2, 3])
+    assert cache.get(keys[0]) is None  # evicted by the third entry
+    assert cache.get(keys[2]) == [1, 2, 3]
+    time.sleep(0.25)
+    assert cache.get(keys[2]) is None  # expired
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+    assert cache.stats()["evictions"] == 1
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    key = ResponseCache.make_key("p", {"do_sample": False})
+    first = ResponseCache(disk_path=path)
+    first.put(key, [5, 6])
+    first.close()
+
+    second = ResponseCache(disk_path=path)
+    assert second.get(key) == [5, 6]
+    assert second.get(key) == [5, 6]
+    assert (second.disk_hits, second.hits) == (1, 1)
+
+
+def test_sampled_requests_are_opt_in():
+    assert ResponseCache().cacheable({"do_sample": False})
+    assert not ResponseCache().cacheable({"do_sample": True})
+    assert ResponseCache(cache_sampled=True).cacheable({"do_sample": True})
+
+
+def test_processor_serves_repeats_from_cache(tiny_pipeline):
+    cache = ResponseCache()
+    processor = PipelineProcessor(pipeline=tiny_pipeline, max_new_tokens=6, do_sample=False, response_cache=cache)
+    messages = [{"role": "user", "content": "same question"}]
+
+    first = processor.complete(messages)
+    assert cache.stats()["misses"] == 1
+    assert processor.complete(messages) == first
+    assert "".join(processor.complete_stream(messages)).strip() == first
+    assert cache.stats()["hits"] == 2
+
+    sampled = PipelineProcessor(pipeline=tiny_pipeline, max_new_tokens=6, response_cache=cache)
+    sampled.complete(messages)
+    assert cache.stats()["entries"] == 1
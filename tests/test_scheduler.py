@@ -0,0 +1,93 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+torch = pytest.importorskip("torch")
+from interface import PipelineProcessor
+from interface.pipeline_processor.scheduler import ContinuousBatchScheduler, SamplingParams
+
+PROMPTS = [
+    "hello there",
+    "a much longer prompt about many different things",
+    "x",
+    "hello there",
+    "another one bites the dust",
+]
+
+
+def reference_tokens(pipeline, prompt, max_new_tokens):
+    tokenizer = pipeline.tokenizer
+    inputs = tokenizer(prompt, return_tensors="pt")
+    output = pipeline.model.generate(
+        **inputs, max_new_tokens=max_new_tokens, do_sample=False, pad_token_id=tokenizer.eos_token_id
+    )[0][inputs.input_ids.shape[1]:].tolist()
+    return output[:-1] if output and output[-1] == tokenizer.eos_token_id else output
+
+
+def test_continuous_batching_matches_sequential_greedy(tiny_pipeline):
+    scheduler = ContinuousBatchScheduler(tiny_pipeline.model, tiny_pipeline.tokenizer, max_batch_size=3, bucket_width=8)
+    lengths = [5, 9, 12, 7, 3]
+    futures = [scheduler.submit(p, SamplingParams(max_new_tokens=n, do_sample=False)) for p, n in zip(PROMPTS, lengths)]
+    scheduler.run_until_idle()
+
+    for prompt, future, n in zip(PROMPTS, futures, lengths):
+        assert future.result().token_ids == reference_tokens(tiny_pipeline, prompt, n)
+    stats = scheduler.stats()
+    assert stats["completed"] == 5
+    assert stats["generated_tokens"] == sum(lengths)
+    assert stats["tokens_per_second"] > 0
+    assert stats["queue_depth"] == 0 and stats["running"] == 0
+
+
+def test_seeded_sampling_is_per_request(tiny_pipeline):
+    scheduler = ContinuousBatchScheduler(tiny_pipeline.model, tiny_pipeline.tokenizer, max_batch_size=4)
+    params = SamplingParams(max_new_tokens=6, temperature=1.0, top_k=20, top_p=0.9, seed=7)
+    first = scheduler.submit("hello there", params)
+    greedy = scheduler.submit("hello", SamplingParams(max_new_tokens=6, do_sample=False))
+    second = scheduler.submit("hello there", params)
+    scheduler.run_until_idle()
+    assert first.result().token_ids == second.result().token_ids
+    assert greedy.result().token_ids == reference_tokens(tiny_pipeline, "hello", 6)
+
+
+def test_background_loop_serves_concurrent_clients(tiny_pipeline):
+    scheduler = ContinuousBatchScheduler(tiny_pipeline.model, tiny_pipeline.tokenizer, max_batch_size=2)
+    processor = PipelineProcessor(pipeline=tiny_pipeline, max_new_tokens=4, do_sample=False, scheduler=scheduler)
+    scheduler.start()
+    try:
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            responses = list(pool.map(processor._generate_response, PROMPTS))
+    finally:
+        scheduler.stop()
+    tokenizer = tiny_pipeline.tokenizer
+    expected = [tokenizer.decode(reference_tokens(tiny_pipeline, prompt, 4), skip_special_tokens=True).strip()
+                for prompt in PROMPTS]
+    assert responses == expected  # The new text only, without the prompt
+    assert scheduler.stats()["completed"] == len(PROMPTS)
+
+
+def test_failed_prefill_fails_the_admitted_requests(tiny_pipeline):
+    class BrokenModel(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+            self.config = model.config
+
+        def forward(self, **kwargs):
+            raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+
+    scheduler = ContinuousBatchScheduler(BrokenModel(tiny_pipeline.model), tiny_pipeline.tokenizer, max_batch_size=2)
+    processor = PipelineProcessor(pipeline=tiny_pipeline, max_new_tokens=4, do_sample=False, scheduler=scheduler)
+    scheduler.start()
+    try:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            futures = [pool.submit(processor.complete, [{"role": "user", "content": prompt}]) for prompt in PROMPTS[:2]]
+            for future in futures:
+                with pytest.raises(RuntimeError, match="out of memory"):
+                    future.result(timeout=30)  # Used to hang: the requests never reached running
+    finally:
+        scheduler.stop()
+    assert scheduler.stats()["running"] == 0
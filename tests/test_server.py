@@ -0,0 +1,185 @@
+import asyncio
+import json
+import sys
+import threading
+import time
+
+import pytest
+
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+pytest.importorskip("aiohttp")
+from aiohttp.test_utils import TestClient, TestServer
+from agent import Agent
+from interface.server import InferenceServer
+
+
+class FakeProcessor:
+    """Answers after `delay` seconds unless cancelled; records what it was asked."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+        self.cancelled = threading.Event()
+
+    def _wait(self, cancel_event):
+        if cancel_event.wait(self.delay):
+            self.cancelled.set()
+            return False
+        return True
+
+    def complete(self, messages, cancel_event=None):
+        self.calls.append(messages)
+        return "echo: " + messages[-1]["content"] if self._wait(cancel_event) else ""
+
+    def complete_stream(self, messages, cancel_event=None):
+        self.calls.append(messages)
+        for word in ["echo:", " ", messages[-1]["content"]]:
+            if not self._wait(cancel_event):
+                return
+            yield word
+
+
+def run(server, scenario):
+    async def main():
+        client = TestClient(TestServer(server.create_app()))
+        await client.start_server()
+        try:
+            return await scenario(client)
+        finally:
+            await client.close()
+    return asyncio.run(main())
+
+
+def chat(content, **extra):
+    return {"messages": [{"role": "user", "content": content}], **extra}
+
+
+def test_completion_shape_and_system_prompt():
+    processor = FakeProcessor()
+    server = InferenceServer(processor, Agent())
+
+    async def scenario(client):
+        response = await client.post("/v1/chat/completions", json=chat("hi"))
+        return response.status, await response.json()
+
+    status, body = run(server, scenario)
+    assert status == 200
+    assert body["object"] == "chat.completion"
+    assert body["choices"][0]["message"] == {"role": "assistant", "content": "echo: hi"}
+    assert processor.calls[0][0]["role"] == "system"
+
+
+def test_streaming_sse_chunks():
+    server = InferenceServer(FakeProcessor(), Agent())
+
+    async def scenario(client):
+        response = await client.post("/v1/chat/completions", json=chat("hi", stream=True))
+        return await response.text()
+
+    events = [line[len("data: "):] for line in run(server, scenario).split("\n\n") if line]
+    assert events[-1] == "[DONE]"
+    chunks = [json.loads(event)["choices"][0] for event in events[:-1]]
+    assert "".join(c["delta"].get("content", "") for c in chunks) == "echo: hi"
+    assert chunks[-1]["finish_reason"] == "stop"
+
+
+def test_backpressure_returns_429():
+    server = InferenceServer(FakeProcessor(delay=0.5), Agent(), max_concurrency=1, max_queue=1)
+
+    async def scenario(client):
+        responses = await asyncio.gather(*[client.post("/v1/chat/completions", json=chat(str(i))) for i in range(4)])
+        return sorted(response.status for response in responses)
+
+    assert run(server, scenario) == [200, 200, 429, 429]
+
+
+def test_timeout_cancels_generation():
+    processor = FakeProcessor(delay=5.0)
+    server = InferenceServer(processor, Agent(), request_timeout=0.2)
+
+    async def scenario(client):
+        started = time.monotonic()
+        response = await client.post("/v1/chat/completions", json=chat("slow"))
+        return response.status, time.monotonic() - started
+
+    status, elapsed = run(server, scenario)
+    assert status == 504
+    assert elapsed < 2
+    assert processor.cancelled.wait(1)
+
+
+def test_client_disconnect_cancels_stream():
+    processor = FakeProcessor(delay=0.3)
+    server = InferenceServer(processor, Agent())
+
+    async def scenario(client):
+        response = await client.post("/v1/chat/completions", json=chat("bye", stream=True))
+        await response.content.readline()
+        response.close()
+        await asyncio.sleep(0.5)
+
+    run(server, scenario)
+    assert processor.cancelled.wait(2)
+
+
+def test_processor_complete_is_stateless_and_cancellable(tiny_pipeline):
+    from interface import PipelineProcessor
+
+    processor = PipelineProcessor(pipeline=tiny_pipeline, max_new_tokens=8, do_sample=False)
+    messages = [{"role": "user", "content": "hello there"}]
+    reply = processor.complete(messages)
+    assert reply and "hello there" not in reply
+    assert processor.conversation_history == []
+
+    cancelled = threading.Event()
+    cancelled.set()
+    first_token = processor.complete(messages, cancelled)  # stops after the first token
+    assert len(tiny_pipeline.tokenizer(first_token).input_ids) == 1
+    assert reply.startswith(first_token)
+    assert "".join(processor.complete_stream(messages, cancelled)).strip() == first_token
+
+
+def test_metrics_endpoint():
+    from metrics import REGISTRY
+
+    server = InferenceServer(FakeProcessor(), Agent())
+
+    async def scenario(client):
+        await client.post("/v1/chat/completions", json=chat("hi"))
+        text = await (await client.get("/metrics")).text()
+        snapshot = await (await client.get("/metrics?format=json")).json()
+        return text, snapshot
+
+    before = sum(entry["value"] for entry in REGISTRY.snapshot()["counters"].get("server_requests_total", [])
+                 if entry["labels"] == {"status": "200"})
+    text, snapshot = run(server, scenario)
+    assert "# TYPE prizm_server_request_seconds histogram" in text
+    assert 'prizm_server_request_seconds_bucket{stream="false",le="+Inf"}' in text
+    assert "prizm_server_active_requests 0" in text
+    assert "prizm_process_peak_rss_bytes" in text
+    requests = {tuple(entry["labels"].items()): entry["value"] for entry in snapshot["counters"]["server_requests_total"]}
+    assert requests[(("status", "200"),)] == before + 1
+
+
+def test_delegations_are_dispatched():
+    class Helper:
+        def handle_prompt(self, command):
+            return f"looked at {command}"
+
+    supervisor = Agent()
+    supervisor.register_agent("helper", Helper())
+    server = InferenceServer(FakeProcessor(), supervisor)
+    content = "\nAGENT:helper:the logs"
+
+    async def scenario(client):
+        plain = await (await client.post("/v1/chat/completions", json=chat(content))).json()
+        streamed = await (await client.post("/v1/chat/completions", json=chat(content, stream=True))).text()
+        return plain, streamed
+
+    plain, streamed = run(server, scenario)
+    expected = "echo: \nAGENT:helper:the logs\nhelper: looked at the logs"
+    assert plain["choices"][0]["message"]["content"] == expected
+    events = [line[len("data: "):] for line in streamed.split("\n\n") if line]
+    chunks = [json.loads(event)["choices"][0] for event in events[:-1]]
+    assert "".join(c["delta"].get("content", "") for c in chunks) == expected
@@ -0,0 +1,146 @@
+import os
+import sys
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+import pytest
+
+from interface.pipeline_processor.session_store import ConversationLog, SessionStore
+
+MESSAGES = [{"role": "user", "content": "Hello there, how are you"}]
+
+
+def segments(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith("segment-"))
+
+
+def test_sessions_interleave_and_resume_after_reopening(tmp_path):
+    log = ConversationLog(str(tmp_path), segment_bytes=256)
+    for turn in range(20):
+        log.append("alice", "user", f"alice message {turn}")
+        log.append("bob", "user", f"bob message {turn} — żółć")
+    log.close()
+    assert len(segments(tmp_path)) > 1  # Rolled over to new segments
+
+    log = ConversationLog(str(tmp_path), segment_bytes=256)
+    assert [m["content"] for m in log.read("alice")] == [f"alice message {turn}" for turn in range(20)]
+    assert log.read("bob")[-1] == {"role": "user", "content": "bob message 19 — żółć"}
+    assert log.read("carol") == [] and "carol" not in log and len(log) == 2
+
+
+def test_appends_after_the_checkpoint_are_replayed(tmp_path):
+    log = ConversationLog(str(tmp_path), checkpoint_every=3)
+    for turn in range(5):
+        log.append("alice", "user", f"message {turn}")
+    log._writer.close()  # A crash: the last two appends are not in the checkpointed index
+
+    reopened = ConversationLog(str(tmp_path))
+    assert len(reopened.read("alice")) == 5
+
+
+def test_a_torn_last_record_is_cut_off(tmp_path):
+    log = ConversationLog(str(tmp_path))
+    log.append("alice", "user", "complete")
+    log.checkpoint()
+    log.append("alice", "agent", "also complete")
+    log._writer.write(b'{"s":"alice","r":"user","c":"half wri')
+    log._writer.close()
+
+    reopened = ConversationLog(str(tmp_path))
+    assert [m["content"] for m in reopened.read("alice")] == ["complete", "also complete"]
+    reopened.append("alice", "user", "after the crash")
+    reopened.close()
+    assert len(ConversationLog(str(tmp_path)).read("alice")) == 3
+
+
+def test_a_lost_index_is_rebuilt_from_the_segments(tmp_path):
+    log = ConversationLog(str(tmp_path), segment_bytes=128)
+    for turn in range(10):
+        log.append("alice", "user", f"message {turn}")
+    log.delete("alice")
+    log.append("alice", "user", "fresh start")
+    log.close()
+    with open(tmp_path / ConversationLog.INDEX_NAME, "w") as file:
+        file.write("{not json")
+
+    assert ConversationLog(str(tmp_path)).read("alice") == [{"role": "user", "content": "fresh start"}]
+
+
+def test_compaction_drops_dead_segments_and_keeps_live_sessions(tmp_path):
+    log = ConversationLog(str(tmp_path), segment_bytes=200)
+    for turn in range(10):
+        log.append("gone", "user", f"soon deleted {turn}")
+        log.append("kept", "user", f"kept {turn}")
+    log.delete("gone")
+    before = len(segments(tmp_path))
+
+    assert log.compact() > 0
+    assert len(segments(tmp_path)) < before
+    expected = [f"kept {turn}" for turn in range(10)]
+    assert [m["content"] for m in log.read("kept")] == expected
+    log.append("kept", "agent", "after compaction")
+    log.close()
+
+    reopened = ConversationLog(str(tmp_path), segment_bytes=200)
+    assert [m["content"] for m in reopened.read("kept")] == expected + ["after compaction"]
+    assert "gone" not in reopened
+    assert reopened.compact() == 0
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_store_evicts_idle_and_least_recently_used_sessions(tmp_path):
+    clock = Clock()
+    store = SessionStore(ConversationLog(str(tmp_path)), idle_seconds=60, max_sessions=2, clock=clock)
+    store.append("alice", "user", "hi")
+    assert store.memory("alice").messages == [{"role": "user", "content": "hi"}]
+    store.append("alice", "agent", "hello")  # Reaches the loaded memory and the log
+    assert len(store.memory("alice")) == 2
+
+    store.memory("bob")
+    store.memory("carol")
+    assert list(store.loaded) == ["bob", "carol"]  # alice was least recently used
+    clock.now = 30
+    store.memory("carol")
+    clock.now = 61
+    assert store.evict_idle() == 1 and list(store.loaded) == ["carol"]
+    assert len(store.memory("alice")) == 2  # Reloaded from the log
+
+    store.reset("alice")
+    assert len(store.memory("alice")) == 0
+
+
+def test_processor_keeps_sessions_apart_and_resumes_them(tiny_pipeline, tmp_path):
+    pytest.importorskip("torch")
+    from agent import Agent
+    from interface.pipeline_processor import PipelineProcessor
+    from interface.pipeline_processor.conversation_memory import ConversationMemory
+
+    def processor():
+        store = SessionStore(ConversationLog(str(tmp_path)),
+                             memory_factory=lambda: ConversationMemory(tiny_pipeline.tokenizer))
+        return PipelineProcessor(tiny_pipeline, max_new_tokens=8, do_sample=False, sessions=store)
+
+    first = processor()
+    reply = first.process(MESSAGES, Agent(), session_id="alice")
+    "".join(first.process_stream([{"role": "user", "content": "Other topic"}], Agent(), session_id="bob"))
+    assert first.history("alice") == [MESSAGES[0], {"role": "agent", "content": reply}]
+    assert first.history("bob")[0]["content"] == "Other topic"
+    assert first.conversation_history == []  # The processor's own conversation is untouched
+    prompt = first._format_prompt(MESSAGES, session_id="alice")
+    first.sessions.close()
+
+    resumed = processor()
+    assert resumed.history("alice") == first.history("alice")
+    assert resumed._format_prompt(MESSAGES, session_id="alice") == prompt
+    resumed.reset_conversation("alice")
+    assert resumed.history("alice") == [] and len(resumed.history("bob")) == 2
+
+    with pytest.raises(ValueError):
+        PipelineProcessor(tiny_pipeline).history("alice")
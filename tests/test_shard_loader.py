@@ -0,0 +1,116 @@
+import os
+import sys
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+import pytest
+
+from tests.conftest import make_tiny_model
+
+
+@pytest.fixture(scope="module")
+def sharded_model_dir(tmp_path_factory):
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    path = make_tiny_model(str(tmp_path_factory.mktemp("sharded_model")), max_shard_size="2MB")
+    assert os.path.exists(join(path, "model.safetensors.index.json"))
+    return path
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("AGENT_CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def greedy(model, tokenizer, text="Hello there"):
+    import torch
+
+    inputs = tokenizer(text, return_tensors="pt")
+    with torch.inference_mode():
+        output = model.generate(**inputs, max_new_tokens=6, do_sample=False, pad_token_id=tokenizer.eos_token_id)
+    return output[0].tolist()
+
+
+def test_parallel_load_matches_from_pretrained(sharded_model_dir):
+    import torch
+    from transformers import AutoModelForCausalLM
+    from shard_loader import PHASES, ShardLoader
+
+    loader = ShardLoader(sharded_model_dir, workers=3)
+    model, tokenizer = loader.load()
+    reference = AutoModelForCausalLM.from_pretrained(sharded_model_dir)
+
+    reference_state = reference.state_dict()
+    for name, tensor in model.state_dict().items():
+        assert torch.equal(tensor, reference_state[name]), name
+    assert greedy(model, tokenizer) == greedy(reference, tokenizer)
+
+    timings = loader.timings
+    assert timings.shards > 1 and not timings.from_cache
+    assert set(timings.phases) == set(PHASES)
+    assert timings.phases["shard_io"] > 0 and timings.phases["tokenizer"] > 0
+    assert timings.bytes_read == sum(
+        os.path.getsize(join(sharded_model_dir, name))
+        for name in os.listdir(sharded_model_dir) if name.endswith(".safetensors")
+    )
+
+
+def test_dtype_conversion(sharded_model_dir):
+    import torch
+    from shard_loader import ShardLoader
+
+    loader = ShardLoader(sharded_model_dir, dtype=torch.bfloat16)
+    model, _ = loader.load()
+    assert {param.dtype for param in model.parameters()} == {torch.bfloat16}
+    assert loader.timings.phases["conversion"] > 0
+
+
+def test_quantized_checkpoint_cache(sharded_model_dir, cache_dir):
+    import torch
+    from shard_loader import ShardLoader
+
+    first = ShardLoader(sharded_model_dir, dtype=torch.float32, quantize=True, checkpoint_cache=True)
+    model, tokenizer = first.load()
+    assert not first.timings.from_cache
+    assert first.timings.phases["quantization"] > 0 and first.timings.phases["cache_write"] > 0
+    assert os.path.exists(join(first.cache_dir(), "cache.json"))
+
+    second = ShardLoader(sharded_model_dir, dtype=torch.float32, quantize=True, checkpoint_cache=True)
+    cached, _ = second.load()
+    assert second.timings.from_cache and second.timings.shards == 1
+    assert second.timings.phases["quantization"] == 0
+    assert isinstance(cached.model.layers[0].mlp.down_proj, torch.ao.nn.quantized.dynamic.Linear)
+    assert greedy(cached, tokenizer) == greedy(model, tokenizer)
+
+
+def test_pipeline_reports_load_phases(sharded_model_dir):
+    import torch
+    from pipeline import Pipeline
+
+    threads = torch.get_num_threads()
+    try:
+        pipeline = Pipeline.initialize_pipeline(sharded_model_dir, device="cpu", precision="bf16", load_workers=2)
+    finally:
+        torch.set_num_threads(threads)
+    assert pipeline.load_report.timings is not None
+    assert pipeline.load_report.timings.shards > 1
+
+
+def test_single_device_map_still_moves_the_model(sharded_model_dir, monkeypatch):
+    import torch
+    from shard_loader import ShardLoader
+
+    loader = ShardLoader(sharded_model_dir)
+    monkeypatch.setattr(loader, "_placement", lambda model: {"": "cpu"})  # As infer_auto_device_map gives for one GPU
+    moved_to = []
+    original_to = torch.nn.Module.to
+
+    def to(module, *args, **kwargs):
+        moved_to.append(args[0] if args else kwargs.get("device"))
+        return original_to(module, *args, **kwargs)
+
+    monkeypatch.setattr(torch.nn.Module, "to", to)
+    model, tokenizer = loader.load()
+    assert moved_to == ["cpu"]  # Buffers such as rotary inv_freq follow the weights
+    assert greedy(model, tokenizer)
@@ -0,0 +1,64 @@
+import sys
+from threading import Event
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+import pytest
+
+from tests.conftest import make_tiny_model
+
+MESSAGES = [{"role": "user", "content": "Hello there, how are you"}]
+
+
+@pytest.fixture(scope="module")
+def other_draft(tmp_path_factory):
+    from transformers import AutoModelForCausalLM
+
+    path = make_tiny_model(str(tmp_path_factory.mktemp("draft_model")), seed=1, num_hidden_layers=1)
+    return AutoModelForCausalLM.from_pretrained(path)
+
+
+def processor(pipeline, **kwargs):
+    from interface.pipeline_processor import PipelineProcessor
+    return PipelineProcessor(pipeline, max_new_tokens=24, do_sample=False, **kwargs)
+
+
+def test_identical_draft_is_always_accepted(tiny_pipeline):
+    reference = processor(tiny_pipeline).complete(MESSAGES)
+    speculative = processor(tiny_pipeline, draft_model=tiny_pipeline.model, num_draft_tokens=4)
+    assert speculative.complete(MESSAGES) == reference
+    stats = speculative.speculative_stats
+    assert stats.acceptance_rate == 1.0
+    assert stats.generated == 24 and stats.rounds == 5  # 4 drafted + 1 verified token per pass
+
+
+def test_greedy_output_does_not_depend_on_the_draft(tiny_pipeline, other_draft):
+    reference = processor(tiny_pipeline).complete(MESSAGES)
+    speculative = processor(tiny_pipeline, draft_model=other_draft, num_draft_tokens=3)
+    assert speculative.complete(MESSAGES) == reference
+    assert speculative.speculative_stats.acceptance_rate < 1.0
+    assert speculative.speculative_stats.generated == 24
+
+
+def test_streaming_and_cancellation(tiny_pipeline):
+    speculative = processor(tiny_pipeline, draft_model=tiny_pipeline.model, num_draft_tokens=4)
+    chunks = list(speculative.complete_stream(MESSAGES))
+    assert "".join(chunks).strip() == speculative.complete(MESSAGES)
+
+    cancelled = Event()
+    cancelled.set()
+    assert speculative.complete(MESSAGES, cancel_event=cancelled) == ""
+
+
+def test_sampling_keeps_the_length_budget(tiny_pipeline, other_draft):
+    import torch
+    from interface.pipeline_processor.scheduler import SamplingParams
+    from interface.pipeline_processor.speculative import SpeculativeDecoder
+
+    decoder = SpeculativeDecoder(tiny_pipeline.model, other_draft, num_draft_tokens=3)
+    input_ids = tiny_pipeline.tokenizer("Hello there", return_tensors="pt").input_ids
+    params = SamplingParams(max_new_tokens=20, temperature=1.0, top_p=1.0, top_k=0)
+    sequence, stats = decoder.generate(input_ids, params, generator=torch.Generator().manual_seed(0))
+    assert len(sequence) == input_ids.shape[1] + 20 == input_ids.shape[1] + stats.generated
+    assert torch.equal(sequence[:input_ids.shape[1]], input_ids[0])
+    assert 0 < stats.rounds <= 20 and stats.accepted <= stats.drafted
@@ -0,0 +1,29 @@
+import sys
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+import pytest
+
+from benchmarks.bench_startup import heavy_imports, profile_imports
+
+# Generous enough for a slow CI machine; importing torch alone takes seconds
+STARTUP_BUDGET_MS = 750
+
+
+@pytest.mark.parametrize("statement", ["import agent", "import interface", "import main"])
+def test_startup_imports_stay_light(statement):
+    profile = profile_imports(statement)
+    assert heavy_imports(profile) == []
+    assert profile.total_us / 1000 < STARTUP_BUDGET_MS
+
+
+def test_interface_reexports_load_on_use():
+    profile = profile_imports("import interface; interface.ConversationMemory")
+    assert "interface.pipeline_processor.conversation_memory" in profile.cumulative_us
+
+
+def test_agent_tools_do_not_need_the_model():
+    profile = profile_imports(
+        "from agent import Agent; Agent(base_directory='.').search_directory('.', max_depth=0)"
+    )
+    assert heavy_imports(profile) == []
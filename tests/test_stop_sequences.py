@@ -0,0 +1,153 @@
+import sys
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from interface.pipeline_processor.stop_sequences import IncrementalDecoder, StopSequences
+
+MESSAGES = [{"role": "user", "content": "Hello there, how are you"}]
+
+
+def test_role_marker_ends_the_reply():
+    stops = StopSequences()
+    assert stops.truncate("Fine, thanks.\nuser: and you?") == "Fine, thanks."
+    assert stops.truncate("Fine.\nUser: more") == "Fine."
+    assert stops.truncate("agent: Fine.\nsystem: x") == "agent: Fine."  # The reply's own label stays
+    assert stops.truncate("\n\nagent: Fine.") == "\n\nagent: Fine."
+    assert stops.find("user: mentioned inline, not on a new line") is None
+    assert StopSequences(roles=("user", "karen")).truncate("Done.\nKaren: next") == "Done."
+
+
+def test_completed_delegation_line_ends_the_reply():
+    stops = StopSequences()
+    assert stops.find("AGENT:linus:search files for main") is None  # Still being written
+    assert stops.truncate("AGENT:linus:search files for main\nmore text") == "AGENT:linus:search files for main"
+    assert stops.truncate("Let me ask.\nAGENT:linus:grep TODO\nuser:") == "Let me ask.\nAGENT:linus:grep TODO"
+    assert stops.find("AGENT:linus:\n") is None  # No command
+    assert StopSequences(stop_on_delegation=False).find("AGENT:linus:grep TODO\nmore") is None
+
+
+def test_stop_strings_and_earliest_cut():
+    stops = StopSequences(stop=["###", "END"], roles=(), stop_on_delegation=False)
+    assert stops.truncate("one END two ### three") == "one "
+    assert stops.truncate("nothing to see") == "nothing to see"
+    assert not StopSequences(roles=(), stop_on_delegation=False)
+
+
+def test_trim_stream_never_leaks_a_marker():
+    stops = StopSequences(stop=["STOP"])
+    chunks = ["Hello", " world\nus", "er: fake", " turn"]
+    assert "".join(stops.trim_stream(chunks)) == "Hello world"
+    chunks = ["ab", "cS", "TO", "Pde"]
+    assert "".join(stops.trim_stream(chunks)) == "abc"
+    assert "".join(stops.trim_stream(["no", " stop ", "here"])) == "no stop here"
+
+
+def test_incremental_decoder_matches_full_decode(tiny_pipeline):
+    tokenizer = tiny_pipeline.tokenizer
+    ids = tokenizer("Zażółć gęślą jaźń — naïve café 🚀 done", add_special_tokens=False).input_ids
+    decoder = IncrementalDecoder(tokenizer)
+    for token in ids:
+        decoder.feed([token])
+    assert decoder.text == tokenizer.decode(ids)
+
+
+def make_processor(pipeline, **kwargs):
+    from interface.pipeline_processor import PipelineProcessor
+    return PipelineProcessor(pipeline, max_new_tokens=32, do_sample=False, **kwargs)
+
+
+@pytest.fixture
+def stop_word(tiny_pipeline):
+    """A piece of the tiny model's greedy reply, and the reply before it."""
+    reply = make_processor(tiny_pipeline, stop_on_turns=False).complete(MESSAGES)
+    words = reply.split()
+    assert len(words) > 4
+    stop = words[len(words) // 2]
+    return stop, reply[:reply.find(stop)].strip()
+
+
+def count_generated(monkeypatch, model):
+    generate = model.generate
+    generated = []
+
+    def counting(*args, **kwargs):
+        outputs = generate(*args, **kwargs)
+        generated.append(outputs.sequences.shape[1] - kwargs["input_ids"].shape[1])
+        return outputs
+
+    monkeypatch.setattr(model, "generate", counting)
+    return generated
+
+
+def test_generation_stops_at_the_stop_string(tiny_pipeline, stop_word, monkeypatch):
+    stop, expected = stop_word
+    generated = count_generated(monkeypatch, tiny_pipeline.model)
+    processor = make_processor(tiny_pipeline, stop_sequences=[stop], stop_on_turns=False)
+    assert processor.complete(MESSAGES) == expected
+    assert generated[0] < 32  # Decoding ended at the stop, not at max_new_tokens
+    assert "".join(processor.complete_stream(MESSAGES)).strip() == expected
+
+
+def test_speculative_and_scheduled_generation_stop_too(tiny_pipeline, stop_word):
+    from interface.pipeline_processor.scheduler import ContinuousBatchScheduler
+
+    stop, expected = stop_word
+    speculative = make_processor(tiny_pipeline, stop_sequences=[stop], stop_on_turns=False,
+                                 draft_model=tiny_pipeline.model, num_draft_tokens=3)
+    assert speculative.complete(MESSAGES) == expected
+    assert speculative.speculative_stats.generated < 32
+
+    scheduler = ContinuousBatchScheduler(tiny_pipeline.model, tiny_pipeline.tokenizer)
+    scheduler.start()
+    try:
+        scheduled = make_processor(tiny_pipeline, stop_sequences=[stop], stop_on_turns=False, scheduler=scheduler)
+        assert scheduled.complete(MESSAGES) == expected
+    finally:
+        scheduler.stop()
+    assert scheduler.stats()["generated_tokens"] < 32
+
+
+def test_process_uses_the_agents_stop_list_and_records_only_new_text(tiny_pipeline, stop_word):
+    from agent import Agent
+
+    stop, expected = stop_word
+    agent = Agent()
+    agent.agent_prompt = {**agent.agent_prompt, "stop": [stop]}
+    processor = make_processor(tiny_pipeline, stop_on_turns=False)
+    assert processor.process(MESSAGES, agent) == expected
+    assert processor.conversation_history[-1] == {"role": "agent", "content": expected}
+
+
+def test_process_delegates_a_completed_agent_line(tiny_pipeline, monkeypatch, tmp_path):
+    from agent import Agent
+
+    supervisor, helper = Agent(str(tmp_path)), Agent(str(tmp_path))
+    helper.agent_prompt = {"prompt": "I am the helper.", "capabilities": []}
+    supervisor.register_agent("helper", helper)
+    processor = make_processor(tiny_pipeline)
+    monkeypatch.setattr(processor, "_generate_response",
+                        lambda *args: "AGENT:helper:search directory contents")
+    assert processor.process(MESSAGES, supervisor).startswith("I am the helper.\nOperation result: Found files")
+    assert supervisor.handle_agent_request("AGENT:nobody:hi") == "Unknown agent: nobody"
+    assert supervisor.handle_agent_request("AGENT:helper") == "Malformed agent request: AGENT:helper"
+
+
+def test_process_stream_dispatches_the_delegation(tiny_pipeline, monkeypatch, tmp_path):
+    from agent import Agent
+
+    supervisor, helper = Agent(str(tmp_path)), Agent(str(tmp_path))
+    helper.agent_prompt = {"prompt": "I am the helper.", "capabilities": []}
+    supervisor.register_agent("helper", helper)
+    processor = make_processor(tiny_pipeline)
+    monkeypatch.setattr(processor, "_stream_response",
+                        lambda *args, **kwargs: iter(["Let me ask.\n", "AGENT:helper:search directory contents"]))
+    chunks = list(processor.process_stream(MESSAGES, supervisor))
+    assert chunks[:2] == ["Let me ask.\n", "AGENT:helper:search directory contents"]
+    assert chunks[2].startswith("\nhelper: I am the helper.\nOperation result: Found files")
+    assert processor.conversation_history[-2] == {
+        "role": "agent", "content": "Let me ask.\nAGENT:helper:search directory contents"}
+    assert processor.conversation_history[-1]["role"] == supervisor.agent_name
@@ -0,0 +1,37 @@
+import sys
+
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+from agent import Agent
+from interface import Interface, PipelineProcessor
+from interface import render
+
+
+def test_process_stream_yields_incrementally(tiny_pipeline):
+    processor = PipelineProcessor(pipeline=tiny_pipeline, max_new_tokens=12)
+    stream = processor.process_stream([{"role": "user", "content": "hello there"}], Agent())
+
+    chunks = list(stream)
+    assert len(chunks) > 1
+    assert processor.conversation_history[-1] == {"role": "agent", "content": "".join(chunks)}
+    assert "hello there" not in "".join(chunks)
+
+
+def test_display_response_prints_chunks(capsys):
+    shown = Interface.display_response(iter(["Hel", "lo", "!"]))
+    assert shown == "Hello!"
+    assert capsys.readouterr().out == "Hello!\n"
+
+
+def test_render_generate_streams_sse_and_text():
+    render.set_stream_source(lambda text: iter([text.upper(), "!"]))
+    client = render.app.test_client()
+
+    response = client.post("/generate", json={"text": "hi"})
+    assert response.mimetype == "text/event-stream"
+    body = response.get_data(as_text=True)
+    assert body == 'data: {"content": "HI"}\n\ndata: {"content": "!"}\n\nevent: done\ndata: {}\n\n'
+
+    response = client.post("/generate?format=text", json={"text": "hi"})
+    assert response.get_data(as_text=True) == "HI!"
+    assert client.post("/generate", json={}).status_code == 400
@@ -0,0 +1,82 @@
+import os
+import sys
+
+from os.path import dirname, join, abspath
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+from agent import Agent
+from agent.trigram_index import TrigramIndex
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(text)
+
+
+def test_required_literals():
+    assert TrigramIndex.required_literals("hello") == ["hello"]
+    assert TrigramIndex.required_literals(r"def\s+parse_(\w+)") == ["def", "parse_"]
+    assert TrigramIndex.required_literals("foo|barbaz") == []
+    assert TrigramIndex.required_literals("a.b") == []
+    assert TrigramIndex.required_literals("(?:abc)+xyz?") == ["abc"]
+
+
+def test_candidates_and_incremental_update(tmp_path):
+    a, b = str(tmp_path / "a.txt"), str(tmp_path / "b.txt")
+    write(a, "The Quick brown fox\n")
+    write(b, "lazy dog\n")
+    index = TrigramIndex(str(tmp_path / "idx"))
+
+    assert index.update([a, b]) == {"indexed": 2, "unchanged": 0, "removed": 0}
+    assert index.candidates("brown") == {a}
+    assert index.candidates("Quick", case_sensitive=True) == {a}
+    assert index.candidates("quick") is None  # i and k also fold to non-ASCII letters
+    assert index.candidates("zebra") == set()
+    assert index.candidates("q.") is None
+    index.save()
+
+    write(b, "brown dog, longer now\n")
+    reloaded = TrigramIndex(str(tmp_path / "idx"))
+    assert reloaded.update([a, b]) == {"indexed": 1, "unchanged": 1, "removed": 0}
+    assert reloaded.candidates("brown") == {a, b}
+
+    os.remove(a)
+    assert reloaded.update([a, b])["removed"] == 1
+    assert reloaded.candidates("brown") == {b}
+    reloaded.compact()
+    assert reloaded.candidates("fox") == set()
+
+
+def test_find_string_in_files_uses_index(tmp_path, monkeypatch):
+    monkeypatch.setenv("AGENT_CACHE_DIR", str(tmp_path / "cache"))
+    tree = tmp_path / "tree"
+    write(str(tree / "one.py"), "import os\ndef parse_args():\n    pass\n")
+    write(str(tree / "two.py"), "print('nothing here')\n")
+    agent = Agent(base_directory=str(tree))
+    agent.search_directory()
+
+    indexed = agent.find_string_in_files(r"parse_\w+")
+    assert indexed == {str(tree / "one.py"): ["def parse_args():"]}
+    assert indexed == agent.find_string_in_files(r"parse_\w+", use_index=False)
+
+    write(str(tree / "two.py"), "parse_me = 1\n")
+    assert set(agent.find_string_in_files("PARSE_")) == {str(tree / "one.py"), str(tree / "two.py")}
+
+
+def test_unicode_case_folds_are_not_filtered_out(tmp_path, monkeypatch):
+    import re
+
+    monkeypatch.setenv("AGENT_CACHE_DIR", str(tmp_path / "cache"))
+    tree = tmp_path / "tree"
+    write(str(tree / "long_s.txt"), "the ſearch box\n")  # ſ folds to s
+    write(str(tree / "kelvin.txt"), "300 Kelvin\n")  # The Kelvin sign folds to k
+    write(str(tree / "plain.txt"), "search kelvin\n")
+    assert TrigramIndex.required_literals("search box", re.IGNORECASE) == ["earch box"]
+    assert TrigramIndex.required_literals("kelvin", re.IGNORECASE) == ["elv"]
+    assert TrigramIndex.required_literals("kelvin") == ["kelvin"]
+
+    agent = Agent(base_directory=str(tree))
+    agent.search_directory()
+    for pattern in ("search", "kelvin"):
+        assert agent.find_string_in_files(pattern) == agent.find_string_in_files(pattern, use_index=False)
+    assert set(agent.find_string_in_files("kelvin")) == {str(tree / "kelvin.txt"), str(tree / "plain.txt")}
@@ -0,0 +1,166 @@
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os.path import dirname, join, abspath
+from urllib.parse import parse_qs, urlparse
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("bs4")
+from agent import Agent
+from agent.web_search import DEFAULT_PROVIDERS, Provider, WebSearch
+
+FIXTURES = join(dirname(__file__), "fixtures", "web_search")
+
+
+class StubSearchServer:
+    """Serves the recorded result pages at /google and /bing, optionally slowly or failing first."""
+
+    def __init__(self, delay=0.0, failures=0, stall=None):
+        self.delay = delay
+        self.failures = failures
+        self.stall = stall or set()
+        self.requests = []
+        self.connections = set()
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, so connection reuse is observable
+
+            def do_GET(self):
+                path = urlparse(self.path).path.strip("/")
+                with stub.lock:
+                    stub.requests.append((path, parse_qs(urlparse(self.path).query)))
+                    stub.connections.add(self.client_address)
+                    fail = stub.failures > 0
+                    stub.failures -= fail
+                time.sleep(30 if path in stub.stall else stub.delay)
+                if fail:
+                    self.send_response(503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                with open(join(FIXTURES, f"{path}.html"), "rb") as f:
+                    body = f.read()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def providers(self):
+        base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        return [
+            Provider(provider.name, base + "/" + provider.name.lower() + "?" + provider.url.split("?", 1)[1],
+                     provider.item_selector, provider.title_selector)
+            for provider in DEFAULT_PROVIDERS
+        ]
+
+
+@pytest.fixture
+def stub_server():
+    servers = []
+
+    def start(**kwargs):
+        server = StubSearchServer(**kwargs)
+        server.thread.start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.server.shutdown()
+        server.server.server_close()
+
+
+def test_results_from_all_providers(stub_server):
+    server = stub_server()
+    search = WebSearch(server.providers())
+    results = search.search("python mmap", num_results=2)
+    assert results == [
+        {"title": "mmap — Memory-mapped file support", "url": "https://docs.python.org/3/library/mmap.html",
+         "source": "Google"},
+        {"title": "Python mmap: Improved File I/O With Memory Mapping", "url": "https://realpython.com/python-mmap/",
+         "source": "Google"},
+        {"title": "mmap — Memory-mapped file support — Python 3 documentation",
+         "url": "https://docs.python.org/3/library/mmap.html", "source": "Bing"},
+        {"title": "mmap — Memory-map Files — PyMOTW 3", "url": "https://pymotw.com/3/mmap/", "source": "Bing"},
+    ]
+    assert {query["q"][0] for _, query in server.requests} == {"python mmap"}
+    search.close()
+
+
+def test_providers_are_fetched_concurrently(stub_server):
+    server = stub_server(delay=0.4)
+    search = WebSearch(server.providers())
+    start = time.perf_counter()
+    results = search.search("python mmap")
+    assert time.perf_counter() - start < 0.75  # Sequential fetches would take 0.8s
+    assert {result["source"] for result in results} == {"Google", "Bing"}
+    search.close()
+
+
+def test_cache_hits_expiry_and_eviction(stub_server):
+    server = stub_server()
+    search = WebSearch(server.providers(), max_entries=2, ttl=0.3)
+    first = search.search("python mmap")
+    assert search.search("  Python   MMAP ") == first
+    assert len(server.requests) == 2 and search.hits == 1
+
+    time.sleep(0.35)
+    search.search("python mmap")
+    assert len(server.requests) == 4
+
+    search.search("second")
+    search.search("third")
+    assert list(search.cache) == [("second", 5), ("third", 5)]
+    search.close()
+
+
+def test_session_reuses_connections(stub_server):
+    server = stub_server()
+    search = WebSearch(server.providers()[:1], ttl=0)
+    for query in ["a", "b", "c"]:
+        search.search(query)
+    assert len(server.requests) == 3 and len(server.connections) == 1
+    search.close()
+
+
+def test_retries_server_errors(stub_server):
+    server = stub_server(failures=1)
+    search = WebSearch(server.providers()[:1], backoff=0)
+    assert len(search.search("python mmap")) == 3
+    assert len(server.requests) == 2
+    search.close()
+
+
+def test_stalled_provider_times_out_without_caching(stub_server):
+    server = stub_server(stall={"bing"})
+    search = WebSearch(server.providers(), timeout=(1.0, 0.3), retries=0)
+    start = time.perf_counter()
+    results = search.search("python mmap")
+    assert time.perf_counter() - start < 2.0
+    assert {result["source"] for result in results} == {"Google"}
+    assert not search.cache  # A partial answer is retried on the next search
+    search.close()
+
+
+def test_agent_web_search_operation(stub_server, tmp_path):
+    server = stub_server()
+    agent = Agent(str(tmp_path))
+    agent.web_search = WebSearch(server.providers())
+    output = agent.process_operation("web_search", "python mmap")
+    assert output.splitlines()[0] == "[Google] mmap — Memory-mapped file support: https://docs.python.org/3/library/mmap.html"
+    assert "[Bing] mmap — Memory-map Files — PyMOTW 3: https://pymotw.com/3/mmap/" in output.splitlines()
+    agent.web_search.close()